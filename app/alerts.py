@@ -0,0 +1,424 @@
+################################################################################
+# Alert sinks: getting violations out of the process.
+#
+# AlertDetector turns the probe's per-frame results into structured events:
+#   helmet_violation  a restricted-area person without a helmet, once per track
+#                     until the track has been compliant or gone for rearm_frames;
+#                     objects the tracker has not seen are keyed by the
+#                     UNTRACKED_CELL grid cell of their box centre instead
+#   ppe_violation     the same for a subject breaking --ppe-rules rules, with
+#                     the names of the broken rules; a track breaking another
+#                     set of rules alerts again
+#   overcrowding      an ROI entering the overcrowded state
+#   line_crossing     a line's cumulative crossing count going up
+# AlertSink runs the detector on the streaming thread, which only costs a few
+# dict lookups per violator, and hands the events to a writer thread through a
+# DropOldestQueue, so emitting never blocks. The writer micro-batches events and
+# passes every batch to its backends:
+#   RotatingEventLog  append-only JSONL file, size based rotation, fsync batched
+#                     to at most once per fsync_interval
+#   WebhookBackend    HTTP POST of {"events": [...]} from a pool of sender
+#                     threads, each keeping one keep-alive connection; failed
+#                     batches wait in a bounded retry queue whose overflow is
+#                     spilled to a file and replayed once the endpoint recovers.
+#                     New batches are held back too while a retry is due later,
+#                     in a queue bounded the same way
+# utils/alert_webhook_server.py is a stand-in endpoint to run this against.
+################################################################################
+
+import collections
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+from compliance import VERDICT_VIOLATION
+from probe_worker import DropOldestQueue
+from track_state import UNTRACKED_OBJECT_ID
+
+ALERT_VIOLATION = "helmet_violation"
+ALERT_RULE_VIOLATION = "ppe_violation"
+ALERT_OVERCROWDING = "overcrowding"
+ALERT_LINE_CROSSING = "line_crossing"
+
+# Frames a violating track must be compliant or unseen before it alerts again
+DEFAULT_REARM_FRAMES = 300
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_BATCH_INTERVAL = 0.5
+DEFAULT_FSYNC_INTERVAL = 1.0
+DEFAULT_LOG_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_LOG_BACKUPS = 5
+DEFAULT_RETRY_CAPACITY = 256
+DEFAULT_PENDING_CAPACITY = 256
+# Grid cell in pixels standing in for the track of an untracked violator
+UNTRACKED_CELL = 64
+RETRY_DELAY_MIN = 0.5
+RETRY_DELAY_MAX = 30.0
+
+
+class AlertDetector:
+    """Derives deduplicated alert events from frames and their verdicts.
+
+    Not thread safe; runs on the streaming thread.
+    """
+
+    def __init__(self, rearm_frames=DEFAULT_REARM_FRAMES, clock=time.time, stream_offset=0):
+        self.rearm_frames = rearm_frames
+        self.clock = clock
+        # Added to the stream ids of the events, see main.py --stream-offset
+        self.stream_offset = stream_offset
+        self._violators = {}
+        self._last_sweep = {}
+        self._overcrowded = {}
+        self._line_counts = {}
+
+    def detect(self, frame, verdict, ppe_engine=None):
+        """Return the new events of a frame as a list of dicts.
+
+        ppe_engine is the ppe_rules.RuleEngine that produced the verdict, if
+        any; it names the broken rules of its events.
+        """
+        events = []
+        stream_id = frame.stream_id
+        event_stream_id = stream_id + self.stream_offset
+        frame_num = frame.frame_num
+        now = None
+
+        violators = np.flatnonzero(verdict.verdicts == VERDICT_VIOLATION)
+        if len(violators):
+            now = self.clock()
+            for index in violators.tolist():
+                object_id = int(frame.object_ids[index])
+                left, top, width, height = frame.boxes[index].tolist()
+                rule_mask = int(verdict.violations[index]) if verdict.violations is not None else 0
+                if object_id == UNTRACKED_OBJECT_ID:
+                    key = (stream_id, object_id, int((left + width / 2) // UNTRACKED_CELL),
+                           int((top + height / 2) // UNTRACKED_CELL), rule_mask)
+                else:
+                    key = (stream_id, object_id, rule_mask)
+                last = self._violators.get(key)
+                self._violators[key] = frame_num
+                if last is not None and 0 <= frame_num - last <= self.rearm_frames:
+                    continue
+                event = {"type": ALERT_VIOLATION, "time": now, "stream_id": event_stream_id,
+                         "frame_num": frame_num, "object_id": object_id, "bbox": [left, top, width, height]}
+                if verdict.violations is not None:
+                    # Bits of the broken ppe_rules rules, in config order
+                    event["type"] = ALERT_RULE_VIOLATION
+                    event["rule_mask"] = rule_mask
+                    if ppe_engine is not None:
+                        event["rules"] = list(ppe_engine.violation_names(rule_mask))
+                events.append(event)
+        last_sweep = self._last_sweep.setdefault(stream_id, frame_num)
+        if not 0 <= frame_num - last_sweep <= self.rearm_frames:
+            self._sweep(stream_id, frame_num)
+
+        for zone, status in (frame.overcrowding or {}).items():
+            key = (stream_id, zone)
+            was = self._overcrowded.get(key, False)
+            self._overcrowded[key] = status
+            if status and not was:
+                now = now or self.clock()
+                events.append({"type": ALERT_OVERCROWDING, "time": now, "stream_id": event_stream_id,
+                               "frame_num": frame_num, "zone": zone,
+                               "count": (frame.zone_counts or {}).get(zone, 0)})
+
+        for line, total in (frame.line_counts or {}).items():
+            key = (stream_id, line)
+            previous = self._line_counts.get(key)
+            self._line_counts[key] = total
+            # The first sighting only sets the baseline
+            if previous is not None and total > previous:
+                now = now or self.clock()
+                events.append({"type": ALERT_LINE_CROSSING, "time": now, "stream_id": event_stream_id,
+                               "frame_num": frame_num, "line": line, "delta": total - previous,
+                               "total": total})
+        return events
+
+    def _sweep(self, stream_id, frame_num):
+        self._last_sweep[stream_id] = frame_num
+        stale = [key for key, last in self._violators.items()
+                 if key[0] == stream_id and not 0 <= frame_num - last <= self.rearm_frames]
+        for key in stale:
+            del self._violators[key]
+
+
+class RotatingEventLog:
+    """Append-only JSONL event log rotated by size, fsynced at most every fsync_interval."""
+
+    def __init__(self, path, max_bytes=DEFAULT_LOG_MAX_BYTES, backups=DEFAULT_LOG_BACKUPS,
+                 fsync_interval=DEFAULT_FSYNC_INTERVAL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.fsync_interval = fsync_interval
+        self.rotations = 0
+        self.fsyncs = 0
+        self._file = open(path, "ab")
+        self._last_fsync = time.monotonic()
+        self._dirty = False
+
+    def write(self, events):
+        self._file.write(b"".join(json.dumps(event, separators=(",", ":")).encode("utf-8") + b"\n"
+                                  for event in events))
+        self._file.flush()
+        self._dirty = True
+        if self._file.tell() >= self.max_bytes:
+            self._rotate()
+        elif time.monotonic() - self._last_fsync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        if self._dirty:
+            os.fsync(self._file.fileno())
+            self.fsyncs += 1
+            self._dirty = False
+        self._last_fsync = time.monotonic()
+
+    def _rotate(self):
+        self.sync()
+        self._file.close()
+        for index in range(self.backups - 1, 0, -1):
+            source = "%s.%d" % (self.path, index)
+            if os.path.exists(source):
+                os.replace(source, "%s.%d" % (self.path, index + 1))
+        if self.backups > 0:
+            os.replace(self.path, self.path + ".1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, "ab")
+        self.rotations += 1
+
+    def close(self):
+        self.sync()
+        self._file.close()
+
+    def stats(self):
+        return {"log_rotations": self.rotations, "log_fsyncs": self.fsyncs}
+
+
+class WebhookBackend:
+    """POSTs event batches to an HTTP endpoint over pooled keep-alive connections."""
+
+    def __init__(self, url, pool_size=2, timeout=5.0, retry_capacity=DEFAULT_RETRY_CAPACITY,
+                 spill_path=None, pending_capacity=DEFAULT_PENDING_CAPACITY):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError("webhook url must be http:// or https://, got %s" % url)
+        self._connection_class = (http.client.HTTPSConnection if parts.scheme == "https"
+                                  else http.client.HTTPConnection)
+        self._netloc = parts.netloc
+        self._path = urllib.parse.urlunsplit(("", "", parts.path or "/", parts.query, ""))
+        self.timeout = timeout
+        self.retry_capacity = retry_capacity
+        self.pending_capacity = pending_capacity
+        self.spill_path = spill_path
+        self._pending = collections.deque()
+        self._retry = collections.deque()
+        self._cond = threading.Condition()
+        self._running = True
+        self._retry_at = 0.0
+        self._retry_delay = RETRY_DELAY_MIN
+        self.sent_batches = 0
+        self.sent_events = 0
+        self.failed_posts = 0
+        self.spilled_batches = 0
+        self.dropped_batches = 0
+        self.pending_overflows = 0
+        self._spilled_on_disk = spill_path is not None and os.path.exists(spill_path) \
+            and os.path.getsize(spill_path) > 0
+        self._threads = [threading.Thread(target=self._send_loop, name="alert-webhook-%d" % index, daemon=True)
+                         for index in range(pool_size)]
+        for thread in self._threads:
+            thread.start()
+
+    def write(self, events):
+        with self._cond:
+            # Only the newest pending_capacity batches wait in memory
+            if len(self._pending) >= self.pending_capacity:
+                self.pending_overflows += 1
+                self._spill(self._pending.popleft())
+            self._pending.append(list(events))
+            self._cond.notify()
+
+    def _next_batch(self):
+        # Called with the condition held; nothing goes out while backing off,
+        # then fresh batches first and retries after them
+        if time.monotonic() < self._retry_at:
+            return None
+        if self._pending:
+            return self._pending.popleft()
+        if self._retry:
+            return self._retry.popleft()
+        if self._spilled_on_disk:
+            self._reload_spill()
+            if self._retry:
+                return self._retry.popleft()
+        return None
+
+    def _send_loop(self):
+        connection = None
+        while True:
+            with self._cond:
+                batch = self._next_batch()
+                while batch is None:
+                    if not self._running:
+                        if connection is not None:
+                            connection.close()
+                        return
+                    self._cond.wait(0.1)
+                    batch = self._next_batch()
+            body = json.dumps({"events": batch}, separators=(",", ":")).encode("utf-8")
+            try:
+                if connection is None:
+                    connection = self._connection_class(self._netloc, timeout=self.timeout)
+                connection.request("POST", self._path, body, {"Content-Type": "application/json"})
+                response = connection.getresponse()
+                response.read()
+                if response.status >= 300:
+                    raise http.client.HTTPException("HTTP %d" % response.status)
+                with self._cond:
+                    self.sent_batches += 1
+                    self.sent_events += len(batch)
+                    self._retry_delay = RETRY_DELAY_MIN
+            except (OSError, http.client.HTTPException) as e:
+                if connection is not None:
+                    connection.close()
+                    connection = None
+                self._failed(batch, e)
+
+    def _failed(self, batch, error):
+        with self._cond:
+            self.failed_posts += 1
+            # Report the first failure of an outage only
+            if self._retry_delay == RETRY_DELAY_MIN:
+                sys.stderr.write("Alert webhook POST failed: %s\n" % error)
+            self._retry_at = time.monotonic() + self._retry_delay
+            self._retry_delay = min(self._retry_delay * 2, RETRY_DELAY_MAX)
+            if len(self._retry) >= self.retry_capacity:
+                self._spill(self._retry.popleft())
+            self._retry.append(batch)
+
+    def _spill(self, batch):
+        if self.spill_path is None:
+            self.dropped_batches += 1
+            return
+        with open(self.spill_path, "ab") as spill:
+            spill.write(json.dumps(batch, separators=(",", ":")).encode("utf-8") + b"\n")
+        self.spilled_batches += 1
+        self._spilled_on_disk = True
+
+    def _reload_spill(self):
+        # Move up to retry_capacity spilled batches back into the retry queue
+        with open(self.spill_path, "rb") as spill:
+            lines = spill.readlines()
+        room = self.retry_capacity - len(self._retry)
+        for line in lines[:room]:
+            self._retry.append(json.loads(line))
+        rest = lines[room:]
+        with open(self.spill_path, "wb") as spill:
+            spill.writelines(rest)
+        self._spilled_on_disk = bool(rest)
+
+    def close(self, timeout=5.0):
+        """Give queued batches until timeout to go out, then spill what is left."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._retry_at = 0.0
+            while (self._pending or self._retry) and time.monotonic() < deadline:
+                self._cond.wait(0.1)
+            self._running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        with self._cond:
+            for batch in list(self._pending) + list(self._retry):
+                self._spill(batch)
+            self._pending.clear()
+            self._retry.clear()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "webhook_batches": self.sent_batches,
+                "webhook_events": self.sent_events,
+                "webhook_failures": self.failed_posts,
+                "webhook_pending_depth": len(self._pending),
+                "webhook_pending_overflows": self.pending_overflows,
+                "webhook_retry_depth": len(self._retry),
+                "webhook_spilled": self.spilled_batches,
+                "webhook_dropped": self.dropped_batches,
+            }
+
+
+class AlertSink(threading.Thread):
+    """Detects alerts on the streaming thread and writes them from a background thread."""
+
+    def __init__(self, backends, detector=None, queue_size=4096, batch_size=DEFAULT_BATCH_SIZE,
+                 batch_interval=DEFAULT_BATCH_INTERVAL):
+        super().__init__(name="alert-sink", daemon=True)
+        self.backends = backends
+        self.detector = detector or AlertDetector()
+        self.queue = DropOldestQueue(queue_size)
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.events = collections.Counter()
+        self._running = True
+
+    def observe(self, frame, verdict, ppe_engine=None):
+        """Queue the alerts of a frame; never blocks the caller."""
+        for event in self.detector.detect(frame, verdict, ppe_engine):
+            self.events[event["type"]] += 1
+            self.queue.put(event)
+
+    def run(self):
+        while self._running or len(self.queue):
+            batch = self._collect()
+            if batch:
+                self._write(batch)
+        for backend in self.backends:
+            backend.close()
+
+    def _collect(self):
+        batch = []
+        deadline = time.monotonic() + self.batch_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            event = self.queue.get(timeout=remaining)
+            if event is None:
+                if not self._running:
+                    break
+                continue
+            batch.append(event)
+        return batch
+
+    def _write(self, batch):
+        for backend in self.backends:
+            try:
+                backend.write(batch)
+            except Exception as e:
+                sys.stderr.write("Alert backend %s failed: %s\n" % (type(backend).__name__, e))
+
+    def stop(self):
+        """Flush what is queued, close the backends and wait for the thread."""
+        self._running = False
+        self.join()
+
+    def stats(self):
+        stats = dict(self.events)
+        stats["queue_dropped"] = self.queue.dropped
+        for backend in self.backends:
+            stats.update(backend.stats())
+        return stats
+
+    def print_stats_callback(self):
+        """GLib timeout callback printing the alert counters."""
+        print("\n**ALERTS: ", self.stats(), "\n")
+        return True
@@ -0,0 +1,250 @@
+################################################################################
+# Per-batch work of the analytics probe.
+#
+# AnalyticsProbe holds the optional components main.py switches on from the
+# command line and runs them over one NvDsBatchMeta: extraction into
+# frame_arrays structures, zone geometry, helmet compliance, alerts, object
+# styling, overlay text and FPS bookkeeping. The GStreamer pad probe in
+# main.py only fetches the batch meta and calls process_batch(), so the same
+# code can be driven by the benchmarks with a stand-in pyds module.
+################################################################################
+
+import functools
+import time
+
+import numpy as np
+import pyds
+
+from compliance import VERDICT_VIOLATION, ComplianceSettings, build_overlay_text, evaluate_frame
+from frame_arrays import LABEL_UNKNOWN, OBJECT_LABELS
+from frame_meta import extract_batch
+from inference_interval import DEFAULT_PGIE_UNIQUE_ID, is_inferred
+from probe_worker import FrameRecord
+from profiling import (SECTION_ASSOCIATION, SECTION_DISPLAY_META, SECTION_FRAME, SECTION_OSD_TEXT,
+                       SECTION_STYLING, SECTION_USER_META)
+
+
+def style_object(obj_meta, label, verdict):
+    """Set the box and label style of an object from its compliance verdict."""
+    rect_params = obj_meta.rect_params
+    rect_params.border_color.set(0.0, 1.0, 0.0, 1.0)  # Green border
+
+    text_params = obj_meta.text_params
+    # Modify the display text to show the class label and confidence
+    text_params.display_text = "{0}".format(label)
+
+    # Optionally, change the font size and color
+    text_params.font_params.font_size = 12  # Set font size
+    text_params.font_params.font_name = "Serif"  # Change font style if needed
+
+    # Set text color (RGBA format: 1.0 = full intensity)
+    text_params.set_bg_clr = 1  # Enable background color
+
+    text_params.text_bg_clr.set(0.0, 1.0, 0.0, 0.3) # Green background with 30% opacity
+
+    # Set the text color (white, full intensity)
+    text_params.font_params.font_color.set(1.0, 1.0, 1.0, 1.0)
+
+    # Set bounding box color based on helmet association
+    if verdict == VERDICT_VIOLATION:
+        rect_params.border_color.set(1.0, 0.0, 0.0, 1.0)  # Red border for not wearing helmet
+        text_params.text_bg_clr.set(1.0, 0.0, 0.0, 0.3)  # Red background with 30% opacity
+        text_params.display_text = pyds.get_string(text_params.display_text) + " DANGER ZONE: WEAR A HELMET!"
+
+
+def label_violations(frame, verdict, ppe_engine):
+    """Replace the label text of rule violators with the messages of the rules they broke."""
+    for index in np.flatnonzero(verdict.violations).tolist():
+        obj_meta = frame.obj_metas[index]
+        label_code = int(frame.labels[index])
+        label = OBJECT_LABELS[label_code] if label_code != LABEL_UNKNOWN else obj_meta.obj_label
+        obj_meta.text_params.display_text = label + " " + ppe_engine.violation_text(int(verdict.violations[index]))
+
+
+def add_overlay_text(batch_meta, frame_meta, display_text):
+    """Attach the counter text to a frame as display meta."""
+    # Acquiring a display meta object. The memory ownership remains in
+    # the C code so downstream plugins can still access it. Otherwise
+    # the garbage collector will claim it when this probe function exits.
+    display_meta=pyds.nvds_acquire_display_meta_from_pool(batch_meta)
+    display_meta.num_labels = 1
+    py_nvosd_text_params = display_meta.text_params[0]
+    # Setting display text to be shown on screen
+    # Note that the pyds module allocates a buffer for the string, and the
+    # memory will not be claimed by the garbage collector.
+    # Reading the display_text field here will return the C address of the
+    # allocated string. Use pyds.get_string() to get the string content.
+    py_nvosd_text_params.display_text = display_text
+
+    # Now set the offsets where the string should appear
+    py_nvosd_text_params.x_offset = 10
+    py_nvosd_text_params.y_offset = 12
+
+    # Font , font-color and font-size
+    py_nvosd_text_params.font_params.font_name = "Serif"
+    py_nvosd_text_params.font_params.font_size = 18
+    # set(red, green, blue, alpha); set to White
+    py_nvosd_text_params.font_params.font_color.set(1.0, 1.0, 1.0, 1.0)
+
+    # Text background color
+    py_nvosd_text_params.set_bg_clr = 1
+    # set(red, green, blue, alpha); set to Black
+    py_nvosd_text_params.text_bg_clr.set(0.0, 0.0, 0.0, 1.0)
+    # Using pyds.get_string() to get display_text as string
+    # print(pyds.get_string(py_nvosd_text_params.display_text))
+    pyds.nvds_add_display_meta_to_frame(frame_meta, display_meta)
+
+
+class AnalyticsProbe:
+    """The probe's state; every optional component is off while None."""
+
+    def __init__(self, perf_data, track_store=None):
+        self.perf_data = perf_data
+        self.track_store = track_store
+        # Set in split mode (--split-probe) to move bookkeeping off the streaming thread
+        self.probe_worker = None
+        # Section timing of the probe, only set with --profile or SAFETY_PROBE_PROFILE=1
+        self.profiler = None
+        # Violation, overcrowding and line crossing events, set with --alert-log / --alert-webhook
+        self.alert_sink = None
+        # Computes ROI / line membership from the zone polygons, set with --zone-geometry
+        self.zone_engine = None
+        # Per-stream inferred / tracker-only frame counters, set with --interval-aware
+        self.interval_stats = None
+        # Helmet / vest / phone rules replacing the built-in helmet check, set with --ppe-rules
+        self.ppe_engine = None
+        # Rolling occupancy / crossing / violation history, set with --timeseries-file
+        self.timeseries = None
+        # Evidence crops of violators, set with --snapshot-dir
+        self.snapshots = None
+        # Jetson surfaces mapped for snapshots must be unmapped again
+        self.unmap_surfaces = False
+        # Restricted zone and head fraction of the built-in check, set with --compliance-config
+        self.compliance = ComplianceSettings()
+        # Columnar copy of every processed frame for CPU replays, set with --record-file
+        self.recorder = None
+        # Counts restricted-zone persons for the adaptive PGIE interval, set with --interval-scheduler
+        self.interval_scheduler = None
+        # Per-stream metrics published to shared memory, set with --metrics-shm
+        self.metrics = None
+        self.pgie_unique_id = DEFAULT_PGIE_UNIQUE_ID
+
+    def evaluate(self, frame, ppe_engine, compliance):
+        """Return the compliance verdict of a frame; in split mode this runs on the worker thread."""
+        # Verdicts, and the PPE rule results, persist per track across buffers, see track_state.py
+        if self.interval_stats is not None:
+            # Tracker-only frames reuse the track verdicts, see inference_interval.py
+            inferred = is_inferred(frame, self.pgie_unique_id)
+            evaluate_start = time.perf_counter()
+            if ppe_engine is not None:
+                verdict = ppe_engine.evaluate(frame, self.track_store, inferred, compliance.head_fraction)
+            else:
+                verdict = evaluate_frame(frame, zone_name=compliance.zone_name, track_store=self.track_store,
+                                         inferred=inferred, head_fraction=compliance.head_fraction)
+            self.interval_stats.record(frame.stream_id, inferred, time.perf_counter() - evaluate_start, verdict)
+            return verdict
+        if ppe_engine is not None:
+            return ppe_engine.evaluate(frame, self.track_store, head_fraction=compliance.head_fraction)
+        return evaluate_frame(frame, zone_name=compliance.zone_name, track_store=self.track_store,
+                              head_fraction=compliance.head_fraction)
+
+    def process_batch(self, batch_meta, gst_buffer=None):
+        profiler = self.profiler
+        probe_worker = self.probe_worker
+        # hot_reload.py swaps these between batches; a batch uses one version throughout
+        zone_engine = self.zone_engine
+        ppe_engine = self.ppe_engine
+        compliance = self.compliance
+
+        # Copy all frames of the batch out of pyds in one pass; the compliance
+        # logic below only works on the extracted arrays.
+        batch = extract_batch(batch_meta, profiler, object_analytics=zone_engine is None)
+        if zone_engine is not None:
+            # The whole batch in one call per zone table, in place of the skipped per-object meta walk
+            if profiler is not None:
+                zones_start = time.perf_counter()
+            zone_engine.apply_batch(batch)
+            if profiler is not None and len(batch):
+                share = (time.perf_counter() - zones_start) / len(batch)
+                for frame in batch:
+                    profiler.record(frame.stream_id, SECTION_USER_META, share)
+        snapshots = self.snapshots if gst_buffer is not None else None
+        if snapshots is not None:
+            snapshots.begin_batch()
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.begin_batch()
+        interval_scheduler = self.interval_scheduler
+        metrics = self.metrics
+        if probe_worker is not None:
+            # The worker evaluates every frame of the batch with the engines of the batch
+            evaluate = functools.partial(self.evaluate, ppe_engine=ppe_engine, compliance=compliance)
+
+        for frame in batch:
+            if profiler is not None or metrics is not None:
+                frame_start = time.perf_counter()
+
+            if recorder is not None:
+                # The ROI and line masks the verdicts below are based on
+                recorder.record(frame)
+            if interval_scheduler is not None:
+                interval_scheduler.observe(frame)
+
+            if probe_worker is None:
+                verdict = self.evaluate(frame, ppe_engine, compliance)
+            else:
+                # Split mode: the worker associates this frame, styles come from its latest verdicts
+                verdict = probe_worker.shown_verdict(frame)
+            if self.alert_sink is not None:
+                self.alert_sink.observe(frame, verdict, ppe_engine)
+            if self.timeseries is not None:
+                self.timeseries.observe(frame, verdict)
+            if snapshots is not None and verdict.alert_count:
+                due = snapshots.due(frame, verdict)
+                if due:
+                    # Only frames with a capture due get their surface mapped
+                    batch_id = frame.frame_meta.batch_id
+                    snapshots.capture(frame, due, pyds.get_nvds_buf_surface(hash(gst_buffer), batch_id))
+                    if self.unmap_surfaces:
+                        pyds.unmap_nvds_buf_surface(hash(gst_buffer), batch_id)
+            if profiler is not None:
+                associated = time.perf_counter()
+
+            for obj_meta, label_code, object_verdict in zip(frame.obj_metas, frame.labels.tolist(),
+                                                            verdict.verdicts.tolist()):
+                label = OBJECT_LABELS[label_code] if label_code != LABEL_UNKNOWN else obj_meta.obj_label
+                style_object(obj_meta, label, object_verdict)
+            if ppe_engine is not None and verdict.alert_count:
+                label_violations(frame, verdict, ppe_engine)
+            if profiler is not None:
+                styled = time.perf_counter()
+
+            if probe_worker is None:
+                display_text = build_overlay_text(verdict.person_count, verdict.alert_count, frame.zone_counts,
+                                                  frame.line_counts, frame.overcrowding)
+            else:
+                # Split mode: association, counters and text are handled by the
+                # worker thread; the probe shows the latest text it built for the stream.
+                probe_worker.submit(FrameRecord.for_association(frame, evaluate))
+                display_text = probe_worker.overlay_text.get(frame.stream_id)
+            if profiler is not None:
+                text_built = time.perf_counter()
+
+            if display_text is not None:
+                add_overlay_text(batch_meta, frame.frame_meta, display_text)
+
+            if profiler is not None:
+                frame_end = time.perf_counter()
+                profiler.record(frame.stream_id, SECTION_ASSOCIATION, associated - frame_start)
+                profiler.record(frame.stream_id, SECTION_STYLING, styled - associated)
+                profiler.record(frame.stream_id, SECTION_OSD_TEXT, text_built - styled)
+                profiler.record(frame.stream_id, SECTION_DISPLAY_META, frame_end - text_built)
+                profiler.record(frame.stream_id, SECTION_FRAME, frame_end - frame_start)
+            if metrics is not None:
+                metrics.observe(frame, verdict, time.perf_counter() - frame_start)
+
+            # Update frame rate through this probe, also in split mode: the
+            # worker only sees the records its queue did not drop
+            stream_index = "stream{0}".format(frame.stream_id)
+            self.perf_data.update_fps(stream_index)
+        return batch
@@ -0,0 +1,153 @@
+################################################################################
+# Batched helmet-to-person association.
+#
+# The probe used to test every restricted-area person against every helmet one
+# pair at a time. The functions below score all persons against all helmets of
+# a frame in one call, either with a dense NumPy distance matrix or, once the
+# number of pairs gets large, through a uniform grid so only helmets in the
+# neighbouring cells of a head point are looked at.
+################################################################################
+
+import math
+
+import numpy as np
+
+# Below this many person x helmet pairs a plain loop beats the NumPy call
+# overhead; above GRID_MIN_PAIRS the uniform grid replaces the dense matrix.
+# Both are the crossovers utils/bench_association.py measures on the arrays
+# the probe passes in (loop/dense about 100 pairs, dense/grid about 30000).
+LOOP_MAX_PAIRS = 100
+GRID_MIN_PAIRS = 32768
+# The head point sits in the upper part of the person box and the match radius
+# is derived from the box height, both as height / HEAD_FRACTION.
+HEAD_FRACTION = 12
+
+
+def is_helmet_on_head(person_center_x, person_center_y, helmet_center_x, helmet_center_y, threshold=30):
+    """Check if the helmet is positioned near the center of the person's head."""
+    # Check if the helmet center is within a certain distance of the head center
+    dx = person_center_x - helmet_center_x
+    dy = person_center_y - helmet_center_y
+    distance = math.sqrt(dx * dx + dy * dy)
+    return distance < threshold  # Return True if the helmet is roughly on the head
+
+
+def head_points(person_boxes, head_fraction=HEAD_FRACTION):
+    """Return the head x, head y and match threshold of each (left, top, width, height) box."""
+    left, top, width, height = person_boxes.T
+    head_x = left + width / 2
+    head_y = top + height / head_fraction
+    threshold = height / head_fraction
+    return head_x, head_y, threshold
+
+
+def _associate_loop(person_boxes, helmet_centers, head_fraction):
+    # Arithmetic on NumPy scalars is several times slower than on floats
+    if isinstance(person_boxes, np.ndarray):
+        person_boxes = person_boxes.tolist()
+    if isinstance(helmet_centers, np.ndarray):
+        helmet_centers = helmet_centers.tolist()
+    sqrt = math.sqrt
+    matches = []
+    for left, top, width, height in person_boxes:
+        match = -1
+        threshold = height / head_fraction
+        head_x = left + width / 2
+        head_y = top + height / head_fraction
+        # is_helmet_on_head() inlined, a call per pair costs more than the test
+        for index, (helmet_x, helmet_y) in enumerate(helmet_centers):
+            dx = head_x - helmet_x
+            dy = head_y - helmet_y
+            if sqrt(dx * dx + dy * dy) < threshold:
+                match = index
+                break
+        matches.append(match)
+    return np.array(matches, dtype=np.int64)
+
+
+def _associate_dense(head_x, head_y, threshold, helmet_centers):
+    dx = head_x[:, None] - helmet_centers[None, :, 0]
+    dy = head_y[:, None] - helmet_centers[None, :, 1]
+    hits = np.sqrt(dx * dx + dy * dy) < threshold[:, None]
+    return np.where(hits.any(axis=1), hits.argmax(axis=1), -1)
+
+
+def _associate_grid(head_x, head_y, threshold, helmet_centers):
+    num_persons = len(head_x)
+    num_helmets = len(helmet_centers)
+    matches = np.full(num_persons, -1, dtype=np.int64)
+
+    # Every helmet within a person's threshold lies in one of the 3x3 cells
+    # around the head point as long as the cell is at least that wide.
+    cell = float(threshold.max())
+    if not cell > 0:
+        return matches
+
+    helmet_cx = np.floor(helmet_centers[:, 0] / cell).astype(np.int64)
+    helmet_cy = np.floor(helmet_centers[:, 1] / cell).astype(np.int64)
+    head_cx = np.floor(head_x / cell).astype(np.int64)
+    head_cy = np.floor(head_y / cell).astype(np.int64)
+
+    # Flatten (cx, cy) into one sortable key; the stride leaves room for the
+    # -1/+1 neighbour offsets on both sides.
+    min_cy = min(helmet_cy.min(), head_cy.min()) - 1
+    stride = max(helmet_cy.max(), head_cy.max()) - min_cy + 2
+    helmet_keys = helmet_cx * stride + (helmet_cy - min_cy)
+    order = np.argsort(helmet_keys, kind="stable")
+    sorted_keys = helmet_keys[order]
+
+    pair_persons = []
+    pair_helmets = []
+    for ox in (-1, 0, 1):
+        for oy in (-1, 0, 1):
+            keys = (head_cx + ox) * stride + (head_cy + oy - min_cy)
+            lo = np.searchsorted(sorted_keys, keys, side="left")
+            hi = np.searchsorted(sorted_keys, keys, side="right")
+            counts = hi - lo
+            total = int(counts.sum())
+            if not total:
+                continue
+            persons = np.repeat(np.arange(num_persons), counts)
+            # Position of each pair inside its person's [lo, hi) run
+            offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            pair_persons.append(persons)
+            pair_helmets.append(order[lo[persons] + offsets])
+
+    if not pair_persons:
+        return matches
+    persons = np.concatenate(pair_persons)
+    helmets = np.concatenate(pair_helmets)
+
+    dx = head_x[persons] - helmet_centers[helmets, 0]
+    dy = head_y[persons] - helmet_centers[helmets, 1]
+    hits = np.sqrt(dx * dx + dy * dy) < threshold[persons]
+
+    # Keep the lowest helmet index per person, like the first hit of a loop
+    first = np.full(num_persons, num_helmets, dtype=np.int64)
+    np.minimum.at(first, persons[hits], helmets[hits])
+    matched = first < num_helmets
+    matches[matched] = first[matched]
+    return matches
+
+
+def associate_helmets(person_boxes, helmet_centers, head_fraction=HEAD_FRACTION,
+                      loop_max_pairs=LOOP_MAX_PAIRS, grid_min_pairs=GRID_MIN_PAIRS):
+    """Return, per person box, the index of the first helmet on its head, or -1 if none.
+
+    person_boxes is a sequence of (left, top, width, height) and helmet_centers
+    a sequence of (x, y). A helmet matches when its center is closer than
+    height / head_fraction to the head point, which is the same test
+    is_helmet_on_head() applies to a single pair.
+    """
+    if len(person_boxes) * len(helmet_centers) <= loop_max_pairs:
+        return _associate_loop(person_boxes, helmet_centers, head_fraction)
+
+    person_boxes = np.asarray(person_boxes, dtype=np.float64).reshape(-1, 4)
+    helmet_centers = np.asarray(helmet_centers, dtype=np.float64).reshape(-1, 2)
+    if not len(person_boxes) or not len(helmet_centers):
+        return np.full(len(person_boxes), -1, dtype=np.int64)
+
+    head_x, head_y, threshold = head_points(person_boxes, head_fraction)
+    if len(person_boxes) * len(helmet_centers) < grid_min_pairs:
+        return _associate_dense(head_x, head_y, threshold, helmet_centers)
+    return _associate_grid(head_x, head_y, threshold, helmet_centers)
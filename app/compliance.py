@@ -0,0 +1,213 @@
+################################################################################
+# Helmet compliance logic on frame_arrays structures.
+#
+# Nothing in here touches pyds: the probe extracts a FrameObjects per frame,
+# evaluate_frame() decides which restricted-area persons wear a helmet and
+# build_overlay_text() renders the on-screen counters. ComplianceSettings
+# holds the thresholds that can be changed at runtime (see hot_reload.py).
+################################################################################
+
+import configparser
+
+import numpy as np
+
+from association import HEAD_FRACTION, associate_helmets
+from frame_arrays import LABEL_HELMET, LABEL_PERSON, zone_bit
+from track_state import UNTRACKED_OBJECT_ID
+
+RESTRICTED_AREA = "Restricted Area"
+COMPLIANCE_SECTION = "compliance"
+
+# Per-object verdicts of evaluate_frame() and ppe_rules.RuleEngine.evaluate()
+VERDICT_NONE = 0       # outside the restricted area or every rule's scope, or not evaluated this frame
+VERDICT_COMPLIANT = 1  # checked and compliant
+VERDICT_VIOLATION = 2  # checked and in violation
+# What the codes mean for the built-in helmet check
+VERDICT_HELMET = VERDICT_COMPLIANT
+VERDICT_NO_HELMET = VERDICT_VIOLATION
+
+
+class FrameVerdict:
+    """Outcome of evaluate_frame() for one frame.
+
+    evaluated_count is how many persons were actually associated with helmets;
+    reused_count is how many restricted-area persons reused a stored track
+    verdict instead. violations is set by ppe_rules.RuleEngine: the mask of
+    the rules each object broke.
+    """
+
+    __slots__ = ("verdicts", "person_count", "helmet_count", "alert_count", "evaluated_count",
+                 "reused_count", "violations")
+
+    def __init__(self, verdicts, person_count, helmet_count, alert_count, evaluated_count=0,
+                 reused_count=0, violations=None):
+        self.verdicts = verdicts
+        self.person_count = person_count
+        self.helmet_count = helmet_count
+        self.alert_count = alert_count
+        self.evaluated_count = evaluated_count
+        self.reused_count = reused_count
+        self.violations = violations
+
+
+def helmet_centers(frame):
+    """Return the centers of the frame's helmets, one per tracked object id.
+
+    As with the dict the probe used to build, a later helmet with the same
+    object id replaces the position of an earlier one but keeps its place.
+    Untracked helmets all share UNTRACKED_OBJECT_ID and are each kept.
+    """
+    helmet_index = np.flatnonzero(frame.labels == LABEL_HELMET)
+    if not len(helmet_index):
+        return np.empty((0, 2), dtype=np.float64)
+    ids = frame.object_ids[helmet_index]
+    untracked = np.flatnonzero(ids == np.uint64(UNTRACKED_OBJECT_ID))
+    tracked = np.flatnonzero(ids != np.uint64(UNTRACKED_OBJECT_ID))
+    tracked_ids = ids[tracked]
+    _, first = np.unique(tracked_ids, return_index=True)
+    _, last_reversed = np.unique(tracked_ids[::-1], return_index=True)
+    last = len(tracked_ids) - 1 - last_reversed
+    places = np.concatenate((tracked[first], untracked))
+    kept = np.concatenate((tracked[last], untracked))
+    chosen = helmet_index[kept[np.argsort(places, kind="stable")]]
+    boxes = frame.boxes[chosen]
+    return np.column_stack((boxes[:, 0] + boxes[:, 2] / 2, boxes[:, 1] + boxes[:, 3] / 2))
+
+
+class ComplianceSettings:
+    """The ROI persons must wear a helmet in and the head point fraction of the association."""
+
+    __slots__ = ("zone_name", "head_fraction")
+
+    def __init__(self, zone_name=RESTRICTED_AREA, head_fraction=HEAD_FRACTION):
+        self.zone_name = zone_name
+        self.head_fraction = head_fraction
+
+    def __eq__(self, other):
+        return (isinstance(other, ComplianceSettings) and self.zone_name == other.zone_name and
+                self.head_fraction == other.head_fraction)
+
+
+def load_compliance_settings(path):
+    """Read the [compliance] section of a config_compliance.txt; raise ValueError if it is invalid."""
+    config = configparser.ConfigParser(interpolation=None, strict=False)
+    try:
+        if not config.read(path):
+            raise ValueError("unable to read %s" % path)
+    except configparser.Error as e:
+        raise ValueError("%s: %s" % (path, e))
+    if not config.has_section(COMPLIANCE_SECTION):
+        raise ValueError("%s: missing [%s] section" % (path, COMPLIANCE_SECTION))
+    section = config[COMPLIANCE_SECTION]
+    zone_name = section.get("restricted-zone", RESTRICTED_AREA).strip()
+    try:
+        head_fraction = section.getfloat("head-fraction", HEAD_FRACTION)
+    except ValueError:
+        raise ValueError("%s: head-fraction must be a number" % path)
+    if not zone_name:
+        raise ValueError("%s: restricted-zone is empty" % path)
+    if not head_fraction > 0:
+        raise ValueError("%s: head-fraction must be positive" % path)
+    return ComplianceSettings(zone_name, head_fraction)
+
+
+def restricted_persons(frame, zone_name=RESTRICTED_AREA):
+    """Return the indices of the persons inside the named ROI."""
+    in_zone = (frame.roi_mask & np.uint64(zone_bit(zone_name))) != 0
+    return np.flatnonzero((frame.labels == LABEL_PERSON) & in_zone)
+
+
+def _evaluate_tracked(frame, persons, verdicts, track_store, inferred=None, head_fraction=HEAD_FRACTION):
+    """Fill verdicts for the given persons through the track state store.
+
+    inferred=True re-associates every track, inferred=False only new ones;
+    None leaves it to the store's re-evaluation interval.
+    """
+    ids = frame.object_ids[persons]
+    tracked = ids != np.uint64(UNTRACKED_OBJECT_ID)
+    tracked_persons = persons[tracked]
+    untracked_persons = persons[~tracked]
+    slots, new = track_store.lookup(frame.stream_id, ids[tracked].tolist(), frame.frame_num)
+    if inferred is None:
+        due = track_store.needs_evaluation(slots, new, frame.frame_num)
+    elif inferred:
+        due = np.ones(len(slots), dtype=bool)
+    else:
+        due = new
+
+    # Untracked persons have no history and are always associated
+    evaluate = np.concatenate((tracked_persons[due], untracked_persons))
+    if len(evaluate):
+        matches = associate_helmets(frame.boxes[evaluate], helmet_centers(frame), head_fraction)
+        observed = np.where(matches >= 0, VERDICT_HELMET, VERDICT_NO_HELMET).astype(np.int8)
+        due_count = int(due.sum())
+        track_store.update(slots[due], observed[:due_count], frame.frame_num)
+        verdicts[untracked_persons] = observed[due_count:]
+    verdicts[tracked_persons] = track_store.verdicts(slots)
+    track_store.sweep(frame.stream_id, frame.frame_num)
+    return len(evaluate)
+
+
+def evaluate_frame(frame, evaluated_ids=None, zone_name=RESTRICTED_AREA, track_store=None, inferred=None,
+                   head_fraction=HEAD_FRACTION):
+    """Associate helmets with the restricted-area persons of a frame.
+
+    With a TrackStateStore every restricted-area person gets a verdict, taken
+    from its track unless the track is due for re-association. Passing
+    inferred (see inference_interval.py) replaces the store's schedule: every
+    track is re-associated on frames the detector ran on, only new tracks on
+    tracker-only frames. Without a store,
+    evaluated_ids is a set of object ids already evaluated earlier in the same
+    batch; such persons are left at VERDICT_NONE but still count as alerts.
+    Newly evaluated ids are added to it; untracked persons are always evaluated.
+    """
+    verdicts = np.zeros(len(frame), dtype=np.int8)
+    persons = restricted_persons(frame, zone_name)
+    person_count = int(np.count_nonzero(frame.labels == LABEL_PERSON))
+    helmet_count = int(np.count_nonzero(frame.labels == LABEL_HELMET))
+
+    if track_store is not None:
+        evaluated_count = _evaluate_tracked(frame, persons, verdicts, track_store, inferred, head_fraction)
+        alert_count = int(np.count_nonzero(verdicts[persons] == VERDICT_NO_HELMET))
+        return FrameVerdict(verdicts, person_count, helmet_count, alert_count, evaluated_count,
+                            len(persons) - evaluated_count)
+
+    if evaluated_ids is None:
+        evaluated_ids = set()
+    pending = []
+    for index in persons.tolist():
+        object_id = int(frame.object_ids[index])
+        if object_id != UNTRACKED_OBJECT_ID:
+            if object_id in evaluated_ids:
+                continue
+            evaluated_ids.add(object_id)
+        pending.append(index)
+
+    alert_count = len(persons)
+    if pending:
+        matches = associate_helmets(frame.boxes[pending], helmet_centers(frame), head_fraction)
+        matched = matches >= 0
+        verdicts[pending] = np.where(matched, VERDICT_HELMET, VERDICT_NO_HELMET)
+        alert_count -= int(matched.sum())
+    return FrameVerdict(verdicts, person_count, helmet_count, alert_count, len(pending),
+                        len(persons) - len(pending))
+
+
+def build_overlay_text(person_count, alert_count, zone_counts, line_counts, overcrowding):
+    """Return the multi-line counter text drawn in the corner of a frame.
+
+    zone_counts, line_counts and overcrowding come from the nvdsanalytics frame
+    meta; when zone_counts is None the frame had none and only the person
+    count is shown.
+    """
+    lines = ["People Current Frame: {0}".format(person_count)]
+    if zone_counts is None:
+        return lines[0] + "\n"
+    for zone, cnt in zone_counts.items():
+        lines.append("People in {0}: {1}".format(zone, cnt))
+    for line, cnt in (line_counts or {}).items():
+        lines.append("{0} Total: {1}".format(line, cnt))
+    for zone, status in (overcrowding or {}).items():
+        lines.append("Overcrowding in {0}: {1}".format(zone, "Yes" if status else "No"))
+    lines.append("Security alerts: {0}".format(alert_count))
+    return "\n".join(lines)
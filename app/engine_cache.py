@@ -0,0 +1,327 @@
+################################################################################
+# TensorRT engine cache for the nvinfer elements.
+#
+# nvinfer only reuses the model-engine-file of its config when the engine's
+# batch size, GPU and precision fit; otherwise it rebuilds the engine at
+# startup, which takes minutes, and saves it as
+# <model file>_b<batch>_gpu<id>_<precision>.engine next to the model. main.py
+# sizes the batch to the number of sources, so the fixed engine path of the
+# shipped configs only fits one camera count.
+#
+# EngineCache derives the engine paths from the model, batch size, GPU and
+# network-mode with the same naming, looks for a fitting engine (the exact
+# batch size, else the smallest larger one) in the cache directory, next to
+# the model and at the configured path, and writes a copy of the nvinfer
+# config with batch-size, gpu-id and model-engine-file set, which the element
+# is created with. EngineBuilder pre-builds the engines of other batch sizes
+# with trtexec on a background thread, so the next start with another camera
+# count finds its engine. Nothing here needs TensorRT; trtexec is only run by
+# the builder.
+################################################################################
+
+import collections
+import configparser
+import os
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+INFER_FACTORY = "nvinfer"
+PROPERTY_SECTION = "property"
+# network-mode values of nvinfer
+PRECISIONS = {0: "fp32", 1: "int8", 2: "fp16"}
+# Model keys of an nvinfer config, in the order nvinfer prefers them
+MODEL_KEYS = ("onnx-file", "tlt-encoded-model", "uff-file", "model-file")
+# Configs that build their engine through a custom library cannot be built by trtexec
+CUSTOM_BUILD_KEYS = ("engine-create-func-name",)
+TRTEXEC_PATHS = ("trtexec", "/usr/src/tensorrt/bin/trtexec")
+_ENGINE_NAME = re.compile(r"_b(\d+)_gpu(\d+)_(fp32|fp16|int8)\.engine$")
+
+
+class InferModel:
+    """The engine relevant settings of one nvinfer config file."""
+
+    __slots__ = ("config_path", "model_path", "engine_path", "batch_size", "gpu_id", "precision",
+                 "input_name", "input_dims", "calib_path", "custom_build")
+
+    def __init__(self, config_path, model_path, engine_path=None, batch_size=1, gpu_id=0, precision="fp32",
+                 input_name=None, input_dims=None, calib_path=None, custom_build=False):
+        self.config_path = config_path
+        self.model_path = model_path
+        self.engine_path = engine_path
+        self.batch_size = batch_size
+        self.gpu_id = gpu_id
+        self.precision = precision
+        self.input_name = input_name
+        self.input_dims = input_dims
+        self.calib_path = calib_path
+        self.custom_build = custom_build
+
+    @classmethod
+    def load(cls, config_path):
+        config = configparser.ConfigParser(interpolation=None, strict=False)
+        if not config.read(config_path) or not config.has_section(PROPERTY_SECTION):
+            raise ValueError("%s: no [%s] section" % (config_path, PROPERTY_SECTION))
+        properties = config[PROPERTY_SECTION]
+        directory = os.path.dirname(os.path.abspath(config_path))
+
+        def path(key):
+            # nvinfer resolves relative paths against the config file
+            value = properties.get(key)
+            return os.path.normpath(os.path.join(directory, value)) if value else None
+
+        model_key = next((key for key in MODEL_KEYS if properties.get(key)), None)
+        if model_key is None:
+            raise ValueError("%s: none of %s is set" % (config_path, ", ".join(MODEL_KEYS)))
+        mode = properties.getint("network-mode", 0)
+        if mode not in PRECISIONS:
+            raise ValueError("%s: unknown network-mode %d" % (config_path, mode))
+        dims = properties.get("infer-dims")
+        return cls(config_path, path(model_key), path("model-engine-file"), properties.getint("batch-size", 1),
+                   properties.getint("gpu-id", 0), PRECISIONS[mode], properties.get("uff-input-blob-name"),
+                   [int(value) for value in dims.split(";")] if dims else None, path("int8-calib-file"),
+                   any(properties.get(key) for key in CUSTOM_BUILD_KEYS))
+
+
+def engine_name(model_path, batch_size, gpu_id, precision):
+    """nvinfer's file name for the engine of a model."""
+    return "%s_b%d_gpu%d_%s.engine" % (os.path.basename(model_path), batch_size, gpu_id, precision)
+
+
+def parse_engine_name(path):
+    """Return (batch size, GPU id, precision) of an engine file name, or None."""
+    match = _ENGINE_NAME.search(os.path.basename(path))
+    if match is None:
+        return None
+    return int(match.group(1)), int(match.group(2)), match.group(3)
+
+
+class EngineChoice:
+    """The engine picked for an element: its path, batch size and whether it existed."""
+
+    __slots__ = ("path", "batch_size", "cached")
+
+    def __init__(self, path, batch_size, cached):
+        self.path = path
+        self.batch_size = batch_size
+        self.cached = cached
+
+
+def rewrite_infer_lines(lines, values):
+    """Set keys of the [property] section, keeping everything else, comments included."""
+    result = []
+    pending = dict(values)
+    section = None
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith("[") and stripped.endswith("]"):
+            if section == PROPERTY_SECTION:
+                result.extend("%s=%s" % item for item in pending.items())
+                pending = {}
+            section = stripped[1:-1]
+        elif section == PROPERTY_SECTION and "=" in stripped and not stripped.startswith("#"):
+            key = stripped.split("=", 1)[0].strip()
+            if key in values:
+                if key in pending:
+                    result.append("%s=%s" % (key, pending.pop(key)))
+                continue
+        result.append(line)
+    if section == PROPERTY_SECTION:
+        result.extend("%s=%s" % item for item in pending.items())
+    elif pending:
+        result.append("[%s]" % PROPERTY_SECTION)
+        result.extend("%s=%s" % item for item in pending.items())
+    return result
+
+
+def infer_elements(spec):
+    """Return [(name, config path)] of the enabled nvinfer elements of a PipelineSpec."""
+    return [(element.name, element.properties["config-file-path"]) for element in spec.enabled_chain
+            if element.factory == INFER_FACTORY and element.properties.get("config-file-path")]
+
+
+class EngineCache:
+    """Picks engines for nvinfer configs and writes the configs that use them."""
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.choices = {}
+
+    def engine_path(self, model, batch_size, gpu_id):
+        """Where the engine of a batch size is expected: the cache directory, else next to the model."""
+        directory = self.cache_dir or os.path.dirname(model.model_path)
+        return os.path.join(directory, engine_name(model.model_path, batch_size, gpu_id, model.precision))
+
+    def candidates(self, model, gpu_id):
+        """Return [(batch size, path)] of the existing engines of the model on a GPU, by batch size."""
+        directories = [os.path.dirname(model.model_path)]
+        if self.cache_dir:
+            directories.insert(0, self.cache_dir)
+        prefix = os.path.basename(model.model_path) + "_b"
+        found = {}
+        for directory in directories:
+            try:
+                names = os.listdir(directory)
+            except OSError:
+                continue
+            for name in names:
+                parsed = parse_engine_name(name) if name.startswith(prefix) else None
+                if parsed is not None and parsed[1:] == (gpu_id, model.precision):
+                    found.setdefault(parsed[0], os.path.join(directory, name))
+        # A configured engine under another naming scheme, e.g. model_b1_gpu0_int8.engine
+        if model.engine_path and os.path.exists(model.engine_path):
+            parsed = parse_engine_name(model.engine_path)
+            if parsed is not None and parsed[1:] == (gpu_id, model.precision):
+                found.setdefault(parsed[0], model.engine_path)
+        return sorted(found.items())
+
+    def resolve(self, model, batch_size, gpu_id):
+        """Return the EngineChoice for running model at batch_size on gpu_id.
+
+        An engine built for a larger batch size also serves smaller batches.
+        Without one, nvinfer builds the engine and saves it at the returned path.
+        """
+        for candidate_batch, path in self.candidates(model, gpu_id):
+            if candidate_batch >= batch_size:
+                return EngineChoice(path, candidate_batch, True)
+        return EngineChoice(os.path.join(os.path.dirname(model.model_path),
+                                         engine_name(model.model_path, batch_size, gpu_id, model.precision)),
+                            batch_size, False)
+
+    def write_config(self, name, config_path, batch_size, gpu_id):
+        """Write the copy of an nvinfer config an element runs with and return its path.
+
+        The copy sits next to the original so its relative paths still resolve.
+        """
+        model = InferModel.load(config_path)
+        choice = self.resolve(model, batch_size, gpu_id)
+        self.choices[name] = (model, choice)
+        root, extension = os.path.splitext(os.path.abspath(config_path))
+        directory, base = os.path.split(root)
+        out_path = os.path.join(directory, ".%s.b%d.gpu%d%s" % (base, batch_size, gpu_id, extension))
+        with open(config_path) as f:
+            lines = f.read().splitlines()
+        lines = rewrite_infer_lines(lines, {"batch-size": batch_size, "gpu-id": gpu_id,
+                                            "model-engine-file": choice.path})
+        temporary = out_path + ".tmp"
+        with open(temporary, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temporary, out_path)
+        return out_path
+
+    def missing(self, model, batch_sizes, gpu_id):
+        """Return the batch sizes that have no engine of their own yet."""
+        existing = {batch for batch, _ in self.candidates(model, gpu_id)}
+        return [batch for batch in batch_sizes if batch not in existing]
+
+    def report(self, startup_seconds):
+        """Return the startup line naming each element's engine and whether it was cached."""
+        engines = []
+        for name, (model, choice) in sorted(self.choices.items()):
+            state = "cached" if choice.cached else ("built" if os.path.exists(choice.path) else "missing")
+            engines.append("%s b%d %s %s" % (name, choice.batch_size, model.precision, state))
+        return "Startup %.1f s to the first batch, engines: %s" % (startup_seconds, ", ".join(engines))
+
+
+def find_trtexec(path=None):
+    for candidate in ((path,) if path else TRTEXEC_PATHS):
+        found = shutil.which(candidate)
+        if found:
+            return found
+    return None
+
+
+def trtexec_command(trtexec, model, batch_size, gpu_id, out_path):
+    """Return the trtexec command line building model's engine for batch_size, or None if unsupported."""
+    if model.custom_build or not model.model_path.endswith(".onnx"):
+        return None
+    command = [trtexec, "--onnx=%s" % model.model_path, "--saveEngine=%s" % out_path, "--device=%d" % gpu_id]
+    if model.input_name and model.input_dims:
+        shape = "%s:%s" % (model.input_name, "x".join(str(dim) for dim in [batch_size] + model.input_dims))
+        # The profile covers every batch size up to batch_size, like nvinfer's own builds
+        minimum = "%s:%s" % (model.input_name, "x".join(str(dim) for dim in [1] + model.input_dims))
+        command += ["--minShapes=%s" % minimum, "--optShapes=%s" % shape, "--maxShapes=%s" % shape]
+    if model.precision == "fp16":
+        command.append("--fp16")
+    elif model.precision == "int8":
+        command.append("--int8")
+        if model.calib_path:
+            command.append("--calib=%s" % model.calib_path)
+    return command
+
+
+class EngineBuilder(threading.Thread):
+    """Builds missing engines with trtexec, one at a time, at low CPU priority."""
+
+    def __init__(self, cache, trtexec, log_path=None):
+        super().__init__(name="engine-builder", daemon=True)
+        self.cache = cache
+        self.trtexec = trtexec
+        self.log_path = log_path
+        self.jobs = collections.deque()
+        self.counters = collections.Counter()
+        self.current = None
+        self._process = None
+        self._running = True
+
+    def queue(self, model, batch_sizes, gpu_id):
+        """Queue the builds of the batch sizes model has no engine for; return how many were queued."""
+        queued = 0
+        for batch_size in self.cache.missing(model, batch_sizes, gpu_id):
+            out_path = self.cache.engine_path(model, batch_size, gpu_id)
+            # Workers of a supervisor may build the same engine at once
+            temporary = "%s.%d.tmp" % (out_path, os.getpid())
+            command = trtexec_command(self.trtexec, model, batch_size, gpu_id, temporary)
+            if command is None:
+                self.counters["unsupported"] += 1
+                continue
+            self.jobs.append((command, temporary, out_path))
+            queued += 1
+        return queued
+
+    def run(self):
+        while self._running and self.jobs:
+            command, temporary, out_path = self.jobs.popleft()
+            self.current = os.path.basename(out_path)
+            started = time.monotonic()
+            try:
+                os.makedirs(os.path.dirname(out_path), exist_ok=True)
+                with open(self.log_path or os.devnull, "ab") as log:
+                    self._process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT,
+                                                     preexec_fn=lambda: os.nice(10))
+                    code = self._process.wait()
+            except OSError as e:
+                sys.stderr.write("Engine build of %s failed: %s\n" % (out_path, e))
+                code = None
+            if code == 0 and os.path.exists(temporary):
+                os.replace(temporary, out_path)
+                self.counters["built"] += 1
+                print("Built engine %s in %.0f s\n" % (out_path, time.monotonic() - started))
+            else:
+                if os.path.exists(temporary):
+                    os.remove(temporary)
+                if self._running:
+                    self.counters["failed"] += 1
+                    sys.stderr.write("Engine build of %s exited with %s\n" % (out_path, code))
+        self.current = None
+
+    def stop(self):
+        """Abandon the queued builds and end the running one."""
+        self._running = False
+        self.jobs.clear()
+        if self._process is not None and self._process.poll() is None:
+            self._process.terminate()
+
+    def stats(self):
+        stats = {key: self.counters[key] for key in ("built", "failed", "unsupported")}
+        stats["queued"] = len(self.jobs)
+        stats["building"] = self.current
+        return stats
+
+    def print_stats_callback(self):
+        """GLib timeout callback printing the build progress; stops once the queue is done."""
+        print("\n**ENGINES: ", self.stats(), "\n")
+        return self.is_alive()
@@ -0,0 +1,168 @@
+################################################################################
+# Array-backed copies of the per-frame object metadata.
+#
+# The analytics probe copies every object of a batch out of pyds once (see
+# frame_meta.py) into the struct-of-arrays below. All compliance logic runs on
+# these arrays, so it can be exercised and benchmarked with synthetic frames on
+# a machine without DeepStream.
+################################################################################
+
+import numpy as np
+
+# Object labels of the PeopleNet PGIE and the YOLO SGIE (labels.txt). Labels
+# are stored as small integer codes, unknown labels as LABEL_UNKNOWN.
+OBJECT_LABELS = ("person", "bag", "face", "Helmet", "Vest", "cell phone")
+LABEL_CODES = {label: code for code, label in enumerate(OBJECT_LABELS)}
+LABEL_UNKNOWN = -1
+LABEL_PERSON = LABEL_CODES["person"]
+LABEL_HELMET = LABEL_CODES["Helmet"]
+
+# nvdsanalytics ROI and line names are interned into a process wide table so
+# an object's ROI / line-crossing membership fits in one 64 bit mask. Configs
+# are checked against the limit when they are loaded (check_zone_names), so
+# the probe never meets a name without a bit.
+MAX_ZONE_NAMES = 64
+_zone_bits = {}
+
+
+def zone_bit(name):
+    """Return the mask bit of an ROI or line name, interning it on first use.
+
+    Raises ValueError when all MAX_ZONE_NAMES bits are taken.
+    """
+    bit = _zone_bits.get(name)
+    if bit is None:
+        if len(_zone_bits) >= MAX_ZONE_NAMES:
+            raise ValueError("no zone mask bit left for %r, at most %d ROI and line names are supported"
+                             % (name, MAX_ZONE_NAMES))
+        bit = 1 << len(_zone_bits)
+        _zone_bits[name] = bit
+    return bit
+
+
+def check_zone_names(names):
+    """Raise ValueError if interning names would take more than MAX_ZONE_NAMES mask bits."""
+    count = len(_zone_bits) + len(set(names).difference(_zone_bits))
+    if count > MAX_ZONE_NAMES:
+        raise ValueError("%d ROI and line names, at most %d are supported" % (count, MAX_ZONE_NAMES))
+
+
+def zone_names():
+    """Return the interned ROI and line names, in mask bit order."""
+    return list(_zone_bits)
+
+
+def zone_mask(names):
+    """Return the combined mask bits of a list of ROI or line names."""
+    mask = 0
+    for name in names:
+        mask |= zone_bit(name)
+    return mask
+
+
+class FrameObjects:
+    """Struct-of-arrays view of the objects of one frame.
+
+    boxes holds (left, top, width, height) rows. roi_mask and lc_mask are the
+    zone_bit() masks of the ROIs the object is in and the lines it crossed.
+    obj_metas keeps the source pyds objects, in the same order, for writing
+    styles back; it is None for synthetic frames. zone_counts, line_counts and
+    overcrowding are the nvdsanalytics frame meta, or None when the frame had
+    none attached.
+    """
+
+    __slots__ = ("stream_id", "frame_num", "boxes", "labels", "class_ids", "component_ids",
+                 "object_ids", "confidences", "roi_mask", "lc_mask", "obj_metas",
+                 "zone_counts", "line_counts", "overcrowding", "frame_meta")
+
+    def __init__(self, stream_id, frame_num, boxes, labels, class_ids, component_ids, object_ids,
+                 confidences, roi_mask, lc_mask, obj_metas=None, zone_counts=None, line_counts=None,
+                 overcrowding=None, frame_meta=None):
+        self.stream_id = stream_id
+        self.frame_num = frame_num
+        self.boxes = boxes
+        self.labels = labels
+        self.class_ids = class_ids
+        self.component_ids = component_ids
+        self.object_ids = object_ids
+        self.confidences = confidences
+        self.roi_mask = roi_mask
+        self.lc_mask = lc_mask
+        self.obj_metas = obj_metas
+        self.zone_counts = zone_counts
+        self.line_counts = line_counts
+        self.overcrowding = overcrowding
+        self.frame_meta = frame_meta
+
+    def __len__(self):
+        return len(self.labels)
+
+    @classmethod
+    def from_rows(cls, stream_id, frame_num, rows, zone_counts=None, line_counts=None,
+                  overcrowding=None, obj_metas=None, frame_meta=None):
+        """Build a frame from per-object rows.
+
+        Each row is (left, top, width, height, label, class_id, component_id,
+        object_id, confidence, roi_names, lc_names); label is a string.
+        """
+        count = len(rows)
+        boxes = np.empty((count, 4), dtype=np.float64)
+        labels = np.empty(count, dtype=np.int16)
+        class_ids = np.empty(count, dtype=np.int32)
+        component_ids = np.empty(count, dtype=np.int32)
+        object_ids = np.empty(count, dtype=np.uint64)
+        confidences = np.empty(count, dtype=np.float32)
+        roi_mask = np.empty(count, dtype=np.uint64)
+        lc_mask = np.empty(count, dtype=np.uint64)
+        for i, (left, top, width, height, label, class_id, component_id, object_id,
+                confidence, roi_names, lc_names) in enumerate(rows):
+            boxes[i] = (left, top, width, height)
+            labels[i] = LABEL_CODES.get(label, LABEL_UNKNOWN)
+            class_ids[i] = class_id
+            component_ids[i] = component_id
+            object_ids[i] = object_id
+            confidences[i] = confidence
+            roi_mask[i] = zone_mask(roi_names)
+            lc_mask[i] = zone_mask(lc_names)
+        return cls(stream_id, frame_num, boxes, labels, class_ids, component_ids, object_ids,
+                   confidences, roi_mask, lc_mask, obj_metas, zone_counts, line_counts,
+                   overcrowding, frame_meta)
+
+    @classmethod
+    def synthetic(cls, stream_id, frame_num, boxes, labels, object_ids=None, roi_names=None,
+                  zone_counts=None, line_counts=None, overcrowding=None):
+        """Build a frame for tests and benchmarks from boxes and label strings.
+
+        roi_names, if given, is one list of ROI names per object.
+        """
+        count = len(labels)
+        if object_ids is None:
+            object_ids = range(count)
+        if roi_names is None:
+            roi_names = [()] * count
+        rows = [(*box, label, 0, 0, object_id, 1.0, rois, ())
+                for box, label, object_id, rois in zip(boxes, labels, object_ids, roi_names)]
+        return cls.from_rows(stream_id, frame_num, rows, zone_counts, line_counts, overcrowding)
+
+
+class BatchObjects:
+    """The frames of one batch, in the order of the batch meta frame list."""
+
+    __slots__ = ("frames",)
+
+    def __init__(self, frames):
+        self.frames = frames
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    def __len__(self):
+        return len(self.frames)
+
+    @property
+    def stream_ids(self):
+        """Stream id of every object in the batch, frame after frame."""
+        if not self.frames:
+            return np.empty(0, dtype=np.int32)
+        return np.concatenate([np.full(len(frame), frame.stream_id, dtype=np.int32)
+                               for frame in self.frames])
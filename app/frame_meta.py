@@ -0,0 +1,167 @@
+################################################################################
+# One-pass extraction of the batch metadata into frame_arrays structures.
+#
+# Every pyds attribute read is a pybind crossing, so each object and user meta
+# is visited exactly once here and its fields are copied into plain Python
+# values; everything downstream works on the resulting arrays.
+################################################################################
+
+import time
+
+import pyds
+
+from frame_arrays import BatchObjects, FrameObjects
+from profiling import SECTION_OBJECTS, SECTION_USER_META
+
+ANALYTICS_OBJ_META = "NVIDIA.DSANALYTICSOBJ.USER_META"
+ANALYTICS_FRAME_META = "NVIDIA.DSANALYTICSFRAME.USER_META"
+
+# The user meta types are registered by the nvdsanalytics plugin; looking them
+# up once instead of per object saves a string round trip through pyds.
+_meta_types = {}
+
+
+def _meta_type(name):
+    meta_type = _meta_types.get(name)
+    if meta_type is None:
+        meta_type = _meta_types[name] = pyds.nvds_get_user_meta_type(name)
+    return meta_type
+
+
+def _object_analytics(obj_meta, obj_meta_type):
+    """Return the (roiStatus, lcStatus) lists of an object's analytics meta."""
+    l_user_meta = obj_meta.obj_user_meta_list
+    while l_user_meta:
+        try:
+            user_meta = pyds.NvDsUserMeta.cast(l_user_meta.data)
+            if user_meta.base_meta.meta_type == obj_meta_type:
+                user_meta_data = pyds.NvDsAnalyticsObjInfo.cast(user_meta.user_meta_data)
+                return user_meta_data.roiStatus, user_meta_data.lcStatus
+        except StopIteration:
+            break
+        try:
+            l_user_meta = l_user_meta.next
+        except StopIteration:
+            break
+    return (), ()
+
+
+def _frame_analytics(frame_meta, frame_meta_type):
+    """Return the (objInROIcnt, objLCCumCnt, ocStatus) dicts of a frame, or None."""
+    l_user = frame_meta.frame_user_meta_list
+    while l_user:
+        try:
+            user_meta = pyds.NvDsUserMeta.cast(l_user.data)
+            if user_meta.base_meta.meta_type == frame_meta_type:
+                user_meta_data = pyds.NvDsAnalyticsFrameMeta.cast(user_meta.user_meta_data)
+                return user_meta_data.objInROIcnt, user_meta_data.objLCCumCnt, user_meta_data.ocStatus
+        except StopIteration:
+            break
+        try:
+            l_user = l_user.next
+        except StopIteration:
+            break
+    return None
+
+
+def _copy_objects(frame_meta):
+    """Return the object metas of a frame and a row of copied fields for each."""
+    rows = []
+    obj_metas = []
+    l_obj = frame_meta.obj_meta_list
+    while l_obj:
+        try:
+            # Note that l_obj.data needs a cast to pyds.NvDsObjectMeta
+            # The casting is done by pyds.NvDsObjectMeta.cast()
+            obj_meta = pyds.NvDsObjectMeta.cast(l_obj.data)
+        except StopIteration:
+            break
+
+        rect_params = obj_meta.rect_params
+        rows.append([rect_params.left, rect_params.top, rect_params.width, rect_params.height,
+                     obj_meta.obj_label, obj_meta.class_id, obj_meta.unique_component_id,
+                     obj_meta.object_id, obj_meta.confidence, (), ()])
+        obj_metas.append(obj_meta)
+
+        try:
+            l_obj = l_obj.next
+        except StopIteration:
+            break
+    return rows, obj_metas
+
+
+def _walk_user_meta(frame_meta, rows, obj_metas, object_analytics=True):
+    """Fill the ROI / line status of every row; return the frame analytics or None."""
+    if object_analytics:
+        obj_meta_type = _meta_type(ANALYTICS_OBJ_META)
+        for row, obj_meta in zip(rows, obj_metas):
+            roi_status, lc_status = _object_analytics(obj_meta, obj_meta_type)
+            row[9] = roi_status or ()
+            row[10] = lc_status or ()
+    return _frame_analytics(frame_meta, _meta_type(ANALYTICS_FRAME_META))
+
+
+def extract_frame(frame_meta, profiler=None, object_analytics=True):
+    """Copy the objects and analytics meta of one NvDsFrameMeta into a FrameObjects.
+
+    With a profiling.SectionProfiler the object walk and the user meta walk
+    are timed separately. object_analytics=False skips the per-object ROI and
+    line status, for when zones.ZoneEngine computes them instead.
+    """
+    if profiler is None:
+        rows, obj_metas = _copy_objects(frame_meta)
+        analytics = _walk_user_meta(frame_meta, rows, obj_metas, object_analytics)
+    else:
+        start = time.perf_counter()
+        rows, obj_metas = _copy_objects(frame_meta)
+        copied = time.perf_counter()
+        analytics = _walk_user_meta(frame_meta, rows, obj_metas, object_analytics)
+        walked = time.perf_counter()
+        profiler.record(frame_meta.pad_index, SECTION_OBJECTS, copied - start)
+        profiler.record(frame_meta.pad_index, SECTION_USER_META, walked - copied)
+
+    zone_counts = line_counts = overcrowding = None
+    if analytics is not None:
+        zone_counts, line_counts, overcrowding = analytics
+    return FrameObjects.from_rows(frame_meta.pad_index, frame_meta.frame_num, rows,
+                                  zone_counts, line_counts, overcrowding, obj_metas, frame_meta)
+
+
+def extract_batch(batch_meta, profiler=None, object_analytics=True):
+    """Copy every frame of an NvDsBatchMeta into a BatchObjects."""
+    frames = []
+    l_frame = batch_meta.frame_meta_list
+    while l_frame:
+        try:
+            # Note that l_frame.data needs a cast to pyds.NvDsFrameMeta
+            # The casting is done by pyds.NvDsFrameMeta.cast()
+            # The casting also keeps ownership of the underlying memory
+            # in the C code, so the Python garbage collector will leave
+            # it alone.
+            frame_meta = pyds.NvDsFrameMeta.cast(l_frame.data)
+        except StopIteration:
+            break
+
+        frames.append(extract_frame(frame_meta, profiler, object_analytics))
+
+        try:
+            l_frame = l_frame.next
+        except StopIteration:
+            break
+    return BatchObjects(frames)
+
+
+def batch_stream_ids(gst_buffer):
+    """Return the stream ids of the frames in a batched buffer, for tracing.PipelineTracer."""
+    batch_meta = pyds.gst_buffer_get_nvds_batch_meta(hash(gst_buffer))
+    if not batch_meta:
+        return (0,)
+    stream_ids = []
+    l_frame = batch_meta.frame_meta_list
+    while l_frame:
+        try:
+            stream_ids.append(pyds.NvDsFrameMeta.cast(l_frame.data).pad_index)
+            l_frame = l_frame.next
+        except StopIteration:
+            break
+    return stream_ids
@@ -0,0 +1,242 @@
+################################################################################
+# Applying config edits to the running pipeline.
+#
+# ConfigReloader polls the files the probe and nvdsanalytics were started
+# with (the nvdsanalytics config, --zone-geometry, --ppe-rules and
+# --compliance-config). A file counts as changed once its size and mtime have
+# been stable for one poll, so a save in progress is not read half written.
+# A changed file is parsed and validated completely on the GLib main loop;
+# only then are the replacements built (ZoneEngine, RuleEngine,
+# ComplianceSettings and a validated copy of the nvdsanalytics config). The
+# streaming thread swaps them in through apply_pending(), called from a probe
+# on the nvdsanalytics sink pad, so the element and the analytics probe switch
+# at the same buffer. A file that fails validation is reported and ignored
+# until it changes again; the pipeline keeps running on the previous version.
+#
+# Stored track verdicts only hold for the zones they were taken in: when the
+# restricted-zone or the ROIs of the verdicts' zone source change, an empty
+# TrackStateStore is swapped in with the rest. The evaluator, on the worker
+# thread in split mode, only ever sees one store or the other.
+################################################################################
+
+import collections
+import configparser
+import os
+import shutil
+import sys
+import threading
+
+from compliance import load_compliance_settings
+from ppe_rules import RuleEngine, load_ppe_rules
+from zones import LINE_SECTION, OVERCROWDING_SECTION, ROI_SECTION, load_zone_geometry
+
+DEFAULT_RELOAD_INTERVAL = 2
+MIN_POLYGON_POINTS = 3
+
+
+def _signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class FileWatcher:
+    """Reports files whose size or mtime changed and then held still for one poll."""
+
+    def __init__(self, paths):
+        self.paths = [path for path in dict.fromkeys(paths) if path]
+        self._applied = {path: _signature(path) for path in self.paths}
+        self._candidates = {}
+
+    def changed(self):
+        changed = []
+        for path in self.paths:
+            signature = _signature(path)
+            if signature == self._applied[path] or signature is None:
+                self._candidates.pop(path, None)
+                continue
+            if self._candidates.get(path) == signature:
+                del self._candidates[path]
+                self._applied[path] = signature
+                changed.append(path)
+            else:
+                self._candidates[path] = signature
+        return changed
+
+
+def validate_analytics_config(path, frame_width=None, frame_height=None):
+    """Parse an nvdsanalytics config as the plugin would; return its geometry or raise ValueError."""
+    config = configparser.ConfigParser(interpolation=None, strict=False)
+    config.optionxform = str
+    try:
+        if not config.read(path):
+            raise ValueError("unable to read %s" % path)
+    except configparser.Error as e:
+        raise ValueError("%s: %s" % (path, e))
+    if not config.has_section("property"):
+        raise ValueError("%s: missing [property] section" % path)
+    properties = config["property"]
+    for key in ("config-width", "config-height"):
+        if not properties.get(key, "1").strip().isdigit() or int(properties.get(key, "1")) <= 0:
+            raise ValueError("%s: %s must be a positive integer" % (path, key))
+    for section_name in config.sections():
+        section = config[section_name]
+        if section_name.startswith(OVERCROWDING_SECTION) and not section.get("object-threshold", "0").isdigit():
+            raise ValueError("%s: [%s] object-threshold must be a non-negative integer" % (path, section_name))
+        if section_name.startswith((ROI_SECTION, OVERCROWDING_SECTION, LINE_SECTION)):
+            if not section_name.rsplit("-", 1)[1].isdigit():
+                raise ValueError("%s: [%s] has no stream id" % (path, section_name))
+            if section.get("enable", "1") not in ("0", "1"):
+                raise ValueError("%s: [%s] enable must be 0 or 1" % (path, section_name))
+        if section_name.startswith((ROI_SECTION, OVERCROWDING_SECTION)):
+            for key, value in section.items():
+                points = len([v for v in value.split(";") if v.strip()]) // 2
+                if key.startswith("roi-") and points < MIN_POLYGON_POINTS:
+                    raise ValueError("%s: [%s] %s has %d points" % (path, section_name, key, points))
+    # Coordinate lists are checked by compiling them
+    try:
+        return load_zone_geometry(path, frame_width, frame_height)
+    except ValueError as e:
+        raise ValueError("%s: %s" % (path, e))
+
+
+def _roi_set(geometry):
+    """Return a comparable form of the ROIs of a geometry, per stream."""
+    return {stream_id: (tuple(stream.rois.names), stream.rois.x1.tobytes(), stream.rois.y1.tobytes(),
+                        stream.inverse_roi, stream.roi_class_id)
+            for stream_id, stream in geometry.items()}
+
+
+class ConfigReloader:
+    """Watches the analytics configs and swaps validated replacements into the running pipeline.
+
+    element is the nvdsanalytics element, or None to leave the plugin alone.
+    """
+
+    def __init__(self, probe, element=None, analytics_config=None, zone_geometry=None, ppe_rules=None,
+                 compliance_config=None, frame_size=(None, None)):
+        self.probe = probe
+        self.element = element
+        self.analytics_config = analytics_config
+        self.zone_geometry = zone_geometry
+        self.ppe_rules = ppe_rules
+        self.compliance_config = compliance_config
+        self.frame_size = frame_size
+        self.watcher = FileWatcher([analytics_config, zone_geometry, ppe_rules, compliance_config])
+        self.counters = collections.Counter()
+        self.last_error = None
+        self._generation = 0
+        self._pending = None
+        self._lock = threading.Lock()
+        # What the stored track verdicts were taken against
+        self._zone_name = probe.compliance.zone_name
+        self._rois = self._load_rois()
+
+    def poll(self):
+        """Validate the changed files and stage their replacements; return the changed paths."""
+        changed = self.watcher.changed()
+        if not changed:
+            return changed
+        try:
+            updates = self._build(changed)
+        except Exception as e:
+            # Whatever a broken file raises, the running version stays
+            self.counters["rejected"] += 1
+            self.last_error = str(e)
+            sys.stderr.write("Config reload rejected, keeping the running version: %s\n" % e)
+            return changed
+        if not updates:
+            return changed
+        with self._lock:
+            pending = self._pending or {}
+            pending.update(updates)
+            self._pending = pending
+        self.counters["staged"] += 1
+        print("Config reload staged: %s" % ", ".join(sorted(updates)))
+        return changed
+
+    def _roi_source(self):
+        # The ROIs of the verdicts: the probe's own geometry, or the plugin's meta
+        return self.zone_geometry if self.probe.zone_engine is not None else self.analytics_config
+
+    def _load_rois(self):
+        source = self._roi_source()
+        if not source:
+            return None
+        try:
+            return _roi_set(load_zone_geometry(source, *self.frame_size))
+        except (OSError, ValueError):
+            return None
+
+    def _geometry_source(self):
+        # The same priority main.py uses for the ppe rules
+        return self.zone_geometry or self.analytics_config
+
+    def _build(self, changed):
+        updates = {}
+        width, height = self.frame_size
+        geometries = {}
+        if self.analytics_config in changed:
+            # Validate a private copy so the element gets exactly the validated text
+            staged = self._live_path(self.analytics_config, self._generation + 1) + ".tmp"
+            shutil.copyfile(self.analytics_config, staged)
+            try:
+                geometries[self.analytics_config] = validate_analytics_config(staged, width, height)
+            except ValueError as e:
+                os.remove(staged)
+                raise ValueError(str(e).replace(staged, self.analytics_config))
+        if self.zone_geometry in changed and self.zone_geometry not in geometries:
+            geometries[self.zone_geometry] = validate_analytics_config(self.zone_geometry, width, height)
+        if self.zone_geometry in geometries and self.probe.zone_engine is not None:
+            updates["zone_engine"] = self.probe.zone_engine.reconfigured(geometries[self.zone_geometry])
+        if self.ppe_rules and self.probe.ppe_engine is not None and (
+                self.ppe_rules in changed or self._geometry_source() in geometries):
+            geometry = geometries.get(self._geometry_source(), self.probe.ppe_engine.geometry)
+            updates["ppe_engine"] = RuleEngine(load_ppe_rules(self.ppe_rules), geometry)
+        if self.compliance_config in changed:
+            updates["compliance"] = load_compliance_settings(self.compliance_config)
+        zone_name = updates["compliance"].zone_name if "compliance" in updates else self._zone_name
+        rois = _roi_set(geometries[self._roi_source()]) if self._roi_source() in geometries else self._rois
+        track_store = self.probe.track_store
+        if track_store is not None and (zone_name != self._zone_name or rois != self._rois):
+            updates["track_store"] = track_store.empty_copy()
+        if self.analytics_config in changed:
+            # Everything validated: publish the copy under a name nobody writes to
+            self._generation += 1
+            live_path = self._live_path(self.analytics_config, self._generation)
+            os.replace(live_path + ".tmp", live_path)
+            if self.element is not None:
+                updates["nvdsanalytics"] = live_path
+        self._zone_name = zone_name
+        self._rois = rois
+        return updates
+
+    def _live_path(self, path, generation):
+        # Two alternating names, so every reload changes the element's property value
+        directory, name = os.path.split(os.path.abspath(path))
+        return os.path.join(directory, ".%s.live%d" % (name, generation % 2))
+
+    def apply_pending(self):
+        """Swap in the staged replacements; runs on the streaming thread between buffers."""
+        if self._pending is None:
+            return
+        with self._lock:
+            pending, self._pending = self._pending, None
+        for name, value in pending.items():
+            if name == "nvdsanalytics":
+                self.element.set_property("config-file", value)
+            else:
+                setattr(self.probe, name, value)
+        self.counters["applied"] += 1
+
+    def poll_callback(self):
+        """GLib timeout callback polling the watched files."""
+        self.poll()
+        return True
+
+    def stats(self):
+        stats = {key: self.counters[key] for key in ("staged", "applied", "rejected")}
+        stats["last_error"] = self.last_error
+        return stats
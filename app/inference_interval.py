@@ -0,0 +1,101 @@
+################################################################################
+# Inference-interval-aware evaluation.
+#
+# With interval=N in the PGIE config, PeopleNet only runs on every (N+1)th
+# batch and nvtracker propagates the person boxes in between. On those
+# tracker-only frames no person detection is new, so the probe reuses the
+# stored per-track verdicts and only associates helmets for tracks that just
+# appeared; every track is re-associated on the next inference frame.
+#
+# A frame counts as inferred when one of its PGIE objects carries a detector
+# confidence: nvtracker sets confidence to -0.1 on objects it propagated
+# without a matching detection. The frame's bInferDone flag is not usable
+# here because the YOLO SGIE runs in full frame mode and sets it on every
+# frame.
+#
+# IntervalStats measures the evaluation time of both kinds of frames per
+# stream and reports how much probe CPU time the reuse saved.
+################################################################################
+
+import configparser
+
+import numpy as np
+
+# gie-unique-id of the PGIE when its config does not set one
+DEFAULT_PGIE_UNIQUE_ID = 1
+
+
+def pgie_settings(config_file):
+    """Return (gie-unique-id, interval) from an nvinfer config file."""
+    config = configparser.ConfigParser(interpolation=None, strict=False)
+    config.read(config_file)
+    if not config.has_section("property"):
+        return DEFAULT_PGIE_UNIQUE_ID, 0
+    properties = config["property"]
+    return (properties.getint("gie-unique-id", DEFAULT_PGIE_UNIQUE_ID), properties.getint("interval", 0))
+
+
+def is_inferred(frame, pgie_unique_id=DEFAULT_PGIE_UNIQUE_ID):
+    """Return True if the detector ran on this frame."""
+    return bool(np.any((frame.component_ids == pgie_unique_id) & (frame.confidences >= 0)))
+
+
+class StreamIntervalStats:
+    __slots__ = ("inferred_frames", "tracked_frames", "inferred_seconds", "tracked_seconds",
+                 "inferred_evaluations", "tracked_evaluations", "reused")
+
+    def __init__(self):
+        self.inferred_frames = 0
+        self.tracked_frames = 0
+        self.inferred_seconds = 0.0
+        self.tracked_seconds = 0.0
+        self.inferred_evaluations = 0
+        self.tracked_evaluations = 0
+        self.reused = 0
+
+    def saved_seconds(self):
+        """Estimated time the tracker-only frames would have cost fully evaluated, minus their cost."""
+        if not self.inferred_evaluations:
+            return 0.0
+        per_evaluation = self.inferred_seconds / self.inferred_evaluations
+        full = per_evaluation * (self.tracked_evaluations + self.reused)
+        return max(0.0, full - self.tracked_seconds)
+
+
+class IntervalStats:
+    """Per-stream counters of inferred and tracker-only frames."""
+
+    def __init__(self, stream_offset=0):
+        self.streams = {}
+        # Added to the stream ids of snapshot(), see main.py --stream-offset
+        self.stream_offset = stream_offset
+
+    def record(self, stream_id, inferred, seconds, verdict):
+        stats = self.streams.get(stream_id)
+        if stats is None:
+            stats = self.streams[stream_id] = StreamIntervalStats()
+        if inferred:
+            stats.inferred_frames += 1
+            stats.inferred_seconds += seconds
+            stats.inferred_evaluations += verdict.evaluated_count
+        else:
+            stats.tracked_frames += 1
+            stats.tracked_seconds += seconds
+            stats.tracked_evaluations += verdict.evaluated_count
+            stats.reused += verdict.reused_count
+
+    def snapshot(self):
+        return {
+            stream_id + self.stream_offset: {
+                "inferred_frames": stats.inferred_frames,
+                "tracked_frames": stats.tracked_frames,
+                "associations_skipped": stats.reused,
+                "saved_ms": round(1000.0 * stats.saved_seconds(), 3),
+            }
+            for stream_id, stats in sorted(self.streams.items())
+        }
+
+    def print_stats_callback(self):
+        """GLib timeout callback printing the per-stream savings."""
+        print("\n**INTERVAL: ", self.snapshot(), "\n")
+        return True
@@ -0,0 +1,307 @@
+################################################################################
+# Adaptive PGIE interval.
+#
+# IntervalScheduler retunes the nvinfer interval property (batches skipped
+# between PeopleNet runs) every period from three measurements:
+#   load      the lowest per-stream FPS against target-fps and the fill level
+#             of the queue in front of the PGIE
+#   activity  the most persons seen at once in the restricted zone of any
+#             stream
+# Both the FPS and the persons are counted from the frames the probe passes
+# to observe(), over the scheduler's own period, so every decision is based
+# on frames of that period only (PERF_DATA's FPS is refreshed every 5 s and
+# would let one slow sample count for several periods).
+# A crowd in the zone (crowd-persons or more) asks for min-interval, a person
+# or two for the interval of the PGIE config, an empty zone for
+# max-interval. Lowering the interval happens at once, but only with load
+# headroom; raising it goes one step per raise-periods quiet periods. While
+# overloaded the interval goes up one step per overload-periods, and the
+# interval that was overloaded stays off limits for floor-periods, after
+# which the floor comes down one step to probe the lower interval. Every
+# time the probed interval overloads again the hold doubles, up to
+# max-floor-periods, and a probe that lasts a whole hold resets it, so on a
+# GPU that cannot keep up with a crowd the probes become rare instead of
+# making the interval swing every floor-periods. The SGIE can
+# follow the PGIE up to sgie-max-interval; helmets are not tracked, so 0
+# (SGIE on every frame) is the default.
+#
+# Every period that wants a change is a decision, applied or held, and is
+# written to the decision log. step() appends to that log with a plain
+# synchronous write and prints applied changes, so it belongs on the GLib
+# main loop (step_callback), never on the streaming thread: observe() is the
+# scheduler's only work there. The frames and the queue level come from
+# observe() and a plain callable, so utils/simulate_interval_scheduler.py
+# drives the scheduler with simulated load traces instead of a pipeline.
+################################################################################
+
+import collections
+import configparser
+import json
+import time
+
+import numpy as np
+
+from compliance import RESTRICTED_AREA
+from frame_arrays import LABEL_PERSON, zone_bit
+
+SCHEDULER_SECTION = "interval-scheduler"
+DEFAULT_PERIOD = 2
+# Decisions kept in memory for stats()
+DECISION_HISTORY = 64
+
+REASON_OVERLOAD = "overload"
+REASON_CROWD = "crowd"
+REASON_ACTIVE = "active"
+REASON_IDLE = "idle"
+REASON_FLOOR = "floor"
+
+
+class SchedulerSettings:
+    """Bounds, thresholds and hold times of the interval scheduler."""
+
+    _FIELDS = (
+        # key, attribute, type, default
+        ("min-interval", "min_interval", int, 0),
+        ("max-interval", "max_interval", int, 10),
+        ("target-fps", "target_fps", float, 30.0),
+        ("overload-fps-ratio", "overload_fps_ratio", float, 0.9),
+        ("recover-fps-ratio", "recover_fps_ratio", float, 0.97),
+        ("high-backlog", "high_backlog", float, 0.5),
+        ("low-backlog", "low_backlog", float, 0.2),
+        ("crowd-persons", "crowd_persons", int, 3),
+        ("raise-periods", "raise_periods", int, 3),
+        ("overload-periods", "overload_periods", int, 2),
+        ("floor-periods", "floor_periods", int, 30),
+        ("max-floor-periods", "max_floor_periods", int, 480),
+        ("sgie-max-interval", "sgie_max_interval", int, 0),
+        ("period", "period", int, DEFAULT_PERIOD),
+        ("restricted-zone", "zone_name", str, RESTRICTED_AREA),
+    )
+
+    __slots__ = tuple(attribute for _, attribute, _, _ in _FIELDS)
+
+    def __init__(self, **values):
+        for _, attribute, _, default in self._FIELDS:
+            setattr(self, attribute, values.pop(attribute, default))
+        if values:
+            raise TypeError("unknown settings %s" % ", ".join(sorted(values)))
+
+    def validate(self):
+        """Raise ValueError if the settings contradict each other."""
+        if not 0 <= self.min_interval <= self.max_interval:
+            raise ValueError("need 0 <= min-interval <= max-interval")
+        if not self.target_fps > 0:
+            raise ValueError("target-fps must be positive")
+        if not 0 < self.overload_fps_ratio <= self.recover_fps_ratio:
+            raise ValueError("need 0 < overload-fps-ratio <= recover-fps-ratio")
+        if not 0 <= self.low_backlog <= self.high_backlog:
+            raise ValueError("need 0 <= low-backlog <= high-backlog")
+        for name in ("crowd_persons", "raise_periods", "overload_periods", "period"):
+            if getattr(self, name) < 1:
+                raise ValueError("%s must be at least 1" % name.replace("_", "-"))
+        if self.floor_periods < 0 or self.sgie_max_interval < 0:
+            raise ValueError("floor-periods and sgie-max-interval must not be negative")
+        if self.max_floor_periods < self.floor_periods:
+            raise ValueError("need floor-periods <= max-floor-periods")
+        return self
+
+
+def load_scheduler_settings(path):
+    """Read the [interval-scheduler] section of a config file; raise ValueError if it is invalid."""
+    config = configparser.ConfigParser(interpolation=None, strict=False)
+    try:
+        if not config.read(path):
+            raise ValueError("unable to read %s" % path)
+    except configparser.Error as e:
+        raise ValueError("%s: %s" % (path, e))
+    if not config.has_section(SCHEDULER_SECTION):
+        raise ValueError("%s: missing [%s] section" % (path, SCHEDULER_SECTION))
+    section = config[SCHEDULER_SECTION]
+    values = {}
+    for key, attribute, kind, _ in SchedulerSettings._FIELDS:
+        if key in section:
+            try:
+                values[attribute] = kind(section[key].strip())
+            except ValueError:
+                raise ValueError("%s: %s must be a %s" % (path, key, "number" if kind is not str else "name"))
+    try:
+        return SchedulerSettings(**values).validate()
+    except ValueError as e:
+        raise ValueError("%s: %s" % (path, e))
+
+
+class IntervalScheduler:
+    """Adjusts the PGIE (and optionally SGIE) interval from load and zone activity.
+
+    apply(pgie_interval, sgie_interval) sets the intervals. The FPS of a
+    stream is its frames passed to observe() over the period; streams without
+    frames in a period (not attached, ended) or in the one before it (just
+    started, part of the period without frames) are ignored. backlog_source()
+    returns the queue fill level in [0, 1], or None. observe() runs on the
+    streaming thread, step() on the GLib loop: it opens and appends to
+    log_path and prints, and must not be called from a pad probe.
+    """
+
+    def __init__(self, settings, interval, apply=None, backlog_source=None, log_path=None, clock=time.time):
+        self.settings = settings
+        self.base_interval = min(max(interval, settings.min_interval), settings.max_interval)
+        self.interval = interval
+        self.apply = apply
+        self.backlog_source = backlog_source
+        self.log_path = log_path
+        self.clock = clock
+        self.decisions = collections.deque(maxlen=DECISION_HISTORY)
+        self.counters = collections.Counter()
+        self._zone_bit = np.uint64(zone_bit(settings.zone_name))
+        self._peaks = {}
+        self._frames = collections.Counter()
+        self._period_start = clock()
+        self._streams = set()
+        self._raise_streak = 0
+        self._overload_streak = 0
+        # Lowest interval allowed, and for how many more periods, after an overload
+        self._floor = settings.min_interval
+        self._floor_periods = 0
+        # Current hold of the floor, and the interval the last floor step probes
+        self._floor_hold = settings.floor_periods
+        self._probed = None
+        self._last_backlog = None
+
+    def observe(self, frame):
+        """Count a frame and its persons in the restricted zone."""
+        self._frames[frame.stream_id] += 1
+        if not len(frame):
+            return
+        count = int(np.count_nonzero((frame.labels == LABEL_PERSON) & ((frame.roi_mask & self._zone_bit) != 0)))
+        peaks = self._peaks
+        if count > peaks.get(frame.stream_id, 0):
+            peaks[frame.stream_id] = count
+
+    def measure(self):
+        """Return the measurements of the period that just ended and start a new one."""
+        peaks, self._peaks = self._peaks, {}
+        frames, self._frames = self._frames, collections.Counter()
+        now = self.clock()
+        elapsed, self._period_start = now - self._period_start, now
+        fps = {}
+        if elapsed > 0:
+            fps = {stream: count / elapsed for stream, count in frames.items() if stream in self._streams}
+        self._streams = set(frames)
+        backlog = self.backlog_source() if self.backlog_source is not None else None
+        return {"min_fps": min(fps.values()) if fps else None, "backlog": backlog,
+                "zone_persons": max(peaks.values()) if peaks else 0}
+
+    def _activity_interval(self, zone_persons):
+        settings = self.settings
+        if zone_persons >= settings.crowd_persons:
+            return settings.min_interval, REASON_CROWD
+        if zone_persons > 0:
+            return self.base_interval, REASON_ACTIVE
+        return settings.max_interval, REASON_IDLE
+
+    def decide(self, measurement):
+        """Return (interval, reason, applied) for one period's measurements; updates the hold state."""
+        settings = self.settings
+        min_fps = measurement["min_fps"]
+        backlog = measurement["backlog"]
+        current = self.interval
+        # A full queue that is already draining is not an overload any more
+        filling = backlog is not None and backlog > settings.high_backlog and (
+            self._last_backlog is None or backlog >= self._last_backlog)
+        self._last_backlog = backlog
+        overloaded = (min_fps is not None and min_fps < settings.overload_fps_ratio * settings.target_fps) or filling
+        headroom = ((min_fps is None or min_fps >= settings.recover_fps_ratio * settings.target_fps)
+                    and (backlog is None or backlog <= settings.low_backlog))
+        if self._floor_periods:
+            self._floor_periods -= 1
+            if not self._floor_periods and self._floor > settings.min_interval:
+                if self._probed is not None:
+                    # The last probe held for a whole hold
+                    self._floor_hold = settings.floor_periods
+                # Probe one step lower at a time
+                self._floor -= 1
+                self._probed = self._floor
+                self._floor_periods = self._floor_hold
+
+        if overloaded:
+            self._raise_streak = 0
+            self._overload_streak += 1
+            if current >= settings.max_interval:
+                return current, REASON_OVERLOAD, False
+            if self._overload_streak < settings.overload_periods:
+                return current + 1, REASON_OVERLOAD, False
+            self._overload_streak = 0
+            if current == self._probed:
+                self._floor_hold = min(2 * self._floor_hold, settings.max_floor_periods)
+            else:
+                self._floor_hold = settings.floor_periods
+            self._probed = None
+            self._floor = current + 1
+            self._floor_periods = self._floor_hold
+            return current + 1, REASON_OVERLOAD, True
+        self._overload_streak = 0
+
+        wanted, reason = self._activity_interval(measurement["zone_persons"])
+        if wanted < current:
+            self._raise_streak = 0
+            if wanted < self._floor:
+                wanted, reason = self._floor, REASON_FLOOR
+            if wanted >= current:
+                return current, reason, False
+            # Without load headroom the change is held
+            return wanted, reason, headroom
+        if wanted > current:
+            self._raise_streak += 1
+            if self._raise_streak < settings.raise_periods:
+                return current + 1, reason, False
+            self._raise_streak = 0
+            return current + 1, reason, True
+        self._raise_streak = 0
+        return current, reason, False
+
+    def sgie_interval(self, interval):
+        return min(interval, self.settings.sgie_max_interval)
+
+    def step(self):
+        """Measure, decide and apply; return the decision, or None if nothing was to change."""
+        measurement = self.measure()
+        previous = self.interval
+        interval, reason, applied = self.decide(measurement)
+        self.counters["periods"] += 1
+        if interval == previous:
+            return None
+        decision = dict(measurement, time=self.clock(), previous=previous, interval=interval, reason=reason,
+                        applied=applied)
+        if applied:
+            self.interval = interval
+            decision["sgie_interval"] = self.sgie_interval(interval)
+            if self.apply is not None:
+                self.apply(interval, decision["sgie_interval"])
+            self.counters["changes"] += 1
+            self.counters[reason] += 1
+            print("Interval scheduler: PGIE interval %d -> %d (%s, fps %s, backlog %s, %d in %s)"
+                  % (previous, interval, reason, measurement["min_fps"], measurement["backlog"],
+                     measurement["zone_persons"], self.settings.zone_name))
+        else:
+            self.counters["held"] += 1
+        self.decisions.append(decision)
+        if self.log_path:
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps(decision) + "\n")
+        return decision
+
+    def step_callback(self):
+        """GLib timeout callback running one control period."""
+        self.step()
+        return True
+
+    def stats(self):
+        stats = {"interval": self.interval, "sgie_interval": self.sgie_interval(self.interval),
+                 "interval_floor": self._floor, "floor_hold": self._floor_hold}
+        stats.update(self.counters)
+        return stats
+
+    def print_stats_callback(self):
+        """GLib timeout callback printing the scheduler state."""
+        print("\n**SCHEDULER: ", self.stats(), "\n")
+        return True
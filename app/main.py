@@ -20,48 +20,66 @@
 import sys
 sys.path.append('../')
 import gi
+import argparse
 import configparser
 gi.require_version('Gst', '1.0')
 from gi.repository import GLib, Gst
 from ctypes import *
+import os
 import time
 import sys
-import math
 import platform
+import signal
 from common.platform_info import PlatformInfo
 from common.bus_call import bus_call
 from common.FPS import PERF_DATA
+from alerts import DEFAULT_REARM_FRAMES, AlertDetector, AlertSink, RotatingEventLog, WebhookBackend
+from analytics_probe import AnalyticsProbe
+from compliance import load_compliance_settings
+from engine_cache import EngineBuilder, EngineCache, find_trtexec, infer_elements
+from frame_meta import batch_stream_ids
+from hot_reload import DEFAULT_RELOAD_INTERVAL, ConfigReloader
+from inference_interval import IntervalStats, pgie_settings
+from interval_scheduler import IntervalScheduler, load_scheduler_settings
+from metrics_ring import DEFAULT_PUBLISH_MS, MetricsRing
+from outputs import OUTPUT_DISPLAY, OutputBuilder, parse_output_modes
+from pipeline_spec import PipelineBuilder, PipelineSpecError, load_pipeline_spec
+from ppe_rules import RuleEngine, load_ppe_rules
+from probe_worker import ProbeWorker
+from profiling import PROFILE_ENV, SectionProfiler, profiling_requested
+from recording import DEFAULT_CHUNK_FRAMES, MetadataRecorder
+from sharding import worker_metrics, write_json
+from snapshots import (DEFAULT_COOLDOWN, DEFAULT_MAX_PER_BATCH, DEFAULT_PROCESSES, SNAPSHOT_FORMATS,
+                       SnapshotCapture)
+from source_manager import ControlServer, SourceManager
+from timeseries import MAX_CHANNELS, TimeSeriesStore, channel_count
+from tracing import PipelineTracer, TraceServer
+from track_state import DEFAULT_SHADOW_TRACKING_AGE, TrackStateStore, shadow_tracking_age
+from zones import ANCHOR_FOOT, ANCHORS, ZoneEngine, load_zone_geometry
 
 import pyds
 
 perf_data = None
+# GPU of every element and decoder, set with --gpu-id
+gpu_id = 0
+# State of the analytics probe and its optional components, see analytics_probe.py
+analytics_probe = None
 
 MAX_DISPLAY_LEN=64
-MUXER_OUTPUT_WIDTH=1920
-MUXER_OUTPUT_HEIGHT=1080
-MUXER_BATCH_TIMEOUT_USEC = 33000
-TILED_OUTPUT_WIDTH=1920
-TILED_OUTPUT_HEIGHT=1080
 GST_CAPS_FEATURES_NVMM="memory:NVMM"
-OSD_PROCESS_MODE= 0
-OSD_DISPLAY_TEXT= 1
 pgie_classes_str= ["Person", "Bag", "Face"]
-pgie_config_file = "pgie_peoplenet_config.txt"
+pipeline_config_file = "pipeline_config.txt"
 tracker_config_file = "config_tracker_mot.txt"
-sgie_config_file = "sgie_yolo_detector_config.txt"
-analytics_config_file = "config_nvdsanalytics.txt"
-
-def is_helmet_on_head(person_center_x, person_center_y, helmet_center_x, helmet_center_y, threshold=30):
-    """Check if the helmet is positioned near the center of the person's head."""
-    # Check if the helmet center is within a certain distance of the head center
-    distance = ((person_center_x - helmet_center_x) ** 2 + (person_center_y - helmet_center_y) ** 2) ** 0.5
-    return distance < threshold  # Return True if the helmet is roughly on the head
+# Element names main.py configures beyond pipeline_config.txt
+PGIE_NAME = "primary-inference"
+TRACKER_NAME = "tracker"
+SGIE_NAME = "secondary1-nvinference-engine"
+SNAPSHOT_CONVERT_NAME = "snapshot-convert"
+SNAPSHOT_CAPS_NAME = "snapshot-caps"
 
 # nvanlytics_src_pad_buffer_probe  will extract metadata received on nvtiler sink pad
 # and update params for drawing rectangle, object information etc.
 def nvanalytics_src_pad_buffer_probe(pad,info,u_data):
-    frame_number=0
-    num_rects=0
     gst_buffer = info.get_buffer()
     if not gst_buffer:
         print("Unable to get GstBuffer ")
@@ -71,199 +89,24 @@ def nvanalytics_src_pad_buffer_probe(pad,info,u_data):
     # Note that pyds.gst_buffer_get_nvds_batch_meta() expects the
     # C address of gst_buffer as input, which is obtained with hash(gst_buffer)
     batch_meta = pyds.gst_buffer_get_nvds_batch_meta(hash(gst_buffer))
-    l_frame = batch_meta.frame_meta_list
+    analytics_probe.process_batch(batch_meta, gst_buffer)
+    return Gst.PadProbeReturn.OK
 
-    # Set of persons IDs who has assosiated with helmets
-    assosiated_persons_ids = set()
-    skip_counter = 5
 
-    while l_frame:
-        try:
-            # Note that l_frame.data needs a cast to pyds.NvDsFrameMeta
-            # The casting is done by pyds.NvDsFrameMeta.cast()
-            # The casting also keeps ownership of the underlying memory
-            # in the C code, so the Python garbage collector will leave
-            # it alone.
-            frame_meta = pyds.NvDsFrameMeta.cast(l_frame.data)
-        except StopIteration:
-            break
+def nvanalytics_sink_pad_buffer_probe(pad, info, reloader):
+    reloader.apply_pending()
+    return Gst.PadProbeReturn.OK
 
-        frame_number=frame_meta.frame_num
-        l_obj=frame_meta.obj_meta_list
-        num_rects = frame_meta.num_obj_meta
-        obj_counter = {'person': 0, 'helmet': 0}
-        helmet_locations = {}  # Store helmet detections with object ID and center positions
-        person_info = []  # Store information about detected persons in restricted areas
-
-        # print("#"*50)
-
-        while l_obj:
-            try: 
-                # Note that l_obj.data needs a cast to pyds.NvDsObjectMeta
-                # The casting is done by pyds.NvDsObjectMeta.cast()
-                obj_meta=pyds.NvDsObjectMeta.cast(l_obj.data)
-            except StopIteration:
-                break
-
-            if obj_meta.obj_label == "Helmet":
-                # Calculate center of the helmet bounding box
-                helmet_center_x = obj_meta.rect_params.left + obj_meta.rect_params.width / 2
-                helmet_center_y = obj_meta.rect_params.top + obj_meta.rect_params.height / 2
-                helmet_locations[obj_meta.object_id] = (helmet_center_x, helmet_center_y)
-                obj_counter['helmet'] += 1
-
-            if obj_meta.obj_label == "person":
-                obj_counter['person'] += 1
-                rect_params = obj_meta.rect_params
-                in_restricted_area = False
-                l_user_meta = obj_meta.obj_user_meta_list
-                while l_user_meta:
-                    try:
-                        user_meta = pyds.NvDsUserMeta.cast(l_user_meta.data)
-                        if user_meta.base_meta.meta_type == pyds.nvds_get_user_meta_type("NVIDIA.DSANALYTICSOBJ.USER_META"):             
-                            user_meta_data = pyds.NvDsAnalyticsObjInfo.cast(user_meta.user_meta_data)
-                            #if user_meta_data.dirStatus: print("Object {0} moving in direction: {1}".format(obj_meta.object_id, user_meta_data.dirStatus))                    
-                            #if user_meta_data.lcStatus: print("Object {0} line crossing status: {1}".format(obj_meta.object_id, user_meta_data.lcStatus))
-                            #if user_meta_data.ocStatus: print("Object {0} overcrowding status: {1}".format(obj_meta.object_id, user_meta_data.ocStatus))
-                            if user_meta_data.roiStatus and "Restricted Area" in user_meta_data.roiStatus:
-                                in_restricted_area = True
-                    except StopIteration:
-                        break
-
-                    try:
-                        l_user_meta = l_user_meta.next
-                    except StopIteration:
-                        break
-            
-                # Store information for persons in restricted zones
-                if in_restricted_area:
-                    person_info.append((obj_meta.object_id, rect_params, obj_meta.text_params))
-
-            rect_params = obj_meta.rect_params
-            rect_params.border_color.set(0.0, 1.0, 0.0, 1.0)  # Green border
-
-            text_params = obj_meta.text_params
-            # Modify the display text to show the class label and confidence
-            text_params.display_text = "{0}".format(obj_meta.obj_label)
-
-            # Optionally, change the font size and color
-            text_params.font_params.font_size = 12  # Set font size
-            text_params.font_params.font_name = "Serif"  # Change font style if needed
-
-            # Set text color (RGBA format: 1.0 = full intensity)
-            text_params.set_bg_clr = 1  # Enable background color
-
-            text_params.text_bg_clr.set(0.0, 1.0, 0.0, 0.3) # Green background with 30% opacity
-
-            # Set the text color (white, full intensity)
-            text_params.font_params.font_color.set(1.0, 1.0, 1.0, 1.0)
-
-            try: 
-                l_obj=l_obj.next
-            except StopIteration:
-                break
-
-        security_alert_cnt = len(person_info)
-        # After gathering all detections, associate helmets with persons in the restricted area
-        for person_id, rect_params, text_params in person_info:
-            if person_id in assosiated_persons_ids:
-                continue
-            assosiated_persons_ids.add(person_id)
-            helmet_associated = False
-            treshold = rect_params.height / 12
-            person_head_center_x = rect_params.left + rect_params.width / 2
-            person_head_center_y = rect_params.top + rect_params.height / 12  # Approximate head location in upper 1/6th
-
-            for _, (helmet_center_x, helmet_center_y) in helmet_locations.items():
-                if is_helmet_on_head(person_head_center_x, person_head_center_y, helmet_center_x, helmet_center_y, treshold):
-                    helmet_associated = True
-                    break
-
-            # Set bounding box color based on helmet association
-            if helmet_associated:
-                security_alert_cnt -= 1
-                rect_params.border_color.set(0.0, 1.0, 0.0, 1.0)  # Green border for wearing helmet
-            else:
-                rect_params.border_color.set(1.0, 0.0, 0.0, 1.0)  # Red border for not wearing helmet
-                text_params.text_bg_clr.set(1.0, 0.0, 0.0, 0.3)  # Red background with 30% opacity
-                text_params.display_text = pyds.get_string(text_params.display_text) + " DANGER ZONE: WEAR A HELMET!"
-        
-        display_text = "People Current Frame: {0}\n".format(obj_counter['person'])
-        
-        # Get meta data from NvDsAnalyticsFrameMeta
-        l_user = frame_meta.frame_user_meta_list
-        while l_user:
-            try:
-                user_meta = pyds.NvDsUserMeta.cast(l_user.data)
-                if user_meta.base_meta.meta_type == pyds.nvds_get_user_meta_type("NVIDIA.DSANALYTICSFRAME.USER_META"):
-                    user_meta_data = pyds.NvDsAnalyticsFrameMeta.cast(user_meta.user_meta_data)
-                    if (zone_dict := user_meta_data.objInROIcnt):
-                        for zone, cnt in zone_dict.items():
-                            display_text += "People in {0}: {1}\n".format(zone, cnt)
-                    if (line_dict := user_meta_data.objLCCumCnt):
-                        for line, cnt in line_dict.items():
-                            display_text += "{0} Total: {1}\n".format(line, cnt)
-                    if (oc_dict := user_meta_data.ocStatus):
-                        for zone, status in oc_dict.items():
-                            display_text += "Overcrowding in {0}: {1}\n".format(zone, "Yes" if status else "No")
-                    display_text += "Security alerts: {0}".format(security_alert_cnt)
-            except StopIteration:
-                break
-            try:
-                l_user = l_user.next
-            except StopIteration:
-                break
-
-        # Update skip counter
-        skip_counter -= 1
-        if skip_counter == 0:
-            assosiated_persons_ids.clear()
-            skip_counter = 5
-
-        # Acquiring a display meta object. The memory ownership remains in
-        # the C code so downstream plugins can still access it. Otherwise
-        # the garbage collector will claim it when this probe function exits.
-        display_meta=pyds.nvds_acquire_display_meta_from_pool(batch_meta)
-        display_meta.num_labels = 1
-        py_nvosd_text_params = display_meta.text_params[0]
-        # Setting display text to be shown on screen
-        # Note that the pyds module allocates a buffer for the string, and the
-        # memory will not be claimed by the garbage collector.
-        # Reading the display_text field here will return the C address of the
-        # allocated string. Use pyds.get_string() to get the string content.
-        py_nvosd_text_params.display_text = display_text
-
-        # Now set the offsets where the string should appear
-        py_nvosd_text_params.x_offset = 10
-        py_nvosd_text_params.y_offset = 12
-
-        # Font , font-color and font-size
-        py_nvosd_text_params.font_params.font_name = "Serif"
-        py_nvosd_text_params.font_params.font_size = 18
-        # set(red, green, blue, alpha); set to White
-        py_nvosd_text_params.font_params.font_color.set(1.0, 1.0, 1.0, 1.0)
-
-        # Text background color
-        py_nvosd_text_params.set_bg_clr = 1
-        # set(red, green, blue, alpha); set to Black
-        py_nvosd_text_params.text_bg_clr.set(0.0, 0.0, 0.0, 1.0)
-        # Using pyds.get_string() to get display_text as string
-        # print(pyds.get_string(py_nvosd_text_params.display_text))
-        pyds.nvds_add_display_meta_to_frame(frame_meta, display_meta)
-
-        # print("Frame Number=", frame_number, "stream id=", frame_meta.pad_index, "Number of Objects=",num_rects,"Face_count=",obj_counter[PGIE_CLASS_ID_FACE],"Person_count=",obj_counter[PGIE_CLASS_ID_PERSON])
-        # Update frame rate through this probe
-        stream_index = "stream{0}".format(frame_meta.pad_index)
-        global perf_data
-        perf_data.update_fps(stream_index)
 
-        try:
-            l_frame=l_frame.next
-        except StopIteration:
-            break
-        #print("#"*50)
-
-    return Gst.PadProbeReturn.OK
+def first_batch_probe(pad, info, u_data):
+    # Runs once: reports the startup time, then pre-builds engines without
+    # competing with the startup of nvinfer
+    engine_cache, engine_builder, startup_start = u_data
+    print(engine_cache.report(time.monotonic() - startup_start), "\n")
+    if engine_builder is not None and engine_builder.jobs:
+        engine_builder.start()
+        GLib.timeout_add(30000, engine_builder.print_stats_callback)
+    return Gst.PadProbeReturn.REMOVE
 
 
 def cb_newpad(decodebin, decoder_src_pad,data):
@@ -294,6 +137,26 @@ def decodebin_child_added(child_proxy,Object,name,user_data):
     print("Decodebin child added:", name, "\n")
     if(name.find("decodebin") != -1):
         Object.connect("child-added",decodebin_child_added,user_data)
+    if gpu_id and Object.find_property("gpu-id") is not None:
+        Object.set_property("gpu-id", gpu_id)
+
+def set_gpu_id(pipeline, gpu_id):
+    """Put every element of the pipeline that has a gpu-id property on gpu_id."""
+    iterator = pipeline.iterate_recurse()
+    while True:
+        result, element = iterator.next()
+        if result == Gst.IteratorResult.RESYNC:
+            iterator.resync()
+            continue
+        if result != Gst.IteratorResult.OK:
+            break
+        if element.find_property("gpu-id") is not None:
+            element.set_property("gpu-id", gpu_id)
+
+def write_metrics_callback(path, tracer):
+    """GLib timeout callback writing the metrics read by supervisor.py."""
+    write_json(path, worker_metrics(perf_data, analytics_probe, tracer))
+    return True
 
 def create_source_bin(index,uri):
     print("Creating source bin")
@@ -331,15 +194,135 @@ def create_source_bin(index,uri):
         return None
     return nbin
 
+def parse_args(args):
+    parser = argparse.ArgumentParser(prog=args[0], usage="%(prog)s [options] <uri1> [uri2] ... [uriN]")
+    parser.add_argument("uris", nargs="+", metavar="uri", help="source URIs (file://, rtsp://, ...)")
+    parser.add_argument("--pipeline-config", default=pipeline_config_file,
+                        help="pipeline topology and queue settings (default %(default)s)")
+    parser.add_argument("--output", type=parse_output_modes, default={OUTPUT_DISPLAY},
+                        help="comma separated outputs: analytics (metadata only, fakesink), display, "
+                             "file (H.264 .mkv); default display")
+    parser.add_argument("--output-file", default="out.mkv", help="file written by the file output")
+    parser.add_argument("--render-queue-size", type=int, default=4,
+                        help="buffers the leaky render queue holds when analytics runs next to "
+                             "display or file output")
+    parser.add_argument("--split-probe", action="store_true",
+                        help="only count FPS and style objects on the streaming thread and do helmet "
+                             "association, counters, overlay text and alert messages on a worker thread")
+    parser.add_argument("--probe-queue-size", type=int, default=256,
+                        help="frames buffered for the worker in split mode before the oldest are dropped")
+    parser.add_argument("--reeval-interval", type=int, default=5,
+                        help="frames between helmet re-association of a confirmed track")
+    parser.add_argument("--verdict-hysteresis", type=int, default=3,
+                        help="consecutive opposite observations needed to flip a track's verdict")
+    parser.add_argument("--profile", action="store_true",
+                        help="time each probe section per stream (also enabled by %s=1)" % PROFILE_ENV)
+    parser.add_argument("--profile-interval", type=int, default=0,
+                        help="seconds between profile dumps, 0 to dump only on SIGUSR1")
+    parser.add_argument("--alert-log", help="append violation, overcrowding and line crossing events "
+                                            "to this rotating JSONL file")
+    parser.add_argument("--alert-webhook", help="POST batches of the same events to this http(s) URL")
+    parser.add_argument("--alert-spill", default="alerts_spill.jsonl",
+                        help="file holding webhook batches that overflowed the retry queue")
+    parser.add_argument("--alert-rearm-frames", type=int, default=DEFAULT_REARM_FRAMES,
+                        help="frames a track must be compliant or unseen before it alerts again")
+    parser.add_argument("--zone-geometry",
+                        help="config_nvdsanalytics*.txt whose ROIs and lines are tested in-process instead "
+                             "of reading each object's analytics meta; slower than the meta, use it for "
+                             "--zone-anchor")
+    parser.add_argument("--zone-anchor", choices=ANCHORS, default=ANCHOR_FOOT,
+                        help="box point tested against the zones with --zone-geometry (default %(default)s)")
+    parser.add_argument("--interval-aware", action="store_true",
+                        help="on frames the PGIE skipped (interval > 0) reuse track verdicts and only "
+                             "associate new tracks; report the saved time per stream")
+    parser.add_argument("--interval-scheduler",
+                        help="adapt the PGIE interval to load and restricted-zone activity with the settings "
+                             "of this file (see config_interval_scheduler.txt)")
+    parser.add_argument("--interval-log", help="append every --interval-scheduler decision to this JSON lines file")
+    parser.add_argument("--ppe-rules",
+                        help="evaluate the helmet / vest / phone rules of this config (see "
+                             "config_ppe_rules.txt) instead of the built-in helmet check")
+    parser.add_argument("--trace", action="store_true",
+                        help="measure per-element and end-to-end buffer latency and sample queue levels")
+    parser.add_argument("--trace-port", type=int, default=0,
+                        help="serve the trace snapshot as JSON on this localhost port, 0 to disable")
+    parser.add_argument("--trace-file", help="write the trace snapshot as JSON to this file")
+    parser.add_argument("--trace-interval", type=int, default=5,
+                        help="seconds between trace snapshots written to --trace-file, or printed "
+                             "when neither --trace-file nor --trace-port is given")
+    parser.add_argument("--max-sources", type=int, default=0,
+                        help="stream slots reserved for sources added at runtime (default: the number of uris)")
+    parser.add_argument("--control-port", type=int, default=0,
+                        help="localhost TCP port accepting 'add <uri>', 'remove <id>' and 'list', 0 to disable")
+    parser.add_argument("--analytics-config",
+                        help="nvdsanalytics config to use instead of the one in the pipeline config")
+    parser.add_argument("--gpu-id", type=int, default=0, help="GPU of the pipeline elements and decoders")
+    parser.add_argument("--metrics-file", help="write FPS, alert and latency metrics as JSON to this file, "
+                                               "for supervisor.py")
+    parser.add_argument("--metrics-interval", type=int, default=5,
+                        help="seconds between writes of --metrics-file")
+    parser.add_argument("--stream-offset", type=int, default=0,
+                        help="camera list id of this process's stream 0, added to the stream ids of alerts, "
+                             "snapshots, time series, recordings and metrics; set by supervisor.py")
+    parser.add_argument("--timeseries-file",
+                        help="keep rolling per-stream occupancy, crossing and violation history and dump "
+                             "it to this .npz file; an existing dump is continued")
+    parser.add_argument("--timeseries-interval", type=int, default=60,
+                        help="seconds between dumps of --timeseries-file (default %(default)s)")
+    parser.add_argument("--snapshot-dir",
+                        help="write a cropped still of every restricted-area person without a helmet here; "
+                             "needs snapshot-convert and snapshot-caps enabled in the pipeline config")
+    parser.add_argument("--snapshot-cooldown", type=float, default=DEFAULT_COOLDOWN,
+                        help="seconds before the same track is captured again (default %(default)s)")
+    parser.add_argument("--snapshot-per-batch", type=int, default=DEFAULT_MAX_PER_BATCH,
+                        help="crops copied out per batch at most, the rest wait (default %(default)s)")
+    parser.add_argument("--snapshot-format", choices=SNAPSHOT_FORMATS, default="jpg",
+                        help="snapshot encoding (default %(default)s)")
+    parser.add_argument("--snapshot-workers", type=int, default=DEFAULT_PROCESSES,
+                        help="processes encoding and writing snapshots (default %(default)s)")
+    parser.add_argument("--record-file",
+                        help="append the objects, track ids and ROI / line status of every frame to this "
+                             "columnar file, for CPU replays with utils/replay_recording.py")
+    parser.add_argument("--record-chunk-frames", type=int, default=DEFAULT_CHUNK_FRAMES,
+                        help="frames per chunk of --record-file (default %(default)s)")
+    parser.add_argument("--metrics-shm",
+                        help="publish per-stream FPS, probe latency, counts and queue levels to this shared "
+                             "memory ring (a name under /dev/shm or a path), read with utils/read_metrics_ring.py")
+    parser.add_argument("--metrics-shm-interval", type=int, default=DEFAULT_PUBLISH_MS,
+                        help="milliseconds between --metrics-shm snapshots (default %(default)s)")
+    parser.add_argument("--compliance-config",
+                        help="restricted zone and head fraction of the built-in helmet check (see "
+                             "config_compliance.txt)")
+    parser.add_argument("--reload-interval", type=int, default=0,
+                        help="seconds between checks of the nvdsanalytics, --zone-geometry, --ppe-rules and "
+                             "--compliance-config files; changes are validated and applied without a restart. "
+                             "0 disables, %d is a good value" % DEFAULT_RELOAD_INTERVAL)
+    parser.add_argument("--no-engine-cache", action="store_true",
+                        help="run nvinfer with its configs as they are instead of picking cached "
+                             "engines for the batch size")
+    parser.add_argument("--engine-cache-dir",
+                        help="directory searched first for engines and holding pre-built ones "
+                             "(default: next to each model)")
+    parser.add_argument("--engine-batch-sizes", type=lambda value: [int(size) for size in value.split(",")],
+                        help="comma separated batch sizes to pre-build missing engines for with trtexec "
+                             "after startup, e.g. 1,2,4,8")
+    parser.add_argument("--trtexec", help="trtexec used for pre-builds (default: from PATH or TensorRT)")
+    parser.add_argument("--engine-build-log", help="append the trtexec output of pre-builds to this file")
+    return parser.parse_args(args[1:])
+
 def main(args):
     # Check input arguments
     if len(args) < 2:
-        sys.stderr.write("usage: %s <uri1> [uri2] ... [uriN]\n" % args[0])
+        sys.stderr.write("usage: %s [options] <uri1> [uri2] ... [uriN]\n" % args[0])
         sys.exit(1)
+    options = parse_args(args)
+    uris = options.uris
 
-    global perf_data
-    perf_data = PERF_DATA(len(args) - 1)
-    number_sources=len(args)-1
+    global perf_data, analytics_probe, gpu_id
+    startup_start = time.monotonic()
+    perf_data = PERF_DATA(len(uris))
+    analytics_probe = AnalyticsProbe(perf_data)
+    number_sources=len(uris)
 
     platform_info = PlatformInfo()
     # Standard GStreamer initialization
@@ -355,129 +338,174 @@ def main(args):
         sys.stderr.write(" Unable to create Pipeline \n")
     print("Creating streamux \n ")
 
-    # Create nvstreammux instance to form batches from one or more sources.
-    streammux = Gst.ElementFactory.make("nvstreammux", "Stream-muxer")
-    if not streammux:
-        sys.stderr.write(" Unable to create NvStreamMux \n")
+    # Create nvstreammux and the inference / analytics chain from the
+    # declarative description, see pipeline_config.txt
+    try:
+        spec = load_pipeline_spec(options.pipeline_config)
+    except PipelineSpecError as e:
+        sys.stderr.write(" %s \n" % e)
+        sys.exit(1)
+    # nvstreammux and nvinfer are sized for max_sources from the start
+    max_sources = max(number_sources, options.max_sources)
+
+    # Point every nvinfer at an engine built for this batch size and GPU, so
+    # another camera count does not rebuild it at startup, see engine_cache.py
+    engine_cache = engine_builder = None
+    if not options.no_engine_cache:
+        engine_cache = EngineCache(options.engine_cache_dir)
+        try:
+            for name, config_path in infer_elements(spec):
+                spec.elements[name].properties["config-file-path"] = engine_cache.write_config(
+                    name, config_path, max_sources, options.gpu_id)
+        except (OSError, ValueError) as e:
+            sys.stderr.write(" %s \n" % e)
+            sys.exit(1)
+        if options.engine_batch_sizes:
+            trtexec = find_trtexec(options.trtexec)
+            if trtexec is None:
+                print("WARNING: trtexec not found, engines are not pre-built \n")
+            else:
+                engine_builder = EngineBuilder(engine_cache, trtexec, options.engine_build_log)
+                for model, _ in engine_cache.choices.values():
+                    engine_builder.queue(model, options.engine_batch_sizes, options.gpu_id)
 
-    pipeline.add(streammux)
+    try:
+        builder = PipelineBuilder(spec)
+        chain_end = builder.build(pipeline)
+    except PipelineSpecError as e:
+        sys.stderr.write(" %s \n" % e)
+        sys.exit(1)
+    # The analytics probe goes on probe-element, not on whatever ends the chain
+    nvanalytics = builder.get(spec.probe_element)
+    streammux = builder.muxer
+    if options.analytics_config:
+        if nvanalytics.find_property("config-file") is None:
+            sys.stderr.write(" --analytics-config needs nvdsanalytics as the probe element \n")
+            sys.exit(1)
+        nvanalytics.set_property("config-file", options.analytics_config)
+    analytics_geometry = None
+    if nvanalytics.find_property("config-file") is not None:
+        # Interns the ROI and line names the plugin will report; more than fit in a zone mask stop here
+        try:
+            analytics_geometry = load_zone_geometry(nvanalytics.get_property("config-file"))
+        except ValueError as e:
+            sys.stderr.write(" %s \n" % e)
+            sys.exit(1)
+    pgie = builder.get(PGIE_NAME)
+    tracker = builder.get(TRACKER_NAME)
+
+    if options.snapshot_dir:
+        snapshot_convert = builder.get(SNAPSHOT_CONVERT_NAME)
+        if snapshot_convert is None or builder.get(SNAPSHOT_CAPS_NAME) is None:
+            sys.stderr.write(" --snapshot-dir needs %s and %s enabled in %s \n"
+                             % (SNAPSHOT_CONVERT_NAME, SNAPSHOT_CAPS_NAME, options.pipeline_config))
+            sys.exit(1)
+        if platform_info.is_integrated_gpu():
+            analytics_probe.unmap_surfaces = True
+        else:
+            # The probe maps the surfaces on the CPU, which needs CUDA unified memory on dGPU
+            snapshot_convert.set_property("nvbuf-memory-type", int(pyds.NVBUF_MEM_CUDA_UNIFIED))
+        try:
+            analytics_probe.snapshots = SnapshotCapture(options.snapshot_dir, options.snapshot_cooldown,
+                                                        options.snapshot_per_batch,
+                                                        processes=options.snapshot_workers,
+                                                        image_format=options.snapshot_format,
+                                                        stream_offset=options.stream_offset)
+        except (OSError, ValueError) as e:
+            sys.stderr.write(" %s \n" % e)
+            sys.exit(1)
+        GLib.timeout_add(5000, analytics_probe.snapshots.print_stats_callback)
+
+    if options.zone_geometry:
+        try:
+            geometry = load_zone_geometry(options.zone_geometry, streammux.get_property("width"),
+                                          streammux.get_property("height"))
+        except ValueError as e:
+            sys.stderr.write(" %s \n" % e)
+            sys.exit(1)
+        analytics_probe.zone_engine = ZoneEngine(geometry, options.zone_anchor)
+
+    if options.ppe_rules:
+        # Lines of near-line rules come from the analytics config the pipeline uses
+        try:
+            analytics_config = (options.zone_geometry or options.analytics_config or
+                                nvanalytics.get_property("config-file"))
+            geometry = load_zone_geometry(analytics_config, streammux.get_property("width"),
+                                          streammux.get_property("height"))
+            analytics_probe.ppe_engine = RuleEngine(load_ppe_rules(options.ppe_rules), geometry)
+        except ValueError as e:
+            sys.stderr.write(" %s \n" % e)
+            sys.exit(1)
+        # Through the probe, which holds the current engine after a reload
+        GLib.timeout_add(5000, lambda: analytics_probe.ppe_engine.print_stats_callback())
+
+    if options.compliance_config:
+        try:
+            analytics_probe.compliance = load_compliance_settings(options.compliance_config)
+        except ValueError as e:
+            sys.stderr.write(" %s \n" % e)
+            sys.exit(1)
+
+    # Sources are attached through the manager so more can be added, removed
+    # and reconnected while the pipeline runs; nvstreammux is sized for
+    # max_sources from the start.
+    source_manager = SourceManager(pipeline, streammux, perf_data, max_sources, create_source_bin)
     for i in range(number_sources):
         print("Creating source_bin ",i," \n ")
-        uri_name=args[i+1]
-        if uri_name.find("rtsp://") == 0 :
+        if uris[i].find("rtsp://") == 0 :
             is_live = True
-        source_bin=create_source_bin(i, uri_name)
-        if not source_bin:
-            sys.stderr.write("Unable to create source bin \n")
-        pipeline.add(source_bin)
-        padname="sink_%u" %i
-        sinkpad= streammux.request_pad_simple(padname) 
-        if not sinkpad:
-            sys.stderr.write("Unable to create sink pad bin \n")
-        srcpad=source_bin.get_static_pad("src")
-        if not srcpad:
-            sys.stderr.write("Unable to create src pad bin \n")
-        srcpad.link(sinkpad)
-    queue1=Gst.ElementFactory.make("queue","queue1")
-    queue2=Gst.ElementFactory.make("queue","queue2")
-    queue3=Gst.ElementFactory.make("queue","queue3")
-    queue4=Gst.ElementFactory.make("queue","queue4")
-    queue5=Gst.ElementFactory.make("queue","queue5")
-    queue6=Gst.ElementFactory.make("queue","queue6")
-    queue7=Gst.ElementFactory.make("queue","queue7")
-    queue8=Gst.ElementFactory.make("queue","queue8")
-    pipeline.add(queue1)
-    pipeline.add(queue2)
-    pipeline.add(queue3)
-    pipeline.add(queue4)
-    pipeline.add(queue5)
-    pipeline.add(queue6)
-    pipeline.add(queue7)
-    pipeline.add(queue8)
-
-    print("Creating Pgie \n ")
-    pgie = Gst.ElementFactory.make("nvinfer", "primary-inference")
-    if not pgie:
-        sys.stderr.write(" Unable to create pgie \n")
-
-    print("Creating nvtracker \n ")
-    tracker = Gst.ElementFactory.make("nvtracker", "tracker")
-    if not tracker:
-        sys.stderr.write(" Unable to create tracker \n")
-
-    print("Creating nvinfer (SGIE1) \n ")
-    
-    # Create nvinfer element
-    sgie = Gst.ElementFactory.make("nvinfer", "secondary1-nvinference-engine")
-    if not sgie:
-        sys.stderr.write(" Unable to make sgie \n")
-
-    print("Creating nvdsanalytics \n ")
-    nvanalytics = Gst.ElementFactory.make("nvdsanalytics", "analytics")
-    if not nvanalytics:
-        sys.stderr.write(" Unable to create nvanalytics \n")
-    nvanalytics.set_property("config-file", analytics_config_file)
-
-    print("Creating tiler \n ")
-    tiler=Gst.ElementFactory.make("nvmultistreamtiler", "nvtiler")
-    if not tiler:
-        sys.stderr.write(" Unable to create tiler \n")
-
-    print("Creating nvvidconv \n ")
-    nvvidconv = Gst.ElementFactory.make("nvvideoconvert", "convertor")
-    if not nvvidconv:
-        sys.stderr.write(" Unable to create nvvidconv \n")
-
-    print("Creating nvosd \n ")
-    nvosd = Gst.ElementFactory.make("nvdsosd", "onscreendisplay")
-    if not nvosd:
-        sys.stderr.write(" Unable to create nvosd \n")
-    nvosd.set_property('process-mode',OSD_PROCESS_MODE)
-    nvosd.set_property('display-text',OSD_DISPLAY_TEXT)
-
-    if platform_info.is_integrated_gpu():
-        print("Creating nv3dsink \n")
-        sink = Gst.ElementFactory.make("nv3dsink", "nv3d-sink")
-        sink.set_property('sync', 0)
-        if not sink:
-            sys.stderr.write(" Unable to create nv3dsink \n")
-    else:
-        if platform_info.is_platform_aarch64():
-            print("Creating nv3dsink \n")
-            sink = Gst.ElementFactory.make("nv3dsink", "nv3d-sink")
-        else:
-            print("Creating EGLSink \n")
-            sink = Gst.ElementFactory.make("nveglglessink", "nvvideo-renderer")
-        if not sink:
-            sys.stderr.write(" Unable to create egl sink \n")
+        source_manager.add_source(uris[i], i)
 
     if is_live:
         print("Atleast one of the sources is live")
-        streammux.set_property('live-source', 1)
-
-    streammux.set_property('width', 1920)
-    streammux.set_property('height', 1080)
-    streammux.set_property('batch-size', number_sources)
-    streammux.set_property('batched-push-timeout', MUXER_BATCH_TIMEOUT_USEC)
-    pgie.set_property('config-file-path', pgie_config_file)
-    pgie_batch_size=pgie.get_property("batch-size")
-    if(pgie_batch_size != number_sources):
-        print("WARNING: Overriding infer-config batch-size",pgie_batch_size," with number of sources ", number_sources," \n")
-        pgie.set_property("batch-size",number_sources)
-    tiler_rows=int(math.sqrt(number_sources))
-    tiler_columns=int(math.ceil((1.0*number_sources)/tiler_rows))
-    tiler.set_property("rows",tiler_rows)
-    tiler.set_property("columns",tiler_columns)
-    tiler.set_property("width", TILED_OUTPUT_WIDTH)
-    tiler.set_property("height", TILED_OUTPUT_HEIGHT)
-    sink.set_property("qos",0)
+
+    streammux.set_property('batch-size', max_sources)
+    if pgie is not None:
+        pgie_batch_size=pgie.get_property("batch-size")
+        if(pgie_batch_size != max_sources):
+            print("WARNING: Overriding infer-config batch-size",pgie_batch_size," with number of sources ", max_sources," \n")
+            pgie.set_property("batch-size",max_sources)
+
+    if options.interval_aware and pgie is not None:
+        analytics_probe.pgie_unique_id, pgie_interval = pgie_settings(pgie.get_property("config-file-path"))
+        if pgie_interval == 0:
+            print("WARNING: PGIE interval is 0, every frame is an inference frame \n")
+        analytics_probe.interval_stats = IntervalStats(options.stream_offset)
+        GLib.timeout_add(5000, analytics_probe.interval_stats.print_stats_callback)
+
+    if options.interval_scheduler and pgie is not None:
+        try:
+            scheduler_settings = load_scheduler_settings(options.interval_scheduler)
+        except ValueError as e:
+            sys.stderr.write(" %s \n" % e)
+            sys.exit(1)
+        _, pgie_interval = pgie_settings(pgie.get_property("config-file-path"))
+        sgie = builder.get(SGIE_NAME)
+        pgie_queue = builder.get(spec.elements[PGIE_NAME].queue) if spec.elements[PGIE_NAME].queue else None
+
+        def apply_intervals(interval, sgie_interval):
+            pgie.set_property("interval", interval)
+            if sgie is not None and scheduler_settings.sgie_max_interval:
+                sgie.set_property("interval", sgie_interval)
+
+        def pgie_backlog():
+            limit = pgie_queue.get_property("max-size-buffers")
+            return pgie_queue.get_property("current-level-buffers") / limit if limit else None
+
+        scheduler = analytics_probe.interval_scheduler = IntervalScheduler(
+            scheduler_settings, pgie_interval, apply_intervals, pgie_backlog if pgie_queue is not None else None,
+            options.interval_log)
+        # On the main loop: step() writes the decision log synchronously
+        GLib.timeout_add_seconds(scheduler_settings.period, scheduler.step_callback)
+        GLib.timeout_add(5000, scheduler.print_stats_callback)
 
     #Set properties of tracker
+    track_ttl = DEFAULT_SHADOW_TRACKING_AGE
     config = configparser.ConfigParser()
     config.read(tracker_config_file)
     config.sections()
 
-    for key in config['tracker']:
+    for key in config['tracker'] if tracker is not None else ():
         if key == 'tracker-width' :
             tracker_width = config.getint('tracker', key)
             tracker.set_property('tracker-width', tracker_width)
@@ -493,59 +521,142 @@ def main(args):
         if key == 'll-config-file' :
             tracker_ll_config_file = config.get('tracker', key)
             tracker.set_property('ll-config-file', tracker_ll_config_file)
-
-    # Set config file for each SGIE
-    sgie.set_property('config-file-path', sgie_config_file)
-
-    print("Adding elements to Pipeline \n")
-    pipeline.add(pgie)
-    pipeline.add(tracker)
-    pipeline.add(sgie)
-    pipeline.add(nvanalytics)
-    pipeline.add(tiler)
-    pipeline.add(nvvidconv)
-    pipeline.add(nvosd)
-    pipeline.add(sink)
-
-    # We link elements in the following order:
-    # sourcebin -> streammux -> nvinfer -> nvtracker -> nvdsanalytics ->
+            # Forget track verdicts once the tracker can no longer revive them
+            track_ttl = shadow_tracking_age(tracker_ll_config_file)
+    analytics_probe.track_store = TrackStateStore(ttl_frames=track_ttl, reeval_interval=options.reeval_interval,
+                                                  hysteresis=options.verdict_hysteresis)
+
+    # The chain is linked in the order of pipeline_config.txt, by default:
+    # sourcebin -> streammux -> nvinfer -> nvtracker -> nvinfer (SGIE) ->
+    # nvdsanalytics -> output branches (see outputs.py), by default
     # nvtiler -> nvvideoconvert -> nvdsosd -> sink
-    print("Linking elements in the Pipeline \n")
-    streammux.link(queue1)
-    queue1.link(pgie)
-    pgie.link(queue2)
-    queue2.link(tracker)
-    tracker.link(queue3)
-    queue3.link(sgie)
-    sgie.link(queue4)
-    queue4.link(nvanalytics)
-    nvanalytics.link(queue5)
-    queue5.link(tiler)
-    tiler.link(queue6)
-    queue6.link(nvvidconv)
-    nvvidconv.link(queue7)
-    queue7.link(nvosd)
-    nvosd.link(queue8)
-    queue8.link(sink)
+    print("Linking output branches \n")
+    try:
+        OutputBuilder(pipeline, spec=spec).build(chain_end, options.output, max_sources, platform_info,
+                                                 options.output_file, options.render_queue_size)
+    except PipelineSpecError as e:
+        sys.stderr.write(" %s \n" % e)
+        sys.exit(1)
+
+    if options.gpu_id:
+        gpu_id = options.gpu_id
+        set_gpu_id(pipeline, gpu_id)
 
     # create an event loop and feed gstreamer bus mesages to it
     loop = GLib.MainLoop()
     bus = pipeline.get_bus()
     bus.add_signal_watch()
-    bus.connect ("message", bus_call, loop)
+    # Errors and per-stream EOS of live sources trigger a reconnect instead of
+    # ending the loop
+    bus.connect ("message", source_manager.bus_call, loop, bus_call)
     nvanalytics_src_pad=nvanalytics.get_static_pad("src")
     if not nvanalytics_src_pad:
         sys.stderr.write(" Unable to get src pad \n")
     else:
         nvanalytics_src_pad.add_probe(Gst.PadProbeType.BUFFER, nvanalytics_src_pad_buffer_probe, 0)
+        if options.reload_interval > 0:
+            has_config = nvanalytics.find_property("config-file") is not None
+            reloader = ConfigReloader(analytics_probe, nvanalytics if has_config else None,
+                                      options.analytics_config or (nvanalytics.get_property("config-file")
+                                                                   if has_config else None),
+                                      options.zone_geometry, options.ppe_rules, options.compliance_config,
+                                      (streammux.get_property("width"), streammux.get_property("height")))
+            # Swaps happen on the streaming thread in front of the element, between two buffers
+            nvanalytics.get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, nvanalytics_sink_pad_buffer_probe,
+                                                        reloader)
+            GLib.timeout_add_seconds(options.reload_interval, reloader.poll_callback)
+        if engine_cache is not None:
+            nvanalytics_src_pad.add_probe(Gst.PadProbeType.BUFFER, first_batch_probe,
+                                          (engine_cache, engine_builder, startup_start))
         # perf callback function to print fps every 5 sec
         GLib.timeout_add(5000, perf_data.perf_print_callback)
+        if options.split_probe:
+            probe_worker = analytics_probe.probe_worker = ProbeWorker(options.probe_queue_size)
+            probe_worker.start()
+            GLib.timeout_add(5000, probe_worker.print_stats_callback)
+        if options.alert_log or options.alert_webhook:
+            backends = []
+            if options.alert_log:
+                backends.append(RotatingEventLog(options.alert_log))
+            if options.alert_webhook:
+                try:
+                    backends.append(WebhookBackend(options.alert_webhook, spill_path=options.alert_spill))
+                except ValueError as e:
+                    sys.stderr.write(" %s \n" % e)
+                    sys.exit(1)
+            detector = AlertDetector(options.alert_rearm_frames, stream_offset=options.stream_offset)
+            alert_sink = analytics_probe.alert_sink = AlertSink(backends, detector)
+            alert_sink.start()
+            GLib.timeout_add(5000, alert_sink.print_stats_callback)
+        if options.timeseries_file:
+            # Room for every stream slot and zone, and for zones a config reload adds
+            max_channels = max(MAX_CHANNELS, channel_count(max_sources, analytics_geometry))
+            if os.path.exists(options.timeseries_file):
+                try:
+                    analytics_probe.timeseries = TimeSeriesStore.load(options.timeseries_file, max_channels,
+                                                                      stream_offset=options.stream_offset)
+                except (OSError, ValueError, KeyError) as e:
+                    sys.stderr.write(" %s \n" % e)
+                    sys.exit(1)
+            else:
+                analytics_probe.timeseries = TimeSeriesStore(max_channels=max_channels,
+                                                             stream_offset=options.stream_offset)
+            GLib.timeout_add(5000, analytics_probe.timeseries.print_stats_callback)
+            GLib.timeout_add_seconds(options.timeseries_interval, analytics_probe.timeseries.dump_callback,
+                                     options.timeseries_file)
+            # Closes the last second of a stalled pipeline, which no later frame does
+            GLib.timeout_add_seconds(1, analytics_probe.timeseries.flush_callback)
+        if options.record_file:
+            try:
+                recorder = analytics_probe.recorder = MetadataRecorder(options.record_file,
+                                                                       options.record_chunk_frames,
+                                                                       stream_offset=options.stream_offset)
+            except (OSError, ValueError) as e:
+                sys.stderr.write(" %s \n" % e)
+                sys.exit(1)
+            recorder.start()
+            GLib.timeout_add(5000, recorder.print_stats_callback)
+        if options.metrics_shm:
+            queues = [builder.get(name) for name in spec.queues if builder.get(name) is not None]
+            try:
+                metrics = analytics_probe.metrics = MetricsRing(options.metrics_shm, max_streams=max_sources,
+                                                                fps_source=lambda: perf_data.perf_dict,
+                                                                queues=queues, stream_offset=options.stream_offset)
+            except OSError as e:
+                sys.stderr.write(" %s \n" % e)
+                sys.exit(1)
+            print("Publishing metrics to %s\n" % metrics.path)
+            GLib.timeout_add(options.metrics_shm_interval, metrics.publish_callback)
+        if profiling_requested(options.profile):
+            profiler = analytics_probe.profiler = SectionProfiler(stream_offset=options.stream_offset)
+            print("Probe profiling enabled, send SIGUSR1 to dump\n")
+            GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGUSR1, profiler.dump_callback)
+            if options.profile_interval > 0:
+                GLib.timeout_add_seconds(options.profile_interval, profiler.dump_callback)
 
     # List the sources
     print("Now playing...")
-    for i, source in enumerate(args):
-        if (i != 0):
-            print(i, ": ", source)
+    for i, source in enumerate(uris):
+        print(i + 1, ": ", source)
+
+    tracer = None
+    if options.trace or options.trace_port or options.trace_file:
+        tracer = PipelineTracer(pipeline, streammux, stream_ids=batch_stream_ids,
+                                stream_offset=options.stream_offset)
+        tracer.attach()
+        if options.trace_port:
+            TraceServer(tracer, options.trace_port).start()
+        if options.trace_file:
+            GLib.timeout_add_seconds(options.trace_interval, tracer.write_callback, options.trace_file)
+        if not options.trace_port and not options.trace_file:
+            GLib.timeout_add_seconds(options.trace_interval, tracer.print_callback)
+
+    if options.metrics_file:
+        GLib.timeout_add_seconds(options.metrics_interval, write_metrics_callback, options.metrics_file, tracer)
+
+    if options.control_port:
+        control_server = ControlServer(source_manager, options.control_port)
+        control_server.start()
 
     print("Starting pipeline \n")
     # start play back and listed to events		
@@ -557,6 +668,20 @@ def main(args):
     # cleanup
     print("Exiting app\n")
     pipeline.set_state(Gst.State.NULL)
+    if analytics_probe.probe_worker is not None:
+        analytics_probe.probe_worker.stop()
+    if analytics_probe.alert_sink is not None:
+        analytics_probe.alert_sink.stop()
+    if analytics_probe.timeseries is not None:
+        analytics_probe.timeseries.dump(options.timeseries_file)
+    if analytics_probe.snapshots is not None:
+        analytics_probe.snapshots.close()
+    if analytics_probe.recorder is not None:
+        analytics_probe.recorder.stop()
+    if analytics_probe.metrics is not None:
+        analytics_probe.metrics.close()
+    if engine_builder is not None:
+        engine_builder.stop()
 
 if __name__ == '__main__':
     sys.exit(main(sys.argv))
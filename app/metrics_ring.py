@@ -0,0 +1,292 @@
+################################################################################
+# Live per-stream metrics in a shared memory ring, for external dashboards.
+#
+# MetricsRing maps a file under /dev/shm holding a fixed-layout header and a
+# ring of snapshot slots. Every publish() fills the next slot with one record
+# per stream (FPS, probe latency percentiles, persons / helmets / alerts of
+# the last frame, totals) plus the fill level of every pipeline queue. Readers
+# map the same file and read the newest slot without locks and without any
+# serialization on the pipeline side. Each slot is guarded by a sequence
+# number (a seqlock): the writer makes it odd before filling the slot and even
+# again after, and bumps the header's published counter last. A reader takes
+# the slot of published - 1, copies it and accepts the copy only if the
+# sequence number was even and unchanged around the copy and the slot holds
+# at least the snapshot published announced. The writer only returns to a
+# slot after slots - 1 further publishes, so a reader is never racing it
+# unless it takes that long to copy one slot.
+#
+# All fields are little endian and naturally aligned, see HEADER_DTYPE,
+# RECORD_DTYPE and slot_dtype(); MetricsReader reads them from Python and
+# utils/read_metrics_ring.py prints them. The streaming thread only adds to
+# per-stream NumPy counters through observe(); publish() runs on the GLib
+# loop and takes the counters and the latency histogram over under a lock
+# that observe() holds for its few stores, so no sample falls between the
+# two and a stream's counters are copied as one observe left them. The
+# stores are plain NumPy writes without barriers, so the seqlock relies on
+# the store order of the CPU: exact on x86, best effort on the Jetson's ARM
+# cores, where the ring of slots and the snapshot check make a reader
+# accepting a slot being written unlikely but not impossible.
+################################################################################
+
+import mmap
+import os
+import threading
+import time
+
+import numpy as np
+
+from compliance import VERDICT_VIOLATION
+from profiling import SectionProfiler
+
+MAGIC = b"PPEMET01"
+RING_VERSION = 1
+SHM_DIR = "/dev/shm"
+DEFAULT_SLOTS = 8
+DEFAULT_MAX_STREAMS = 64
+MAX_QUEUES = 16
+QUEUE_NAME_BYTES = 32
+DEFAULT_PUBLISH_MS = 1000
+# Attempts of a reader to get a slot the writer is not filling
+READ_RETRIES = 16
+
+HEADER_DTYPE = np.dtype([
+    ("magic", "S8"),
+    ("version", "<u4"),
+    ("header_size", "<u4"),
+    ("slot_size", "<u4"),
+    ("slots", "<u4"),
+    ("max_streams", "<u4"),
+    ("max_queues", "<u4"),
+    ("pid", "<u4"),
+    ("queue_count", "<u4"),
+    # Snapshots published so far; the newest is in slot (published - 1) % slots
+    ("published", "<u8"),
+    ("queue_names", "S%d" % QUEUE_NAME_BYTES, (MAX_QUEUES,)),
+], align=True)
+
+RECORD_DTYPE = np.dtype([
+    ("stream_id", "<i4"),
+    # 1 once the stream delivered a frame
+    ("active", "<u4"),
+    ("frames", "<u8"),
+    ("fps", "<f4"),
+    # Probe time per frame over the last publish interval, microseconds
+    ("probe_p50_us", "<f4"),
+    ("probe_p95_us", "<f4"),
+    ("probe_p99_us", "<f4"),
+    # Of the stream's last frame
+    ("persons", "<u4"),
+    ("helmets", "<u4"),
+    ("alerts", "<u4"),
+    ("violators", "<u4"),
+    ("alerts_total", "<u8"),
+    ("last_frame_time", "<f8"),
+], align=True)
+
+
+def slot_dtype(max_streams):
+    """Layout of one ring slot for max_streams streams."""
+    return np.dtype([
+        # Odd while the writer fills the slot
+        ("seq", "<u8"),
+        ("time", "<f8"),
+        ("snapshot", "<u8"),
+        ("stream_count", "<u4"),
+        ("queue_count", "<u4"),
+        ("queue_levels", "<f4", (MAX_QUEUES,)),
+        ("records", RECORD_DTYPE, (max_streams,)),
+    ], align=True)
+
+
+def shm_path(name):
+    """Return the file of a ring name; names without a '/' live in /dev/shm."""
+    return name if os.sep in name else os.path.join(SHM_DIR, name)
+
+
+def _header_size():
+    # Slots start on a cache line
+    return -(-HEADER_DTYPE.itemsize // 64) * 64
+
+
+class MetricsRing:
+    """Writer side of the shared memory metrics ring.
+
+    fps_source() returns {"stream<N>": fps}; queues is a list of queue
+    elements, sampled through their current-level-buffers and
+    max-size-buffers properties, or (name, level()) pairs.
+    """
+
+    def __init__(self, name, slots=DEFAULT_SLOTS, max_streams=DEFAULT_MAX_STREAMS, fps_source=None, queues=(),
+                 clock=time.time, stream_offset=0):
+        self.path = shm_path(name)
+        self.slots = slots
+        self.max_streams = max_streams
+        self.fps_source = fps_source
+        self.queues = [queue if isinstance(queue, tuple) else (queue.get_name(), self._queue_level(queue))
+                       for queue in queues][:MAX_QUEUES]
+        self.clock = clock
+        self.slot_dtype = slot_dtype(max_streams)
+        header_size = _header_size()
+        size = header_size + slots * self.slot_dtype.itemsize
+
+        # Built under a temporary name so readers never see a half written header
+        temporary = "%s.%d.tmp" % (self.path, os.getpid())
+        fd = os.open(temporary, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.header = np.ndarray((), dtype=HEADER_DTYPE, buffer=self._map)
+        self.ring = np.ndarray((slots,), dtype=self.slot_dtype, buffer=self._map, offset=header_size)
+        header = self.header
+        header["magic"] = MAGIC
+        header["version"] = RING_VERSION
+        header["header_size"] = header_size
+        header["slot_size"] = self.slot_dtype.itemsize
+        header["slots"] = slots
+        header["max_streams"] = max_streams
+        header["max_queues"] = MAX_QUEUES
+        header["pid"] = os.getpid()
+        header["queue_count"] = len(self.queues)
+        for index, (queue_name, _) in enumerate(self.queues):
+            header["queue_names"][index] = queue_name.encode("utf-8")[:QUEUE_NAME_BYTES]
+        # Records carry the global stream ids, see main.py --stream-offset
+        self.ring["records"]["stream_id"] = stream_offset + np.arange(max_streams)
+        os.replace(temporary, self.path)
+
+        # Per-stream counters written by the streaming thread
+        self.frames = np.zeros(max_streams, dtype=np.uint64)
+        self.last = np.zeros((max_streams, 4), dtype=np.uint32)
+        self.alerts_total = np.zeros(max_streams, dtype=np.uint64)
+        self.last_frame_time = np.zeros(max_streams, dtype=np.float64)
+        self._latency = SectionProfiler(max_streams, ("frame",))
+        self._lock = threading.Lock()
+        self.published = 0
+
+    @staticmethod
+    def _queue_level(queue):
+        def level():
+            limit = queue.get_property("max-size-buffers")
+            return queue.get_property("current-level-buffers") / limit if limit else 0.0
+        return level
+
+    def observe(self, frame, verdict, seconds):
+        """Count one frame the probe took seconds for; runs on the streaming thread."""
+        stream_id = frame.stream_id
+        if not 0 <= stream_id < self.max_streams:
+            return
+        violators = int(np.count_nonzero(verdict.verdicts == VERDICT_VIOLATION))
+        now = self.clock()
+        with self._lock:
+            self.frames[stream_id] += 1
+            self.last[stream_id] = (verdict.person_count, verdict.helmet_count, verdict.alert_count, violators)
+            self.alerts_total[stream_id] += verdict.alert_count
+            self.last_frame_time[stream_id] = now
+            self._latency.record(stream_id, 0, seconds)
+
+    def publish(self):
+        """Write a snapshot into the next slot of the ring."""
+        # Everything is gathered first so the slot stays odd only for a few copies
+        fresh = SectionProfiler(self.max_streams, ("frame",))
+        with self._lock:
+            latency, self._latency = self._latency, fresh
+            frames = self.frames.copy()
+            last = self.last.copy()
+            alerts_total = self.alerts_total.copy()
+            last_frame_time = self.last_frame_time.copy()
+        percentiles = np.zeros((self.max_streams, 3), dtype=np.float32)
+        for stream_id in np.flatnonzero(latency.counts.sum(axis=(1, 2))).tolist():
+            percentiles[stream_id] = [1e6 * value for value in latency.percentiles(stream_id, 0)]
+        fps = self.fps_source() if self.fps_source is not None else {}
+        fps = [fps.get("stream%d" % stream_id) or 0.0 for stream_id in range(self.max_streams)]
+        levels = np.zeros(MAX_QUEUES, dtype=np.float32)
+        levels[:len(self.queues)] = [level() for _, level in self.queues]
+        active = np.flatnonzero(frames)
+
+        slot = self.ring[self.published % self.slots, ...]
+        slot["seq"] += 1
+        slot["time"] = self.clock()
+        slot["snapshot"] = self.published + 1
+        slot["stream_count"] = int(active[-1]) + 1 if len(active) else 0
+        slot["queue_count"] = len(self.queues)
+        slot["queue_levels"] = levels
+        records = slot["records"]
+        records["active"] = frames != 0
+        records["frames"] = frames
+        records["fps"] = fps
+        records["probe_p50_us"] = percentiles[:, 0]
+        records["probe_p95_us"] = percentiles[:, 1]
+        records["probe_p99_us"] = percentiles[:, 2]
+        records["persons"] = last[:, 0]
+        records["helmets"] = last[:, 1]
+        records["alerts"] = last[:, 2]
+        records["violators"] = last[:, 3]
+        records["alerts_total"] = alerts_total
+        records["last_frame_time"] = last_frame_time
+        slot["seq"] += 1
+        self.published += 1
+        self.header["published"] = self.published
+
+    def publish_callback(self):
+        """GLib timeout callback publishing a snapshot."""
+        self.publish()
+        return True
+
+    def close(self, unlink=True):
+        self.header["pid"] = 0
+        del self.header, self.ring
+        self._map.close()
+        if unlink:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+class MetricsReader:
+    """Reader side: maps a ring read-only and returns consistent copies of its newest slot."""
+
+    def __init__(self, name):
+        self.path = shm_path(name)
+        with open(self.path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.header = np.ndarray((), dtype=HEADER_DTYPE, buffer=self._map)
+        if bytes(self.header["magic"]) != MAGIC or int(self.header["version"]) != RING_VERSION:
+            raise ValueError("%s is not a version %d metrics ring" % (self.path, RING_VERSION))
+        self.slots = int(self.header["slots"])
+        self.slot_dtype = slot_dtype(int(self.header["max_streams"]))
+        if self.slot_dtype.itemsize != int(self.header["slot_size"]):
+            raise ValueError("%s: unexpected slot size %d" % (self.path, int(self.header["slot_size"])))
+        self.ring = np.ndarray((self.slots,), dtype=self.slot_dtype, buffer=self._map,
+                               offset=int(self.header["header_size"]))
+        self.queue_names = [name.decode("utf-8") for name in
+                            self.header["queue_names"][:int(self.header["queue_count"])].tolist()]
+        self.retries = 0
+
+    @property
+    def writer_pid(self):
+        return int(self.header["pid"])
+
+    def latest(self):
+        """Return a copy of the newest complete slot, or None if nothing was published or the writer kept lapping."""
+        for _ in range(READ_RETRIES):
+            published = int(self.header["published"])
+            if not published:
+                return None
+            slot = self.ring[(published - 1) % self.slots, ...]
+            seq = int(slot["seq"])
+            if seq % 2 == 0:
+                copy = slot.copy()
+                # A slot holding an older snapshot than published was read out of order
+                if int(slot["seq"]) == seq and int(copy["snapshot"]) >= published:
+                    return copy
+            self.retries += 1
+        return None
+
+    def close(self):
+        del self.header, self.ring
+        try:
+            self._map.close()
+        except BufferError:
+            pass
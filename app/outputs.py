@@ -0,0 +1,223 @@
+################################################################################
+# Output branches after nvdsanalytics.
+#
+# Three outputs can be combined with --output:
+#   analytics  metadata only: queue -> fakesink, no tiler or OSD
+#   display    tiler -> nvvideoconvert -> nvdsosd -> EGL / 3D sink (the default)
+#   file       tiler -> nvvideoconvert -> nvdsosd -> H.264 encode -> .mkv
+# When analytics is combined with a rendered output a tee splits the stream and
+# the render branch starts with a leaky queue, so a slow display or encoder
+# drops frames instead of back-pressuring the analytics branch.
+#
+# Elements are created through an injectable make(factory, name), and
+# pipeline_spec.stand_in_make() maps the DeepStream factories to stock
+# GStreamer elements so the branch layout can be built on a machine without
+# DeepStream, see utils/check_outputs.py. Elements that cannot be created or
+# linked raise PipelineSpecError, as in the chain before the branches.
+# Element and queue properties from a pipeline_spec.PipelineSpec override the
+# defaults. The buffering of the leaky render queue is set by
+# --render-queue-size only: a description that also sets it is rejected
+# rather than silently overridden.
+################################################################################
+
+import argparse
+import math
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from pipeline_spec import PipelineSpecError, set_properties
+
+OUTPUT_ANALYTICS = "analytics"
+OUTPUT_DISPLAY = "display"
+OUTPUT_FILE = "file"
+OUTPUT_MODES = (OUTPUT_ANALYTICS, OUTPUT_DISPLAY, OUTPUT_FILE)
+
+TILED_OUTPUT_WIDTH = 1920
+TILED_OUTPUT_HEIGHT = 1080
+OSD_PROCESS_MODE = 0
+OSD_DISPLAY_TEXT = 1
+ENCODE_CAPS = "video/x-raw(memory:NVMM), format=I420"
+ENCODER_BITRATE = 4000000
+# queue leaky=2 drops the oldest buffers when full
+QUEUE_LEAK_DOWNSTREAM = 2
+# Queue properties a leaky queue sets itself
+LEAKY_QUEUE_KEYS = ("leaky", "max-size-buffers", "max-size-bytes", "max-size-time")
+
+# Encoder input caps with pipeline_spec.stand_in_make()
+STAND_IN_ENCODE_CAPS = "video/x-raw, format=I420"
+
+
+def parse_output_modes(value):
+    """argparse type for --output: a comma separated subset of OUTPUT_MODES."""
+    modes = {mode.strip() for mode in value.split(",") if mode.strip()}
+    unknown = modes.difference(OUTPUT_MODES)
+    if unknown:
+        raise argparse.ArgumentTypeError("unknown output mode(s): %s" % ", ".join(sorted(unknown)))
+    if not modes:
+        raise argparse.ArgumentTypeError("no output mode given")
+    return modes
+
+
+def _set(element, name, value):
+    # Stand-in elements do not have the DeepStream specific properties
+    if element.find_property(name) is not None:
+        element.set_property(name, value)
+
+
+class OutputBuilder:
+    """Creates, adds and links the output branches of a pipeline."""
+
+    def __init__(self, pipeline, make=Gst.ElementFactory.make, encode_caps=ENCODE_CAPS, spec=None,
+                 strict_properties=True):
+        self.pipeline = pipeline
+        self.make = make
+        self.encode_caps = encode_caps
+        self.spec = spec
+        self.strict_properties = strict_properties
+        self.elements = {}
+        # Leaky queues by name, with their buffer limit
+        self.leaky_queues = {}
+
+    def add(self, factory, name):
+        element = self.make(factory, name)
+        if not element:
+            raise PipelineSpecError("unable to create %s (%s)" % (name, factory))
+        self.pipeline.add(element)
+        self.elements[name] = element
+        return element
+
+    def link(self, *elements):
+        for upstream, downstream in zip(elements, elements[1:]):
+            if not upstream.link(downstream):
+                raise PipelineSpecError("unable to link %s to %s" % (upstream.get_name(), downstream.get_name()))
+
+    def configure(self, element):
+        """Apply the spec's properties for an element on top of its defaults."""
+        name = element.get_name()
+        if element.get_factory().get_name() == "queue":
+            properties = self.spec.queue_properties(name)
+        else:
+            properties = self.spec.element_properties(name)
+        set_properties(element, properties, self.strict_properties)
+
+    def add_queue(self, name, leaky_buffers=0):
+        queue = self.add("queue", name)
+        if leaky_buffers:
+            self.leaky_queues[name] = leaky_buffers
+            self.make_leaky(queue, leaky_buffers)
+        return queue
+
+    @staticmethod
+    def make_leaky(queue, buffers):
+        queue.set_property("leaky", QUEUE_LEAK_DOWNSTREAM)
+        queue.set_property("max-size-buffers", buffers)
+        queue.set_property("max-size-bytes", 0)
+        queue.set_property("max-size-time", 0)
+
+    def add_fakesink(self, name):
+        sink = self.add("fakesink", name)
+        sink.set_property("sync", 0)
+        sink.set_property("async", 0)
+        return sink
+
+    def add_display_sink(self, platform_info):
+        if platform_info is None:
+            print("Creating EGLSink \n")
+            sink = self.add("nveglglessink", "nvvideo-renderer")
+        elif platform_info.is_integrated_gpu() or platform_info.is_platform_aarch64():
+            print("Creating nv3dsink \n")
+            sink = self.add("nv3dsink", "nv3d-sink")
+            if platform_info.is_integrated_gpu():
+                sink.set_property('sync', 0)
+        else:
+            print("Creating EGLSink \n")
+            sink = self.add("nveglglessink", "nvvideo-renderer")
+        sink.set_property("qos", 0)
+        return sink
+
+    def add_file_branch(self, head, output_file):
+        """Encode to H.264 in Matroska, which stays playable if the app is killed."""
+        print("Creating H.264 file output to %s \n" % output_file)
+        convertor = self.add("nvvideoconvert", "encode-convertor")
+        capsfilter = self.add("capsfilter", "encode-caps")
+        capsfilter.set_property("caps", Gst.Caps.from_string(self.encode_caps))
+        encoder = self.add("nvv4l2h264enc", "encoder")
+        _set(encoder, "bitrate", ENCODER_BITRATE)
+        parser = self.add("h264parse", "encode-parser")
+        muxer = self.add("matroskamux", "encode-muxer")
+        sink = self.add("filesink", "file-sink")
+        sink.set_property("location", output_file)
+        sink.set_property("sync", 0)
+        self.link(head, convertor, capsfilter, encoder, parser, muxer, sink)
+
+    def build(self, upstream, modes, number_sources, platform_info=None, output_file="out.mkv",
+              render_queue_size=4):
+        """Build the branches selected by modes after upstream; returns the created elements."""
+        self.build_branches(upstream, modes, number_sources, platform_info, output_file, render_queue_size)
+        if self.spec is not None:
+            # The spec must not turn the render queue back into a blocking one
+            for name in self.leaky_queues:
+                conflicting = sorted(set(self.spec.queue_properties(name)) & set(LEAKY_QUEUE_KEYS))
+                if conflicting:
+                    raise PipelineSpecError("[queue-%s] sets %s, but the queue is leaky and sized by "
+                                            "--render-queue-size" % (name, ", ".join(conflicting)))
+            for element in self.elements.values():
+                self.configure(element)
+        return self.elements
+
+    def build_branches(self, upstream, modes, number_sources, platform_info, output_file, render_queue_size):
+        render = modes & {OUTPUT_DISPLAY, OUTPUT_FILE}
+        if OUTPUT_ANALYTICS in modes:
+            print("Creating analytics fakesink \n")
+            if not render:
+                queue = self.add_queue("analytics-queue")
+                self.link(upstream, queue, self.add_fakesink("analytics-sink"))
+                return
+            tee = self.add("tee", "analytics-tee")
+            queue = self.add_queue("analytics-queue")
+            self.link(upstream, tee)
+            self.link(tee, queue, self.add_fakesink("analytics-sink"))
+            render_head = self.add_queue("queue5", leaky_buffers=render_queue_size)
+            self.link(tee, render_head)
+        else:
+            render_head = self.add_queue("queue5")
+            self.link(upstream, render_head)
+
+        print("Creating tiler \n ")
+        tiler = self.add("nvmultistreamtiler", "nvtiler")
+        tiler_rows = int(math.sqrt(number_sources))
+        tiler_columns = int(math.ceil((1.0 * number_sources) / tiler_rows))
+        _set(tiler, "rows", tiler_rows)
+        _set(tiler, "columns", tiler_columns)
+        _set(tiler, "width", TILED_OUTPUT_WIDTH)
+        _set(tiler, "height", TILED_OUTPUT_HEIGHT)
+
+        print("Creating nvvidconv \n ")
+        nvvidconv = self.add("nvvideoconvert", "convertor")
+
+        print("Creating nvosd \n ")
+        nvosd = self.add("nvdsosd", "onscreendisplay")
+        _set(nvosd, "process-mode", OSD_PROCESS_MODE)
+        _set(nvosd, "display-text", OSD_DISPLAY_TEXT)
+
+        queue6 = self.add_queue("queue6")
+        queue7 = self.add_queue("queue7")
+        self.link(render_head, tiler, queue6, nvvidconv, queue7, nvosd)
+
+        if render == {OUTPUT_DISPLAY, OUTPUT_FILE}:
+            tee = self.add("tee", "render-tee")
+            self.link(nvosd, tee)
+            queue8 = self.add_queue("queue8")
+            self.link(tee, queue8, self.add_display_sink(platform_info))
+            encode_queue = self.add_queue("encode-queue")
+            self.link(tee, encode_queue)
+            self.add_file_branch(encode_queue, output_file)
+        else:
+            queue8 = self.add_queue("queue8")
+            self.link(nvosd, queue8)
+            if OUTPUT_DISPLAY in render:
+                self.link(queue8, self.add_display_sink(platform_info))
+            else:
+                self.add_file_branch(queue8, output_file)
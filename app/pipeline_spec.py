@@ -0,0 +1,242 @@
+################################################################################
+# Declarative pipeline topology.
+#
+# pipeline_config.txt describes the muxer, the chain of elements linked after
+# it, the queue in front of each chain element and per-queue buffering and leak
+# settings. load_pipeline_spec() parses and validates it into a PipelineSpec and
+# PipelineBuilder creates, configures and links the elements through an
+# injectable make(factory, name), so the builder can be exercised with stock
+# GStreamer elements (stand_in_make(), see utils/check_pipeline_builder.py).
+################################################################################
+
+import configparser
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+PIPELINE_SECTION = "pipeline"
+ELEMENT_PREFIX = "element-"
+QUEUE_PREFIX = "queue-"
+MUXER_FACTORY = "nvstreammux"
+QUEUE_LIMITS = ("max-size-buffers", "max-size-bytes", "max-size-time", "min-threshold-buffers",
+                "min-threshold-bytes", "min-threshold-time")
+# Keys of an element section that configure the spec rather than the element
+ELEMENT_KEYS = ("factory", "enable", "queue")
+
+# Stock elements standing in for the DeepStream chain and output branches
+# (see outputs.py) when building without it
+STAND_INS = {
+    "nvstreammux": "funnel",
+    "nvinfer": "identity",
+    "nvtracker": "identity",
+    "nvvideoconvert": "videoconvert",
+    "nvdsanalytics": "identity",
+    "nvmultistreamtiler": "identity",
+    "nvdsosd": "identity",
+    "nveglglessink": "fakesink",
+    "nv3dsink": "fakesink",
+    "nvv4l2h264enc": "x264enc",
+}
+
+
+class PipelineSpecError(Exception):
+    """Raised for a pipeline description that cannot be built."""
+
+
+class ElementSpec:
+    """One element: its factory, properties and the queue in front of it."""
+
+    __slots__ = ("name", "factory", "enabled", "queue", "properties")
+
+    def __init__(self, name, factory=None, enabled=True, queue=None, properties=None):
+        self.name = name
+        self.factory = factory
+        self.enabled = enabled
+        self.queue = queue
+        self.properties = properties or {}
+
+
+class PipelineSpec:
+    """Parsed pipeline description.
+
+    elements maps element names to ElementSpecs, including property-only
+    entries for elements created elsewhere; queues maps queue names to their
+    property dicts.
+    """
+
+    def __init__(self, muxer, chain, probe_element, elements, queues):
+        self.muxer = muxer
+        self.chain = chain
+        self.probe_element = probe_element
+        self.elements = elements
+        self.queues = queues
+
+    @property
+    def enabled_chain(self):
+        return [self.elements[name] for name in self.chain if self.elements[name].enabled]
+
+    def element_properties(self, name):
+        element = self.elements.get(name)
+        return element.properties if element is not None else {}
+
+    def queue_properties(self, name):
+        return self.queues.get(name, {})
+
+    def validate(self):
+        """Raise PipelineSpecError listing every problem of the description."""
+        problems = []
+        if self.muxer is None:
+            problems.append("no [%s...] section with factory=%s" % (ELEMENT_PREFIX, MUXER_FACTORY))
+        if not self.chain:
+            problems.append("[%s] chain is empty" % PIPELINE_SECTION)
+        if len(set(self.chain)) != len(self.chain):
+            problems.append("[%s] chain lists an element twice" % PIPELINE_SECTION)
+        used_queues = set()
+        for name in self.chain:
+            element = self.elements.get(name)
+            if element is None:
+                problems.append("chain element %s has no [%s%s] section" % (name, ELEMENT_PREFIX, name))
+                continue
+            if not element.factory:
+                problems.append("chain element %s has no factory" % name)
+            if element.queue:
+                if element.queue in used_queues:
+                    problems.append("queue %s is used in front of two elements" % element.queue)
+                used_queues.add(element.queue)
+        if self.probe_element not in self.chain:
+            problems.append("probe-element %s is not in the chain" % self.probe_element)
+        elif self.probe_element in self.elements and not self.elements[self.probe_element].enabled:
+            problems.append("probe-element %s is disabled" % self.probe_element)
+        for name, properties in self.queues.items():
+            for key, value in properties.items():
+                if key in QUEUE_LIMITS and not value.isdigit():
+                    problems.append("queue %s: %s must be a non-negative integer" % (name, key))
+                if key == "leaky" and value not in ("0", "1", "2", "no", "upstream", "downstream"):
+                    problems.append("queue %s: leaky must be 0, 1 or 2" % name)
+        if problems:
+            raise PipelineSpecError("invalid pipeline description:\n  " + "\n  ".join(problems))
+
+
+def _parse_enable(section, name):
+    try:
+        return section.getboolean("enable", True)
+    except ValueError:
+        raise PipelineSpecError("[%s%s] enable must be 0 or 1" % (ELEMENT_PREFIX, name))
+
+
+def parse_pipeline_spec(config):
+    """Build a PipelineSpec from a ConfigParser holding a pipeline description."""
+    if not config.has_section(PIPELINE_SECTION):
+        raise PipelineSpecError("missing [%s] section" % PIPELINE_SECTION)
+    pipeline = config[PIPELINE_SECTION]
+    chain = [name.strip() for name in pipeline.get("chain", "").split(";") if name.strip()]
+    probe_element = pipeline.get("probe-element", chain[-1] if chain else None)
+
+    muxer = None
+    elements = {}
+    queues = {}
+    for section_name in config.sections():
+        section = config[section_name]
+        if section_name.startswith(ELEMENT_PREFIX):
+            name = section_name[len(ELEMENT_PREFIX):]
+            properties = {key: value for key, value in section.items() if key not in ELEMENT_KEYS}
+            element = ElementSpec(name, section.get("factory"), _parse_enable(section, name),
+                                  section.get("queue"), properties)
+            if element.factory == MUXER_FACTORY:
+                muxer = element
+            else:
+                elements[name] = element
+        elif section_name.startswith(QUEUE_PREFIX):
+            queues[section_name[len(QUEUE_PREFIX):]] = dict(section.items())
+        elif section_name != PIPELINE_SECTION:
+            raise PipelineSpecError("unknown section [%s]" % section_name)
+
+    spec = PipelineSpec(muxer, chain, probe_element, elements, queues)
+    spec.validate()
+    return spec
+
+
+def load_pipeline_spec(path):
+    """Read and validate a pipeline description file."""
+    # Keys keep their case and '-' so they map 1:1 to GStreamer properties
+    config = configparser.ConfigParser(interpolation=None)
+    config.optionxform = str
+    try:
+        if not config.read(path):
+            raise PipelineSpecError("unable to read %s" % path)
+    except configparser.Error as e:
+        raise PipelineSpecError("%s: %s" % (path, e))
+    return parse_pipeline_spec(config)
+
+
+def stand_in_make(factory, name):
+    """Element factory that replaces DeepStream elements with STAND_INS."""
+    return Gst.ElementFactory.make(STAND_INS.get(factory, factory), name)
+
+
+def set_properties(element, properties, strict=True):
+    """Set string valued properties, converted according to the element's property specs.
+
+    Unknown properties are an error unless strict is False, which is meant for
+    stock stand-in elements that lack the DeepStream properties.
+    """
+    for key, value in properties.items():
+        if element.find_property(key) is None:
+            if strict:
+                raise PipelineSpecError("%s has no property %s" % (element.get_name(), key))
+            continue
+        Gst.util_set_object_arg(element, key, str(value))
+
+
+class PipelineBuilder:
+    """Creates the muxer and the element chain of a PipelineSpec."""
+
+    def __init__(self, spec, make=Gst.ElementFactory.make, strict_properties=True):
+        self.spec = spec
+        self.make = make
+        self.strict_properties = strict_properties
+        self.elements = {}
+
+    def add(self, pipeline, factory, name, properties):
+        element = self.make(factory, name)
+        if not element:
+            raise PipelineSpecError("unable to create %s (%s)" % (name, factory))
+        set_properties(element, properties, self.strict_properties)
+        pipeline.add(element)
+        self.elements[name] = element
+        return element
+
+    def add_queue(self, pipeline, name):
+        return self.add(pipeline, "queue", name, self.spec.queue_properties(name))
+
+    def build(self, pipeline):
+        """Add the muxer and chain to pipeline, link them and return the last chain element.
+
+        The analytics probe belongs on get(spec.probe_element), which need not be the last one.
+        """
+        muxer = self.spec.muxer
+        print("Creating %s \n " % muxer.name)
+        upstream = self.add(pipeline, muxer.factory, muxer.name, muxer.properties)
+        for element_spec in self.spec.enabled_chain:
+            print("Creating %s \n " % element_spec.name)
+            element = self.add(pipeline, element_spec.factory, element_spec.name, element_spec.properties)
+            if element_spec.queue:
+                queue = self.add_queue(pipeline, element_spec.queue)
+                self.link(upstream, queue)
+                upstream = queue
+            self.link(upstream, element)
+            upstream = element
+        return upstream
+
+    def link(self, upstream, downstream):
+        if not upstream.link(downstream):
+            raise PipelineSpecError("unable to link %s to %s" % (upstream.get_name(), downstream.get_name()))
+
+    @property
+    def muxer(self):
+        return self.elements[self.spec.muxer.name]
+
+    def get(self, name):
+        """Return a created element by name, or None if it is disabled or unknown."""
+        return self.elements.get(name)
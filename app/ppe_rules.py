@@ -0,0 +1,405 @@
+################################################################################
+# Configurable PPE rules (helmet, vest, phone, ...) evaluated in one pass.
+#
+# Rules are read from [rule-<name>] sections (see config_ppe_rules.txt): a
+# subject and an item, both given as gie-unique-id:class-id, whether the item
+# is required or forbidden, the region of the subject box the item has to be
+# in, and optionally ROIs, counting lines and streams the rule is limited to.
+#
+# RuleEngine compiles the rules into a dispatch table keyed by
+# (gie-unique-id, class-id). Each frame's objects are sorted into subjects and
+# items with one vectorized lookup; the item-in-region test runs once per
+# subject class, item class and region and is shared by every rule that needs
+# it, so a rule only adds a few mask operations over the subjects. The result
+# is a compliance.FrameVerdict, with the mask of the broken rules per object,
+# so the probe, OSD and alerts work on it like on the built-in helmet check.
+# With a track_state.TrackStateStore a tracked subject's verdict and rule
+# mask persist across frames like the helmet check's verdicts: the item test
+# only runs for subjects that are new or due for re-evaluation (every
+# subject on inferred frames, only new ones on tracker-only frames when
+# inferred is passed), and a result only flips after the store's hysteresis.
+# The rule scopes (zones, lines) are recomputed on every frame.
+# The time spent per rule, shared tests split between their rules, is kept
+# for print_stats_callback().
+################################################################################
+
+import configparser
+import time
+
+import numpy as np
+
+from association import HEAD_FRACTION, associate_helmets
+from compliance import VERDICT_COMPLIANT, VERDICT_VIOLATION, FrameVerdict
+from frame_arrays import LABEL_HELMET, LABEL_PERSON, check_zone_names, zone_mask
+from track_state import UNTRACKED_OBJECT_ID
+from zones import ANCHOR_FOOT, anchor_points
+
+RULE_SECTION = "rule-"
+REQUIRED = "required"
+FORBIDDEN = "forbidden"
+REGION_HEAD = "head"
+# Other regions as (left, top, right, bottom) fractions of the subject box;
+# the head uses the head point test of association.py, as the helmet check.
+REGIONS = {
+    "torso": (0.0, 0.15, 1.0, 0.6),
+    "hands": (-0.25, 0.35, 1.25, 0.75),
+    "box": (0.0, 0.0, 1.0, 1.0),
+}
+DEFAULT_NEAR_DISTANCE = 150.0
+# Rules are reported as bits of a uint32 per object
+MAX_RULES = 32
+# gie-unique-id and class-id are folded into one int64 key
+KEY_STRIDE = 1 << 16
+# A subject's result is stored per track as verdict | violation mask << VERDICT_BITS
+VERDICT_BITS = 2
+
+
+def _class_key(value, name):
+    """Parse 'gie-unique-id:class-id' into a dispatch key."""
+    try:
+        gie_id, class_id = (int(part) for part in value.split(":"))
+    except ValueError:
+        raise ValueError("rule %s: expected gie-unique-id:class-id, got %r" % (name, value))
+    return gie_id * KEY_STRIDE + class_id
+
+
+def _names(value):
+    return [name.strip() for name in value.split(";") if name.strip()]
+
+
+class PpeRule:
+    """One compiled [rule-<name>] section."""
+
+    __slots__ = ("name", "index", "bit", "subject", "item", "required", "region", "zones", "zone_mask",
+                 "lines", "near_distance", "streams", "message")
+
+    def __init__(self, name, index, subject, item, required, region, zones=(), lines=(),
+                 near_distance=DEFAULT_NEAR_DISTANCE, streams=None, message=""):
+        self.name = name
+        self.index = index
+        self.bit = 1 << index
+        self.subject = subject
+        self.item = item
+        self.required = required
+        self.region = region
+        self.zones = list(zones)
+        self.zone_mask = zone_mask(self.zones)
+        self.lines = list(lines)
+        self.near_distance = near_distance
+        self.streams = set(streams) if streams else None
+        self.message = message
+
+    def applies_to(self, stream_id):
+        return self.streams is None or stream_id in self.streams
+
+
+def parse_ppe_rules(config):
+    """Compile the enabled [rule-<name>] sections of a parsed config into PpeRules."""
+    arguments = []
+    for section_name in config.sections():
+        if not section_name.startswith(RULE_SECTION):
+            continue
+        section = config[section_name]
+        if not section.getboolean("enable", True):
+            continue
+        name = section_name[len(RULE_SECTION):]
+        requirement = section.get("requirement", REQUIRED).strip()
+        if requirement not in (REQUIRED, FORBIDDEN):
+            raise ValueError("rule %s: requirement must be %s or %s" % (name, REQUIRED, FORBIDDEN))
+        region = section.get("region", REGION_HEAD).strip()
+        if region != REGION_HEAD and region not in REGIONS:
+            raise ValueError("rule %s: unknown region %r" % (name, region))
+        for key in ("subject", "item"):
+            if key not in section:
+                raise ValueError("rule %s: %s is missing" % (name, key))
+        if len(arguments) == MAX_RULES:
+            raise ValueError("at most %d rules are supported" % MAX_RULES)
+        try:
+            streams = [int(stream) for stream in _names(section.get("streams", ""))]
+            near_distance = section.getfloat("near-distance", DEFAULT_NEAR_DISTANCE)
+        except ValueError as e:
+            raise ValueError("rule %s: %s" % (name, e))
+        arguments.append((name, len(arguments), _class_key(section["subject"], name),
+                          _class_key(section["item"], name), requirement == REQUIRED, region,
+                          _names(section.get("zones", "")), _names(section.get("near-line", "")),
+                          near_distance, streams, section.get("message", name)))
+    # Rule zones take zone_bit() masks; checked before any of them is interned
+    check_zone_names([zone for rule in arguments for zone in rule[6]])
+    return [PpeRule(*rule) for rule in arguments]
+
+
+def load_ppe_rules(path):
+    """Read and compile a config_ppe_rules*.txt file."""
+    config = configparser.ConfigParser(interpolation=None, strict=False)
+    config.optionxform = str
+    if not config.read(path):
+        raise ValueError("unable to read %s" % path)
+    rules = parse_ppe_rules(config)
+    if not rules:
+        raise ValueError("no enabled rule in %s" % path)
+    return rules
+
+
+def items_in_region(subject_boxes, item_boxes, region, head_fraction=HEAD_FRACTION):
+    """Return, per subject box, whether the center of one of the item boxes lies in its region.
+
+    The head region is the head point test of association.associate_helmets()
+    with head_fraction, the compliance setting of the helmet check.
+    """
+    if not len(subject_boxes) or not len(item_boxes):
+        return np.zeros(len(subject_boxes), dtype=bool)
+    centers = np.column_stack((item_boxes[:, 0] + item_boxes[:, 2] / 2, item_boxes[:, 1] + item_boxes[:, 3] / 2))
+    if region == REGION_HEAD:
+        return associate_helmets(subject_boxes, centers, head_fraction) >= 0
+    fx0, fy0, fx1, fy1 = REGIONS[region]
+    left, top, width, height = (subject_boxes[:, column, None] for column in range(4))
+    x, y = centers[None, :, 0], centers[None, :, 1]
+    inside = ((x >= left + fx0 * width) & (x <= left + fx1 * width) &
+              (y >= top + fy0 * height) & (y <= top + fy1 * height))
+    return inside.any(axis=1)
+
+
+class _Check:
+    """An item-in-region test of one subject class and the rules sharing it."""
+
+    __slots__ = ("item_slot", "region", "rules")
+
+    def __init__(self, item_slot, region):
+        self.item_slot = item_slot
+        self.region = region
+        self.rules = []
+
+
+class RuleEngine:
+    """Evaluates compiled PpeRules over FrameObjects.
+
+    geometry is the {stream id: zones.StreamGeometry} of the nvdsanalytics
+    config, needed by rules with near-line; on streams without one of a
+    rule's lines the rule does not apply.
+    """
+
+    def __init__(self, rules, geometry=None):
+        self.rules = list(rules)
+        self.geometry = geometry or {}
+        if len(self.rules) > MAX_RULES:
+            raise ValueError("at most %d rules are supported" % MAX_RULES)
+        known_lines = {name for stream in self.geometry.values() for name in stream.lines.names}
+        for rule in self.rules:
+            missing = [name for name in rule.lines if name not in known_lines]
+            if missing:
+                raise ValueError("rule %s: unknown line(s) %s" % (rule.name, ", ".join(missing)))
+        self._keys = np.array(sorted({rule.subject for rule in self.rules} | {rule.item for rule in self.rules}),
+                              dtype=np.int64)
+        self._plans = {}
+        # Per stream: line columns of the near-line rules, and the subjects' line distances of the frame
+        self._columns = {}
+        self._messages = {}
+        self._names = {}
+        self.frames = [0] * len(self.rules)
+        self.violations = [0] * len(self.rules)
+        self.seconds = [0.0] * len(self.rules)
+
+    def _slot(self, key):
+        return int(np.searchsorted(self._keys, key))
+
+    def _plan(self, stream_id):
+        """Return [(subject slot, [_Check])] of the rules applying to a stream."""
+        plan = self._plans.get(stream_id)
+        if plan is not None:
+            return plan
+        subjects = {}
+        for rule in self.rules:
+            if not rule.applies_to(stream_id):
+                continue
+            checks = subjects.setdefault(self._slot(rule.subject), {})
+            check = checks.get((rule.item, rule.region))
+            if check is None:
+                check = checks[(rule.item, rule.region)] = _Check(self._slot(rule.item), rule.region)
+            check.rules.append(rule)
+        plan = self._plans[stream_id] = [(slot, list(checks.values())) for slot, checks in subjects.items()]
+        return plan
+
+    def _line_columns(self, stream_id, rule):
+        stream = self.geometry.get(stream_id)
+        if stream is None:
+            return []
+        return [index for index, name in enumerate(stream.lines.names) if name in rule.lines]
+
+    def _scope(self, frame, rule, subjects, boxes, cache):
+        """Return the mask of the subjects a rule applies to, or None for all of them."""
+        applies = None
+        if rule.zone_mask:
+            applies = (frame.roi_mask[subjects] & np.uint64(rule.zone_mask)) != 0
+        if rule.lines:
+            columns = cache.get(rule.index)
+            if columns is None:
+                columns = cache[rule.index] = self._line_columns(frame.stream_id, rule)
+            if not columns:
+                return np.zeros(len(subjects), dtype=bool)
+            if "distances" not in cache:
+                lines = self.geometry[frame.stream_id].lines
+                cache["distances"] = lines.distances(anchor_points(boxes, ANCHOR_FOOT))
+            near = (cache["distances"][:, columns] <= rule.near_distance).any(axis=1)
+            applies = near if applies is None else applies & near
+        return applies
+
+    def _due(self, frame, subjects, in_scope, track_store, inferred):
+        """Look up the in-scope subjects' tracks; return (subjects to test, tracked subjects, their slots, due)."""
+        candidates = np.flatnonzero(in_scope)
+        ids = frame.object_ids[subjects[candidates]]
+        tracked = ids != np.uint64(UNTRACKED_OBJECT_ID)
+        tracked_index = candidates[tracked]
+        slots, new = track_store.lookup(frame.stream_id, ids[tracked].tolist(), frame.frame_num)
+        if inferred is None:
+            due = track_store.needs_evaluation(slots, new, frame.frame_num)
+        elif inferred:
+            due = np.ones(len(slots), dtype=bool)
+        else:
+            due = new
+        # Untracked subjects have no history and are always tested
+        test = np.zeros(len(subjects), dtype=bool)
+        test[candidates[~tracked]] = True
+        test[tracked_index[due]] = True
+        return test, tracked_index, slots, due
+
+    def evaluate(self, frame, track_store=None, inferred=None, head_fraction=HEAD_FRACTION):
+        """Apply every rule to a frame and return a FrameVerdict.
+
+        Subjects in the scope of a rule get VERDICT_COMPLIANT, those breaking one
+        VERDICT_VIOLATION; verdict.violations holds the broken rule bits. The
+        item test only runs for subjects at least one of its rules applies to
+        and, with a track_store, that are due for evaluation; the others keep
+        their track's result. inferred is as for compliance.evaluate_frame(),
+        head_fraction is the ComplianceSettings one, used by head region rules.
+        """
+        if track_store is not None and track_store.owner is not self:
+            # Stored masks hold the rule bits of the engine that wrote them
+            track_store.clear(self)
+        count = len(frame)
+        verdicts = np.zeros(count, dtype=np.int8)
+        violations = np.zeros(count, dtype=np.uint32)
+        keys = frame.component_ids.astype(np.int64) * KEY_STRIDE + frame.class_ids
+        slots = np.searchsorted(self._keys, keys)
+        known = slots < len(self._keys)
+        known[known] = self._keys[slots[known]] == keys[known]
+        slots[~known] = -1
+
+        evaluated = 0
+        reused = 0
+        for subject_slot, checks in self._plan(frame.stream_id):
+            subjects = np.flatnonzero(slots == subject_slot)
+            if not len(subjects):
+                continue
+            boxes = frame.boxes[subjects]
+            cache = self._columns.setdefault(frame.stream_id, {})
+            cache.pop("distances", None)
+            # Bits of the rules applying to each subject
+            scope_bits = np.zeros(len(subjects), dtype=np.uint32)
+            check_scopes = []
+            for check in checks:
+                scopes = []
+                for rule in check.rules:
+                    start = time.perf_counter()
+                    scope = self._scope(frame, rule, subjects, boxes, cache)
+                    if scope is None:
+                        scope_bits |= np.uint32(rule.bit)
+                    else:
+                        scope_bits[scope] |= np.uint32(rule.bit)
+                    scopes.append(scope)
+                    self.frames[rule.index] += 1
+                    self.seconds[rule.index] += time.perf_counter() - start
+                check_scopes.append(scopes)
+            in_scope = scope_bits != 0
+            if not in_scope.any():
+                continue
+
+            # Subjects whose items are tested this frame, None for all of them
+            test = None
+            if track_store is not None:
+                test, tracked_index, track_slots, due = self._due(frame, subjects, in_scope, track_store,
+                                                                  inferred)
+            found = np.zeros(len(subjects), dtype=np.uint32)
+            for check, scopes in zip(checks, check_scopes):
+                start = time.perf_counter()
+                tested = test
+                if all(scope is not None for scope in scopes):
+                    scope_any = np.logical_or.reduce(scopes)
+                    tested = scope_any if tested is None else tested & scope_any
+                if tested is not None and not tested.any():
+                    continue
+                if tested is None:
+                    has_item = items_in_region(boxes, frame.boxes[slots == check.item_slot], check.region,
+                                               head_fraction)
+                else:
+                    has_item = np.zeros(len(subjects), dtype=bool)
+                    has_item[tested] = items_in_region(boxes[tested], frame.boxes[slots == check.item_slot],
+                                                       check.region, head_fraction)
+                shared = (time.perf_counter() - start) / len(check.rules)
+
+                for rule, scope in zip(check.rules, scopes):
+                    start = time.perf_counter()
+                    broken = has_item != rule.required
+                    if scope is not None:
+                        broken &= scope
+                    if tested is not None:
+                        broken &= tested
+                    found[broken] |= np.uint32(rule.bit)
+                    self.seconds[rule.index] += shared + time.perf_counter() - start
+
+            if track_store is None:
+                tested_count = int(np.count_nonzero(in_scope))
+            else:
+                # Fresh results feed the tracks; tracked subjects show their track's
+                # result, limited to the rules applying to them this frame
+                codes = (found.astype(np.int64) << VERDICT_BITS) | np.where(found != 0, VERDICT_VIOLATION,
+                                                                            VERDICT_COMPLIANT)
+                track_store.update(track_slots[due], codes[tracked_index[due]], frame.frame_num)
+                stored = (track_store.verdicts(track_slots) >> VERDICT_BITS).astype(np.uint32)
+                found[tracked_index] = stored & scope_bits[tracked_index]
+                tested_count = int(np.count_nonzero(test))
+                reused += int(np.count_nonzero(in_scope)) - tested_count
+            if found.any():
+                for check in checks:
+                    for rule in check.rules:
+                        self.violations[rule.index] += int(np.count_nonzero(found & np.uint32(rule.bit)))
+            violations[subjects[in_scope]] = found[in_scope]
+            verdicts[subjects[in_scope]] = VERDICT_COMPLIANT
+            evaluated += tested_count
+
+        if track_store is not None:
+            track_store.sweep(frame.stream_id, frame.frame_num)
+        violators = violations != 0
+        verdicts[violators] = VERDICT_VIOLATION
+        return FrameVerdict(verdicts, int(np.count_nonzero(frame.labels == LABEL_PERSON)),
+                            int(np.count_nonzero(frame.labels == LABEL_HELMET)), int(np.count_nonzero(violators)),
+                            evaluated, reused, violations)
+
+    def violation_text(self, mask):
+        """Return the messages of the rules in a violation mask, joined."""
+        text = self._messages.get(mask)
+        if text is None:
+            text = self._messages[mask] = " ".join(rule.message for rule in self.rules if mask & rule.bit)
+        return text
+
+    def violation_names(self, mask):
+        """Return the names of the rules in a violation mask, in config order."""
+        names = self._names.get(mask)
+        if names is None:
+            names = self._names[mask] = tuple(rule.name for rule in self.rules if mask & rule.bit)
+        return names
+
+    def stats(self):
+        return {
+            rule.name: {
+                "frames": self.frames[rule.index],
+                "violations": self.violations[rule.index],
+                "mean_us": round(1e6 * self.seconds[rule.index] / self.frames[rule.index], 1)
+                if self.frames[rule.index] else 0.0,
+            }
+            for rule in self.rules
+        }
+
+    def print_stats_callback(self):
+        """GLib timeout callback printing the per-rule violations and evaluation time."""
+        print("\n**PPE: ", self.stats(), "\n")
+        return True
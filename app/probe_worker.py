@@ -0,0 +1,227 @@
+################################################################################
+# Off-thread processing for the analytics probe (split mode).
+#
+# In split mode the probe only does the work that has to touch the buffer
+# (FPS counting, object styles and display meta) and hands a FrameRecord per
+# frame to a ProbeWorker through a bounded DropOldestQueue. The record carries
+# the frame's arrays, without its pyds metas, and the worker thread runs the
+# helmet association on them. It publishes the verdicts per track, which the
+# probe styles later frames of the stream with, builds the overlay text the
+# probe attaches and runs any registered record handlers (logging, alerting).
+# Styles and text therefore lag the association by the queue latency. FPS is
+# counted on the streaming thread, so records the queue drops under load do
+# not lower it.
+################################################################################
+
+import collections
+import sys
+import threading
+import time
+
+import numpy as np
+
+from compliance import VERDICT_VIOLATION, FrameVerdict, build_overlay_text
+from frame_arrays import LABEL_HELMET, LABEL_PERSON, FrameObjects
+from track_state import UNTRACKED_OBJECT_ID
+
+# Number of most recent queue latencies kept for the percentile estimate
+LATENCY_WINDOW = 1024
+
+
+class FrameRecord:
+    """What the worker needs to know about one processed frame.
+
+    A record built with for_association() carries the frame and the evaluate
+    callable to run on it; the worker fills in the verdict and the counts.
+    """
+
+    __slots__ = ("stream_id", "frame_num", "person_count", "helmet_count", "alert_count",
+                 "zone_counts", "line_counts", "overcrowding", "timestamp", "frame", "evaluate", "verdict")
+
+    def __init__(self, stream_id, frame_num, person_count, helmet_count, alert_count,
+                 zone_counts=None, line_counts=None, overcrowding=None, timestamp=None, frame=None,
+                 evaluate=None):
+        self.stream_id = stream_id
+        self.frame_num = frame_num
+        self.person_count = person_count
+        self.helmet_count = helmet_count
+        self.alert_count = alert_count
+        self.zone_counts = zone_counts
+        self.line_counts = line_counts
+        self.overcrowding = overcrowding
+        self.timestamp = time.monotonic() if timestamp is None else timestamp
+        self.frame = frame
+        self.evaluate = evaluate
+        self.verdict = None
+
+    @classmethod
+    def from_frame(cls, frame, verdict):
+        """Build a record from a FrameObjects and its compliance FrameVerdict."""
+        return cls(frame.stream_id, frame.frame_num, verdict.person_count, verdict.helmet_count,
+                   verdict.alert_count, frame.zone_counts, frame.line_counts, frame.overcrowding)
+
+    @classmethod
+    def for_association(cls, frame, evaluate):
+        """Build a record whose verdict evaluate(frame) computes on the worker thread.
+
+        The pyds metas stay behind: the buffer they live in moves on once the
+        probe returns.
+        """
+        arrays = FrameObjects(frame.stream_id, frame.frame_num, frame.boxes, frame.labels, frame.class_ids,
+                              frame.component_ids, frame.object_ids, frame.confidences, frame.roi_mask,
+                              frame.lc_mask, zone_counts=frame.zone_counts, line_counts=frame.line_counts,
+                              overcrowding=frame.overcrowding)
+        return cls(frame.stream_id, frame.frame_num, 0, 0, 0, frame.zone_counts, frame.line_counts,
+                   frame.overcrowding, frame=arrays, evaluate=evaluate)
+
+
+class DropOldestQueue:
+    """Bounded FIFO whose put() never blocks: when full the oldest item is dropped.
+
+    Tracks how many items were dropped and how long items waited between put()
+    and get(), so the decoupling can be checked under load.
+    """
+
+    def __init__(self, maxsize):
+        self._items = collections.deque(maxlen=maxsize)
+        self._not_empty = threading.Condition(threading.Lock())
+        self._latencies = [0.0] * LATENCY_WINDOW
+        self.maxsize = maxsize
+        self.enqueued = 0
+        self.dequeued = 0
+        self.dropped = 0
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item):
+        with self._not_empty:
+            if len(self._items) == self.maxsize:
+                self.dropped += 1
+            # deque(maxlen=...) discards the oldest entry itself
+            self._items.append((time.monotonic(), item))
+            self.enqueued += 1
+            self._not_empty.notify()
+
+    def get(self, timeout=None):
+        """Return the oldest item, or None if nothing arrived within timeout."""
+        with self._not_empty:
+            if not self._items and not self._not_empty.wait_for(lambda: self._items, timeout):
+                return None
+            put_time, item = self._items.popleft()
+            latency = time.monotonic() - put_time
+            self._latencies[self.dequeued % LATENCY_WINDOW] = latency
+            self.dequeued += 1
+            self.total_latency += latency
+            if latency > self.max_latency:
+                self.max_latency = latency
+            return item
+
+    def stats(self):
+        """Return a snapshot of the queue counters, latencies in milliseconds."""
+        with self._not_empty:
+            window = sorted(self._latencies[:min(self.dequeued, LATENCY_WINDOW)])
+            stats = {
+                "depth": len(self._items),
+                "enqueued": self.enqueued,
+                "dequeued": self.dequeued,
+                "dropped": self.dropped,
+                "mean_latency_ms": 1000.0 * self.total_latency / self.dequeued if self.dequeued else 0.0,
+                "max_latency_ms": 1000.0 * self.max_latency,
+            }
+        for name, q in (("p50_latency_ms", 0.50), ("p99_latency_ms", 0.99)):
+            stats[name] = 1000.0 * window[int(q * (len(window) - 1))] if window else 0.0
+        return stats
+
+
+class ProbeWorker(threading.Thread):
+    """Consumes FrameRecords off the streaming thread."""
+
+    def __init__(self, queue_size=256):
+        super().__init__(name="probe-worker", daemon=True)
+        self.queue = DropOldestQueue(queue_size)
+        self.handlers = []
+        # Latest overlay text per stream id, read by the probe without locking
+        self.overlay_text = {}
+        # Latest (sorted object ids, verdicts, violations) per stream id, replaced whole
+        self.track_verdicts = {}
+        self._alerting = {}
+        self._running = True
+
+    def submit(self, record):
+        """Hand a record to the worker; never blocks the caller."""
+        self.queue.put(record)
+
+    def add_handler(self, handler):
+        """Register a callable run on the worker thread for every record."""
+        self.handlers.append(handler)
+
+    def stop(self):
+        self._running = False
+        self.join()
+
+    def run(self):
+        while self._running:
+            record = self.queue.get(timeout=0.1)
+            if record is None:
+                continue
+            try:
+                self.process(record)
+            except Exception as e:
+                sys.stderr.write("Probe worker failed on stream %d frame %d: %s\n"
+                                 % (record.stream_id, record.frame_num, e))
+
+    def process(self, record):
+        if record.evaluate is not None:
+            verdict = record.verdict = record.evaluate(record.frame)
+            record.person_count = verdict.person_count
+            record.helmet_count = verdict.helmet_count
+            record.alert_count = verdict.alert_count
+            self.publish_verdicts(record.frame, verdict)
+        self.overlay_text[record.stream_id] = build_overlay_text(
+            record.person_count, record.alert_count, record.zone_counts, record.line_counts,
+            record.overcrowding)
+
+        alerting = record.alert_count > 0
+        if alerting != self._alerting.get(record.stream_id, False):
+            self._alerting[record.stream_id] = alerting
+            if alerting:
+                print("Security alert on stream {0} frame {1}: {2} person(s) without helmet".format(
+                    record.stream_id, record.frame_num, record.alert_count))
+
+        for handler in self.handlers:
+            handler(record)
+
+    def publish_verdicts(self, frame, verdict):
+        tracked = np.flatnonzero(frame.object_ids != UNTRACKED_OBJECT_ID)
+        order = tracked[np.argsort(frame.object_ids[tracked], kind="stable")]
+        violations = verdict.violations[order] if verdict.violations is not None else None
+        self.track_verdicts[frame.stream_id] = (frame.object_ids[order], verdict.verdicts[order], violations)
+
+    def shown_verdict(self, frame):
+        """Verdict of a frame from the latest track verdicts published for its stream.
+
+        Runs on the streaming thread in place of the association; objects
+        the worker has not evaluated yet, and untracked ones, get none.
+        """
+        verdicts = np.zeros(len(frame), dtype=np.int8)
+        violations = None
+        published = self.track_verdicts.get(frame.stream_id)
+        if published is not None and len(published[0]) and len(frame):
+            object_ids, track_verdicts, track_violations = published
+            where = np.minimum(np.searchsorted(object_ids, frame.object_ids), len(object_ids) - 1)
+            known = (object_ids[where] == frame.object_ids) & (frame.object_ids != UNTRACKED_OBJECT_ID)
+            verdicts[known] = track_verdicts[where[known]]
+            if track_violations is not None:
+                violations = np.zeros(len(frame), dtype=track_violations.dtype)
+                violations[known] = track_violations[where[known]]
+        return FrameVerdict(verdicts, int(np.count_nonzero(frame.labels == LABEL_PERSON)),
+                            int(np.count_nonzero(frame.labels == LABEL_HELMET)),
+                            int(np.count_nonzero(verdicts == VERDICT_VIOLATION)), violations=violations)
+
+    def print_stats_callback(self):
+        """GLib timeout callback printing the hand-off queue counters."""
+        print("\n**PROBE QUEUE: ", self.queue.stats(), "\n")
+        return True
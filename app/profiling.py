@@ -0,0 +1,120 @@
+################################################################################
+# Section-level timing of the analytics probe.
+#
+# A SectionProfiler keeps one fixed-size log-scale histogram per stream and
+# probe section, so its memory does not grow with uptime, and reports
+# p50/p95/p99 per section. The probe only calls into it when profiling is on;
+# with the profiler unset the hot path does a single None check per section.
+################################################################################
+
+import math
+import os
+import sys
+
+import numpy as np
+
+# Environment variable that switches profiling on, same as --profile
+PROFILE_ENV = "SAFETY_PROBE_PROFILE"
+
+# Probe sections, in execution order
+SECTION_OBJECTS = 0       # object list walk and field copies
+SECTION_USER_META = 1     # per-object and per-frame nvdsanalytics user meta walk
+SECTION_ASSOCIATION = 2   # helmet association and verdicts
+SECTION_STYLING = 3       # writing box and label styles back to the objects
+SECTION_OSD_TEXT = 4      # building the overlay text
+SECTION_DISPLAY_META = 5  # acquiring and attaching the display meta
+SECTION_FRAME = 6         # all per-frame work after extraction
+SECTION_NAMES = ("objects", "user_meta", "association", "styling", "osd_text", "display_meta", "frame")
+
+# Buckets are spaced 2**(1/BUCKETS_PER_OCTAVE) apart starting at MIN_SECONDS;
+# 80 buckets at 4 per octave cover 1 us to ~1 s.
+MIN_SECONDS = 1e-6
+BUCKETS_PER_OCTAVE = 4
+NUM_BUCKETS = 80
+MAX_STREAMS = 64
+
+
+def profiling_requested(flag=False):
+    """Return True if profiling was asked for by flag or environment variable."""
+    return flag or os.environ.get(PROFILE_ENV, "0") not in ("", "0")
+
+
+class SectionProfiler:
+    """Per-stream, per-section latency histograms with a fixed footprint."""
+
+    def __init__(self, max_streams=MAX_STREAMS, sections=SECTION_NAMES, stream_offset=0):
+        self.sections = sections
+        self.max_streams = max_streams
+        # Added to the stream ids dump() prints, see main.py --stream-offset
+        self.stream_offset = stream_offset
+        self.counts = np.zeros((max_streams, len(sections), NUM_BUCKETS), dtype=np.int64)
+        self.totals = np.zeros((max_streams, len(sections)), dtype=np.float64)
+        # Upper edge of every bucket, used to report percentiles
+        self.bucket_edges = MIN_SECONDS * 2.0 ** (np.arange(1, NUM_BUCKETS + 1) / BUCKETS_PER_OCTAVE)
+
+    def record(self, stream_id, section, seconds):
+        if not 0 <= stream_id < self.max_streams:
+            return
+        if seconds <= MIN_SECONDS:
+            bucket = 0
+        else:
+            bucket = min(int(math.log2(seconds / MIN_SECONDS) * BUCKETS_PER_OCTAVE), NUM_BUCKETS - 1)
+        self.counts[stream_id, section, bucket] += 1
+        self.totals[stream_id, section] += seconds
+
+    def reset(self):
+        self.counts[:] = 0
+        self.totals[:] = 0.0
+
+    def add(self, other):
+        """Accumulate the histograms of another profiler with the same layout."""
+        self.counts += other.counts
+        self.totals += other.totals
+
+    def percentiles(self, stream_id, section, quantiles=(0.50, 0.95, 0.99)):
+        """Return the upper bucket edges, in seconds, holding the given quantiles."""
+        counts = self.counts[stream_id, section]
+        total = counts.sum()
+        if not total:
+            return [0.0] * len(quantiles)
+        cumulative = np.cumsum(counts)
+        return [float(self.bucket_edges[np.searchsorted(cumulative, q * total)]) for q in quantiles]
+
+    def snapshot(self, stream_offset=0):
+        """Return {stream: {section: {count, mean_us, p50_us, p95_us, p99_us}}} for active streams.
+
+        The stream<N> keys are the profiled stream ids plus stream_offset.
+        """
+        result = {}
+        for stream_id in np.flatnonzero(self.counts.sum(axis=(1, 2))).tolist():
+            sections = {}
+            for section, name in enumerate(self.sections):
+                count = int(self.counts[stream_id, section].sum())
+                if not count:
+                    continue
+                p50, p95, p99 = self.percentiles(stream_id, section)
+                sections[name] = {
+                    "count": count,
+                    "mean_us": round(1e6 * self.totals[stream_id, section] / count, 1),
+                    "p50_us": round(1e6 * p50, 1),
+                    "p95_us": round(1e6 * p95, 1),
+                    "p99_us": round(1e6 * p99, 1),
+                }
+            result["stream{0}".format(stream_id + stream_offset)] = sections
+        return result
+
+    def dump(self, out=sys.stdout):
+        out.write("\n**PROBE PROFILE (us, bucket upper bounds)\n")
+        out.write("{0:<10} {1:<13} {2:>9} {3:>9} {4:>9} {5:>9} {6:>9}\n".format(
+            "stream", "section", "count", "mean", "p50", "p95", "p99"))
+        for stream, sections in self.snapshot(self.stream_offset).items():
+            for name, stats in sections.items():
+                out.write("{0:<10} {1:<13} {2:>9} {3:>9} {4:>9} {5:>9} {6:>9}\n".format(
+                    stream, name, stats["count"], stats["mean_us"], stats["p50_us"],
+                    stats["p95_us"], stats["p99_us"]))
+        out.flush()
+
+    def dump_callback(self, *args):
+        """GLib timeout / unix signal callback; keeps the source installed."""
+        self.dump()
+        return True
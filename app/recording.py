@@ -0,0 +1,391 @@
+################################################################################
+# Recording of the per-frame analytics metadata, for replays without a GPU.
+#
+# MetadataRecorder is fed every frame by the probe, after the zones are
+# applied, and appends the frame's object arrays (boxes, labels, ids, ROI and
+# line masks) and nvdsanalytics frame meta to a chunked columnar file. The
+# streaming thread only keeps references to the frame arrays; between batches,
+# once chunk_frames frames are pending, they are handed to a writer thread
+# that concatenates them into columns and appends the chunk. A file is:
+#   file header   MAGIC, zero padded to 64 bytes
+#   chunk         8 byte little endian header length, a JSON header padded to
+#                 a multiple of 64 bytes, then one 64 byte aligned block per
+#                 column; repeated
+# Chunks hold whole batches. Every chunk header lists the zone names in mask
+# bit order and the object labels, so its masks and label codes can be mapped
+# in another process. A chunk goes out in a single write, so a recording cut
+# short by a crash loses at most the chunk being written; a recorder opening
+# such a file cuts that partial chunk off before appending to it.
+#
+# Recording memory maps a file and yields its batches as FrameObjects whose
+# arrays are views of the file; replay.py runs them through the compliance
+# logic and utils/replay_recording.py replays a recording.
+################################################################################
+
+import collections
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+from frame_arrays import LABEL_CODES, LABEL_UNKNOWN, OBJECT_LABELS, BatchObjects, FrameObjects, zone_bit, zone_names
+from probe_worker import DropOldestQueue
+
+MAGIC = b"PPEREC01"
+RECORDING_FORMAT = 1
+FILE_HEADER_SIZE = 64
+ALIGNMENT = 64
+DEFAULT_CHUNK_FRAMES = 2048
+# Chunks waiting for the writer; the oldest is dropped when it falls behind
+DEFAULT_QUEUE_CHUNKS = 8
+
+# Kinds of the nvdsanalytics frame meta entries
+ANALYTICS_ZONE_COUNT = 0
+ANALYTICS_LINE_COUNT = 1
+ANALYTICS_OVERCROWDING = 2
+
+# analytics_count is -1 for frames without nvdsanalytics frame meta
+FRAME_COLUMNS = (("stream_id", np.int32), ("frame_num", np.int64), ("batch", np.int64),
+                 ("timestamp", np.float64), ("object_count", np.int32), ("analytics_count", np.int32))
+# Boxes come from float rect_params, so float32 keeps them exactly
+OBJECT_COLUMNS = (("boxes", np.float32), ("labels", np.int16), ("class_ids", np.int32),
+                  ("component_ids", np.int32), ("object_ids", np.uint64), ("confidences", np.float32),
+                  ("roi_mask", np.uint64), ("lc_mask", np.uint64))
+ANALYTICS_COLUMNS = (("analytics_kind", np.uint8), ("analytics_name", np.int32),
+                     ("analytics_value", np.int64))
+
+
+def chunk_columns(entries):
+    """Return the columns and analytics names of a chunk from MetadataRecorder entries."""
+    columns = {}
+    for index, (name, dtype) in enumerate(FRAME_COLUMNS[:4]):
+        columns[name] = np.array([entry[index] for entry in entries], dtype=dtype)
+    columns["object_count"] = np.array([len(entry[5]) for entry in entries], dtype=np.int32)
+    for index, (name, dtype) in enumerate(OBJECT_COLUMNS, 4):
+        columns[name] = np.concatenate([entry[index] for entry in entries]).astype(dtype, copy=False)
+    columns["boxes"] = columns["boxes"].reshape(-1, 4)
+
+    names = {}
+    analytics_counts = []
+    kinds = []
+    name_indices = []
+    values = []
+    for entry in entries:
+        zone_counts, line_counts, overcrowding = entry[12:]
+        if zone_counts is None:
+            analytics_counts.append(-1)
+            continue
+        count = 0
+        for kind, table in ((ANALYTICS_ZONE_COUNT, zone_counts), (ANALYTICS_LINE_COUNT, line_counts),
+                            (ANALYTICS_OVERCROWDING, overcrowding)):
+            for name, value in (table or {}).items():
+                kinds.append(kind)
+                name_indices.append(names.setdefault(name, len(names)))
+                values.append(int(value))
+                count += 1
+        analytics_counts.append(count)
+    columns["analytics_count"] = np.array(analytics_counts, dtype=np.int32)
+    for (name, dtype), data in zip(ANALYTICS_COLUMNS, (kinds, name_indices, values)):
+        columns[name] = np.array(data, dtype=dtype)
+    return columns, list(names)
+
+
+def encode_chunk(columns, zones, analytics_names):
+    """Return the bytes of a chunk holding columns."""
+    layout = {}
+    blocks = []
+    offset = 0
+    for name, array in columns.items():
+        data = np.ascontiguousarray(array).tobytes()
+        layout[name] = [array.dtype.str, list(array.shape), offset]
+        padding = -len(data) % ALIGNMENT
+        blocks.append(data + b"\0" * padding)
+        offset += len(data) + padding
+    header = {"format": RECORDING_FORMAT, "frames": len(columns["stream_id"]), "size": offset,
+              "labels": list(OBJECT_LABELS), "zones": zones, "analytics": analytics_names, "columns": layout}
+    text = json.dumps(header).encode("utf-8")
+    text += b" " * (-(8 + len(text)) % ALIGNMENT)
+    return b"".join([struct.pack("<Q", len(text)), text] + blocks)
+
+
+def _remap_masks(mask, names):
+    """Map masks written with names in bit order onto this process's zone bits."""
+    bits = [zone_bit(name) for name in names]
+    if all(bit == 1 << index for index, bit in enumerate(bits)):
+        return mask
+    remapped = np.zeros_like(mask)
+    for index, bit in enumerate(bits):
+        if bit:
+            remapped[(mask & np.uint64(1 << index)) != 0] |= np.uint64(bit)
+    return remapped
+
+
+def _chunk_header(data, offset):
+    """Return (header, column data offset) of the chunk at offset, None if it is incomplete."""
+    if offset + 8 > len(data):
+        return None
+    header_size, = struct.unpack_from("<Q", data, offset)
+    begin = offset + 8 + header_size
+    if begin > len(data):
+        return None
+    try:
+        header = json.loads(bytes(data[offset + 8:begin]).decode("utf-8"))
+    except ValueError:
+        # A header cut short by a crash, padding included, is not valid JSON
+        return None
+    if not isinstance(header, dict) or begin + header.get("size", len(data)) > len(data):
+        return None
+    return header, begin
+
+
+def complete_length(data):
+    """Return the length of data up to the end of its last complete chunk."""
+    offset = FILE_HEADER_SIZE
+    while offset < len(data):
+        chunk = _chunk_header(data, offset)
+        if chunk is None:
+            break
+        header, begin = chunk
+        offset = begin + header["size"]
+    return min(offset, len(data))
+
+
+class RecordedChunk:
+    """The columns of one chunk, as views of the mapped file."""
+
+    def __init__(self, header, columns):
+        self.header = header
+        self.columns = columns
+
+    def __len__(self):
+        return self.header["frames"]
+
+    def _labels(self):
+        labels = self.columns["labels"]
+        if self.header["labels"] == list(OBJECT_LABELS):
+            return labels
+        codes = np.array([LABEL_CODES.get(label, LABEL_UNKNOWN) for label in self.header["labels"]] + [LABEL_UNKNOWN],
+                         dtype=np.int16)
+        return codes[np.where(labels >= 0, labels, len(codes) - 1)]
+
+    def _analytics(self):
+        """Return the (zone_counts, line_counts, overcrowding) of every frame, None without frame meta."""
+        counts = self.columns["analytics_count"].tolist()
+        kinds = self.columns["analytics_kind"].tolist()
+        names = [self.header["analytics"][index] for index in self.columns["analytics_name"].tolist()]
+        values = self.columns["analytics_value"].tolist()
+        analytics = []
+        position = 0
+        for count in counts:
+            if count < 0:
+                analytics.append(None)
+                continue
+            tables = ({}, {}, {})
+            for index in range(position, position + count):
+                value = values[index]
+                tables[kinds[index]][names[index]] = bool(value) if kinds[index] == ANALYTICS_OVERCROWDING else value
+            position += count
+            analytics.append(tables)
+        return analytics
+
+    def batches(self):
+        """Yield (timestamp, BatchObjects) for every batch of the chunk."""
+        columns = self.columns
+        boxes = columns["boxes"].astype(np.float64)
+        labels = self._labels()
+        roi_mask = _remap_masks(columns["roi_mask"], self.header["zones"])
+        lc_mask = _remap_masks(columns["lc_mask"], self.header["zones"])
+        starts = np.zeros(len(self) + 1, dtype=np.int64)
+        np.cumsum(columns["object_count"], out=starts[1:])
+        starts = starts.tolist()
+        analytics = self._analytics()
+        stream_ids = columns["stream_id"].tolist()
+        frame_nums = columns["frame_num"].tolist()
+        batch_numbers = columns["batch"].tolist()
+        timestamps = columns["timestamp"].tolist()
+
+        frames = []
+        for index in range(len(self)):
+            if frames and batch_numbers[index] != batch_numbers[index - 1]:
+                yield timestamps[index - 1], BatchObjects(frames)
+                frames = []
+            begin, end = starts[index], starts[index + 1]
+            tables = analytics[index] or (None, None, None)
+            frames.append(FrameObjects(stream_ids[index], frame_nums[index], boxes[begin:end], labels[begin:end],
+                                       columns["class_ids"][begin:end], columns["component_ids"][begin:end],
+                                       columns["object_ids"][begin:end], columns["confidences"][begin:end],
+                                       roi_mask[begin:end], lc_mask[begin:end], None, *tables))
+        if frames:
+            yield timestamps[-1], BatchObjects(frames)
+
+
+class Recording:
+    """A recording file, memory mapped for reading.
+
+    truncated is set once chunks() reaches an incomplete last chunk.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.truncated = False
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("%s is not a metadata recording" % path)
+            size = os.fstat(f.fileno()).st_size
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size > FILE_HEADER_SIZE else b""
+
+    def chunks(self):
+        """Yield the complete chunks of the file in order."""
+        data = self._map
+        offset = FILE_HEADER_SIZE
+        while offset < len(data):
+            chunk = _chunk_header(data, offset)
+            if chunk is None:
+                self.truncated = True
+                return
+            header, begin = chunk
+            if header.get("format") != RECORDING_FORMAT:
+                raise ValueError("%s: unsupported recording format %r" % (self.path, header.get("format")))
+            columns = {}
+            for name, (dtype, shape, column_offset) in header["columns"].items():
+                count = int(np.prod(shape)) if shape else 1
+                columns[name] = np.frombuffer(data, dtype=np.dtype(dtype), count=count,
+                                              offset=begin + column_offset).reshape(shape)
+            yield RecordedChunk(header, columns)
+            offset = begin + header["size"]
+
+    def batches(self):
+        """Yield (timestamp, BatchObjects) for every batch of the file."""
+        for chunk in self.chunks():
+            yield from chunk.batches()
+
+    def close(self):
+        try:
+            if isinstance(self._map, mmap.mmap):
+                self._map.close()
+        except BufferError:
+            # Frames still reference the map; it is released with them
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class MetadataRecorder(threading.Thread):
+    """Appends the frames the probe processed to a recording file from a background thread.
+
+    begin_batch() and record() run on the streaming thread and never block.
+    """
+
+    def __init__(self, path, chunk_frames=DEFAULT_CHUNK_FRAMES, queue_chunks=DEFAULT_QUEUE_CHUNKS,
+                 clock=time.time, stream_offset=0):
+        super().__init__(name="metadata-recorder", daemon=True)
+        self.path = path
+        self.chunk_frames = chunk_frames
+        self.clock = clock
+        # Added to the recorded stream ids, see main.py --stream-offset
+        self.stream_offset = stream_offset
+        self.queue = DropOldestQueue(queue_chunks)
+        self.counters = collections.Counter()
+        # Opened here so a bad path fails at startup; an existing recording is appended to
+        self._file = self._open(path)
+        self._entries = []
+        self._batch = -1
+        self._timestamp = 0.0
+        self._running = True
+
+    @staticmethod
+    def _open(path):
+        """Open path for appending, after the last complete chunk of an existing recording."""
+        try:
+            f = open(path, "r+b")
+        except FileNotFoundError:
+            f = open(path, "w+b")
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            f.write(MAGIC.ljust(FILE_HEADER_SIZE, b"\0"))
+            f.flush()
+            return f
+        if f.read(len(MAGIC)) != MAGIC:
+            f.close()
+            raise ValueError("%s exists and is not a metadata recording" % path)
+        if size < FILE_HEADER_SIZE:
+            f.seek(0)
+            f.truncate()
+            f.write(MAGIC.ljust(FILE_HEADER_SIZE, b"\0"))
+            f.flush()
+            return f
+        # Appending after a chunk cut short by a crash would make the reader
+        # take the new chunks for the rest of it
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            length = complete_length(data)
+        if length < size:
+            sys.stderr.write("%s ends in an incomplete chunk, dropping its last %d bytes\n" % (path, size - length))
+            f.truncate(length)
+        f.seek(length)
+        return f
+
+    def begin_batch(self):
+        if len(self._entries) >= self.chunk_frames:
+            self.flush()
+        self._batch += 1
+        self._timestamp = self.clock()
+
+    def record(self, frame):
+        """Keep a frame for the next chunk; its arrays are referenced, not copied."""
+        self._entries.append((frame.stream_id + self.stream_offset, frame.frame_num, self._batch, self._timestamp,
+                              frame.boxes, frame.labels, frame.class_ids, frame.component_ids, frame.object_ids,
+                              frame.confidences, frame.roi_mask, frame.lc_mask, frame.zone_counts,
+                              frame.line_counts, frame.overcrowding))
+
+    def flush(self):
+        """Hand the pending frames to the writer thread."""
+        if self._entries:
+            self.queue.put((self._entries, zone_names()))
+            self._entries = []
+
+    def run(self):
+        while self._running or len(self.queue):
+            item = self.queue.get(timeout=0.5)
+            if item is not None:
+                self._write(*item)
+        self._file.close()
+
+    def _write(self, entries, zones):
+        try:
+            columns, analytics_names = chunk_columns(entries)
+            data = encode_chunk(columns, zones, analytics_names)
+            self._file.write(data)
+            self._file.flush()
+        except (OSError, ValueError) as e:
+            self.counters["failed_chunks"] += 1
+            sys.stderr.write("Recording to %s failed: %s\n" % (self.path, e))
+            return
+        self.counters["chunks"] += 1
+        self.counters["frames"] += len(entries)
+        self.counters["objects"] += len(columns["labels"])
+        self.counters["bytes"] += len(data)
+
+    def stop(self):
+        """Write what is pending and wait for the thread."""
+        self.flush()
+        self._running = False
+        self.join()
+
+    def stats(self):
+        stats = {key: self.counters[key] for key in ("frames", "objects", "chunks", "bytes", "failed_chunks")}
+        stats["dropped_chunks"] = self.queue.dropped
+        return stats
+
+    def print_stats_callback(self):
+        """GLib timeout callback printing the recorder counters."""
+        print("\n**RECORDER: ", self.stats(), "\n")
+        return True
@@ -0,0 +1,149 @@
+################################################################################
+# CPU-only replay of recorded analytics metadata.
+#
+# ReplayEngine runs the batches of a recording.Recording through the steps
+# of the analytics probe that decide verdicts: the optional ZoneEngine of
+# --zone-geometry, then the RuleEngine of --ppe-rules or the built-in helmet
+# check with its TrackStateStore (interval aware if asked). An AlertDetector
+# or TimeSeriesStore driven by engine.clock sees the recorded time instead
+# of the wall clock. Nothing touches pyds or a GPU, so hours of recorded
+# site metadata replay in minutes.
+#
+# VerdictLog keeps the per-object verdicts of a replay; saved logs of two
+# rule or threshold versions of the same recording are compared with
+# compare_verdicts().
+################################################################################
+
+import json
+import time
+
+import numpy as np
+
+from compliance import ComplianceSettings, evaluate_frame
+from inference_interval import DEFAULT_PGIE_UNIQUE_ID, is_inferred
+
+VERDICT_LOG_FORMAT = 1
+
+
+class VerdictLog:
+    """Per-frame counts and per-object verdicts of a replay, in recording order."""
+
+    def __init__(self):
+        self._frames = []
+        self._verdicts = []
+        self._violations = []
+
+    def add(self, frame, verdict):
+        self._frames.append((frame.stream_id, frame.frame_num, verdict.person_count, verdict.alert_count,
+                             len(frame)))
+        self._verdicts.append(verdict.verdicts)
+        if verdict.violations is not None:
+            self._violations.append(verdict.violations)
+
+    def arrays(self):
+        frames = np.array(self._frames, dtype=np.int64).reshape(-1, 5)
+        verdicts = np.concatenate(self._verdicts) if self._verdicts else np.empty(0, dtype=np.int8)
+        arrays = {"frames": frames, "verdicts": verdicts.astype(np.int8, copy=False)}
+        if self._violations and len(self._violations) == len(self._verdicts):
+            arrays["violations"] = np.concatenate(self._violations)
+        return arrays
+
+    def save(self, path):
+        """Write the log to a compressed .npz."""
+        arrays = self.arrays()
+        arrays["header"] = np.frombuffer(json.dumps({"format": VERDICT_LOG_FORMAT}).encode("utf-8"), dtype=np.uint8)
+        np.savez_compressed(path, **arrays)
+
+
+def load_verdicts(path):
+    """Return the arrays of a VerdictLog saved to path."""
+    with np.load(path) as data:
+        header = json.loads(data["header"].tobytes().decode("utf-8"))
+        if header.get("format") != VERDICT_LOG_FORMAT:
+            raise ValueError("%s: unsupported verdict log format %r" % (path, header.get("format")))
+        return {name: data[name] for name in data.files if name != "header"}
+
+
+def compare_verdicts(before, after, examples=10):
+    """Compare the VerdictLog arrays of two replays of the same recording.
+
+    Returns the frames and objects whose verdicts differ, the alert totals of
+    both and the (stream, frame_num) of the first differing frames.
+    """
+    frames_before, frames_after = before["frames"], after["frames"]
+    if frames_before.shape != frames_after.shape or not np.array_equal(frames_before[:, [0, 1, 4]],
+                                                                       frames_after[:, [0, 1, 4]]):
+        raise ValueError("the verdict logs are not of the same recording")
+    changed_objects = before["verdicts"] != after["verdicts"]
+    changed_frames = frames_before[:, 3] != frames_after[:, 3]
+    object_frames = np.repeat(np.arange(len(frames_before)), frames_before[:, 4])
+    changed_frames[object_frames[changed_objects]] = True
+    changed = np.flatnonzero(changed_frames)
+    return {
+        "frames": len(frames_before),
+        "changed_frames": len(changed),
+        "changed_objects": int(np.count_nonzero(changed_objects)),
+        "alerts_before": int(frames_before[:, 3].sum()),
+        "alerts_after": int(frames_after[:, 3].sum()),
+        "examples": [tuple(frames_before[index, :2].tolist()) for index in changed[:examples]],
+    }
+
+
+class ReplayEngine:
+    """Re-evaluates recorded frames with the compliance logic of the probe."""
+
+    def __init__(self, track_store=None, zone_engine=None, ppe_engine=None, compliance=None,
+                 interval_aware=False, pgie_unique_id=DEFAULT_PGIE_UNIQUE_ID):
+        self.track_store = track_store
+        self.zone_engine = zone_engine
+        self.ppe_engine = ppe_engine
+        self.compliance = compliance or ComplianceSettings()
+        self.interval_aware = interval_aware
+        self.pgie_unique_id = pgie_unique_id
+        # Fed every frame and verdict when set, like the probe's
+        self.alert_detector = None
+        self.timeseries = None
+        # Recorded time of the batch being replayed
+        self.now = 0.0
+
+    def clock(self):
+        return self.now
+
+    def evaluate(self, frame, evaluated_ids=None):
+        """Return the FrameVerdict of a frame; evaluated_ids as for evaluate_frame() without a track store."""
+        if self.zone_engine is not None:
+            self.zone_engine.apply(frame)
+        compliance = self.compliance
+        inferred = is_inferred(frame, self.pgie_unique_id) if self.interval_aware else None
+        if self.ppe_engine is not None:
+            return self.ppe_engine.evaluate(frame, self.track_store, inferred, compliance.head_fraction)
+        return evaluate_frame(frame, evaluated_ids, compliance.zone_name, self.track_store, inferred,
+                              compliance.head_fraction)
+
+    def run(self, recording, log=None):
+        """Replay every batch of recording; return the replay counters."""
+        stats = {"batches": 0, "frames": 0, "objects": 0, "persons": 0, "alerts": 0, "events": 0}
+        first = last = None
+        start = time.perf_counter()
+        for timestamp, batch in recording.batches():
+            self.now = timestamp
+            first = timestamp if first is None else first
+            last = timestamp
+            evaluated_ids = None if self.track_store is not None else set()
+            for frame in batch:
+                verdict = self.evaluate(frame, evaluated_ids)
+                if log is not None:
+                    log.add(frame, verdict)
+                if self.alert_detector is not None:
+                    stats["events"] += len(self.alert_detector.detect(frame, verdict, self.ppe_engine))
+                if self.timeseries is not None:
+                    self.timeseries.observe(frame, verdict)
+                stats["frames"] += 1
+                stats["objects"] += len(frame)
+                stats["persons"] += verdict.person_count
+                stats["alerts"] += verdict.alert_count
+            stats["batches"] += 1
+        stats["seconds"] = time.perf_counter() - start
+        stats["recorded_seconds"] = (last - first) if first is not None else 0.0
+        stats["speedup"] = stats["recorded_seconds"] / stats["seconds"] if stats["seconds"] else 0.0
+        return stats
@@ -0,0 +1,239 @@
+################################################################################
+# Splitting one camera list over several worker pipelines.
+#
+# plan_shards() cuts the uri list into contiguous blocks, one per worker, so a
+# worker's local stream i is global stream offset + i. Each worker gets the
+# nvdsanalytics sections of its streams renumbered to local ids
+# (remap_analytics_config), the PPE rules with their streams= lists
+# renumbered the same way (remap_ppe_rules), and writes its metrics to a JSON file
+# (worker_metrics / write_json), which merge_metrics() turns back into one
+# view keyed by global stream ids. Nothing here needs GStreamer or a GPU; the
+# processes themselves are run by supervisor.py.
+################################################################################
+
+import json
+import os
+import re
+import time
+
+from ppe_rules import RULE_SECTION
+from zones import DIRECTION_SECTION, LINE_SECTION, OVERCROWDING_SECTION, ROI_SECTION
+
+STREAM_SECTIONS = (ROI_SECTION, OVERCROWDING_SECTION, LINE_SECTION, DIRECTION_SECTION)
+_STREAM_KEY = re.compile(r"^stream(\d+)$")
+_STREAMS_OPTION = re.compile(r"^(\s*streams\s*[=:]\s*)(.*?)\s*$")
+# streams= of a rule none of whose streams a worker runs; matches no stream id
+NO_LOCAL_STREAM = -1
+
+
+class WorkerSpec:
+    """The streams, CPU cores and GPU of one worker."""
+
+    __slots__ = ("index", "uris", "stream_ids", "cpus", "gpu_id")
+
+    def __init__(self, index, uris, stream_ids, cpus=None, gpu_id=0):
+        self.index = index
+        self.uris = list(uris)
+        self.stream_ids = list(stream_ids)
+        self.cpus = set(cpus) if cpus else None
+        self.gpu_id = gpu_id
+
+    def to_dict(self):
+        return {"index": self.index, "uris": self.uris, "stream_ids": self.stream_ids,
+                "cpus": sorted(self.cpus) if self.cpus else None, "gpu_id": self.gpu_id}
+
+
+def parse_cpu_sets(value):
+    """Parse '0-3,4-7' style per-worker core lists separated by ':' into sets.
+
+    '0-3:4-7' gives worker 0 cores 0..3 and worker 1 cores 4..7.
+    """
+    cpu_sets = []
+    for group in value.split(":"):
+        cpus = set()
+        for part in group.split(","):
+            part = part.strip()
+            if not part:
+                continue
+            first, _, last = part.partition("-")
+            try:
+                cpus.update(range(int(first), int(last or first) + 1))
+            except ValueError:
+                raise ValueError("invalid cpu list %r" % group)
+        if not cpus:
+            raise ValueError("empty cpu list in %r" % value)
+        cpu_sets.append(cpus)
+    return cpu_sets
+
+
+def plan_shards(uris, workers, cpu_sets=None, gpu_ids=None):
+    """Split uris into at most workers contiguous, balanced WorkerSpecs.
+
+    CPU sets and GPU ids are handed out to the workers round robin.
+    """
+    if workers < 1:
+        raise ValueError("need at least one worker, got %d" % workers)
+    workers = min(workers, len(uris))
+    shards = []
+    start = 0
+    for index in range(workers):
+        count = len(uris) // workers + (1 if index < len(uris) % workers else 0)
+        shards.append(WorkerSpec(index, uris[start:start + count], range(start, start + count),
+                                 cpu_sets[index % len(cpu_sets)] if cpu_sets else None,
+                                 gpu_ids[index % len(gpu_ids)] if gpu_ids else 0))
+        start += count
+    return shards
+
+
+def _stream_section(header):
+    """Return (prefix, stream id) of a per-stream section header, or None."""
+    for prefix in STREAM_SECTIONS:
+        if header.startswith(prefix) and header[len(prefix):].isdigit():
+            return prefix, int(header[len(prefix):])
+    return None
+
+
+def remap_analytics_lines(lines, stream_ids):
+    """Keep the per-stream sections of stream_ids, renumbered to their index in it.
+
+    Sections of other streams are dropped; everything else, comments
+    included, is kept as is.
+    """
+    local_ids = {global_id: local_id for local_id, global_id in enumerate(stream_ids)}
+    result = []
+    keep = True
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith("[") and stripped.endswith("]"):
+            stream_section = _stream_section(stripped[1:-1])
+            keep = stream_section is None or stream_section[1] in local_ids
+            if stream_section is not None and keep:
+                line = "[%s%d]" % (stream_section[0], local_ids[stream_section[1]])
+        if keep:
+            result.append(line)
+    return result
+
+
+def remap_analytics_config(path, stream_ids, out_path):
+    """Write the nvdsanalytics config of one worker to out_path."""
+    with open(path) as f:
+        lines = f.read().splitlines()
+    with open(out_path, "w") as f:
+        f.write("\n".join(remap_analytics_lines(lines, stream_ids)) + "\n")
+    return out_path
+
+
+def remap_ppe_rules_lines(lines, stream_ids):
+    """Renumber the streams= lists of the [rule-*] sections to indices in stream_ids.
+
+    Streams of other workers are dropped; a rule left without streams gets
+    streams=NO_LOCAL_STREAM instead of an empty list, which would mean all
+    streams. Rules are kept, so a rule has the same bit in every worker.
+    """
+    local_ids = {global_id: local_id for local_id, global_id in enumerate(stream_ids)}
+    result = []
+    in_rule = False
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith("[") and stripped.endswith("]"):
+            in_rule = stripped[1:-1].startswith(RULE_SECTION)
+        match = _STREAMS_OPTION.match(line) if in_rule else None
+        if match and match.group(2):
+            try:
+                streams = [int(stream) for stream in match.group(2).split(";") if stream.strip()]
+            except ValueError:
+                # Left for load_ppe_rules() to report in the worker
+                result.append(line)
+                continue
+            local = [str(local_ids[stream]) for stream in streams if stream in local_ids]
+            line = match.group(1) + (";".join(local) if local else str(NO_LOCAL_STREAM))
+        result.append(line)
+    return result
+
+
+def remap_ppe_rules(path, stream_ids, out_path):
+    """Write the PPE rules of one worker to out_path."""
+    with open(path) as f:
+        lines = f.read().splitlines()
+    with open(out_path, "w") as f:
+        f.write("\n".join(remap_ppe_rules_lines(lines, stream_ids)) + "\n")
+    return out_path
+
+
+def remap_stream_keys(values, stream_ids):
+    """Rename the 'stream<local id>' keys of a dict to global ids."""
+    remapped = {}
+    for key, value in values.items():
+        match = _STREAM_KEY.match(str(key))
+        if match and int(match.group(1)) < len(stream_ids):
+            key = "stream{0}".format(stream_ids[int(match.group(1))])
+        remapped[key] = value
+    return remapped
+
+
+def worker_metrics(perf_data, analytics_probe=None, tracer=None):
+    """Metrics of this process for the supervisor, keyed by local stream ids.
+
+    Latency is the end-to-end latency of the tracer if one runs, else the
+    per-frame probe time of the profiler, else left empty.
+    """
+    metrics = {"time": time.time(), "pid": os.getpid(), "fps": dict(perf_data.perf_dict), "alerts": {},
+               "latency": {}}
+    if analytics_probe is not None and analytics_probe.alert_sink is not None:
+        metrics["alerts"] = analytics_probe.alert_sink.stats()
+    if tracer is not None:
+        # Imported here, tracing needs GStreamer
+        from tracing import END_TO_END
+        metrics["latency"] = tracer.snapshot(stream_offset=0)["stages"].get(END_TO_END, {})
+    elif analytics_probe is not None and analytics_probe.profiler is not None:
+        metrics["latency"] = {stream: sections["frame"]
+                              for stream, sections in analytics_probe.profiler.snapshot().items()
+                              if "frame" in sections}
+    return metrics
+
+
+def write_json(path, data):
+    """Write data as JSON to path, atomically."""
+    temporary = path + ".tmp"
+    with open(temporary, "w") as f:
+        json.dump(data, f)
+    os.replace(temporary, path)
+
+
+def read_json(path):
+    """Return the JSON in path, or None if it is missing or being written."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def merge_metrics(workers, snapshots, states=None):
+    """Merge worker metrics into one view keyed by global stream ids.
+
+    snapshots maps a worker index to its worker_metrics() dict (or None if it
+    has not reported yet); states optionally maps it to a status dict that is
+    reported as is. Alert counters are summed over the workers.
+    """
+    merged = {"time": time.time(), "fps": {}, "latency": {}, "alerts": {}, "workers": {}}
+    for worker in workers:
+        snapshot = snapshots.get(worker.index)
+        status = dict(states.get(worker.index, {})) if states else {}
+        status["stream_ids"] = worker.stream_ids
+        if snapshot is not None:
+            merged["fps"].update(remap_stream_keys(snapshot.get("fps", {}), worker.stream_ids))
+            merged["latency"].update(remap_stream_keys(snapshot.get("latency", {}), worker.stream_ids))
+            for name, value in snapshot.get("alerts", {}).items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    merged["alerts"][name] = merged["alerts"].get(name, 0) + value
+            status["reported"] = snapshot.get("time")
+        merged["workers"][worker.index] = status
+    merged["fps"] = dict(sorted(merged["fps"].items(), key=_stream_order))
+    merged["latency"] = dict(sorted(merged["latency"].items(), key=_stream_order))
+    return merged
+
+
+def _stream_order(item):
+    match = _STREAM_KEY.match(str(item[0]))
+    return (0, int(match.group(1))) if match else (1, str(item[0]))
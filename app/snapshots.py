@@ -0,0 +1,260 @@
+################################################################################
+# Evidence snapshots: a cropped still of every restricted-area person found
+# without a helmet.
+#
+# SnapshotCapture splits the work so the streaming thread only copies pixels:
+#   due()      picks the tracked violators of a frame whose track has not been
+#              captured within the cooldown; no surface is mapped otherwise
+#   capture()  copies the crops of at most max_per_batch violators per batch
+#              out of the frame image (the RGBA surface pyds maps, or any
+#              HxWxC NumPy array) into a fixed pool of shared memory slots
+# A process pool then encodes each slot (JPEG / PNG through OpenCV, or raw
+# .npy) and writes it under <directory>/stream<id>/, after which the slot is
+# reused. A capture that finds no free slot is dropped and counted, so a slow
+# disk never stalls the pipeline; violators over the batch budget stay due
+# and are captured on a later batch.
+# utils/check_snapshots.py runs the crop / encode / write path on synthetic
+# frames.
+################################################################################
+
+import collections
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from compliance import VERDICT_VIOLATION
+from track_state import UNTRACKED_OBJECT_ID
+
+SNAPSHOT_FORMATS = ("jpg", "png", "npy")
+DEFAULT_COOLDOWN = 30.0
+DEFAULT_MAX_PER_BATCH = 2
+DEFAULT_SLOTS = 8
+DEFAULT_PROCESSES = 2
+# Context added around the person box, as a fraction of its size
+DEFAULT_MARGIN = 0.15
+# Crops larger than this are subsampled while copying out
+MAX_CROP_WIDTH = 640
+MAX_CROP_HEIGHT = 960
+CHANNELS = 4
+JPEG_QUALITY = 90
+
+# Shared memory blocks attached by this (pool) process, by name
+_attached = {}
+
+
+def crop_rect(box, margin, width, height):
+    """Return the (x1, y1, x2, y2) pixel rectangle of a left/top/width/height box plus margin."""
+    left, top, box_width, box_height = box
+    pad_x = box_width * margin
+    pad_y = box_height * margin
+    x1 = min(max(int(left - pad_x), 0), width)
+    y1 = min(max(int(top - pad_y), 0), height)
+    x2 = min(max(int(left + box_width + pad_x + 0.5), x1), width)
+    y2 = min(max(int(top + box_height + pad_y + 0.5), y1), height)
+    return x1, y1, x2, y2
+
+
+def snapshot_path(directory, stream_id, frame_num, object_id, timestamp, image_format):
+    return os.path.join(directory, "stream%d" % stream_id, "%d_%d_%d.%s" % (
+        int(timestamp * 1000), frame_num, object_id, image_format))
+
+
+def _started():
+    return os.getpid()
+
+
+def write_snapshot(block, shape, path, image_format, quality=JPEG_QUALITY):
+    """Encode the RGBA pixels at the start of a shared memory block and write them to path.
+
+    Runs in the pool processes; returns path.
+    """
+    memory = _attached.get(block)
+    if memory is None:
+        memory = _attached[block] = shared_memory.SharedMemory(name=block)
+    pixels = np.ndarray(shape, dtype=np.uint8, buffer=memory.buf)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = path + ".tmp"
+    if image_format == "npy":
+        with open(temporary, "wb") as f:
+            np.save(f, pixels)
+    else:
+        import cv2
+        image = cv2.cvtColor(pixels, cv2.COLOR_RGBA2BGR)
+        parameters = [cv2.IMWRITE_JPEG_QUALITY, quality] if image_format == "jpg" else []
+        ok, encoded = cv2.imencode("." + image_format, image, parameters)
+        if not ok:
+            raise ValueError("unable to encode %s" % path)
+        with open(temporary, "wb") as f:
+            f.write(encoded.tobytes())
+    os.replace(temporary, path)
+    return path
+
+
+class SlotPool:
+    """A fixed set of shared memory blocks holding crops until they are written."""
+
+    def __init__(self, count, slot_bytes):
+        self.slot_bytes = slot_bytes
+        self.blocks = [shared_memory.SharedMemory(create=True, size=slot_bytes) for _ in range(count)]
+        self._free = collections.deque(range(count))
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Return a free slot index, or None when all are in flight."""
+        with self._lock:
+            return self._free.popleft() if self._free else None
+
+    def release(self, slot):
+        with self._lock:
+            self._free.append(slot)
+
+    def view(self, slot, shape):
+        return np.ndarray(shape, dtype=np.uint8, buffer=self.blocks[slot].buf)
+
+    @property
+    def in_use(self):
+        return len(self.blocks) - len(self._free)
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+
+
+class SnapshotCapture:
+    """Rate-limited evidence crops of violators, written by a process pool.
+
+    due(), begin_batch() and capture() run on the streaming thread, the
+    write callbacks on an executor thread; counters is shared by both and
+    only touched under _counters_lock.
+    """
+
+    def __init__(self, directory, cooldown=DEFAULT_COOLDOWN, max_per_batch=DEFAULT_MAX_PER_BATCH,
+                 slots=DEFAULT_SLOTS, processes=DEFAULT_PROCESSES, image_format="jpg",
+                 margin=DEFAULT_MARGIN, max_crop=(MAX_CROP_WIDTH, MAX_CROP_HEIGHT), clock=time.time,
+                 stream_offset=0):
+        if image_format not in SNAPSHOT_FORMATS:
+            raise ValueError("snapshot format must be one of %s, not %r" % (", ".join(SNAPSHOT_FORMATS),
+                                                                             image_format))
+        self.directory = directory
+        self.cooldown = cooldown
+        self.max_per_batch = max_per_batch
+        self.image_format = image_format
+        self.margin = margin
+        self.max_crop = max_crop
+        self.clock = clock
+        # Added to the stream ids of the snapshot paths, see main.py --stream-offset
+        self.stream_offset = stream_offset
+        self.pool = SlotPool(slots, max_crop[0] * max_crop[1] * CHANNELS)
+        # Spawned, not forked: the pipeline process holds CUDA and GStreamer threads
+        self.executor = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"))
+        # Start the pool now instead of on the streaming thread at the first capture
+        for future in [self.executor.submit(_started) for _ in range(processes)]:
+            future.result()
+        self.counters = collections.Counter()
+        self._counters_lock = threading.Lock()
+        self._captured = {}
+        self._last_sweep = 0.0
+        self._budget = max_per_batch
+
+    def begin_batch(self):
+        self._budget = self.max_per_batch
+
+    def due(self, frame, verdict):
+        """Return the indices of the frame's tracked violators outside their cooldown."""
+        if not self._budget:
+            return []
+        violators = np.flatnonzero(verdict.verdicts == VERDICT_VIOLATION)
+        if not len(violators):
+            return []
+        now = self.clock()
+        if now - self._last_sweep > self.cooldown:
+            self._sweep(now)
+        stream_id = frame.stream_id
+        captured = self._captured
+        due = []
+        for index, object_id in zip(violators.tolist(), frame.object_ids[violators].tolist()):
+            if object_id == UNTRACKED_OBJECT_ID:
+                continue
+            last = captured.get((stream_id, object_id))
+            if last is None or now - last >= self.cooldown:
+                due.append(index)
+        return due
+
+    def capture(self, frame, due, image):
+        """Copy the crops of the due violators out of image (H x W x 4) and queue their writes."""
+        height, width = image.shape[:2]
+        now = self.clock()
+        for index in due:
+            if not self._budget:
+                # Still due on the next batch
+                self._count("deferred")
+                continue
+            slot = self.pool.acquire()
+            if slot is None:
+                self._count("dropped")
+                continue
+            x1, y1, x2, y2 = crop_rect(frame.boxes[index].tolist(), self.margin, width, height)
+            # Subsample crops larger than a slot rather than resizing on this thread
+            step = max(-(-(x2 - x1) // self.max_crop[0]), -(-(y2 - y1) // self.max_crop[1]), 1)
+            crop = image[y1:y2:step, x1:x2:step, :CHANNELS]
+            if not crop.size:
+                self.pool.release(slot)
+                continue
+            np.copyto(self.pool.view(slot, crop.shape), crop)
+            object_id = int(frame.object_ids[index])
+            path = snapshot_path(self.directory, frame.stream_id + self.stream_offset, frame.frame_num, object_id,
+                                 now, self.image_format)
+            try:
+                future = self.executor.submit(write_snapshot, self.pool.blocks[slot].name, crop.shape, path,
+                                              self.image_format)
+            except RuntimeError:
+                # The pool is shutting down
+                self.pool.release(slot)
+                self._count("dropped")
+                continue
+            future.add_done_callback(lambda future, slot=slot: self._written(future, slot))
+            self._captured[(frame.stream_id, object_id)] = now
+            self._budget -= 1
+            self._count("captured")
+
+    def _written(self, future, slot):
+        self.pool.release(slot)
+        error = future.exception()
+        if error is None:
+            self._count("written")
+        else:
+            self._count("failed")
+            sys.stderr.write("Snapshot failed: %s\n" % error)
+
+    def _count(self, key):
+        with self._counters_lock:
+            self.counters[key] += 1
+
+    def _sweep(self, now):
+        self._last_sweep = now
+        stale = [key for key, last in self._captured.items() if now - last >= self.cooldown]
+        for key in stale:
+            del self._captured[key]
+
+    def close(self):
+        """Wait for the queued writes and free the pool."""
+        self.executor.shutdown(wait=True)
+        self.pool.close()
+
+    def stats(self):
+        with self._counters_lock:
+            stats = {key: self.counters[key] for key in ("captured", "written", "failed", "dropped", "deferred")}
+        stats["pending"] = self.pool.in_use
+        return stats
+
+    def print_stats_callback(self):
+        """GLib timeout callback printing the snapshot counters."""
+        print("\n**SNAPSHOTS: ", self.stats(), "\n")
+        return True
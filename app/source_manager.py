@@ -0,0 +1,305 @@
+################################################################################
+# Runtime management of the camera sources.
+#
+# SourceManager attaches and detaches source bins on live nvstreammux request
+# pads, creates the PERF_DATA stream slot of every attached source and
+# reconnects live (RTSP) sources that fail to link, error out or reach end of
+# stream, with exponential backoff, without touching the rest of the pipeline.
+#
+# ControlServer exposes it on a local TCP port with a line based protocol:
+#   add <uri>      attach a new source, replies with its stream id
+#   remove <id>    detach a source
+#   list           list the attached sources
+# Every reply is one line of JSON.
+#
+# Source bins are created through an injectable make_source_bin(index, uri);
+# stand_in_source_bin() builds videotestsrc / decoded filesrc bins so the
+# manager can be driven without cameras or hardware decoders, see
+# utils/check_source_manager.py.
+################################################################################
+
+import json
+import socketserver
+import sys
+import threading
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GLib, Gst
+
+from common.FPS import GETFPS
+
+RECONNECT_MIN_SECONDS = 1
+RECONNECT_MAX_SECONDS = 60
+SOURCE_BIN_PREFIX = "source-bin-"
+CONTROL_TIMEOUT_SECONDS = 10
+
+
+def is_live_uri(uri):
+    return uri.startswith("rtsp://")
+
+
+def _link_decoded_video(decodebin, pad, convert):
+    caps = pad.get_current_caps() or pad.query_caps(None)
+    if caps.get_size() and caps.get_structure(0).get_name().startswith("video/"):
+        sinkpad = convert.get_static_pad("sink")
+        if not sinkpad.is_linked() and pad.link(sinkpad) != Gst.PadLinkReturn.OK:
+            # Posted as an error of the bin, so SourceManager.bus_call() handles it like any source failure
+            error = GLib.Error.new_literal(Gst.stream_error_quark(), "unable to link the decoded video",
+                                           Gst.StreamError.FAILED)
+            decodebin.post_message(Gst.Message.new_error(decodebin, error, pad.get_name()))
+
+
+def stand_in_source_bin(index, uri):
+    """Source bin of stock elements: videotestsrc for test://, a decoded file otherwise.
+
+    Files go through filesrc ! decodebin ! videoconvert so the bin outputs
+    raw video like create_source_bin(). The bin is named like
+    create_source_bin() names its bins so the manager treats both the same.
+    """
+    nbin = Gst.Bin.new("%s%02d" % (SOURCE_BIN_PREFIX, index))
+    if uri.startswith("test://"):
+        src = Gst.ElementFactory.make("videotestsrc", "test-src")
+        src.set_property("is-live", True)
+        nbin.add(src)
+        nbin.add_pad(Gst.GhostPad.new("src", src.get_static_pad("src")))
+        return nbin
+    src = Gst.ElementFactory.make("filesrc", "file-src")
+    src.set_property("location", uri[len("file://"):] if uri.startswith("file://") else uri)
+    decodebin = Gst.ElementFactory.make("decodebin", "file-decodebin")
+    convert = Gst.ElementFactory.make("videoconvert", "file-convert")
+    for element in (src, decodebin, convert):
+        nbin.add(element)
+    src.link(decodebin)
+    # decodebin exposes its video pad once the file is typefound
+    decodebin.connect("pad-added", _link_decoded_video, convert)
+    nbin.add_pad(Gst.GhostPad.new("src", convert.get_static_pad("src")))
+    return nbin
+
+
+class SourceEntry:
+    __slots__ = ("uri", "bin", "backoff", "reconnect_id")
+
+    def __init__(self, uri):
+        self.uri = uri
+        self.bin = None
+        self.backoff = RECONNECT_MIN_SECONDS
+        self.reconnect_id = 0
+
+
+class SourceManager:
+    """Attaches, detaches and reconnects source bins on a running nvstreammux.
+
+    All methods except call_on_main_loop() must run on the GLib main loop thread.
+    """
+
+    def __init__(self, pipeline, streammux, perf_data, max_sources, make_source_bin,
+                 reconnect_min=RECONNECT_MIN_SECONDS, reconnect_max=RECONNECT_MAX_SECONDS):
+        self.pipeline = pipeline
+        self.streammux = streammux
+        self.perf_data = perf_data
+        self.max_sources = max_sources
+        self.make_source_bin = make_source_bin
+        self.reconnect_min = reconnect_min
+        self.reconnect_max = reconnect_max
+        self.sources = {}
+        self.reconnects = 0
+
+    def free_slot(self):
+        for source_id in range(self.max_sources):
+            if source_id not in self.sources:
+                return source_id
+        return None
+
+    def add_source(self, uri, source_id=None):
+        """Attach a source and return its stream id, or None if it cannot be attached.
+
+        A live source that fails to attach keeps its slot and is retried like
+        one that errors out later.
+        """
+        if source_id is None:
+            source_id = self.free_slot()
+            if source_id is None:
+                sys.stderr.write("Unable to add %s: all %d source slots are in use\n" % (uri, self.max_sources))
+                return None
+        entry = SourceEntry(uri)
+        self.sources[source_id] = entry
+        if is_live_uri(uri) and self.streammux.find_property("live-source") is not None:
+            self.streammux.set_property("live-source", 1)
+        self.perf_data.all_stream_fps["stream{0}".format(source_id)] = GETFPS(source_id)
+        if not self._attach(source_id, entry):
+            if is_live_uri(uri):
+                self.schedule_reconnect(source_id)
+                return source_id
+            self.remove_source(source_id)
+            return None
+        return source_id
+
+    def remove_source(self, source_id):
+        """Detach a source and free its stream slot for the next add_source()."""
+        entry = self.sources.pop(source_id, None)
+        if entry is None:
+            return False
+        if entry.reconnect_id:
+            GLib.source_remove(entry.reconnect_id)
+        self._detach(source_id, entry)
+        # The PERF_DATA slot stays: batches of this source still queued
+        # downstream of the muxer update its FPS when they reach the probe.
+        # add_source() replaces it when the id is reused.
+        print("Removed source %d: %s\n" % (source_id, entry.uri))
+        return True
+
+    def list_sources(self):
+        return {source_id: entry.uri for source_id, entry in sorted(self.sources.items())}
+
+    def _attach(self, source_id, entry):
+        print("Attaching source %d: %s\n" % (source_id, entry.uri))
+        source_bin = self.make_source_bin(source_id, entry.uri)
+        if not source_bin:
+            sys.stderr.write("Unable to create source bin \n")
+            return False
+        self.pipeline.add(source_bin)
+        sinkpad = self.streammux.request_pad_simple("sink_%u" % source_id)
+        if not sinkpad:
+            sys.stderr.write("Unable to create sink pad bin \n")
+            self.pipeline.remove(source_bin)
+            return False
+        srcpad = source_bin.get_static_pad("src")
+        if srcpad.link(sinkpad) != Gst.PadLinkReturn.OK:
+            sys.stderr.write("Unable to link source %d to the muxer \n" % source_id)
+            self.streammux.release_request_pad(sinkpad)
+            self.pipeline.remove(source_bin)
+            return False
+        # The first buffer after a (re)connect resets the backoff
+        srcpad.add_probe(Gst.PadProbeType.BUFFER, self._first_buffer_probe, source_id)
+        entry.bin = source_bin
+        if self.pipeline.get_state(0)[1] in (Gst.State.PAUSED, Gst.State.PLAYING):
+            source_bin.sync_state_with_parent()
+        return True
+
+    def _detach(self, source_id, entry):
+        source_bin = entry.bin
+        entry.bin = None
+        if source_bin is None:
+            return
+        state_return = source_bin.set_state(Gst.State.NULL)
+        if state_return == Gst.StateChangeReturn.ASYNC:
+            source_bin.get_state(Gst.CLOCK_TIME_NONE)
+        sinkpad = self.streammux.get_static_pad("sink_%u" % source_id)
+        if sinkpad is not None:
+            sinkpad.send_event(Gst.Event.new_flush_stop(False))
+            self.streammux.release_request_pad(sinkpad)
+        self.pipeline.remove(source_bin)
+
+    def _first_buffer_probe(self, pad, info, source_id):
+        entry = self.sources.get(source_id)
+        if entry is not None:
+            entry.backoff = self.reconnect_min
+        return Gst.PadProbeReturn.REMOVE
+
+    def schedule_reconnect(self, source_id):
+        """Detach a failed source and re-attach it after the current backoff."""
+        entry = self.sources.get(source_id)
+        if entry is None or entry.reconnect_id:
+            return
+        self._detach(source_id, entry)
+        print("Reconnecting source %d in %d s: %s\n" % (source_id, entry.backoff, entry.uri))
+        entry.reconnect_id = GLib.timeout_add_seconds(entry.backoff, self._reconnect, source_id)
+        entry.backoff = min(entry.backoff * 2, self.reconnect_max)
+
+    def _reconnect(self, source_id):
+        entry = self.sources.get(source_id)
+        if entry is None:
+            return False
+        entry.reconnect_id = 0
+        self.reconnects += 1
+        if not self._attach(source_id, entry):
+            self.schedule_reconnect(source_id)
+        return False
+
+    def source_of(self, element):
+        """Return the stream id of the source bin element belongs to, or None."""
+        while element is not None:
+            name = element.get_name()
+            if name.startswith(SOURCE_BIN_PREFIX):
+                for source_id, entry in self.sources.items():
+                    if entry.bin is element:
+                        return source_id
+                return None
+            element = element.get_parent()
+        return None
+
+    def bus_call(self, bus, message, loop, fallback):
+        """Bus handler: recovers live source failures, passes the rest to fallback."""
+        if message.type == Gst.MessageType.ERROR:
+            source_id = self.source_of(message.src)
+            if source_id is not None and is_live_uri(self.sources[source_id].uri):
+                err, debug = message.parse_error()
+                sys.stderr.write("Source %d error: %s\n" % (source_id, err))
+                self.schedule_reconnect(source_id)
+                return True
+        elif message.type == Gst.MessageType.ELEMENT:
+            structure = message.get_structure()
+            if structure is not None and structure.has_name("stream-eos"):
+                # nvstreammux reports the end of a single stream this way
+                parsed, source_id = structure.get_uint("stream-id")
+                entry = self.sources.get(source_id) if parsed else None
+                if entry is not None and is_live_uri(entry.uri):
+                    self.schedule_reconnect(source_id)
+                return True
+        return fallback(bus, message, loop)
+
+    def call_on_main_loop(self, fn, *args):
+        """Run fn on the main loop from another thread and return its result."""
+        done = threading.Event()
+        result = []
+
+        def run():
+            try:
+                result.append(fn(*args))
+            finally:
+                done.set()
+            return False
+
+        GLib.idle_add(run)
+        if not done.wait(CONTROL_TIMEOUT_SECONDS):
+            raise TimeoutError("main loop did not respond")
+        return result[0] if result else None
+
+
+class _ControlHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        manager = self.server.manager
+        for raw in self.rfile:
+            command, _, argument = raw.decode("utf-8", "replace").strip().partition(" ")
+            argument = argument.strip()
+            try:
+                if command == "add" and argument:
+                    source_id = manager.call_on_main_loop(manager.add_source, argument)
+                    reply = {"ok": source_id is not None, "id": source_id}
+                elif command == "remove" and argument.isdigit():
+                    reply = {"ok": manager.call_on_main_loop(manager.remove_source, int(argument))}
+                elif command == "list":
+                    reply = {"ok": True, "sources": manager.call_on_main_loop(manager.list_sources)}
+                else:
+                    reply = {"ok": False, "error": "usage: add <uri> | remove <id> | list"}
+            except Exception as e:
+                reply = {"ok": False, "error": str(e)}
+            self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+
+
+class ControlServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """Local control endpoint for a SourceManager, served from a daemon thread."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, manager, port, host="127.0.0.1"):
+        super().__init__((host, port), _ControlHandler)
+        self.manager = manager
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name="source-control", daemon=True)
+        thread.start()
+        print("Source control listening on %s:%d\n" % self.server_address)
+        return thread
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+
+################################################################################
+# Runs the camera list as several main.py worker processes.
+#
+# The uris are split into contiguous shards (sharding.plan_shards); every
+# worker runs its own pipeline and Python interpreter, so the probe of one
+# worker does not share a GIL with the others and a crash only takes down its
+# own cameras. Workers can be pinned to CPU cores and put on different GPUs.
+# Each worker gets an nvdsanalytics config holding only its streams'
+# sections, renumbered to its local stream ids, PPE rules whose streams= lists
+# are renumbered the same way, and --stream-offset so its alerts, snapshots,
+# time series, recordings and metrics name cameras by their global stream
+# id, and writes its metrics to a file in its run directory. The supervisor restarts workers that exit with
+# an error, with exponential backoff, and merges their FPS, alert and latency
+# metrics into one view keyed by global stream ids, printed, written to
+# --metrics-file and/or served as JSON on --metrics-port.
+#
+# Options after '--' are passed to every worker. File options that would
+# collide between workers get the worker index added to their name and port
+# options get it added to their number.
+#
+# usage: python3 supervisor.py [--workers N] [--cpus 0-3:4-7] [--gpus 0,1]
+#                              uri1 [uri2] ... [-- main.py options]
+################################################################################
+
+import argparse
+import http.server
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from sharding import (merge_metrics, parse_cpu_sets, plan_shards, read_json, remap_analytics_config,
+                      remap_ppe_rules, write_json)
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+MAIN = os.path.join(APP_DIR, "main.py")
+DEFAULT_ANALYTICS_CONFIG = os.path.join(APP_DIR, "config_nvdsanalytics.txt")
+RESTART_MIN_SECONDS = 1
+RESTART_MAX_SECONDS = 60
+# A worker that ran this long without exiting starts over at the minimum backoff
+STABLE_SECONDS = 60
+STOP_TIMEOUT_SECONDS = 10
+POLL_SECONDS = 0.5
+# main.py options naming per-process files or ports
+PER_WORKER_FILES = ("--alert-log", "--alert-spill", "--trace-file", "--output-file", "--timeseries-file",
+                    "--snapshot-dir", "--engine-build-log", "--record-file", "--interval-log",
+                    "--metrics-shm")
+PER_WORKER_PORTS = ("--trace-port", "--control-port")
+# main.py options naming configs with global stream ids: nvdsanalytics
+# configs, split like --analytics-config, and PPE rules
+PER_WORKER_CONFIGS = ("--zone-geometry", "--ppe-rules")
+
+
+def worker_options(options, index, remap_config=None):
+    """Return the passed-through main.py options with per-worker files and ports.
+
+    remap_config(option, path) returns the worker's copy of a config given
+    to one of PER_WORKER_CONFIGS.
+    """
+    result = []
+    pending = None
+    for option in options:
+        if pending is not None:
+            result.append(_per_worker(pending, option, index, remap_config))
+            pending = None
+            continue
+        name, has_value, value = option.partition("=")
+        if name in PER_WORKER_FILES + PER_WORKER_PORTS + PER_WORKER_CONFIGS:
+            if has_value:
+                result.append("%s=%s" % (name, _per_worker(name, value, index, remap_config)))
+            else:
+                result.append(option)
+                pending = name
+            continue
+        result.append(option)
+    return result
+
+
+def _per_worker(name, value, index, remap_config):
+    if name in PER_WORKER_CONFIGS:
+        return remap_config(name, value) if remap_config is not None else value
+    if name in PER_WORKER_PORTS:
+        port = int(value)
+        return str(port + index) if port else value
+    root, extension = os.path.splitext(value)
+    return "%s.worker%d%s" % (root, index, extension)
+
+
+class Worker:
+    """One main.py process and its restart state."""
+
+    def __init__(self, spec, run_dir, analytics_config, options, python=sys.executable, main=MAIN):
+        self.spec = spec
+        self.run_dir = os.path.join(run_dir, "worker-%d" % spec.index)
+        self.analytics_config = analytics_config
+        self.options = options
+        self.python = python
+        self.main = main
+        self.metrics_path = os.path.join(self.run_dir, "metrics.json")
+        self.log_path = os.path.join(self.run_dir, "worker.log")
+        self.process = None
+        self.started = 0.0
+        self.restarts = 0
+        self.backoff = RESTART_MIN_SECONDS
+        self.restart_at = None
+        self.last_exit = None
+        self.finished = False
+
+    def remap_config(self, option, path):
+        """Write the worker's copy of the config given to option and return its path."""
+        remap = remap_ppe_rules if option == "--ppe-rules" else remap_analytics_config
+        return remap(os.path.join(APP_DIR, path), self.spec.stream_ids,
+                     os.path.join(self.run_dir, os.path.basename(path)))
+
+    def command(self):
+        os.makedirs(self.run_dir, exist_ok=True)
+        config = self.remap_config("--analytics-config", self.analytics_config)
+        return ([self.python, self.main] + worker_options(self.options, self.spec.index, self.remap_config) +
+                ["--analytics-config", config, "--gpu-id", str(self.spec.gpu_id),
+                 "--stream-offset", str(self.spec.stream_ids[0]), "--metrics-file", self.metrics_path] +
+                self.spec.uris)
+
+    def start(self):
+        cpus = self.spec.cpus
+
+        def pin():
+            # Runs in the child before exec, so every thread of the worker inherits it
+            if cpus:
+                os.sched_setaffinity(0, cpus)
+
+        command = self.command()
+        # Metrics of the previous run are stale
+        if os.path.exists(self.metrics_path):
+            os.remove(self.metrics_path)
+        with open(self.log_path, "ab") as log:
+            self.process = subprocess.Popen(command, cwd=APP_DIR, stdout=log, stderr=subprocess.STDOUT,
+                                            preexec_fn=pin)
+        self.started = time.monotonic()
+        self.restart_at = None
+        print("Worker %d started, pid %d, streams %s" % (self.spec.index, self.process.pid, self.spec.stream_ids))
+
+    def poll(self, now):
+        """Restart the worker if it crashed and its backoff has passed."""
+        if self.finished:
+            return
+        if self.process is not None:
+            code = self.process.poll()
+            if code is None:
+                if now - self.started >= STABLE_SECONDS:
+                    self.backoff = RESTART_MIN_SECONDS
+                return
+            self.process = None
+            self.last_exit = code
+            if code == 0:
+                # All of its sources reached end of stream
+                print("Worker %d finished" % self.spec.index)
+                self.finished = True
+                return
+            self.restart_at = now + self.backoff
+            print("Worker %d exited with %d, restarting in %d s" % (self.spec.index, code, self.backoff))
+            self.backoff = min(self.backoff * 2, RESTART_MAX_SECONDS)
+        elif self.restart_at is not None and now >= self.restart_at:
+            self.restarts += 1
+            self.start()
+
+    def stop(self):
+        self.finished = True
+        if self.process is not None and self.process.poll() is None:
+            # main.py cleans up on SIGINT like on Ctrl-C
+            self.process.send_signal(signal.SIGINT)
+
+    def wait(self, timeout):
+        if self.process is None:
+            return
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+    def state(self):
+        return {"pid": self.process.pid if self.process is not None else None,
+                "running": self.process is not None and self.process.poll() is None,
+                "restarts": self.restarts, "last_exit": self.last_exit, "finished": self.finished}
+
+
+class Supervisor:
+    """Starts, restarts and collects the metrics of a set of Workers."""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._merged = merge_metrics([worker.spec for worker in workers], {})
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def collect(self):
+        snapshots = {worker.spec.index: read_json(worker.metrics_path) for worker in self.workers}
+        states = {worker.spec.index: worker.state() for worker in self.workers}
+        merged = merge_metrics([worker.spec for worker in self.workers], snapshots, states)
+        with self._lock:
+            self._merged = merged
+        return merged
+
+    def snapshot(self):
+        with self._lock:
+            return self._merged
+
+    def run(self, metrics_interval=5.0, metrics_file=None, print_metrics=True):
+        """Poll the workers until all finished or stop() is called."""
+        next_metrics = time.monotonic() + metrics_interval
+        while not self._stopping.is_set():
+            now = time.monotonic()
+            for worker in self.workers:
+                worker.poll(now)
+            if now >= next_metrics:
+                next_metrics = now + metrics_interval
+                merged = self.collect()
+                if metrics_file:
+                    write_json(metrics_file, merged)
+                if print_metrics:
+                    print("\n**CLUSTER: ", json.dumps(merged), "\n")
+            if all(worker.finished for worker in self.workers):
+                break
+            self._stopping.wait(POLL_SECONDS)
+        self.collect()
+
+    def request_stop(self):
+        """Make run() return; safe to call from a signal handler."""
+        self._stopping.set()
+
+    def stop(self):
+        """Stop every worker, killing those that do not exit in time."""
+        self._stopping.set()
+        for worker in self.workers:
+            worker.stop()
+        for worker in self.workers:
+            worker.wait(STOP_TIMEOUT_SECONDS)
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = json.dumps(self.server.supervisor.snapshot()).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(http.server.ThreadingHTTPServer):
+    """Serves the merged metrics as JSON on GET, from a daemon thread."""
+
+    daemon_threads = True
+
+    def __init__(self, supervisor, port, host="127.0.0.1"):
+        super().__init__((host, port), _MetricsHandler)
+        self.supervisor = supervisor
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name="metrics-server", daemon=True)
+        thread.start()
+        print("Cluster metrics on http://%s:%d/\n" % self.server_address)
+        return thread
+
+
+def parse_args(args):
+    if "--" in args:
+        split = args.index("--")
+        args, passed = args[:split], args[split + 1:]
+    else:
+        passed = []
+    parser = argparse.ArgumentParser(prog=args[0], usage="%(prog)s [options] <uri1> [uri2] ... [-- main.py options]")
+    parser.add_argument("uris", nargs="+", metavar="uri", help="source URIs (file://, rtsp://, ...)")
+    parser.add_argument("--workers", type=int, default=2, help="number of worker pipelines (default %(default)s)")
+    parser.add_argument("--cpus", type=parse_cpu_sets,
+                        help="cores per worker, e.g. 0-3:4-7, handed out round robin; default unpinned")
+    parser.add_argument("--gpus", type=lambda value: [int(gpu) for gpu in value.split(",")], default=[0],
+                        help="comma separated GPU ids handed out to the workers round robin (default 0)")
+    parser.add_argument("--analytics-config", default=DEFAULT_ANALYTICS_CONFIG,
+                        help="nvdsanalytics config for the whole camera list, split per worker")
+    parser.add_argument("--run-dir", default="supervisor-run",
+                        help="directory of the worker configs, logs and metrics (default %(default)s)")
+    parser.add_argument("--metrics-interval", type=float, default=5.0,
+                        help="seconds between merged metrics (default %(default)s)")
+    parser.add_argument("--metrics-file", help="write the merged metrics as JSON to this file")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="serve the merged metrics as JSON on this localhost port, 0 to disable")
+    options = parser.parse_args(args[1:])
+    options.worker_options = passed
+    return options
+
+
+def main(args):
+    options = parse_args(args)
+    try:
+        specs = plan_shards(options.uris, options.workers, options.cpus, options.gpus)
+    except ValueError as e:
+        sys.stderr.write(" %s \n" % e)
+        sys.exit(1)
+    run_dir = os.path.abspath(options.run_dir)
+    os.makedirs(run_dir, exist_ok=True)
+    write_json(os.path.join(run_dir, "shards.json"), [spec.to_dict() for spec in specs])
+
+    supervisor = Supervisor([Worker(spec, run_dir, os.path.abspath(options.analytics_config),
+                                    options.worker_options) for spec in specs])
+    if options.metrics_port:
+        MetricsServer(supervisor, options.metrics_port).start()
+
+    def on_signal(signum, frame):
+        supervisor.request_stop()
+
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+
+    supervisor.start()
+    supervisor.run(options.metrics_interval, options.metrics_file)
+    print("Stopping workers\n")
+    supervisor.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,315 @@
+################################################################################
+# Fixed-memory rolling time series of the per-frame analytics.
+#
+# TimeSeriesStore is fed every frame by the probe and keeps, per stream:
+#   occupancy    objInROIcnt of every ROI
+#   overcrowded  ocStatus of every overcrowding ROI, as 0 / 1
+#   crossings    the increase of objLCCumCnt of every line
+#   persons      persons in the frame
+#   violations   persons breaking the compliance check in the frame
+# Each of these is a channel. A channel keeps sum, count and max per time
+# bucket at several resolutions (by default 1 s for 15 minutes, 1 min for a
+# day and 1 h for a month), each a preallocated ring of buckets, so memory
+# does not depend on uptime. The frame path only adds to per-channel Python
+# accumulators; they are flushed into every resolution at once, so coarser
+# rings always hold the downsampled finer data. The first frame of a new
+# second flushes the previous one, flush_callback() flushes a second no
+# frame has closed (stalled or stopped streams) and dump() flushes before it
+# writes, so the last second is never lost. A second flushed early and then
+# added to again lands in the same buckets.
+#
+# Every ring is allocated for max_channels channels up front; channel_count()
+# sizes it from the streams and the nvdsanalytics config. Samples of channels
+# past the limit are counted as dropped and shown by print_stats_callback().
+#
+# query() and summary() read the rings in-process; dump() writes them to a
+# compressed .npz and load() restores them, so history survives restarts.
+# utils/timeseries_report.py prints a report from a dump.
+################################################################################
+
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+SERIES_OCCUPANCY = "occupancy"
+SERIES_OVERCROWDED = "overcrowded"
+SERIES_CROSSINGS = "crossings"
+SERIES_PERSONS = "persons"
+SERIES_VIOLATIONS = "violations"
+
+# (bucket seconds, buckets kept) per resolution
+DEFAULT_RESOLUTIONS = ((1, 900), (60, 1440), (3600, 744))
+MAX_CHANNELS = 128
+DUMP_FORMAT = 1
+# persons and violations
+STREAM_CHANNELS = 2
+
+
+def channel_count(stream_count, geometry=None):
+    """Return the channels stream_count streams can use under a zones.load_zone_geometry() config."""
+    count = STREAM_CHANNELS * stream_count
+    for stream_id, stream in (geometry or {}).items():
+        if stream_id < stream_count:
+            # Occupancy may be reported for overcrowding ROIs as well
+            occupancy = set(stream.rois.names) | set(stream.overcrowding.names)
+            count += len(occupancy) + len(stream.overcrowding.names) + len(stream.lines.names)
+    return count
+
+
+class _Ring:
+    """sum / count / max of every channel over the last size buckets."""
+
+    __slots__ = ("seconds", "size", "buckets", "sums", "counts", "maxima")
+
+    def __init__(self, seconds, size, channels):
+        self.seconds = seconds
+        self.size = size
+        # Bucket number (time // seconds) each slot holds, -1 when empty
+        self.buckets = np.full(size, -1, dtype=np.int64)
+        self.sums = np.zeros((channels, size), dtype=np.float64)
+        self.counts = np.zeros((channels, size), dtype=np.uint32)
+        self.maxima = np.zeros((channels, size), dtype=np.float32)
+
+    def add(self, second, used, sums, counts, maxima):
+        bucket = second // self.seconds
+        slot = bucket % self.size
+        if self.buckets[slot] != bucket:
+            self.buckets[slot] = bucket
+            self.sums[:, slot] = 0.0
+            self.counts[:, slot] = 0
+            self.maxima[:, slot] = 0.0
+        self.sums[:used, slot] += sums
+        self.counts[:used, slot] += counts
+        np.maximum(self.maxima[:used, slot], maxima, out=self.maxima[:used, slot])
+
+    def window(self, start, end):
+        """Return the slots holding buckets that start in [start, end), in time order."""
+        valid = self.buckets >= 0
+        starts = self.buckets * self.seconds
+        if start is not None:
+            valid &= starts >= start
+        if end is not None:
+            valid &= starts < end
+        slots = np.flatnonzero(valid)
+        return slots[np.argsort(self.buckets[slots], kind="stable")]
+
+
+class TimeSeriesStore:
+    """Per-stream analytics counters at several resolutions, in constant memory.
+
+    observe() runs on the streaming thread; add(), flush(), query(), summary()
+    and dump() may run on any thread.
+    """
+
+    def __init__(self, resolutions=DEFAULT_RESOLUTIONS, max_channels=MAX_CHANNELS, clock=time.time,
+                 stream_offset=0):
+        self.resolutions = tuple((int(seconds), int(size)) for seconds, size in resolutions)
+        self.max_channels = max_channels
+        self.clock = clock
+        # Added to the stream ids observe() records, see main.py --stream-offset
+        self.stream_offset = stream_offset
+        self.rings = [_Ring(seconds, size, max_channels) for seconds, size in self.resolutions]
+        self.channels = {}
+        self.keys = []
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._second = None
+        self._sums = []
+        self._counts = []
+        self._maxima = []
+        self._line_totals = {}
+
+    def _channel(self, key):
+        channel = self.channels.get(key)
+        if channel is None:
+            if len(self.keys) >= self.max_channels:
+                return None
+            channel = self.channels[key] = len(self.keys)
+            self.keys.append(key)
+            self._sums.append(0.0)
+            self._counts.append(0)
+            self._maxima.append(0.0)
+        return channel
+
+    def add(self, stream_id, series, name, value):
+        """Add one sample to a channel."""
+        with self._lock:
+            self._add(stream_id, series, name, value)
+
+    def _add(self, stream_id, series, name, value):
+        # Called with the lock held
+        channel = self.channels.get((stream_id, series, name))
+        if channel is None:
+            channel = self._channel((stream_id, series, name))
+            if channel is None:
+                self.dropped += 1
+                return
+        self._sums[channel] += value
+        self._counts[channel] += 1
+        if value > self._maxima[channel]:
+            self._maxima[channel] = value
+
+    def observe(self, frame, verdict):
+        """Record the analytics of one frame and its compliance verdict."""
+        second = int(self.clock())
+        stream_id = frame.stream_id + self.stream_offset
+        with self._lock:
+            if second != self._second:
+                self._flush()
+                self._second = second
+            add = self._add
+            add(stream_id, SERIES_PERSONS, "", verdict.person_count)
+            add(stream_id, SERIES_VIOLATIONS, "", verdict.alert_count)
+            if frame.zone_counts:
+                for zone, count in frame.zone_counts.items():
+                    add(stream_id, SERIES_OCCUPANCY, zone, count)
+            if frame.overcrowding:
+                for zone, status in frame.overcrowding.items():
+                    add(stream_id, SERIES_OVERCROWDED, zone, 1 if status else 0)
+            if frame.line_counts:
+                line_totals = self._line_totals
+                for line, total in frame.line_counts.items():
+                    key = (stream_id, line)
+                    previous = line_totals.get(key)
+                    line_totals[key] = total
+                    # The first sighting and counter resets only set the baseline
+                    add(stream_id, SERIES_CROSSINGS, line,
+                        total - previous if previous is not None and total >= previous else 0)
+
+    def flush(self):
+        """Move the accumulated second into every resolution."""
+        with self._lock:
+            self._flush()
+
+    def flush_callback(self):
+        """GLib timeout callback flushing a second no frame has closed."""
+        with self._lock:
+            if self._second is not None and int(self.clock()) != self._second:
+                self._flush()
+        return True
+
+    def _flush(self):
+        # Called with the lock held
+        used = len(self.keys)
+        if self._second is None or not used:
+            return
+        sums = np.array(self._sums, dtype=np.float64)
+        counts = np.array(self._counts, dtype=np.uint32)
+        maxima = np.array(self._maxima, dtype=np.float32)
+        for ring in self.rings:
+            ring.add(self._second, used, sums, counts, maxima)
+        self._sums = [0.0] * used
+        self._counts = [0] * used
+        self._maxima = [0.0] * used
+        self._second = None
+
+    def _resolution(self, resolution):
+        for ring in self.rings:
+            if ring.seconds == resolution:
+                return ring
+        raise ValueError("no %d s resolution, have %s" % (resolution, [ring.seconds for ring in self.rings]))
+
+    def query(self, stream_id, series, name="", resolution=60, start=None, end=None):
+        """Return {time, mean, max, sum, count} lists of one channel's buckets in [start, end)."""
+        ring = self._resolution(resolution)
+        channel = self.channels.get((stream_id, series, name))
+        result = {"time": [], "mean": [], "max": [], "sum": [], "count": []}
+        if channel is None:
+            return result
+        with self._lock:
+            slots = ring.window(start, end)
+            counts = ring.counts[channel, slots]
+            sums = ring.sums[channel, slots]
+            maxima = ring.maxima[channel, slots]
+            times = ring.buckets[slots] * ring.seconds
+        seen = counts > 0
+        result["time"] = times[seen].tolist()
+        result["mean"] = (sums[seen] / counts[seen]).tolist()
+        result["max"] = maxima[seen].tolist()
+        result["sum"] = sums[seen].tolist()
+        result["count"] = counts[seen].tolist()
+        return result
+
+    def summary(self, start=None, end=None, resolution=60):
+        """Return {stream: {series: {name: {mean, max, sum, count}}}} over [start, end)."""
+        ring = self._resolution(resolution)
+        used = len(self.keys)
+        with self._lock:
+            slots = ring.window(start, end)
+            sums = ring.sums[:used, slots].sum(axis=1)
+            counts = ring.counts[:used, slots].sum(axis=1)
+            maxima = ring.maxima[:used, slots].max(axis=1) if len(slots) else np.zeros(used)
+        result = {}
+        for channel, (stream_id, series, name) in enumerate(self.keys[:used]):
+            if not counts[channel]:
+                continue
+            result.setdefault("stream{0}".format(stream_id), {}).setdefault(series, {})[name] = {
+                "mean": round(float(sums[channel] / counts[channel]), 3),
+                "max": float(maxima[channel]),
+                "sum": float(sums[channel]),
+                "count": int(counts[channel]),
+            }
+        return result
+
+    def memory_bytes(self):
+        return sum(ring.buckets.nbytes + ring.sums.nbytes + ring.counts.nbytes + ring.maxima.nbytes
+                   for ring in self.rings)
+
+    def dump(self, path):
+        """Write the rings of the used channels to a compressed .npz, atomically.
+
+        The second being accumulated is flushed first.
+        """
+        arrays = {}
+        with self._lock:
+            self._flush()
+            used = len(self.keys)
+            # Copies, compressing happens outside the lock
+            for index, ring in enumerate(self.rings):
+                arrays["buckets%d" % index] = ring.buckets.copy()
+                arrays["sums%d" % index] = ring.sums[:used].copy()
+                arrays["counts%d" % index] = ring.counts[:used].copy()
+                arrays["maxima%d" % index] = ring.maxima[:used].copy()
+            keys = self.keys[:used]
+        header = {"format": DUMP_FORMAT, "time": self.clock(), "resolutions": self.resolutions,
+                  "keys": keys}
+        arrays["header"] = np.frombuffer(json.dumps(header).encode("utf-8"), dtype=np.uint8)
+        temporary = path + ".tmp.npz"
+        np.savez_compressed(temporary, **arrays)
+        os.replace(temporary, path)
+
+    def stats(self):
+        with self._lock:
+            return {"channels": len(self.keys), "max_channels": self.max_channels, "dropped": self.dropped}
+
+    def print_stats_callback(self):
+        """GLib timeout callback printing the channel counters."""
+        print("\n**TIMESERIES: ", self.stats(), "\n")
+        return True
+
+    def dump_callback(self, path):
+        """GLib timeout callback dumping the store to path."""
+        self.dump(path)
+        return True
+
+    @classmethod
+    def load(cls, path, max_channels=MAX_CHANNELS, clock=time.time, stream_offset=0):
+        """Restore a store written by dump()."""
+        with np.load(path) as data:
+            header = json.loads(data["header"].tobytes().decode("utf-8"))
+            if header.get("format") != DUMP_FORMAT:
+                raise ValueError("%s: unsupported time series format %r" % (path, header.get("format")))
+            keys = [tuple(key) for key in header["keys"]]
+            store = cls(header["resolutions"], max(max_channels, len(keys)), clock, stream_offset)
+            used = len(keys)
+            for index, ring in enumerate(store.rings):
+                ring.buckets[:] = data["buckets%d" % index]
+                ring.sums[:used] = data["sums%d" % index]
+                ring.counts[:used] = data["counts%d" % index]
+                ring.maxima[:used] = data["maxima%d" % index]
+        for key in keys:
+            store._channel(key)
+        return store
@@ -0,0 +1,259 @@
+################################################################################
+# Pipeline-wide latency tracing and queue occupancy telemetry (opt-in).
+#
+# PipelineTracer puts a pad probe on the sink and src pad of every element
+# after the muxer. A buffer's wall clock arrival is remembered by PTS on the
+# sink pad and the difference is recorded when the same PTS leaves the src
+# pad, which gives the latency each element, queues included, adds to it.
+# The muxer's src pad and the sinks' sink pads give the end-to-end latency.
+# Latencies go into profiling.SectionProfiler histograms per stream and are
+# reported over a rolling window of the last one to two window_seconds.
+#
+# A GLib timer samples current-level-buffers / current-level-time of every
+# queue, so the queue that fills up points at the slow stage behind it.
+#
+# snapshot() is plain JSON; it can be served on a local HTTP port and/or
+# written to a file. Nothing here depends on DeepStream: streams are resolved
+# through an optional stream_ids(buffer) callable, and utils/trace_pipeline.py
+# runs the tracer on a CPU-only pipeline.
+################################################################################
+
+import collections
+import http.server
+import json
+import os
+import threading
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GLib, Gst
+
+from profiling import MAX_STREAMS, SectionProfiler
+
+END_TO_END = "end_to_end"
+DEFAULT_WINDOW_SECONDS = 10.0
+DEFAULT_SAMPLE_MS = 200
+# Arrivals remembered per element; buffers a leaky queue drops never leave
+PENDING_PER_STAGE = 256
+QUEUE_SAMPLES = 64
+
+
+def _no_streams(buffer):
+    return (0,)
+
+
+class _Stage:
+    __slots__ = ("index", "arrivals")
+
+    def __init__(self, index):
+        self.index = index
+        self.arrivals = collections.OrderedDict()
+
+
+class PipelineTracer:
+    """Per-element and end-to-end buffer latency plus queue levels of a pipeline."""
+
+    def __init__(self, pipeline, start_element, stream_ids=None, window_seconds=DEFAULT_WINDOW_SECONDS,
+                 sample_ms=DEFAULT_SAMPLE_MS, max_streams=MAX_STREAMS, stream_offset=0):
+        self.pipeline = pipeline
+        self.start_element = start_element
+        self.stream_ids = stream_ids or _no_streams
+        self.window_seconds = window_seconds
+        self.sample_ms = sample_ms
+        self.max_streams = max_streams
+        # Added to the stream ids of snapshot(), see main.py --stream-offset
+        self.stream_offset = stream_offset
+        self.stages = {}
+        self.sinks = []
+        self.queues = []
+        self.queue_samples = {}
+        self._origins = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._windows = None
+        self._window_start = time.monotonic()
+        self._sections = ()
+
+    def attach(self):
+        """Install the pad probes and the queue sampler; call before PLAYING."""
+        names = []
+        for element in self._elements():
+            sinkpad = element.get_static_pad("sink")
+            srcpad = element.get_static_pad("src")
+            if element is self.start_element or sinkpad is None:
+                continue
+            if "Sink" in element.get_factory().get_metadata("klass"):
+                self.sinks.append(element)
+                sinkpad.add_probe(Gst.PadProbeType.BUFFER, self._sink_probe, None)
+                continue
+            if srcpad is None:
+                # tee and other elements with request src pads
+                continue
+            stage = _Stage(len(names))
+            names.append(element.get_name())
+            self.stages[element.get_name()] = stage
+            sinkpad.add_probe(Gst.PadProbeType.BUFFER, self._enter_probe, stage)
+            srcpad.add_probe(Gst.PadProbeType.BUFFER, self._leave_probe, stage)
+            if element.get_factory().get_name() == "queue":
+                self.queues.append(element)
+                self.queue_samples[element.get_name()] = collections.deque(maxlen=QUEUE_SAMPLES)
+        names.append(END_TO_END)
+        self._sections = tuple(names)
+        self._windows = [SectionProfiler(self.max_streams, self._sections) for _ in range(2)]
+        self.start_element.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self._origin_probe, None)
+        GLib.timeout_add(self.sample_ms, self._sample_queues)
+
+    def _elements(self):
+        # Source bins sit in front of the muxer and are not traced
+        iterator = self.pipeline.iterate_elements()
+        elements = []
+        while True:
+            result, element = iterator.next()
+            if result == Gst.IteratorResult.RESYNC:
+                iterator.resync()
+                elements = []
+                continue
+            if result != Gst.IteratorResult.OK:
+                break
+            if not isinstance(element, Gst.Bin):
+                elements.append(element)
+        return elements
+
+    def _origin_probe(self, pad, info, u_data):
+        buffer = info.get_buffer()
+        if buffer is not None and buffer.pts != Gst.CLOCK_TIME_NONE:
+            streams = [s for s in self.stream_ids(buffer) if 0 <= s < self.max_streams]
+            with self._lock:
+                self._origins[buffer.pts] = (time.perf_counter(), streams)
+                if len(self._origins) > PENDING_PER_STAGE:
+                    self._origins.popitem(last=False)
+        return Gst.PadProbeReturn.OK
+
+    def _enter_probe(self, pad, info, stage):
+        buffer = info.get_buffer()
+        if buffer is not None and buffer.pts != Gst.CLOCK_TIME_NONE:
+            with self._lock:
+                stage.arrivals[buffer.pts] = time.perf_counter()
+                if len(stage.arrivals) > PENDING_PER_STAGE:
+                    stage.arrivals.popitem(last=False)
+        return Gst.PadProbeReturn.OK
+
+    def _leave_probe(self, pad, info, stage):
+        buffer = info.get_buffer()
+        if buffer is not None:
+            now = time.perf_counter()
+            with self._lock:
+                arrived = stage.arrivals.pop(buffer.pts, None)
+                if arrived is not None:
+                    self._record(buffer.pts, stage.index, now - arrived)
+        return Gst.PadProbeReturn.OK
+
+    def _sink_probe(self, pad, info, u_data):
+        buffer = info.get_buffer()
+        if buffer is not None:
+            now = time.perf_counter()
+            with self._lock:
+                origin = self._origins.get(buffer.pts)
+                if origin is not None:
+                    self._record(buffer.pts, len(self._sections) - 1, now - origin[0])
+        return Gst.PadProbeReturn.OK
+
+    def _record(self, pts, section, seconds):
+        # Called with the lock held
+        if time.monotonic() - self._window_start >= self.window_seconds:
+            self._windows.reverse()
+            self._windows[0].reset()
+            self._window_start = time.monotonic()
+        origin = self._origins.get(pts)
+        streams = origin[1] if origin is not None else (0,)
+        for stream_id in streams:
+            self._windows[0].record(stream_id, section, seconds)
+
+    def _sample_queues(self):
+        for queue in self.queues:
+            self.queue_samples[queue.get_name()].append(
+                (queue.get_property("current-level-buffers"), queue.get_property("current-level-time")))
+        return True
+
+    def snapshot(self, stream_offset=None):
+        """Return latencies per stage and stream plus queue levels as a JSON-able dict.
+
+        stream_offset overrides the tracer's for the stream<N> keys.
+        """
+        with self._lock:
+            merged = SectionProfiler(self.max_streams, self._sections)
+            for window in self._windows or ():
+                merged.add(window)
+        stages = {}
+        offset = self.stream_offset if stream_offset is None else stream_offset
+        for stream, sections in merged.snapshot(offset).items():
+            for name, stats in sections.items():
+                stages.setdefault(name, {})[stream] = stats
+        queues = {}
+        for queue in self.queues:
+            samples = list(self.queue_samples[queue.get_name()])
+            if not samples:
+                continue
+            levels = [level for level, _ in samples]
+            queues[queue.get_name()] = {
+                "level_buffers": levels[-1],
+                "level_time_ms": round(samples[-1][1] / 1e6, 3),
+                "max_size_buffers": queue.get_property("max-size-buffers"),
+                "mean_level_buffers": round(sum(levels) / len(levels), 2),
+                "max_level_buffers": max(levels),
+            }
+        return {"time": time.time(), "window_seconds": self.window_seconds, "stages": stages, "queues": queues}
+
+    def bottleneck(self):
+        """Return the name of the stage with the highest mean latency, or None."""
+        best = None
+        best_mean = -1.0
+        for name, streams in self.snapshot()["stages"].items():
+            if name == END_TO_END:
+                continue
+            mean = max(stats["mean_us"] for stats in streams.values())
+            if mean > best_mean:
+                best, best_mean = name, mean
+        return best
+
+    def print_callback(self):
+        """GLib timeout callback printing the snapshot."""
+        print("\n**TRACE: ", json.dumps(self.snapshot()), "\n")
+        return True
+
+    def write_callback(self, path):
+        """GLib timeout callback writing the snapshot to path, atomically."""
+        temporary = path + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(temporary, path)
+        return True
+
+
+class _SnapshotHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = json.dumps(self.server.tracer.snapshot()).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TraceServer(http.server.ThreadingHTTPServer):
+    """Serves the tracer snapshot as JSON on GET, from a daemon thread."""
+
+    daemon_threads = True
+
+    def __init__(self, tracer, port, host="127.0.0.1"):
+        super().__init__((host, port), _SnapshotHandler)
+        self.tracer = tracer
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name="trace-server", daemon=True)
+        thread.start()
+        print("Trace snapshot on http://%s:%d/\n" % self.server_address)
+        return thread
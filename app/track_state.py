@@ -0,0 +1,180 @@
+################################################################################
+# Per-track compliance state kept across buffers.
+#
+# Every (stream pad_index, tracker object_id) gets a slot in a set of
+# preallocated arrays holding its displayed verdict, a hysteresis counter and
+# the frame numbers it was last seen and last evaluated at. Confirmed tracks are
+# only re-associated every reeval_interval frames, a verdict only flips after
+# `hysteresis` consecutive opposite observations, and tracks the tracker has
+# dropped are evicted once they have been missing for ttl_frames.
+#
+# A verdict is any non-zero int64: compliance.py stores its VERDICT_* codes,
+# ppe_rules.py a verdict code combined with the mask of the broken rules.
+################################################################################
+
+import re
+
+import numpy as np
+
+# object_id of objects that did not go through the tracker
+UNTRACKED_OBJECT_ID = 0xFFFFFFFFFFFFFFFF
+# NvDCF default when the low level config does not set maxShadowTrackingAge
+DEFAULT_SHADOW_TRACKING_AGE = 30
+
+_SHADOW_AGE_RE = re.compile(r"^\s*maxShadowTrackingAge\s*:\s*(\d+)")
+
+
+def shadow_tracking_age(ll_config_file, default=DEFAULT_SHADOW_TRACKING_AGE):
+    """Return maxShadowTrackingAge from an NvDCF low level YAML config.
+
+    The file starts with an OpenCV style %YAML:1.0 directive, so it is scanned
+    line by line rather than loaded with a YAML parser.
+    """
+    try:
+        with open(ll_config_file) as f:
+            for line in f:
+                match = _SHADOW_AGE_RE.match(line)
+                if match:
+                    return int(match.group(1))
+    except OSError as e:
+        print("Unable to read tracker config {0}: {1}".format(ll_config_file, e))
+    return default
+
+
+class TrackStateStore:
+    """Compact verdict store keyed by (stream id, object id)."""
+
+    _FIELDS = (("_active", bool), ("_stream_ids", np.int32), ("_verdicts", np.int64),
+               ("_candidates", np.int64), ("_streaks", np.int16), ("_last_seen", np.int64),
+               ("_last_eval", np.int64))
+
+    def __init__(self, ttl_frames=DEFAULT_SHADOW_TRACKING_AGE, reeval_interval=5, hysteresis=3,
+                 capacity=256):
+        self.ttl_frames = ttl_frames
+        self.reeval_interval = reeval_interval
+        self.hysteresis = hysteresis
+        self._slots = {}
+        self._keys = []
+        self._free = []
+        self._capacity = 0
+        for name, dtype in self._FIELDS:
+            setattr(self, name, np.zeros(0, dtype=dtype))
+        self._allocate(capacity)
+        self._last_sweep = {}
+        self.evictions = 0
+        # The evaluator whose verdicts are stored, see clear()
+        self.owner = None
+
+    def _allocate(self, capacity):
+        """Grow the slot arrays to capacity, keeping the existing slots."""
+        old = self._capacity
+        for name, dtype in self._FIELDS:
+            grown = np.zeros(capacity, dtype=dtype)
+            grown[:old] = getattr(self, name)
+            setattr(self, name, grown)
+        self._keys.extend([None] * (capacity - old))
+        # Hand out low slots first
+        self._free.extend(range(capacity - 1, old - 1, -1))
+        self._capacity = capacity
+
+    def __len__(self):
+        return len(self._slots)
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def lookup(self, stream_id, object_ids, frame_num):
+        """Return the slots of the given tracks and a mask of newly created ones.
+
+        Marks every track as seen at frame_num.
+        """
+        slots = np.empty(len(object_ids), dtype=np.int64)
+        new = np.zeros(len(object_ids), dtype=bool)
+        for i, object_id in enumerate(object_ids):
+            key = (stream_id, object_id)
+            slot = self._slots.get(key)
+            if slot is None:
+                if not self._free:
+                    self._allocate(self._capacity * 2)
+                slot = self._free.pop()
+                self._slots[key] = slot
+                self._keys[slot] = key
+                self._active[slot] = True
+                self._stream_ids[slot] = stream_id
+                self._verdicts[slot] = 0
+                self._candidates[slot] = 0
+                self._streaks[slot] = 0
+                self._last_eval[slot] = -1
+                new[i] = True
+            slots[i] = slot
+        self._last_seen[slots] = frame_num
+        return slots, new
+
+    def needs_evaluation(self, slots, new, frame_num):
+        """Return a mask of the tracks that have to be re-associated this frame.
+
+        New tracks, tracks with a pending verdict change and confirmed tracks
+        whose last evaluation is reeval_interval frames old are due.
+        """
+        age = frame_num - self._last_eval[slots]
+        # A negative age means the stream restarted its frame numbers
+        stale = (age >= self.reeval_interval) | (age < 0)
+        return new | stale | (self._streaks[slots] > 0)
+
+    def update(self, slots, observed, frame_num):
+        """Feed freshly observed verdicts and return the displayed ones."""
+        for slot, verdict in zip(slots.tolist(), observed.tolist()):
+            self._last_eval[slot] = frame_num
+            current = self._verdicts[slot]
+            if current == 0 or verdict == current:
+                # First verdict of a track, or the current one confirmed
+                self._verdicts[slot] = verdict
+                self._streaks[slot] = 0
+                continue
+            if verdict == self._candidates[slot]:
+                self._streaks[slot] += 1
+            else:
+                self._candidates[slot] = verdict
+                self._streaks[slot] = 1
+            if self._streaks[slot] >= self.hysteresis:
+                self._verdicts[slot] = verdict
+                self._streaks[slot] = 0
+        return self._verdicts[slots]
+
+    def verdicts(self, slots):
+        return self._verdicts[slots]
+
+    def empty_copy(self):
+        """Return an empty store with the settings and capacity of this one."""
+        return TrackStateStore(self.ttl_frames, self.reeval_interval, self.hysteresis, self._capacity)
+
+    def clear(self, owner=None):
+        """Forget every track, e.g. when the stored verdicts no longer mean the same."""
+        self._slots.clear()
+        self._keys = [None] * self._capacity
+        self._free = list(range(self._capacity - 1, -1, -1))
+        self._active[:] = False
+        self._last_sweep.clear()
+        self.owner = owner
+
+    def sweep(self, stream_id, frame_num):
+        """Evict the tracks of a stream that have not been seen for ttl_frames.
+
+        Runs at most once every ttl_frames per stream, so the cost per frame
+        stays negligible.
+        """
+        last = self._last_sweep.get(stream_id)
+        if last is not None and 0 <= frame_num - last < self.ttl_frames:
+            return 0
+        self._last_sweep[stream_id] = frame_num
+        age = frame_num - self._last_seen
+        expired = np.flatnonzero(self._active & (self._stream_ids == stream_id)
+                                 & ((age > self.ttl_frames) | (age < 0)))
+        for slot in expired.tolist():
+            del self._slots[self._keys[slot]]
+            self._keys[slot] = None
+            self._free.append(slot)
+        self._active[expired] = False
+        self.evictions += len(expired)
+        return len(expired)
@@ -0,0 +1,188 @@
+################################################################################
+# Stand-in HTTP endpoint for the alert webhook (see alerts.py).
+#
+#   python3 alert_webhook_server.py --port 8088
+# prints every batch it receives, and
+#   python3 alert_webhook_server.py --check
+# starts the endpoint on a free port, pushes synthetic frames through an
+# AlertSink with a RotatingEventLog and a WebhookBackend, takes the endpoint
+# down for a while to exercise the retry queue and disk spill, and fails unless
+# the log and the endpoint each received every event exactly once, the pending
+# queue stayed bounded and no batch went out while the sender backed off.
+# Untracked violators are checked to alert once per position, not per stream.
+################################################################################
+
+import argparse
+import http.server
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from alerts import ALERT_VIOLATION, RETRY_DELAY_MAX, RETRY_DELAY_MIN, UNTRACKED_CELL, AlertDetector, AlertSink, RotatingEventLog, WebhookBackend
+from compliance import VERDICT_NO_HELMET, FrameVerdict
+from frame_arrays import FrameObjects
+from track_state import UNTRACKED_OBJECT_ID
+
+import numpy as np
+
+
+class AlertHandler(http.server.BaseHTTPRequestHandler):
+    # Keep-alive, so the pooled connections of WebhookBackend are reused
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        server = self.server
+        if server.failing:
+            with server.lock:
+                server.rejected += 1
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        events = json.loads(body)["events"]
+        with server.lock:
+            server.events.extend(events)
+            server.batches += 1
+            server.connections.add(self.client_address)
+        if server.verbose:
+            print("batch of %d event(s): %s" % (len(events), ", ".join(sorted({e["type"] for e in events}))))
+        self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class AlertServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port, verbose=False):
+        super().__init__(("127.0.0.1", port), AlertHandler)
+        self.verbose = verbose
+        self.failing = False
+        self.lock = threading.Lock()
+        self.events = []
+        self.batches = 0
+        self.rejected = 0
+        self.connections = set()
+
+
+def synthetic_frame(stream_id, frame_num, violator_id):
+    boxes = np.array([[100.0, 100.0, 80.0, 200.0]])
+    labels = ["person"]
+    frame = FrameObjects.synthetic(stream_id, frame_num, boxes, labels,
+                                   object_ids=np.array([violator_id], dtype=np.uint64))
+    verdict = FrameVerdict(np.array([VERDICT_NO_HELMET], dtype=np.int8), 1, 0, 1)
+    return frame, verdict
+
+
+def check_untracked():
+    """Two untracked violators far apart alert once each, however often they are seen."""
+    detector = AlertDetector(rearm_frames=10)
+    boxes = np.array([[100.0, 100.0, 80.0, 200.0], [100.0 + 4 * UNTRACKED_CELL, 100.0, 80.0, 200.0]])
+    verdict = FrameVerdict(np.array([VERDICT_NO_HELMET] * 2, dtype=np.int8), 2, 0, 2)
+    events = []
+    for frame_num in range(5):
+        frame = FrameObjects.synthetic(0, frame_num, boxes + frame_num, ["person"] * 2,
+                                       object_ids=np.array([UNTRACKED_OBJECT_ID] * 2, dtype=np.uint64))
+        events.extend(detector.detect(frame, verdict))
+    print("untracked violators: %d event(s) over 5 frames" % len(events))
+    return len(events) == 2
+
+
+def check(streams, tracks, frames_per_track):
+    server = AlertServer(0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    directory = tempfile.mkdtemp()
+    log_path = os.path.join(directory, "alerts.jsonl")
+    log = RotatingEventLog(log_path, max_bytes=4096, backups=1000)
+    webhook = WebhookBackend("http://127.0.0.1:%d/alerts" % server.server_address[1], retry_capacity=4,
+                             spill_path=os.path.join(directory, "alerts.spill"), pending_capacity=4)
+    sink = AlertSink([log, webhook], batch_size=16, batch_interval=0.05)
+    sink.start()
+
+    frame_num = 0
+    expected = 0
+    pending_depth = 0
+    outage = [0.0, 0.0]
+    for track in range(tracks):
+        if track == tracks // 3:
+            server.failing = True
+            outage[0] = time.monotonic()
+        elif track == 2 * tracks // 3:
+            server.failing = False
+            outage[1] = time.monotonic()
+        for _ in range(frames_per_track):
+            for stream_id in range(streams):
+                sink.observe(*synthetic_frame(stream_id, frame_num, track + 1))
+            frame_num += 1
+        expected += streams
+        time.sleep(0.05 if server.failing else 0.01)
+        pending_depth = max(pending_depth, webhook.stats()["webhook_pending_depth"])
+
+    deadline = time.monotonic() + 30
+    while webhook.stats()["webhook_events"] < expected and time.monotonic() < deadline:
+        time.sleep(0.1)
+    sink.stop()
+    server.shutdown()
+    stats = webhook.stats()
+
+    # Once a POST fails, each sender thread sends at most one batch per
+    # backoff window, fresh batches included
+    windows, delay, elapsed = 1, RETRY_DELAY_MIN, 0.0
+    while elapsed + delay <= outage[1] - outage[0]:
+        elapsed += delay
+        delay = min(delay * 2, RETRY_DELAY_MAX)
+        windows += 1
+    rejected_limit = len(webhook._threads) * windows
+
+    logged = []
+    for name in os.listdir(directory):
+        if name.startswith("alerts.jsonl"):
+            with open(os.path.join(directory, name)) as f:
+                logged.extend(json.loads(line) for line in f)
+    key = lambda e: (e["stream_id"], e["object_id"])
+    received = sorted(map(key, server.events))
+    wanted = sorted((stream_id, track + 1) for track in range(tracks) for stream_id in range(streams))
+    print("events expected %d, logged %d, received %d in %d batches over %d connection(s)"
+          % (expected, len(logged), len(received), server.batches, len(server.connections)))
+    print(sink.stats())
+    print("%d POST(s) rejected during a %.2f s outage (at most %d), pending queue at most %d deep"
+          % (server.rejected, outage[1] - outage[0], rejected_limit, pending_depth))
+    ok = sorted(map(key, logged)) == wanted and received == wanted \
+        and all(e["type"] == ALERT_VIOLATION for e in server.events) \
+        and 0 < server.rejected <= rejected_limit \
+        and pending_depth <= webhook.pending_capacity and stats["webhook_pending_overflows"] > 0 \
+        and check_untracked()
+    print("OK" if ok else "MISMATCH")
+    return 0 if ok else 1
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog=args[0])
+    parser.add_argument("--port", type=int, default=8088)
+    parser.add_argument("--check", action="store_true", help="run the end to end check and exit")
+    parser.add_argument("--streams", type=int, default=4)
+    parser.add_argument("--tracks", type=int, default=60)
+    parser.add_argument("--frames-per-track", type=int, default=10)
+    options = parser.parse_args(args[1:])
+    if options.check:
+        return check(options.streams, options.tracks, options.frames_per_track)
+    server = AlertServer(options.port, verbose=True)
+    print("Listening on http://127.0.0.1:%d/" % options.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+# Micro-benchmark of the helmet-to-person association used by the analytics
+# probe: the old per-pair loop over is_helmet_on_head() against the batched
+# associate_helmets() at a few crowd sizes. Results of both are compared so the
+# run also doubles as an equivalence check. Each time is the best of at least
+# MIN_REPEATS runs, repeated for up to MIN_SECONDS so small sizes are not lost
+# in timer noise; the batched paths get NumPy arrays, as the probe passes them.
+#
+# usage: python3 bench_association.py [objects per frame ...]
+
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from association import associate_helmets, is_helmet_on_head
+from compliance import RESTRICTED_AREA, VERDICT_HELMET, evaluate_frame, helmet_centers
+from frame_arrays import FrameObjects
+from track_state import UNTRACKED_OBJECT_ID, TrackStateStore
+
+FRAME_WIDTH = 1920
+FRAME_HEIGHT = 1080
+FRAMES = 50
+MIN_REPEATS = 3
+MIN_SECONDS = 0.5
+
+
+def make_frame(num_objects, rng):
+    """Half persons, half helmets; every other person gets a helmet near its head."""
+    persons = []
+    helmets = []
+    for i in range(num_objects // 2):
+        height = rng.uniform(120, 400)
+        width = height * rng.uniform(0.3, 0.5)
+        left = rng.uniform(0, FRAME_WIDTH - width)
+        top = rng.uniform(0, FRAME_HEIGHT - height)
+        persons.append((left, top, width, height))
+        if i % 2 == 0:
+            jitter = height / 12
+            helmets.append((left + width / 2 + rng.uniform(-jitter, jitter),
+                            top + height / 12 + rng.uniform(-jitter, jitter)))
+        else:
+            helmets.append((rng.uniform(0, FRAME_WIDTH), rng.uniform(0, FRAME_HEIGHT)))
+    return persons, helmets
+
+
+def associate_loop(persons, helmets):
+    matches = []
+    for left, top, width, height in persons:
+        match = -1
+        treshold = height / 12
+        head_x = left + width / 2
+        head_y = top + height / 12
+        for index, (helmet_x, helmet_y) in enumerate(helmets):
+            if is_helmet_on_head(head_x, head_y, helmet_x, helmet_y, treshold):
+                match = index
+                break
+        matches.append(match)
+    return matches
+
+
+def associate_batched(persons, helmets):
+    return associate_helmets(persons, helmets)
+
+
+def timed(fn, frames):
+    best = None
+    repeats = total = 0
+    while repeats < MIN_REPEATS or total < MIN_SECONDS:
+        results = []
+        start = time.perf_counter()
+        for persons, helmets in frames:
+            results.append(fn(persons, helmets))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        repeats += 1
+        total += elapsed
+    return best / len(frames), [list(map(int, matches)) for matches in results]
+
+
+def check_untracked_pair():
+    """Two untracked persons, each with a helmet on its head, must both be matched."""
+    persons = [(100.0, 100.0, 60.0, 240.0), (600.0, 300.0, 60.0, 240.0)]
+    helmets = [(left + width / 2 - 5, top + height / 12 - 5, 10.0, 10.0) for left, top, width, height in persons]
+    frame = FrameObjects.synthetic(0, 0, persons + helmets, ["person", "person", "Helmet", "Helmet"],
+                                   [UNTRACKED_OBJECT_ID] * 4, [[RESTRICTED_AREA]] * 2 + [()] * 2)
+    centers = helmet_centers(frame)
+    expected = associate_loop(persons, centers.tolist())
+    if associate_helmets(frame.boxes[:2], centers).tolist() != expected or expected != [0, 1]:
+        return False
+    for track_store in (None, TrackStateStore()):
+        verdict = evaluate_frame(frame, track_store=track_store)
+        if verdict.verdicts[:2].tolist() != [VERDICT_HELMET] * 2 or verdict.alert_count:
+            return False
+    return True
+
+
+def main(args):
+    sizes = [int(arg) for arg in args[1:]] or [10, 100, 500]
+    if not check_untracked_pair():
+        sys.stderr.write("Untracked persons and helmets are not associated one to one\n")
+        return 1
+    rng = random.Random(0)
+    print("{0:>8} {1:>12} {2:>12} {3:>12} {4:>12} {5:>8}".format(
+        "objects", "loop us", "dense us", "grid us", "auto us", "speedup"))
+    for size in sizes:
+        frames = [make_frame(size, rng) for _ in range(FRAMES)]
+        loop_time, expected = timed(associate_loop, frames)
+        frames = [(np.array(persons).reshape(-1, 4), np.array(helmets).reshape(-1, 2)) for persons, helmets in frames]
+        dense_time, dense = timed(
+            lambda p, h: associate_helmets(p, h, loop_max_pairs=0, grid_min_pairs=sys.maxsize), frames)
+        grid_time, grid = timed(lambda p, h: associate_helmets(p, h, loop_max_pairs=0, grid_min_pairs=0), frames)
+        auto_time, auto = timed(associate_batched, frames)
+        if dense != expected or grid != expected or auto != expected:
+            sys.stderr.write("Mismatch between loop and batched association at %d objects\n" % size)
+            return 1
+        print("{0:>8} {1:>12.1f} {2:>12.1f} {3:>12.1f} {4:>12.1f} {5:>7.1f}x".format(
+            size, loop_time * 1e6, dense_time * 1e6, grid_time * 1e6, auto_time * 1e6,
+            loop_time / auto_time))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
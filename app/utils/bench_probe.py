@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+
+# Benchmark of the analytics probe (analytics_probe.AnalyticsProbe, the body of
+# nvanalytics_src_pad_buffer_probe) on synthetic batches, run through the pyds
+# stand-in of pyds_stand_in.py so it needs neither DeepStream nor a GPU.
+#
+# A scenario sets the number of streams, the persons and helmet wearers per
+# frame, the share of persons standing in the restricted area and the track
+# churn (chance per frame that a person leaves and a new track appears).
+# Batches mirror the shipped configs: stream N uses the nvdsanalytics sections
+# of stream N % 2 of config_nvdsanalytics.txt, PeopleNet reports
+# person / bag / face as gie 1 with its interval from pgie_peoplenet_config.txt
+# (tracker-only frames carry confidence -0.1), and the YOLO SGIE reports
+# Helmet / Vest / cell phone as gie 2 on every frame. The SGIE runs behind
+# nvtracker, so its objects are all UNTRACKED_OBJECT_ID; a run fails if the
+# helmets of a frame do not all reach the association. Every run is seeded,
+# so each scenario sees the same batches in every probe mode.
+#
+# For each scenario and mode the per-frame probe latency (batch time divided by
+# the frames in the batch) is reported as p50 / p95 / p99 together with the
+# throughput; a second pass under tracemalloc reports the peak Python
+# allocation per batch. As a reference for the speed of the machine, the time
+# the scenario's generator takes to build each batch is measured in the same
+# run, and "ratio" is the probe's p50 over the generator's.
+#
+# --update-baseline stores the results in bench_probe_baseline.json and
+# --check fails when the p50 ratio or the peak allocation is worse than the
+# baseline by more than --tolerance. Absolute times are only reported: they
+# follow the load and speed of the machine, the ratio does not as much.
+# Allocations depend on the Python and NumPy versions: refresh the baseline
+# along with them. The stand-in makes every pyds access a plain attribute
+# lookup, so absolute times are lower than on a pipeline.
+#
+# usage: python3 bench_probe.py [--scenario NAME ...] [--mode NAME ...]
+#                               [--check | --update-baseline] [--tolerance 0.25]
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pyds_stand_in
+
+pyds = pyds_stand_in.install()
+
+from analytics_probe import AnalyticsProbe
+from compliance import helmet_centers
+from frame_arrays import LABEL_HELMET, LABEL_PERSON
+from frame_meta import ANALYTICS_FRAME_META, ANALYTICS_OBJ_META
+from inference_interval import IntervalStats, pgie_settings
+from ppe_rules import RuleEngine, load_ppe_rules
+from track_state import UNTRACKED_OBJECT_ID, TrackStateStore
+from zones import ALL_CLASSES, ANCHOR_FOOT, ZoneEngine, load_zone_geometry
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+ANALYTICS_CONFIG = os.path.join(APP_DIR, 'config_nvdsanalytics.txt')
+PGIE_CONFIG = os.path.join(APP_DIR, 'pgie_peoplenet_config.txt')
+PPE_RULES = os.path.join(APP_DIR, 'config_ppe_rules.txt')
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_probe_baseline.json')
+FRAME_WIDTH = 1920
+FRAME_HEIGHT = 1080
+# object-threshold of the overcrowding sections
+OVERCROWDING_THRESHOLD = 2
+# Detector confidence nvtracker leaves on objects it propagated
+TRACKER_CONFIDENCE = -0.1
+PGIE_ID = 1
+SGIE_ID = 2
+# Share of persons that also have a face, a bag, a vest, a phone detected
+FACE_RATIO = 0.5
+BAG_RATIO = 0.1
+VEST_RATIO = 0.4
+PHONE_RATIO = 0.05
+WARMUP_BATCHES = 5
+ALLOCATION_BATCHES = 10
+
+SCENARIOS = {
+    # The shipped two camera site
+    "site-2": dict(streams=2, persons=6, helmets=4, roi_ratio=0.3, churn=0.02, batches=400),
+    "site-16": dict(streams=16, persons=12, helmets=8, roi_ratio=0.3, churn=0.02, batches=80),
+    "crowd-64": dict(streams=64, persons=30, helmets=15, roi_ratio=0.5, churn=0.05, batches=20),
+}
+MODES = ("default", "interval-aware", "zone-geometry", "ppe-rules")
+# Results compared by --check, lower is better: the p50 relative to the reference
+# and the allocations; p95 and p99 are too noisy over a short run to gate on
+CHECKED = ("p50_ratio", "peak_kb_per_batch")
+
+
+class Person:
+    __slots__ = ("object_id", "x", "y", "height", "width", "helmet", "face", "bag", "vest", "phone")
+
+
+class StreamScene:
+    """Persons walking around one camera, with the analytics meta of its config section."""
+
+    def __init__(self, stream_id, scenario, geometry, rng, next_id):
+        self.stream_id = stream_id
+        self.scenario = scenario
+        self.geometry = geometry
+        self.rng = rng
+        self.next_id = next_id
+        self.frame_num = 0
+        self.line_counts = {name: 0 for name in geometry.lines.names}
+        self.previous = {}
+        self.persons = [self.spawn(index < scenario["helmets"]) for index in range(scenario["persons"])]
+
+    def spawn(self, helmet):
+        rng = self.rng
+        person = Person()
+        person.object_id = self.next_id()
+        person.height = rng.uniform(120, 400)
+        person.width = person.height * rng.uniform(0.3, 0.5)
+        rois = self.geometry.rois
+        inside = len(rois) and rng.random() < self.scenario["roi_ratio"]
+        for _ in range(100):
+            if inside:
+                left, top, right, bottom = rois.bbox[rng.randrange(len(rois))]
+                x, y = rng.uniform(left, right), rng.uniform(top, bottom)
+            else:
+                x, y = rng.uniform(0, FRAME_WIDTH), rng.uniform(person.height, FRAME_HEIGHT)
+            if not len(rois) or bool(rois.contains([(x, y)]).any()) == bool(inside):
+                break
+        person.x, person.y = x, y
+        person.helmet = helmet
+        person.face = rng.random() < FACE_RATIO
+        person.bag = rng.random() < BAG_RATIO
+        person.vest = rng.random() < VEST_RATIO
+        person.phone = rng.random() < PHONE_RATIO
+        return person
+
+    def step(self, inferred):
+        """Advance the scene by one frame and return its NvDsFrameMeta."""
+        rng = self.rng
+        helmet_ratio = self.scenario["helmets"] / max(1, self.scenario["persons"])
+        for index, person in enumerate(self.persons):
+            if rng.random() < self.scenario["churn"]:
+                self.persons[index] = self.spawn(rng.random() < helmet_ratio)
+                continue
+            person.x = min(max(person.x + rng.uniform(-6, 6), 0.0), FRAME_WIDTH)
+            person.y = min(max(person.y + rng.uniform(-4, 4), person.height), FRAME_HEIGHT)
+
+        feet = np.array([(person.x, person.y) for person in self.persons]).reshape(-1, 2)
+        rois = self.geometry.rois
+        # The plugin reports the ROIs a person is outside of on inverse-roi streams
+        in_roi = rois.contains(feet) != self.geometry.inverse_roi
+        if self.geometry.roi_class_id not in (ALL_CLASSES, 0):
+            in_roi[:] = False
+        in_crowd = self.geometry.overcrowding.contains(feet)
+        lines = self.geometry.lines
+        crossed = np.zeros((len(self.persons), len(lines)), dtype=bool)
+        known = [index for index, person in enumerate(self.persons) if person.object_id in self.previous]
+        if known and len(lines):
+            before = [self.previous[self.persons[index].object_id] for index in known]
+            crossed[known] = lines.crossings(before, feet[known])
+        self.previous = {person.object_id: (person.x, person.y) for person in self.persons}
+
+        obj_metas = []
+        for index, person in enumerate(self.persons):
+            left, top = person.x - person.width / 2, person.y - person.height
+            confidence = rng.uniform(0.4, 0.95) if inferred else TRACKER_CONFIDENCE
+            info = pyds.NvDsAnalyticsObjInfo(
+                [name for name, inside in zip(rois.names, in_roi[index].tolist()) if inside],
+                [name for name, hit in zip(lines.names, crossed[index].tolist()) if hit])
+            obj_metas.append(pyds.NvDsObjectMeta(
+                left, top, person.width, person.height, "person", 0, PGIE_ID, person.object_id, confidence,
+                pyds.glist([pyds.NvDsUserMeta(ANALYTICS_OBJ_META, info)])))
+            if person.face:
+                obj_metas.append(pyds.NvDsObjectMeta(
+                    person.x - person.width / 6, top, person.width / 3, person.height / 8, "face", 2, PGIE_ID,
+                    person.object_id + (1 << 32), confidence))
+            if person.bag:
+                obj_metas.append(pyds.NvDsObjectMeta(
+                    person.x, person.y - person.height / 2, person.width / 2, person.height / 4, "bag", 1,
+                    PGIE_ID, person.object_id + (2 << 32), confidence))
+            if person.helmet:
+                size = person.width * 0.4
+                obj_metas.append(pyds.NvDsObjectMeta(
+                    person.x - size / 2 + rng.uniform(-3, 3), top + person.height / 12 - size / 2, size, size,
+                    "Helmet", 0, SGIE_ID, UNTRACKED_OBJECT_ID, rng.uniform(0.3, 0.9)))
+            if person.vest:
+                obj_metas.append(pyds.NvDsObjectMeta(
+                    left, top + person.height / 5, person.width, person.height / 3, "Vest", 1, SGIE_ID,
+                    UNTRACKED_OBJECT_ID, rng.uniform(0.3, 0.9)))
+            if person.phone:
+                obj_metas.append(pyds.NvDsObjectMeta(
+                    person.x, top + person.height / 3, 20.0, 35.0, "cell phone", 2, SGIE_ID,
+                    UNTRACKED_OBJECT_ID, rng.uniform(0.3, 0.9)))
+
+        for name, hits in zip(lines.names, crossed.sum(axis=0).tolist()):
+            self.line_counts[name] += hits
+        crowd = in_crowd.sum(axis=0).tolist()
+        frame_info = pyds.NvDsAnalyticsFrameMeta(
+            objInROIcnt=dict(zip(rois.names, in_roi.sum(axis=0).tolist())),
+            objLCCumCnt=self.line_counts,
+            ocStatus={name: count >= OVERCROWDING_THRESHOLD
+                      for name, count in zip(self.geometry.overcrowding.names, crowd)})
+        frame_meta = pyds.NvDsFrameMeta(self.stream_id, self.frame_num, obj_metas,
+                                        [pyds.NvDsUserMeta(ANALYTICS_FRAME_META, frame_info)])
+        self.frame_num += 1
+        return frame_meta
+
+
+class BatchSource:
+    """Seeded synthetic batches of one scenario."""
+
+    def __init__(self, scenario, geometry, interval, seed=0):
+        rng = random.Random(seed)
+        ids = iter(range(1, 1 << 31))
+        config_streams = sorted(geometry)
+        self.interval = interval
+        self.scenes = [StreamScene(stream_id, scenario, geometry[config_streams[stream_id % len(config_streams)]],
+                                   rng, ids.__next__)
+                       for stream_id in range(scenario["streams"])]
+        self.batch_num = 0
+
+    def next_batch(self):
+        # nvinfer skips the same batches on every stream
+        inferred = self.batch_num % (self.interval + 1) == 0
+        self.batch_num += 1
+        return pyds.NvDsBatchMeta([scene.step(inferred) for scene in self.scenes])
+
+
+class PerfData:
+    """Counts frames like common.FPS.PERF_DATA.update_fps(), without the timer."""
+
+    def __init__(self):
+        self.frames = {}
+
+    def update_fps(self, stream_index):
+        self.frames[stream_index] = self.frames.get(stream_index, 0) + 1
+
+
+def make_probe(mode, geometry, streams, pgie_unique_id):
+    probe = AnalyticsProbe(PerfData(), TrackStateStore())
+    probe.pgie_unique_id = pgie_unique_id
+    if mode == "interval-aware":
+        probe.interval_stats = IntervalStats()
+    elif mode == "zone-geometry":
+        config_streams = sorted(geometry)
+        probe.zone_engine = ZoneEngine({stream_id: geometry[config_streams[stream_id % len(config_streams)]]
+                                        for stream_id in range(streams)}, ANCHOR_FOOT)
+    elif mode == "ppe-rules":
+        config_streams = sorted(geometry)
+        probe.ppe_engine = RuleEngine(load_ppe_rules(PPE_RULES),
+                                      {stream_id: geometry[config_streams[stream_id % len(config_streams)]]
+                                       for stream_id in range(streams)})
+    return probe
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def run(scenario, mode, geometry, pgie_unique_id, interval):
+    source = BatchSource(scenario, geometry, interval)
+    probe = make_probe(mode, geometry, scenario["streams"], pgie_unique_id)
+    frame_times = []
+    reference_times = []
+    total_time = 0.0
+    frames = 0
+    in_roi = 0
+    helmets = 0
+    helmets_kept = 0
+    for index in range(WARMUP_BATCHES + scenario["batches"]):
+        generate_start = time.perf_counter()
+        batch_meta = source.next_batch()
+        start = time.perf_counter()
+        batch = probe.process_batch(batch_meta)
+        elapsed = time.perf_counter() - start
+        if index < WARMUP_BATCHES:
+            continue
+        frame_times.append(elapsed / len(batch))
+        reference_times.append((start - generate_start) / len(batch))
+        total_time += elapsed
+        frames += len(batch)
+        in_roi += sum(int(np.count_nonzero(frame.roi_mask[frame.labels == LABEL_PERSON])) for frame in batch)
+        helmets += sum(int(np.count_nonzero(frame.labels == LABEL_HELMET)) for frame in batch)
+        helmets_kept += sum(len(helmet_centers(frame)) for frame in batch)
+
+    # Allocations are measured in a separate pass, tracemalloc slows everything down
+    source = BatchSource(scenario, geometry, interval)
+    probe = make_probe(mode, geometry, scenario["streams"], pgie_unique_id)
+    for _ in range(WARMUP_BATCHES):
+        probe.process_batch(source.next_batch())
+    peaks = []
+    tracemalloc.start()
+    for _ in range(ALLOCATION_BATCHES):
+        batch_meta = source.next_batch()
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        batch = probe.process_batch(batch_meta)
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        del batch
+    tracemalloc.stop()
+
+    reference = percentile(reference_times, 50)
+    return {
+        "frames": frames,
+        "frame_p50_us": round(percentile(frame_times, 50) * 1e6, 2),
+        "frame_p95_us": round(percentile(frame_times, 95) * 1e6, 2),
+        "frame_p99_us": round(percentile(frame_times, 99) * 1e6, 2),
+        "reference_p50_us": round(reference * 1e6, 2),
+        "p50_ratio": round(percentile(frame_times, 50) / reference, 3) if reference else 0.0,
+        "frames_per_second": round(frames / total_time, 1) if total_time else 0.0,
+        "peak_kb_per_batch": round(max(peaks) / 1024.0, 1),
+        "persons_in_roi": in_roi,
+        "helmets": helmets,
+        "helmets_kept": helmets_kept,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Return the descriptions of all results worse than the baseline."""
+    failures = []
+    for key, result in results.items():
+        expected = baseline.get(key)
+        if expected is None:
+            print("%s: no baseline, not checked" % key)
+            continue
+        for field in CHECKED:
+            if field in expected and result[field] > expected[field] * (1.0 + tolerance):
+                failures.append("%s %s: %.2f, baseline %.2f" % (key, field, result[field], expected[field]))
+    return failures
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog=args[0])
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run, repeatable; all by default")
+    parser.add_argument("--mode", action="append", choices=MODES, help="probe mode to run, repeatable; all by default")
+    parser.add_argument("--batches", type=int, help="override the number of measured batches of every scenario")
+    parser.add_argument("--check", action="store_true", help="fail when a result regresses against the baseline")
+    parser.add_argument("--update-baseline", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed relative regression for --check (default 0.25)")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline file")
+    options = parser.parse_args(args[1:])
+
+    geometry = load_zone_geometry(ANALYTICS_CONFIG, FRAME_WIDTH, FRAME_HEIGHT)
+    pgie_unique_id, interval = pgie_settings(PGIE_CONFIG)
+
+    results = {}
+    print("{0:<28} {1:>8} {2:>10} {3:>10} {4:>10} {5:>8} {6:>10} {7:>10}".format(
+        "scenario/mode", "frames", "p50 us", "p95 us", "p99 us", "ratio", "frames/s", "peak KB"))
+    for name in options.scenario or sorted(SCENARIOS):
+        scenario = dict(SCENARIOS[name])
+        if options.batches:
+            scenario["batches"] = options.batches
+        in_roi = {}
+        for mode in options.mode or MODES:
+            key = "%s/%s" % (name, mode)
+            result = results[key] = run(scenario, mode, geometry, pgie_unique_id, interval)
+            in_roi[mode] = result["persons_in_roi"]
+            print("{0:<28} {1:>8} {2:>10.1f} {3:>10.1f} {4:>10.1f} {5:>8.3f} {6:>10.0f} {7:>10.1f}".format(
+                key, result["frames"], result["frame_p50_us"], result["frame_p95_us"], result["frame_p99_us"],
+                result["p50_ratio"], result["frames_per_second"], result["peak_kb_per_batch"]))
+            if result["helmets_kept"] != result["helmets"]:
+                sys.stderr.write("%s: %d of %d helmets reach the association\n"
+                                 % (key, result["helmets_kept"], result["helmets"]))
+                return 1
+        # The compiled geometry has to agree with the meta the batches carry
+        if len(set(in_roi.values())) > 1:
+            sys.stderr.write("%s: ROI membership differs between modes: %s\n" % (name, in_roi))
+            return 1
+
+    if options.update_baseline:
+        baseline = {}
+        if os.path.exists(options.baseline):
+            with open(options.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(options.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print("Baseline written to %s" % options.baseline)
+    elif options.check:
+        if not os.path.exists(options.baseline):
+            sys.stderr.write("No baseline at %s, run with --update-baseline first\n" % options.baseline)
+            return 1
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        failures = compare(results, baseline, options.tolerance)
+        for failure in failures:
+            sys.stderr.write("Regression: %s\n" % failure)
+        if failures:
+            return 1
+        print("No regression beyond %d%%" % round(options.tolerance * 100))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
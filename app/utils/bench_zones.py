@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+# Micro-benchmark of restricted-area membership: the per-object meta walk the
+# probe uses by default (scan every object's user meta list and search its
+# roiStatus for the ROI name) against the compiled zone geometry of zones.py,
+# which tests the foot points of a whole frame at once. The user meta lists are
+# emulated with Python lists holding what nvdsanalytics would report, computed
+# with a scalar point-in-polygon reference; the run fails if the vectorized
+# test disagrees. The "cost" column is the geometry time over the walk time:
+# the geometry is slower at the object counts of a camera frame and only breaks
+# even at a few hundred objects.
+#
+# The emulated walk has none of the pybind overhead of the real one (a cast and
+# several attribute crossings per user meta), so its times are a lower bound;
+# on a running pipeline compare the user_meta section of --profile with and
+# without --zone-geometry.
+#
+# --check compares ZoneEngine with a scalar model of the plugin on every
+# stream of both shipped nvdsanalytics configs: inverse-roi, the class-id
+# of ROI and line sections and the line-crossing mode included.
+#
+# usage: python3 bench_zones.py [objects per frame ...]
+#        python3 bench_zones.py --check
+
+import configparser
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+
+from compliance import RESTRICTED_AREA
+from frame_arrays import FrameObjects, zone_bit
+from zones import ANCHOR_FOOT, ZoneEngine, anchor_points, load_zone_geometry
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+CONFIG = os.path.join(APP_DIR, 'config_nvdsanalytics.txt')
+SHIPPED_CONFIGS = [os.path.join(APP_DIR, name) for name in ('config_nvdsanalytics.txt',
+                                                             'config_nvdsanalytics_c02.txt')]
+FRAME_WIDTH = 1920
+FRAME_HEIGHT = 1080
+FRAMES = 50
+# Other user metas an object typically carries ahead of the analytics one
+OTHER_USER_METAS = 2
+
+
+def point_in_polygon(x, y, polygon):
+    inside = False
+    count = len(polygon)
+    for i in range(count):
+        x1, y1 = polygon[i]
+        x2, y2 = polygon[(i + 1) % count]
+        if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+            inside = not inside
+    return inside
+
+
+def make_frame(num_objects, rng, polygons):
+    """Random person boxes and the user meta lists the plugin would attach to them."""
+    boxes = []
+    user_metas = []
+    for _ in range(num_objects):
+        height = rng.uniform(120, 400)
+        width = height * rng.uniform(0.3, 0.5)
+        left = rng.uniform(0, FRAME_WIDTH - width)
+        top = rng.uniform(0, FRAME_HEIGHT - height)
+        boxes.append((left, top, width, height))
+        foot_x, foot_y = left + width / 2, top + height
+        roi_status = [name for name, polygon in polygons if point_in_polygon(foot_x, foot_y, polygon)]
+        user_metas.append([("NVIDIA.OTHER.USER_META", None)] * OTHER_USER_METAS +
+                          [("NVIDIA.DSANALYTICSOBJ.USER_META", (roi_status, []))])
+    return np.array(boxes).reshape(-1, 4), user_metas
+
+
+def meta_walk(boxes, user_metas):
+    in_zone = []
+    for metas in user_metas:
+        found = False
+        for meta_type, data in metas:
+            if meta_type == "NVIDIA.DSANALYTICSOBJ.USER_META":
+                for status in data[0]:
+                    if RESTRICTED_AREA in status:
+                        found = True
+                break
+        in_zone.append(found)
+    return in_zone
+
+
+def _cross(ax, ay, bx, by):
+    return ax * by - ay * bx
+
+
+# Largest angle between a move and a line's direction per line-crossing mode
+MODE_DEGREES = {"loose": 90, "balanced": 60, "strict": 30}
+
+
+def plugin_model(path):
+    """Read the ROI and line sections of a config as the plugin does, independently of zones.py."""
+    config = configparser.ConfigParser(interpolation=None, strict=False)
+    config.optionxform = str
+    config.read(path)
+
+    def points(value):
+        values = [float(v) for v in value.split(";") if v.strip()]
+        return list(zip(values[::2], values[1::2]))
+
+    streams = {}
+    for section_name in config.sections():
+        kind, _, stream_id = section_name.rpartition("-stream-")
+        section = config[section_name]
+        if not stream_id.isdigit() or not section.getboolean("enable", True):
+            continue
+        model = streams.setdefault(int(stream_id), {"rois": [], "roi_class": -1, "inverse": False, "lines": [],
+                                                    "line_class": -1, "extended": False, "mode": "balanced"})
+        if kind == "roi-filtering":
+            model["rois"] = [(key[4:], points(value)) for key, value in section.items() if key.startswith("roi-")]
+            model["roi_class"] = section.getint("class-id", -1)
+            model["inverse"] = section.getboolean("inverse-roi", False)
+        elif kind == "line-crossing":
+            model["lines"] = [(key[14:], points(value)) for key, value in section.items()
+                              if key.startswith("line-crossing-")]
+            model["line_class"] = section.getint("class-id", -1)
+            model["extended"] = section.getboolean("extended", False)
+            model["mode"] = section.get("mode", "balanced").strip()
+    return streams
+
+
+def line_crossed(before, after, entry, extended, mode):
+    """Scalar reference of one line-crossing entry [direction start, direction end, line start, line end]."""
+    (dx1, dy1), (dx2, dy2), (cx, cy), (fx, fy) = entry
+    (ax, ay), (bx, by) = before, after
+    ex, ey = fx - cx, fy - cy
+    if _cross(ex, ey, ax - cx, ay - cy) * _cross(ex, ey, bx - cx, by - cy) >= 0:
+        return False
+    mx, my = bx - ax, by - ay
+    if not extended and _cross(mx, my, cx - ax, cy - ay) * _cross(mx, my, fx - ax, fy - ay) >= 0:
+        return False
+    dx, dy = dx2 - dx1, dy2 - dy1
+    if mx * dx + my * dy <= 0:
+        return False
+    angle = math.degrees(math.acos(min(1.0, (mx * dx + my * dy) / (math.hypot(mx, my) * math.hypot(dx, dy)))))
+    return angle <= MODE_DEGREES[mode] + 0.01
+
+
+def reference_masks(model, boxes, class_ids, before):
+    """The ROI and line masks the plugin reports for a frame, one object at a time."""
+    roi_masks = []
+    lc_masks = []
+    for index, (left, top, width, height) in enumerate(boxes):
+        x, y = left + width / 2, top + height
+        mask = 0
+        if model["roi_class"] in (-1, class_ids[index]):
+            for name, polygon in model["rois"]:
+                if point_in_polygon(x, y, polygon) != model["inverse"]:
+                    mask |= zone_bit(name)
+        roi_masks.append(mask)
+        mask = 0
+        if before[index] is not None and model["line_class"] in (-1, class_ids[index]):
+            for name, entry in model["lines"]:
+                if line_crossed(before[index], (x, y), entry, model["extended"], model["mode"]):
+                    mask |= zone_bit(name)
+        lc_masks.append(mask)
+    return roi_masks, lc_masks
+
+
+def check_configs(rng, frames=300, objects=40):
+    """Compare ZoneEngine with the plugin model on every stream of the shipped configs."""
+    checked = {"streams": 0, "in_roi": 0, "crossings": 0}
+    for path in SHIPPED_CONFIGS:
+        engine = ZoneEngine(load_zone_geometry(path, FRAME_WIDTH, FRAME_HEIGHT), ANCHOR_FOOT)
+        for stream_id, model in sorted(plugin_model(path).items()):
+            checked["streams"] += 1
+            # Feet walking around the frame, with the classes of PeopleNet
+            tracks = [[rng.uniform(0, FRAME_WIDTH), rng.uniform(200, FRAME_HEIGHT), rng.uniform(-40, 40),
+                       rng.uniform(-40, 40), rng.choice((0, 0, 1, 2))] for _ in range(objects)]
+            feet = {}
+            for frame_num in range(frames):
+                boxes = []
+                for track in tracks:
+                    for axis, low, high in ((0, 0.0, FRAME_WIDTH), (1, 200.0, FRAME_HEIGHT)):
+                        track[axis] += track[axis + 2] * rng.uniform(0.5, 1.5)
+                        if not low <= track[axis] <= high:
+                            track[axis] = min(max(track[axis], low), high)
+                            track[axis + 2] = -track[axis + 2]
+                    boxes.append((track[0] - 40, track[1] - 200, 80, 200))
+                class_ids = [track[4] for track in tracks]
+                rows = [(*box, "person", class_id, 1, object_id, 0.9, (), ())
+                        for object_id, (box, class_id) in enumerate(zip(boxes, class_ids), 1)]
+                frame = FrameObjects.from_rows(stream_id, frame_num, rows)
+                engine.apply(frame)
+                expected_roi, expected_lc = reference_masks(model, boxes, class_ids,
+                                                            [feet.get(object_id) for object_id in range(1, objects + 1)])
+                where = "%s stream %d frame %d" % (os.path.basename(path), stream_id, frame_num)
+                if frame.roi_mask.tolist() != expected_roi:
+                    raise AssertionError("%s: ROI masks differ from the plugin model" % where)
+                if model["lines"] and frame.lc_mask.tolist() != expected_lc:
+                    raise AssertionError("%s: line masks differ from the plugin model" % where)
+                checked["in_roi"] += sum(1 for mask in expected_roi if mask)
+                checked["crossings"] += sum(1 for mask in expected_lc if mask)
+                feet = {object_id: (box[0] + box[2] / 2, box[1] + box[3])
+                        for object_id, box in enumerate(boxes, 1)}
+    if not checked["in_roi"] or not checked["crossings"]:
+        raise AssertionError("the check saw no ROI members or no crossings: %s" % checked)
+    print("%(streams)d streams agree with the plugin model, %(in_roi)d ROI members, %(crossings)d crossings"
+          % checked)
+    print("OK")
+    return 0
+
+
+def main(args):
+    if "--check" in args[1:]:
+        try:
+            return check_configs(random.Random(1))
+        except AssertionError as e:
+            sys.stderr.write("FAILED: %s\n" % e)
+            return 1
+    sizes = [int(arg) for arg in args[1:]] or [10, 100, 500]
+    geometry = load_zone_geometry(CONFIG, FRAME_WIDTH, FRAME_HEIGHT)[0]
+    rois = geometry.rois
+    polygons = [(name, list(zip(rois.x1[i].tolist(), rois.y1[i].tolist()))) for i, name in enumerate(rois.names)]
+    bit = np.uint64(zone_bit(RESTRICTED_AREA))
+    rng = random.Random(0)
+    print("{0:>8} {1:>12} {2:>12} {3:>8}".format("objects", "meta us", "geometry us", "cost"))
+    for size in sizes:
+        frames = [make_frame(size, rng, polygons) for _ in range(FRAMES)]
+
+        start = time.perf_counter()
+        expected = [meta_walk(boxes, metas) for boxes, metas in frames]
+        meta_time = (time.perf_counter() - start) / FRAMES
+
+        start = time.perf_counter()
+        computed = [((rois.masks(anchor_points(boxes, ANCHOR_FOOT)) & bit) != 0).tolist() for boxes, _ in frames]
+        geometry_time = (time.perf_counter() - start) / FRAMES
+
+        if computed != expected:
+            sys.stderr.write("Mismatch between meta walk and zone geometry at %d objects\n" % size)
+            return 1
+        print("{0:>8} {1:>12.1f} {2:>12.1f} {3:>7.1f}x".format(
+            size, meta_time * 1e6, geometry_time * 1e6, geometry_time / meta_time))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+# Checks the engine cache without TensorRT: engine naming, picking an engine
+# for a batch size (exact, else the smallest larger one, never another GPU or
+# precision), the rewritten nvinfer config, the trtexec command lines, and a
+# background pre-build run with a stand-in trtexec that writes the engine it
+# is asked for, after which the next resolve is a cache hit.
+#
+# usage: python3 check_engine_cache.py
+
+import configparser
+import os
+import stat
+import sys
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from engine_cache import (EngineBuilder, EngineCache, InferModel, engine_name, parse_engine_name,
+                          rewrite_infer_lines, trtexec_command)
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CONFIG = """[property]
+## comment kept
+onnx-file=models/net.onnx
+model-engine-file=models/net.onnx_b2_gpu0_fp32.engine
+#model-engine-file=old.engine
+int8-calib-file=calib.table
+batch-size=2
+network-mode=1
+uff-input-blob-name=input_1
+infer-dims=3;544;960
+
+[class-attrs-all]
+pre-cluster-threshold=0.2
+"""
+
+# Writes the engine named by --saveEngine, fails for batch size 4
+STAND_IN_TRTEXEC = """#!%s
+import sys
+options = dict(option[2:].split("=", 1) for option in sys.argv[1:] if "=" in option)
+if options.get("maxShapes", "").endswith(":4x3x544x960"):
+    sys.exit(1)
+with open(options["saveEngine"], "w") as f:
+    f.write("engine")
+""" % sys.executable
+
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "w").close()
+
+
+def check_shipped_configs():
+    pgie = InferModel.load(os.path.join(APP_DIR, "pgie_peoplenet_config.txt"))
+    check(pgie.model_path.endswith("resnet34_peoplenet_int8.onnx") and pgie.precision == "fp32",
+          "pgie model %s %s" % (pgie.model_path, pgie.precision))
+    check(pgie.input_name == "input_1" and pgie.input_dims == [3, 544, 960], "pgie input")
+    sgie = InferModel.load(os.path.join(APP_DIR, "sgie_yolo_detector_config.txt"))
+    check(sgie.precision == "int8" and sgie.custom_build and sgie.batch_size == 1, "sgie settings")
+    check(sgie.calib_path == os.path.normpath(os.path.join(APP_DIR, "calib.table")), "sgie calib path")
+
+
+def check_resolve(directory):
+    config_path = os.path.join(directory, "infer_config.txt")
+    with open(config_path, "w") as f:
+        f.write(CONFIG)
+    model = InferModel.load(config_path)
+    models = os.path.join(directory, "models")
+    check(model.model_path == os.path.join(models, "net.onnx"), "model path %s" % model.model_path)
+    check(engine_name(model.model_path, 4, 1, "int8") == "net.onnx_b4_gpu1_int8.engine", "engine name")
+    check(parse_engine_name("model_b1_gpu0_int8.engine") == (1, 0, "int8"), "engine name not parsed")
+    check(parse_engine_name("net.engine") is None, "plain engine name parsed")
+
+    cache = EngineCache()
+    choice = cache.resolve(model, 3, 0)
+    check(not choice.cached and choice.path == os.path.join(models, "net.onnx_b3_gpu0_int8.engine"),
+          "cold cache picked %s" % choice.path)
+    # The configured engine is fp32 while network-mode is int8: never picked
+    touch(os.path.join(models, "net.onnx_b2_gpu0_fp32.engine"))
+    for batch in (2, 8):
+        touch(os.path.join(models, "net.onnx_b%d_gpu0_int8.engine" % batch))
+    touch(os.path.join(models, "net.onnx_b16_gpu1_int8.engine"))
+    for batch, gpu, expected in ((2, 0, 2), (3, 0, 8), (8, 0, 8), (9, 0, None), (1, 1, 16)):
+        choice = cache.resolve(model, batch, gpu)
+        check(choice.cached == (expected is not None), "b%d gpu%d cached %s" % (batch, gpu, choice.cached))
+        if expected is not None:
+            check(choice.batch_size == expected and choice.path.endswith("_b%d_gpu%d_int8.engine" % (expected, gpu)),
+                  "b%d gpu%d picked %s" % (batch, gpu, choice.path))
+    check(EngineCache().missing(model, [1, 2, 4, 8], 0) == [1, 4], "missing batch sizes")
+
+    # The cache directory is searched first
+    cache_dir = os.path.join(directory, "cache")
+    touch(os.path.join(cache_dir, "net.onnx_b2_gpu0_int8.engine"))
+    choice = EngineCache(cache_dir).resolve(model, 2, 0)
+    check(choice.path == os.path.join(cache_dir, "net.onnx_b2_gpu0_int8.engine"), "cache dir not preferred")
+
+    out_path = cache.write_config("pgie", config_path, 8, 0)
+    check(os.path.dirname(out_path) == directory, "config copy not next to the original")
+    with open(out_path) as f:
+        text = f.read()
+    check("## comment kept" in text and "#model-engine-file=old.engine" in text, "comments dropped")
+    check(text.count("batch-size=") == 1 and text.count("\nmodel-engine-file=") == 1, "keys duplicated")
+    config = configparser.ConfigParser(interpolation=None, strict=False)
+    config.read(out_path)
+    check(config["property"]["batch-size"] == "8" and config["property"]["gpu-id"] == "0", "batch or gpu not set")
+    check(config["property"]["model-engine-file"] == os.path.join(models, "net.onnx_b8_gpu0_int8.engine"),
+          "engine %s" % config["property"]["model-engine-file"])
+    check(config["class-attrs-all"]["pre-cluster-threshold"] == "0.2", "other sections changed")
+    check(InferModel.load(out_path).model_path == model.model_path, "relative paths broken in the copy")
+    check(rewrite_infer_lines(["[other]"], {"batch-size": 1}) == ["[other]", "[property]", "batch-size=1"],
+          "missing section not added")
+    return model
+
+
+def check_builder(directory, model):
+    trtexec = os.path.join(directory, "trtexec")
+    with open(trtexec, "w") as f:
+        f.write(STAND_IN_TRTEXEC)
+    os.chmod(trtexec, os.stat(trtexec).st_mode | stat.S_IXUSR)
+
+    command = trtexec_command(trtexec, model, 4, 1, "out.engine")
+    check(command[1:] == ["--onnx=%s" % model.model_path, "--saveEngine=out.engine", "--device=1",
+                          "--minShapes=input_1:1x3x544x960", "--optShapes=input_1:4x3x544x960",
+                          "--maxShapes=input_1:4x3x544x960", "--int8", "--calib=%s" % model.calib_path],
+          "trtexec command %s" % command)
+    sgie = InferModel.load(os.path.join(APP_DIR, "sgie_yolo_detector_config.txt"))
+    check(trtexec_command(trtexec, sgie, 2, 0, "out.engine") is None, "custom engine build not refused")
+
+    cache_dir = os.path.join(directory, "built")
+    cache = EngineCache(cache_dir)
+    builder = EngineBuilder(cache, trtexec)
+    check(builder.queue(model, [1, 2, 4, 8, 16], 0) == 3, "queued %d builds" % len(builder.jobs))
+    builder.queue(sgie, [2], 0)
+    builder.start()
+    builder.join(60)
+    stats = builder.stats()
+    check(stats["built"] == 2 and stats["failed"] == 1 and stats["unsupported"] == 1, "stats %s" % stats)
+    check(sorted(os.listdir(cache_dir)) == ["net.onnx_b16_gpu0_int8.engine", "net.onnx_b1_gpu0_int8.engine"],
+          "built %s" % sorted(os.listdir(cache_dir)))
+    choice = cache.resolve(model, 1, 0)
+    check(choice.cached and os.path.dirname(choice.path) == cache_dir, "pre-built engine not picked")
+    check(cache.resolve(model, 9, 0).batch_size == 16, "larger pre-built engine not picked")
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            check_shipped_configs()
+            model = check_resolve(directory)
+            check_builder(directory, model)
+        except AssertionError as e:
+            sys.stderr.write("FAILED: %s\n" % e)
+            return 1
+    print("OK")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
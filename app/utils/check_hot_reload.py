@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+# Checks config hot reload without GStreamer: an edit is picked up only after
+# the file held still for one poll, a broken nvdsanalytics config or rule file
+# is rejected while the running version stays, and valid edits are staged and
+# then swapped into the probe and a stand-in nvdsanalytics element by
+# apply_pending(), with the element pointed at alternating validated copies.
+# Configs with more ROI and line names than fit in a zone mask are rejected
+# without interning any of them. Moving the ROIs or renaming the restricted
+# zone swaps in an empty track store, other edits keep the stored verdicts.
+#
+# usage: python3 check_hot_reload.py
+
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from compliance import ComplianceSettings, load_compliance_settings
+from frame_arrays import MAX_ZONE_NAMES, zone_bit, zone_names
+from hot_reload import ConfigReloader, FileWatcher, validate_analytics_config
+from ppe_rules import RuleEngine, load_ppe_rules
+from track_state import TrackStateStore
+from zones import ZoneEngine
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+class _Element:
+    def __init__(self):
+        self.properties = {}
+
+    def set_property(self, name, value):
+        self.properties[name] = value
+
+
+class _Probe:
+    def __init__(self, analytics_config, ppe_rules):
+        geometry = validate_analytics_config(analytics_config)
+        self.zone_engine = ZoneEngine(geometry)
+        self.ppe_engine = RuleEngine(load_ppe_rules(ppe_rules), geometry)
+        self.compliance = ComplianceSettings()
+        self.track_store = TrackStateStore()
+
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+def edit(path, old, new, tick=[0]):
+    with open(path) as f:
+        text = f.read()
+    check(old in text, "%r not in %s" % (old, path))
+    with open(path, "w") as f:
+        f.write(text.replace(old, new))
+    # A distinct mtime even on coarse clocks
+    tick[0] += 1
+    os.utime(path, ns=(tick[0] * 10 ** 9, tick[0] * 10 ** 9))
+
+
+def check_watcher(directory):
+    path = os.path.join(directory, "watched.txt")
+    with open(path, "w") as f:
+        f.write("a")
+    watcher = FileWatcher([path, None, path])
+    check(watcher.paths == [path], "paths %s" % watcher.paths)
+    check(watcher.changed() == [], "unchanged file reported")
+    edit(path, "a", "ab")
+    check(watcher.changed() == [], "file reported before it settled")
+    edit(path, "ab", "abc")
+    check(watcher.changed() == [], "file still being written reported")
+    check(watcher.changed() == [path], "settled file not reported")
+    check(watcher.changed() == [], "file reported twice")
+    os.remove(path)
+    check(watcher.changed() == [], "removed file reported")
+
+
+def check_shipped_configs():
+    geometry = validate_analytics_config(os.path.join(APP_DIR, "config_nvdsanalytics.txt"))
+    check(0 in geometry and "Restricted Area" in geometry[0].rois.names, "shipped zones not loaded")
+    settings = load_compliance_settings(os.path.join(APP_DIR, "config_compliance.txt"))
+    check(settings == ComplianceSettings(), "shipped compliance config differs from the defaults")
+
+
+def check_reload(directory):
+    analytics_config = os.path.join(directory, "config_nvdsanalytics.txt")
+    ppe_rules = os.path.join(directory, "config_ppe_rules.txt")
+    compliance_config = os.path.join(directory, "config_compliance.txt")
+    for path in (analytics_config, ppe_rules, compliance_config):
+        shutil.copyfile(os.path.join(APP_DIR, os.path.basename(path)), path)
+    probe = _Probe(analytics_config, ppe_rules)
+    element = _Element()
+    # --zone-geometry pointing at the nvdsanalytics config, as main.py is usually run
+    reloader = ConfigReloader(probe, element, analytics_config, analytics_config, ppe_rules, compliance_config,
+                              (1920, 1080))
+
+    def poll_settled():
+        reloader.poll()
+        return reloader.poll()
+
+    # A polygon with two points: rejected, nothing staged
+    zone_engine = probe.zone_engine
+    edit(analytics_config, "roi-Restricted Area=1017;893;1296;671;1818;698;1747;920\n#remove",
+         "roi-Restricted Area=1017;893;1296;671\n#remove")
+    check(poll_settled() == [analytics_config], "edit not picked up")
+    reloader.apply_pending()
+    stats = reloader.stats()
+    check(stats["rejected"] == 1 and not stats["staged"] and "points" in stats["last_error"], "stats %s" % stats)
+    check(probe.zone_engine is zone_engine and not element.properties, "broken config applied")
+    check([name for name in os.listdir(directory) if name.endswith(".tmp")] == [], "staged copy left behind")
+
+    # Fixed and moved: the zones, the rules using them and the element switch together
+    track_store = probe.track_store
+    track_store.lookup(0, [7], 0)
+    edit(analytics_config, "roi-Restricted Area=1017;893;1296;671\n#remove",
+         "roi-Restricted Area=0;0;960;0;960;1080;0;1080\n#remove")
+    poll_settled()
+    check(probe.zone_engine is zone_engine, "swapped before apply_pending")
+    reloader.apply_pending()
+    check(probe.zone_engine is not zone_engine, "zone engine not swapped")
+    check(probe.track_store is not track_store and not len(probe.track_store), "tracks kept over moved ROIs")
+    check(probe.track_store.reeval_interval == track_store.reeval_interval, "track store settings not kept")
+    check(probe.zone_engine._previous is zone_engine._previous, "last positions not kept")
+    check(probe.ppe_engine.geometry is probe.zone_engine.geometry, "rules not rebuilt on the new zones")
+    first = element.properties.get("config-file")
+    check(first is not None and os.path.basename(first) == ".config_nvdsanalytics.txt.live1",
+          "element config %s" % first)
+    with open(first) as f:
+        check("roi-Restricted Area=0;0;960;0" in f.read(), "element not given the validated text")
+
+    track_store = probe.track_store
+    edit(analytics_config, "object-threshold=2", "object-threshold=3")
+    poll_settled()
+    reloader.apply_pending()
+    check(probe.track_store is track_store, "tracks dropped though the ROIs did not change")
+    second = element.properties["config-file"]
+    check(second != first and os.path.basename(second) == ".config_nvdsanalytics.txt.live0",
+          "live copy not alternated: %s" % second)
+
+    # A rule naming a line that does not exist is rejected, the rules stay
+    ppe_engine = probe.ppe_engine
+    edit(ppe_rules, "near-line=Entry;Exit", "near-line=Entry;Gate")
+    poll_settled()
+    reloader.apply_pending()
+    check(probe.ppe_engine is ppe_engine and reloader.stats()["rejected"] == 2, "broken rules applied")
+    edit(ppe_rules, "near-line=Entry;Gate", "near-line=Entry")
+    edit(compliance_config, "head-fraction=12", "head-fraction=10")
+    poll_settled()
+    reloader.apply_pending()
+    check(probe.ppe_engine is not ppe_engine and probe.compliance.head_fraction == 10, "valid edits not applied")
+    check(list(probe.ppe_engine.rules[2].lines) == ["Entry"], "new rules not applied")
+    check(probe.track_store is track_store, "tracks dropped though the restricted zone did not change")
+    edit(compliance_config, "restricted-zone=Restricted Area", "restricted-zone=Entry Area")
+    poll_settled()
+    reloader.apply_pending()
+    check(probe.compliance.zone_name == "Entry Area" and probe.track_store is not track_store,
+          "tracks kept over a new restricted zone")
+    stats = reloader.stats()
+    check(stats["staged"] == 4 and stats["applied"] == 4, "stats %s" % stats)
+
+
+def check_zone_limit(directory):
+    analytics_config = os.path.join(directory, "limit_nvdsanalytics.txt")
+    ppe_rules = os.path.join(directory, "limit_ppe_rules.txt")
+    shutil.copyfile(os.path.join(APP_DIR, "config_nvdsanalytics.txt"), analytics_config)
+    shutil.copyfile(os.path.join(APP_DIR, "config_ppe_rules.txt"), ppe_rules)
+    probe = _Probe(analytics_config, ppe_rules)
+    reloader = ConfigReloader(probe, None, analytics_config, analytics_config, ppe_rules, None, (1920, 1080))
+    zone_engine, ppe_engine = probe.zone_engine, probe.ppe_engine
+    interned = zone_names()
+    extra = ["Bay %d" % index for index in range(MAX_ZONE_NAMES)]
+
+    # One ROI per extra name: more names than mask bits
+    original = "roi-Restricted Area=1017;893;1296;671;1818;698;1747;920\n#remove"
+    edit(analytics_config, original,
+         "".join("roi-%s=0;0;10;0;10;10\n" % name for name in extra) + original)
+    reloader.poll()
+    reloader.poll()
+    reloader.apply_pending()
+    stats = reloader.stats()
+    check(stats["rejected"] == 1 and "at most %d" % MAX_ZONE_NAMES in stats["last_error"], "stats %s" % stats)
+    check(probe.zone_engine is zone_engine, "config over the zone limit applied")
+    check(zone_names() == interned, "names of a rejected config interned")
+
+    edit(ppe_rules, "zones=Restricted Area", "zones=Restricted Area;" + ";".join(extra))
+    reloader.poll()
+    reloader.poll()
+    reloader.apply_pending()
+    check(reloader.stats()["rejected"] == 2 and probe.ppe_engine is ppe_engine, "rules over the zone limit applied")
+    check(zone_names() == interned, "zones of rejected rules interned")
+
+    # Past the limit zone_bit() fails instead of returning an empty mask
+    for name in extra[:MAX_ZONE_NAMES - len(interned)]:
+        zone_bit(name)
+    try:
+        zone_bit(extra[-1])
+    except ValueError:
+        pass
+    else:
+        check(False, "zone_bit() gave a name past the limit a mask")
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            check_watcher(directory)
+            check_shipped_configs()
+            check_reload(directory)
+            check_zone_limit(directory)
+        except AssertionError as e:
+            sys.stderr.write("FAILED: %s\n" % e)
+            return 1
+    print("OK")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
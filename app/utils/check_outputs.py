@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+# Builds every combination of the --output branches of outputs.py with
+# stand_in_make() (stock elements for the tiler, OSD, converters, display
+# sinks and H.264 encoder) behind videotestsrc, runs each to EOS and asserts
+#   - the elements of the selected branches, and only those, are created
+#   - every sink of the selected branches receives buffers and the file
+#     branch writes a non-empty .mkv
+#   - with analytics next to a rendered output the render queue is leaky
+#     (drop oldest) with --render-queue-size buffers, and a pipeline
+#     description setting [queue-queue5] to a blocking 200 buffer queue is
+#     rejected with PipelineSpecError; without analytics it is applied
+#   - an element that cannot be created raises PipelineSpecError
+#
+# usage: python3 check_outputs.py [buffers]
+
+import configparser
+import os
+import sys
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GLib, Gst
+
+from outputs import (OUTPUT_ANALYTICS, OUTPUT_DISPLAY, OUTPUT_FILE, QUEUE_LEAK_DOWNSTREAM, STAND_IN_ENCODE_CAPS,
+                     OutputBuilder)
+from pipeline_spec import PipelineSpecError, parse_pipeline_spec, stand_in_make
+
+PIPELINE_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pipeline_config.txt')
+RENDER_QUEUE_SIZE = 3
+NUMBER_SOURCES = 4
+COMBINATIONS = [
+    {OUTPUT_ANALYTICS},
+    {OUTPUT_DISPLAY},
+    {OUTPUT_FILE},
+    {OUTPUT_ANALYTICS, OUTPUT_DISPLAY},
+    {OUTPUT_ANALYTICS, OUTPUT_FILE},
+    {OUTPUT_DISPLAY, OUTPUT_FILE},
+    {OUTPUT_ANALYTICS, OUTPUT_DISPLAY, OUTPUT_FILE},
+]
+RENDER_ELEMENTS = {"queue5", "nvtiler", "queue6", "convertor", "queue7", "onscreendisplay", "queue8"}
+FILE_ELEMENTS = {"encode-convertor", "encode-caps", "encoder", "encode-parser", "encode-muxer", "file-sink"}
+
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+def load_spec(blocking_queue5=False):
+    config = configparser.ConfigParser(interpolation=None)
+    config.optionxform = str
+    config.read(PIPELINE_CONFIG)
+    if blocking_queue5:
+        config["queue-queue5"] = {"max-size-buffers": "200", "leaky": "0"}
+    return parse_pipeline_spec(config)
+
+
+def expected_elements(modes):
+    render = modes & {OUTPUT_DISPLAY, OUTPUT_FILE}
+    names = set()
+    if OUTPUT_ANALYTICS in modes:
+        names |= {"analytics-queue", "analytics-sink"}
+        if render:
+            names.add("analytics-tee")
+    if render:
+        names |= RENDER_ELEMENTS
+    if OUTPUT_DISPLAY in modes:
+        names.add("nvvideo-renderer")
+    if OUTPUT_FILE in modes:
+        names |= FILE_ELEMENTS
+    if render == {OUTPUT_DISPLAY, OUTPUT_FILE}:
+        names |= {"render-tee", "encode-queue"}
+    return names
+
+
+def run_outputs(modes, spec, buffers, directory):
+    pipeline = Gst.Pipeline()
+    source = Gst.ElementFactory.make("videotestsrc", "source")
+    source.set_property("num-buffers", buffers)
+    analytics = Gst.ElementFactory.make("identity", "analytics")
+    pipeline.add(source)
+    pipeline.add(analytics)
+    source.link(analytics)
+    output_file = os.path.join(directory, "out-%s.mkv" % "-".join(sorted(modes)))
+    builder = OutputBuilder(pipeline, make=stand_in_make, encode_caps=STAND_IN_ENCODE_CAPS, spec=spec,
+                            strict_properties=False)
+    elements = builder.build(analytics, modes, NUMBER_SOURCES, output_file=output_file,
+                             render_queue_size=RENDER_QUEUE_SIZE)
+    label = "+".join(sorted(modes))
+    check(set(elements) == expected_elements(modes), "%s: created %s, expected %s"
+          % (label, sorted(elements), sorted(expected_elements(modes))))
+
+    queue5 = elements.get("queue5")
+    if queue5 is not None:
+        leaky = OUTPUT_ANALYTICS in modes
+        check((int(queue5.get_property("leaky")) == QUEUE_LEAK_DOWNSTREAM) == leaky,
+              "%s: queue5 leaky is %s" % (label, queue5.get_property("leaky")))
+        if leaky:
+            check(queue5.get_property("max-size-buffers") == RENDER_QUEUE_SIZE,
+                  "%s: queue5 holds %d buffers" % (label, queue5.get_property("max-size-buffers")))
+
+    counts = {}
+
+    def count_buffers(pad, info, name):
+        counts[name] += 1
+        return Gst.PadProbeReturn.OK
+
+    for name, element in elements.items():
+        if element.get_factory().get_name() in ("fakesink", "filesink"):
+            counts[name] = 0
+            element.get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, count_buffers, name)
+
+    loop = GLib.MainLoop()
+    bus = pipeline.get_bus()
+    bus.add_signal_watch()
+    errors = []
+
+    def on_message(bus, message):
+        if message.type == Gst.MessageType.ERROR:
+            errors.append(message.parse_error()[0].message)
+            loop.quit()
+        elif message.type == Gst.MessageType.EOS:
+            loop.quit()
+
+    bus.connect("message", on_message)
+    pipeline.set_state(Gst.State.PLAYING)
+    GLib.timeout_add_seconds(60, loop.quit)
+    loop.run()
+    pipeline.set_state(Gst.State.NULL)
+    check(not errors, "%s: pipeline error: %s" % (label, errors))
+    for name, count in counts.items():
+        check(count > 0, "%s: %s received no buffers" % (label, name))
+    if OUTPUT_FILE in modes:
+        check(os.path.exists(output_file) and os.path.getsize(output_file) > 0, "%s: %s is empty"
+              % (label, output_file))
+    return counts
+
+
+def check_blocking_queue5():
+    """A blocking [queue-queue5] conflicts only with the leaky render queue next to analytics."""
+    spec = load_spec(blocking_queue5=True)
+    for modes in COMBINATIONS:
+        pipeline = Gst.Pipeline()
+        analytics = Gst.ElementFactory.make("identity", "analytics")
+        pipeline.add(analytics)
+        builder = OutputBuilder(pipeline, make=stand_in_make, encode_caps=STAND_IN_ENCODE_CAPS, spec=spec,
+                                strict_properties=False)
+        label = "+".join(sorted(modes))
+        leaky = OUTPUT_ANALYTICS in modes and bool(modes & {OUTPUT_DISPLAY, OUTPUT_FILE})
+        try:
+            elements = builder.build(analytics, modes, NUMBER_SOURCES, render_queue_size=RENDER_QUEUE_SIZE)
+        except PipelineSpecError:
+            check(leaky, "%s: blocking [queue-queue5] rejected" % label)
+            continue
+        check(not leaky, "%s: blocking [queue-queue5] accepted next to the leaky render queue" % label)
+        if "queue5" in elements:
+            check(elements["queue5"].get_property("max-size-buffers") == 200,
+                  "%s: [queue-queue5] not applied" % label)
+
+
+def check_missing_element(spec):
+    def make(factory, name):
+        return None if factory == "nvdsosd" else stand_in_make(factory, name)
+
+    pipeline = Gst.Pipeline()
+    analytics = Gst.ElementFactory.make("identity", "analytics")
+    pipeline.add(analytics)
+    builder = OutputBuilder(pipeline, make=make, encode_caps=STAND_IN_ENCODE_CAPS, spec=spec,
+                            strict_properties=False)
+    try:
+        builder.build(analytics, {OUTPUT_DISPLAY}, NUMBER_SOURCES)
+    except PipelineSpecError:
+        return
+    check(False, "a missing nvdsosd did not raise PipelineSpecError")
+
+
+def main(args):
+    buffers = int(args[1]) if len(args) > 1 else 60
+    Gst.init(None)
+    spec = load_spec()
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            for modes in COMBINATIONS:
+                counts = run_outputs(modes, spec, buffers, directory)
+                print("%-24s %s" % ("+".join(sorted(modes)), counts))
+            check_blocking_queue5()
+            check_missing_element(spec)
+        except AssertionError as e:
+            sys.stderr.write("FAILED: %s\n" % e)
+            return 1
+    print("OK")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
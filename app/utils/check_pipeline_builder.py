@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+# Builds the chain of pipeline_config.txt with pipeline_spec.PipelineBuilder
+# and stock stand-ins for the DeepStream elements (pipeline_spec.STAND_INS),
+# fed by videotestsrc and closed with a fakesink. Asserts that the enabled
+# chain elements are linked in config order with every queue directly in
+# front of its element and carrying its [queue-*] settings, and that a
+# buffer probe on probe-element sees every buffer. The config is then built
+# again with an element appended after the probe element, which must not
+# move the probe.
+#
+# usage: python3 check_pipeline_builder.py [buffers]
+
+import configparser
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GLib, Gst
+
+from pipeline_spec import PIPELINE_SECTION, PipelineBuilder, parse_pipeline_spec, stand_in_make
+
+PIPELINE_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pipeline_config.txt')
+EXTRA_ELEMENT = "after-analytics"
+
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+def read_config(extra_element=False):
+    config = configparser.ConfigParser(interpolation=None)
+    config.optionxform = str
+    config.read(PIPELINE_CONFIG)
+    if extra_element:
+        pipeline = config[PIPELINE_SECTION]
+        pipeline["chain"] = pipeline["chain"] + ";" + EXTRA_ELEMENT
+        config["element-" + EXTRA_ELEMENT] = {"factory": "identity", "queue": "queue-extra"}
+    return config
+
+
+def expected_order(spec):
+    order = []
+    for element in spec.enabled_chain:
+        if element.queue:
+            order.append(element.queue)
+        order.append(element.name)
+    return order
+
+
+def linked_order(muxer):
+    """Names of the elements downstream of the muxer, following the src pads."""
+    order = []
+    pad = muxer.get_static_pad("src").get_peer()
+    while pad is not None:
+        element = pad.get_parent_element()
+        order.append(element.get_name())
+        src = element.get_static_pad("src")
+        pad = src.get_peer() if src is not None else None
+    return order
+
+
+def run_pipeline(config, buffers):
+    """Build, check and run one description; return the chain end and the probe's buffer count."""
+    spec = parse_pipeline_spec(config)
+    pipeline = Gst.Pipeline()
+    builder = PipelineBuilder(spec, make=stand_in_make, strict_properties=False)
+    chain_end = builder.build(pipeline)
+
+    order = linked_order(builder.muxer)
+    check(order == expected_order(spec), "linked %s, expected %s" % (order, expected_order(spec)))
+    for element in spec.enabled_chain:
+        if not element.queue:
+            continue
+        queue = builder.get(element.queue)
+        check(queue is not None, "queue %s not created" % element.queue)
+        peer = queue.get_static_pad("src").get_peer().get_parent_element()
+        check(peer is builder.get(element.name), "%s feeds %s, not %s" % (element.queue, peer.get_name(),
+                                                                         element.name))
+        for key, value in spec.queue_properties(element.queue).items():
+            check(str(queue.get_property(key)) == value, "%s %s is %s, not %s"
+                  % (element.queue, key, queue.get_property(key), value))
+
+    probe_element = builder.get(spec.probe_element)
+    check(probe_element is not None, "probe-element %s not created" % spec.probe_element)
+    counts = {"probe": 0}
+
+    def count_buffers(pad, info, counts):
+        counts["probe"] += 1
+        return Gst.PadProbeReturn.OK
+
+    probe_element.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, count_buffers, counts)
+
+    source = Gst.ElementFactory.make("videotestsrc", "source")
+    source.set_property("num-buffers", buffers)
+    sink = Gst.ElementFactory.make("fakesink", "sink")
+    sink.set_property("sync", False)
+    pipeline.add(source)
+    pipeline.add(sink)
+    check(source.link(builder.muxer), "unable to link the source to the muxer")
+    check(chain_end.link(sink), "unable to link the chain end to the sink")
+
+    loop = GLib.MainLoop()
+    bus = pipeline.get_bus()
+    bus.add_signal_watch()
+    errors = []
+
+    def on_message(bus, message):
+        if message.type == Gst.MessageType.ERROR:
+            errors.append(message.parse_error()[0].message)
+            loop.quit()
+        elif message.type == Gst.MessageType.EOS:
+            loop.quit()
+
+    bus.connect("message", on_message)
+    pipeline.set_state(Gst.State.PLAYING)
+    GLib.timeout_add_seconds(30, loop.quit)
+    loop.run()
+    pipeline.set_state(Gst.State.NULL)
+    check(not errors, "pipeline error: %s" % errors)
+    check(counts["probe"] == buffers, "probe-element saw %d of %d buffers" % (counts["probe"], buffers))
+    return spec, builder, chain_end
+
+
+def main(args):
+    buffers = int(args[1]) if len(args) > 1 else 30
+    Gst.init(None)
+    try:
+        spec, builder, chain_end = run_pipeline(read_config(), buffers)
+        check(chain_end is builder.get(spec.probe_element), "the shipped chain does not end at probe-element")
+        print("chain: %s" % " ! ".join(expected_order(spec)))
+
+        spec, builder, chain_end = run_pipeline(read_config(extra_element=True), buffers)
+        check(chain_end.get_name() == EXTRA_ELEMENT, "chain ends at %s" % chain_end.get_name())
+        check(builder.get(spec.probe_element).get_name() == spec.probe_element,
+              "probe moved off %s" % spec.probe_element)
+    except AssertionError as e:
+        sys.stderr.write("FAILED: %s\n" % e)
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+# Checks that PPE rule results persist per track like the helmet check's
+# verdicts, through AnalyticsProbe.evaluate() as the probe calls it:
+#   - a tracked subject is only re-tested every --reeval-interval frames and
+#     keeps its rule mask in between
+#   - a changed result only shows after the store's hysteresis
+#   - a stored mask only shows the rules that apply to the subject this frame
+#   - with --interval-aware, tracker-only frames reuse the stored results and
+#     are counted by IntervalStats
+#   - a reloaded rule set starts from empty tracks, since rule bits change
+#   - head region rules use the head-fraction of --compliance-config
+#   - alert events name the broken rules, and a new set of them alerts again
+#
+# usage: python3 check_ppe_rules.py
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pyds_stand_in
+
+pyds_stand_in.install()
+
+from alerts import ALERT_RULE_VIOLATION, AlertDetector
+from analytics_probe import AnalyticsProbe
+from compliance import RESTRICTED_AREA, ComplianceSettings
+from frame_arrays import FrameObjects
+from inference_interval import IntervalStats
+from ppe_rules import RuleEngine, load_ppe_rules
+from track_state import UNTRACKED_OBJECT_ID, TrackStateStore
+from zones import load_zone_geometry
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+ANALYTICS_CONFIG = os.path.join(APP_DIR, 'config_nvdsanalytics.txt')
+PPE_RULES = os.path.join(APP_DIR, 'config_ppe_rules.txt')
+REEVAL_INTERVAL = 5
+HYSTERESIS = 3
+PERSON_ID = 7
+
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+def frame(frame_num, helmet, in_zone=True, inferred=True, helmet_top=304):
+    """A PeopleNet person of stream 0, with a YOLO helmet on the head if helmet is set."""
+    rows = [(1000, 300, 80, 240, "person", 0, 1, PERSON_ID, 0.9 if inferred else -0.1,
+             (RESTRICTED_AREA,) if in_zone else (), ())]
+    if helmet:
+        rows.append((1028, helmet_top, 24, 18, "Helmet", 0, 2, UNTRACKED_OBJECT_ID, 0.8, (), ()))
+    return FrameObjects.from_rows(0, frame_num, rows)
+
+
+def make_probe():
+    probe = AnalyticsProbe(None, TrackStateStore(reeval_interval=REEVAL_INTERVAL, hysteresis=HYSTERESIS))
+    probe.ppe_engine = RuleEngine(load_ppe_rules(PPE_RULES), load_zone_geometry(ANALYTICS_CONFIG, 1920, 1080))
+    return probe
+
+
+def evaluate(probe, frame):
+    return probe.evaluate(frame, probe.ppe_engine, probe.compliance)
+
+
+def rule_bits(engine, *names):
+    return sum(rule.bit for rule in engine.rules if rule.name in names)
+
+
+def check_persistence():
+    probe = make_probe()
+    engine = probe.ppe_engine
+    both = rule_bits(engine, "helmet", "vest")
+    vest = rule_bits(engine, "vest")
+    masks, evaluated = [], []
+    # The helmet shows up at frame 10; the vest never does
+    for frame_num in range(20):
+        verdict = evaluate(probe, frame(frame_num, frame_num >= 10))
+        masks.append(int(verdict.violations[0]))
+        evaluated.append(verdict.evaluated_count)
+    check(evaluated[:10] == [1, 0, 0, 0, 0] * 2, "tested on frames %s before the helmet" % evaluated[:10])
+    flip = 10 + HYSTERESIS - 1
+    check(masks[:flip] == [both] * flip and masks[flip:] == [vest] * (20 - flip),
+          "masks %s, expected the helmet rule to clear at frame %d" % (masks, flip))
+
+    # Out of the restricted area neither stored rule applies
+    verdict = evaluate(probe, frame(20, False, in_zone=False))
+    check(not verdict.alert_count and not verdict.violations.any(), "stored rules shown out of their zone")
+
+
+def check_interval_aware():
+    probe = make_probe()
+    probe.interval_stats = IntervalStats()
+    engine = probe.ppe_engine
+    both = rule_bits(engine, "helmet", "vest")
+    evaluate(probe, frame(0, False))
+    # A helmet seen on tracker-only frames is not tested until the next inferred frame
+    for frame_num in range(1, 4):
+        verdict = evaluate(probe, frame(frame_num, True, inferred=False))
+        check(int(verdict.violations[0]) == both and verdict.reused_count == 1,
+              "tracker-only frame %d re-tested" % frame_num)
+    stats = probe.interval_stats.snapshot()[0]
+    check(stats["inferred_frames"] == 1 and stats["tracked_frames"] == 3 and stats["associations_skipped"] == 3,
+          "interval stats %s" % stats)
+
+
+def check_reload():
+    probe = make_probe()
+    for frame_num in range(3):
+        evaluate(probe, frame(frame_num, False))
+    check(len(probe.track_store) == 1, "track not stored")
+    probe.ppe_engine = RuleEngine(load_ppe_rules(PPE_RULES), probe.ppe_engine.geometry)
+    verdict = evaluate(probe, frame(3, True))
+    check(verdict.evaluated_count == 1 and int(verdict.violations[0]) == rule_bits(probe.ppe_engine, "vest"),
+          "reloaded rules used the stored mask: %d" % int(verdict.violations[0]))
+
+
+def check_head_fraction():
+    probe = make_probe()
+    engine = probe.ppe_engine
+    # A helmet a quarter of the way down the box: off the head point at the
+    # default head-fraction of 12, on it at 4
+    low_helmet = frame(0, True, helmet_top=351)
+    verdict = evaluate(probe, low_helmet)
+    check(int(verdict.violations[0]) == rule_bits(engine, "helmet", "vest"), "low helmet on the default head")
+    probe = make_probe()
+    probe.compliance = ComplianceSettings(head_fraction=4)
+    verdict = evaluate(probe, low_helmet)
+    check(int(verdict.violations[0]) == rule_bits(probe.ppe_engine, "vest"),
+          "head-fraction 4 not used by the helmet rule: %d" % int(verdict.violations[0]))
+
+
+def check_alert_events():
+    probe = make_probe()
+    detector = AlertDetector()
+    events = []
+    for frame_num in range(20):
+        current = frame(frame_num, frame_num >= 10)
+        events.extend(detector.detect(current, evaluate(probe, current), probe.ppe_engine))
+    rules = [(event["type"], event["rules"]) for event in events]
+    check(rules == [(ALERT_RULE_VIOLATION, ["helmet", "vest"]), (ALERT_RULE_VIOLATION, ["vest"])],
+          "alert events %s" % rules)
+
+
+def main(args):
+    try:
+        check_persistence()
+        check_interval_aware()
+        check_reload()
+        check_head_fraction()
+        check_alert_events()
+    except AssertionError as e:
+        sys.stderr.write("FAILED: %s\n" % e)
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+# Checks the split probe mode (probe_worker.py) under overload, on the pyds
+# stand-in and the synthetic batches of bench_probe.py.
+#
+# The queue check submits records every SUBMIT_SECONDS to a ProbeWorker
+# whose handler takes four times as long, so its DropOldestQueue fills, and
+# asserts that
+#   - records are dropped, and every record is either handled, dropped or
+#     still queued
+#   - the p99 time of submit() on the submitting thread stays below
+#     ENQUEUE_P99_MS
+#
+# The probe check runs an AnalyticsProbe in split mode with a slow worker
+# and asserts that
+#   - FPS counts every frame of every batch although the queue drops records
+#   - the helmet association only ever runs on the worker thread
+#   - every violator styled from the published track verdicts is one the
+#     inline probe finds on the same batches
+#
+# usage: python3 check_probe_worker.py [records]
+
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bench_probe import ANALYTICS_CONFIG, FRAME_HEIGHT, FRAME_WIDTH, PGIE_CONFIG, SCENARIOS, BatchSource, make_probe
+
+from inference_interval import pgie_settings
+from probe_worker import FrameRecord, ProbeWorker
+from zones import load_zone_geometry
+
+QUEUE_SIZE = 16
+# Time the worker's handler spends on every record
+HANDLER_SECONDS = 0.002
+SUBMIT_SECONDS = HANDLER_SECONDS / 4
+ENQUEUE_P99_MS = 1.0
+PROBE_SCENARIO = "site-16"
+PROBE_BATCHES = 60
+
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+def slow_handler(record):
+    time.sleep(HANDLER_SECONDS)
+
+
+def check_queue(records):
+    worker = ProbeWorker(QUEUE_SIZE)
+    worker.add_handler(slow_handler)
+    worker.start()
+    latencies = np.empty(records)
+    due = time.perf_counter()
+    for index in range(records):
+        record = FrameRecord(index % 4, index, 3, 1, index % 2)
+        while time.perf_counter() < due:
+            pass
+        start = time.perf_counter()
+        worker.submit(record)
+        latencies[index] = time.perf_counter() - start
+        due = start + SUBMIT_SECONDS
+    worker.stop()
+    stats = worker.queue.stats()
+    p99_ms = float(np.percentile(latencies, 99)) * 1000.0
+    print("queue: %d submitted, %d handled, %d dropped, %d left, submit p99 %.3f ms, max %.3f ms"
+          % (stats["enqueued"], stats["dequeued"], stats["dropped"], stats["depth"], p99_ms,
+             latencies.max() * 1000.0))
+    check(stats["enqueued"] == records, "%d of %d records enqueued" % (stats["enqueued"], records))
+    check(stats["dropped"] > 0, "the queue never filled")
+    check(stats["dequeued"] + stats["dropped"] + stats["depth"] == records,
+          "handled %d + dropped %d + queued %d != %d submitted"
+          % (stats["dequeued"], stats["dropped"], stats["depth"], records))
+    check(p99_ms < ENQUEUE_P99_MS, "submit p99 %.3f ms, limit %.1f ms" % (p99_ms, ENQUEUE_P99_MS))
+
+
+def styled_violators(batch):
+    """(stream, object id) of the objects of a processed batch painted as violators."""
+    found = set()
+    for frame in batch:
+        for obj_meta in frame.obj_metas:
+            if obj_meta.rect_params.border_color.red == 1.0:
+                found.add((frame.stream_id, obj_meta.object_id))
+    return found
+
+
+def check_probe():
+    geometry = load_zone_geometry(ANALYTICS_CONFIG, FRAME_WIDTH, FRAME_HEIGHT)
+    pgie_unique_id, interval = pgie_settings(PGIE_CONFIG)
+    scenario = SCENARIOS[PROBE_SCENARIO]
+
+    # The violators the probe finds without the worker
+    inline = make_probe("default", geometry, scenario["streams"], pgie_unique_id)
+    source = BatchSource(scenario, geometry, interval)
+    expected = set()
+    for _ in range(PROBE_BATCHES):
+        expected |= styled_violators(inline.process_batch(source.next_batch()))
+
+    probe = make_probe("default", geometry, scenario["streams"], pgie_unique_id)
+    worker = probe.probe_worker = ProbeWorker(QUEUE_SIZE)
+    worker.add_handler(slow_handler)
+    threads = set()
+    evaluate = probe.evaluate
+
+    def evaluate_on(frame, ppe_engine, compliance):
+        threads.add(threading.current_thread().name)
+        return evaluate(frame, ppe_engine, compliance)
+
+    probe.evaluate = evaluate_on
+    worker.start()
+    source = BatchSource(scenario, geometry, interval)
+    frames = 0
+    styled = set()
+    for _ in range(PROBE_BATCHES):
+        batch = probe.process_batch(source.next_batch())
+        frames += len(batch)
+        styled |= styled_violators(batch)
+    worker.stop()
+    stats = worker.queue.stats()
+    counted = sum(probe.perf_data.frames.values())
+    print("probe: %d frames, %d counted for FPS, %d records dropped, association on %s, %d violators styled "
+          "(%d inline)" % (frames, counted, stats["dropped"], sorted(threads), len(styled), len(expected)))
+    check(stats["dropped"] > 0, "the probe queue never filled")
+    check(counted == frames, "FPS counted %d of %d frames" % (counted, frames))
+    check(threads == {worker.name}, "association ran on %s" % sorted(threads))
+    check(styled, "no violator styled in split mode")
+    check(styled <= expected, "violators styled in split mode only: %s" % sorted(styled - expected)[:5])
+
+
+def main(args):
+    records = int(args[1]) if len(args) > 1 else 2000
+    try:
+        check_queue(records)
+        check_probe()
+    except AssertionError as e:
+        sys.stderr.write("FAILED: %s\n" % e)
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+# Checks the sharded deployment without GPUs: shard planning, the per-worker
+# nvdsanalytics configs (each worker's compiled zones must equal the global
+# zones of its streams), the per-worker PPE rules (each rule must apply to
+# the local ids of its global streams only, keeping its bit), metrics merging, per-worker option rewriting, the
+# global stream ids of a worker's per-stream outputs, and a supervisor run on a stand-in worker that crashes once, must be restarted
+# and then reports metrics for its local streams until it is stopped.
+#
+# usage: python3 check_sharding.py
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+
+from alerts import AlertDetector
+from compliance import VERDICT_NO_HELMET, FrameVerdict
+from frame_arrays import FrameObjects
+from inference_interval import IntervalStats
+from ppe_rules import load_ppe_rules
+from sharding import (merge_metrics, parse_cpu_sets, plan_shards, read_json, remap_analytics_config,
+                      remap_ppe_rules)
+from supervisor import Supervisor, Worker, worker_options
+from timeseries import TimeSeriesStore
+from zones import load_zone_geometry
+
+CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config_nvdsanalytics.txt')
+PPE_RULES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config_ppe_rules.txt')
+
+# Writes one FPS entry per local stream; the first run of each worker crashes
+STAND_IN_WORKER = """
+import json, os, sys, time
+options = sys.argv[1:]
+metrics = options[options.index("--metrics-file") + 1]
+uris = options[options.index("--metrics-file") + 2:]
+marker = metrics + ".crashed"
+if not os.path.exists(marker):
+    open(marker, "w").close()
+    sys.exit(3)
+try:
+    while True:
+        with open(metrics + ".tmp", "w") as f:
+            json.dump({"time": time.time(), "pid": os.getpid(),
+                       "fps": {"stream%d" % i: 25.0 for i in range(len(uris))},
+                       "alerts": {"events": len(uris)}, "latency": {}}, f)
+        os.replace(metrics + ".tmp", metrics)
+        time.sleep(0.1)
+except KeyboardInterrupt:
+    pass
+"""
+
+
+def same_tables(a, b):
+    return (a.names == b.names and all(np.allclose(getattr(a, field), getattr(b, field))
+                                       for field in ("x1", "y1", "x2", "y2")))
+
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+def check_plan():
+    uris = ["file:///video%d.mp4" % i for i in range(7)]
+    shards = plan_shards(uris, 3, parse_cpu_sets("0-1:2,3"), [0, 1])
+    check([shard.stream_ids for shard in shards] == [[0, 1, 2], [3, 4], [5, 6]], "unbalanced shards")
+    check([uri for shard in shards for uri in shard.uris] == uris, "uris lost or reordered")
+    check([shard.cpus for shard in shards] == [{0, 1}, {2, 3}, {0, 1}], "cpu sets not round robin")
+    check([shard.gpu_id for shard in shards] == [0, 1, 0], "gpus not round robin")
+    check(len(plan_shards(uris[:2], 4)) == 2, "more workers than streams")
+
+
+def check_remap(directory):
+    geometry = load_zone_geometry(CONFIG)
+    for stream_ids in ([1], [1, 0], [5, 0]):
+        path = remap_analytics_config(CONFIG, stream_ids, os.path.join(directory, "remapped.txt"))
+        remapped = load_zone_geometry(path)
+        expected = {local: geometry[stream] for local, stream in enumerate(stream_ids) if stream in geometry}
+        check(sorted(remapped) == sorted(expected), "streams %s remapped to %s" % (stream_ids, sorted(remapped)))
+        for local, stream in expected.items():
+            for table in ("rois", "overcrowding"):
+                check(same_tables(getattr(remapped[local], table), getattr(stream, table)),
+                      "%s of stream %d differ" % (table, local))
+            check(remapped[local].lines.names == stream.lines.names, "lines of stream %d differ" % local)
+            check(remapped[local].inverse_roi == stream.inverse_roi, "inverse-roi of stream %d differs" % local)
+
+
+def check_ppe_rules(directory):
+    path = os.path.join(directory, "rules.txt")
+    with open(PPE_RULES) as f:
+        text = f.read()
+    with open(path, "w") as f:
+        # The vest rule on global streams 0 and 3, the phone rule on stream 4
+        f.write(text.replace("streams=0", "streams=0;3").replace("near-distance=150",
+                                                                 "near-distance=150\nstreams=4"))
+    rules = load_ppe_rules(path)
+    for stream_ids in ([0, 1, 2], [3, 4], [5, 6]):
+        remapped = load_ppe_rules(remap_ppe_rules(path, stream_ids, os.path.join(directory, "remapped.txt")))
+        check([rule.name for rule in remapped] == [rule.name for rule in rules], "rules of %s renumbered" % stream_ids)
+        for rule, local in zip(rules, remapped):
+            applies = [rule.applies_to(stream) for stream in stream_ids]
+            local_applies = [local.applies_to(index) for index in range(len(stream_ids))]
+            check(local_applies == applies, "rule %s applies to %s of streams %s, expected %s"
+                  % (rule.name, local_applies, stream_ids, applies))
+
+
+def check_merge():
+    shards = plan_shards(["a", "b", "c"], 2)
+    merged = merge_metrics(shards, {
+        0: {"time": 1.0, "fps": {"stream0": 25.0, "stream1": 24.0}, "alerts": {"events": 2},
+            "latency": {"stream1": {"p50_us": 10.0}}},
+        1: {"time": 2.0, "fps": {"stream0": 12.5}, "alerts": {"events": 3}, "latency": {}},
+    })
+    check(merged["fps"] == {"stream0": 25.0, "stream1": 24.0, "stream2": 12.5}, "fps %s" % merged["fps"])
+    check(merged["latency"] == {"stream1": {"p50_us": 10.0}}, "latency %s" % merged["latency"])
+    check(merged["alerts"] == {"events": 5}, "alerts %s" % merged["alerts"])
+
+
+def check_options():
+    options = ["--alert-log", "alerts.jsonl", "--trace-port=8000", "--control-port", "0",
+               "--zone-geometry", "zones.txt", "--ppe-rules=rules.txt", "--split-probe"]
+    rewritten = worker_options(options, 2, lambda option, path: "worker/%s/%s" % (option, path))
+    check(rewritten == ["--alert-log", "alerts.worker2.jsonl", "--trace-port=8002", "--control-port", "0",
+                        "--zone-geometry", "worker/--zone-geometry/zones.txt",
+                        "--ppe-rules=worker/--ppe-rules/rules.txt", "--split-probe"], "options %s" % rewritten)
+
+
+def check_stream_offset(directory):
+    shards = plan_shards(["test://%d" % i for i in range(5)], 2)
+    command = Worker(shards[1], directory, CONFIG, []).command()
+    offset = int(command[command.index("--stream-offset") + 1])
+    check(offset == shards[1].stream_ids[0], "worker of streams %s got --stream-offset %d"
+          % (shards[1].stream_ids, offset))
+
+    # Local stream 1 of that worker must show up as its global id
+    global_id = offset + 1
+    rows = [(100, 100, 50, 120, "person", 0, 1, 7, 0.9, (), ())]
+    frame = FrameObjects.from_rows(1, 10, rows)
+    frame.line_counts = {"entry": 3}
+    verdict = FrameVerdict(np.array([VERDICT_NO_HELMET]), 1, 0, 1)
+    detector = AlertDetector(stream_offset=offset)
+    detector.detect(frame, verdict)
+    frame.line_counts = {"entry": 4}
+    events = detector.detect(frame, verdict)
+    check([event["stream_id"] for event in events] == [global_id], "alert events %s" % events)
+    store = TimeSeriesStore(stream_offset=offset)
+    store.observe(frame, verdict)
+    check(store.channels and all(key[0] == global_id for key in store.channels), "time series channels %s" % list(store.channels))
+    stats = IntervalStats(offset)
+    stats.record(1, True, 0.001, verdict)
+    check(list(stats.snapshot()) == [global_id], "interval stats of %s" % list(stats.snapshot()))
+
+
+def check_supervisor(directory):
+    stand_in = os.path.join(directory, "stand_in_worker.py")
+    with open(stand_in, "w") as f:
+        f.write(STAND_IN_WORKER)
+    shards = plan_shards(["test://%d" % i for i in range(5)], 2)
+    workers = [Worker(shard, directory, CONFIG, [], main=stand_in) for shard in shards]
+    supervisor = Supervisor(workers)
+    supervisor.start()
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        now = time.monotonic()
+        for worker in workers:
+            worker.poll(now)
+        merged = supervisor.collect()
+        if len(merged["fps"]) == 5:
+            break
+        time.sleep(0.1)
+    supervisor.stop()
+    check(sorted(merged["fps"]) == ["stream%d" % i for i in range(5)], "fps of %s" % sorted(merged["fps"]))
+    check(merged["alerts"] == {"events": 5}, "alerts %s" % merged["alerts"])
+    check(all(worker.restarts == 1 and worker.last_exit == 3 for worker in workers), "workers not restarted once")
+    check(all(read_json(worker.metrics_path) is not None for worker in workers), "metrics files missing")
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            check_plan()
+            check_remap(directory)
+            check_ppe_rules(directory)
+            check_merge()
+            check_options()
+            check_stream_offset(directory)
+            check_supervisor(directory)
+        except AssertionError as e:
+            sys.stderr.write("FAILED: %s\n" % e)
+            return 1
+    print("OK")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+# Checks the evidence snapshot path on synthetic RGBA frames instead of GPU
+# surfaces: violators are captured once per track per cooldown, at most
+# max_per_batch per batch with the rest deferred, captures finding the slot
+# pool busy are dropped and counted, crops larger than a slot are subsampled,
+# and the files the process pool writes hold exactly the cropped pixels.
+# JPEG output is checked too when OpenCV is installed. Reports the time the
+# streaming thread spends per capture.
+#
+# usage: python3 check_snapshots.py
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+
+from compliance import VERDICT_HELMET, VERDICT_NO_HELMET, FrameVerdict
+from frame_arrays import FrameObjects
+from snapshots import SnapshotCapture, crop_rect
+from track_state import UNTRACKED_OBJECT_ID
+
+WIDTH = 1920
+HEIGHT = 1080
+# left, top, width, height, object id, verdict
+PERSONS = [
+    (100, 200, 120, 300, 1, VERDICT_NO_HELMET),
+    (700, 150, 90, 260, 2, VERDICT_NO_HELMET),
+    (1800, 900, 200, 300, 3, VERDICT_NO_HELMET),
+    (1200, 300, 100, 250, 4, VERDICT_HELMET),
+    (400, 500, 100, 250, UNTRACKED_OBJECT_ID, VERDICT_NO_HELMET),
+]
+
+
+class _Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+def make_image():
+    y, x = np.mgrid[0:HEIGHT, 0:WIDTH]
+    image = np.empty((HEIGHT, WIDTH, 4), dtype=np.uint8)
+    image[..., 0] = x % 251
+    image[..., 1] = y % 241
+    image[..., 2] = (x + y) % 239
+    image[..., 3] = 255
+    return image
+
+
+def make_frame(persons, frame_num=0):
+    rows = [(left, top, width, height, "Person", 0, 0, object_id, 0.9, (), ())
+            for left, top, width, height, object_id, _ in persons]
+    frame = FrameObjects.from_rows(0, frame_num, rows)
+    verdict = FrameVerdict(np.array([verdict for *_, verdict in persons], dtype=np.uint8), len(persons), 0,
+                           sum(verdict == VERDICT_NO_HELMET for *_, verdict in persons))
+    return frame, verdict
+
+
+def run_batch(snapshots, frame, verdict, image):
+    snapshots.begin_batch()
+    due = snapshots.due(frame, verdict)
+    if due:
+        snapshots.capture(frame, due, image)
+    return due
+
+
+def wait_written(snapshots, timeout=30):
+    deadline = time.monotonic() + timeout
+    while snapshots.pool.in_use and time.monotonic() < deadline:
+        time.sleep(0.01)
+    check(not snapshots.pool.in_use, "writes still pending after %d s" % timeout)
+
+
+def written(directory):
+    stream_dir = os.path.join(directory, "stream0")
+    return sorted(os.listdir(stream_dir)) if os.path.isdir(stream_dir) else []
+
+
+def check_rate_limits(directory, image):
+    clock = _Clock(1000.0)
+    snapshots = SnapshotCapture(directory, cooldown=10, max_per_batch=2, slots=3, processes=1,
+                                image_format="npy", clock=clock)
+    try:
+        frame, verdict = make_frame(PERSONS)
+        check(run_batch(snapshots, frame, verdict, image) == [0, 1, 2], "untracked or compliant persons due")
+        check(snapshots.stats()["captured"] == 2 and snapshots.stats()["deferred"] == 1, "batch budget ignored")
+        check(run_batch(snapshots, frame, verdict, image) == [2], "deferred violator not due on the next batch")
+        check(run_batch(snapshots, frame, verdict, image) == [], "captured tracks due within the cooldown")
+        wait_written(snapshots)
+        clock.now += 10
+        check(run_batch(snapshots, frame, verdict, image) == [0, 1, 2], "tracks not due after the cooldown")
+        wait_written(snapshots)
+
+        # No free slot: the captures are dropped, not queued
+        held = [snapshots.pool.acquire() for _ in range(3)]
+        clock.now += 10
+        run_batch(snapshots, frame, verdict, image)
+        check(snapshots.stats()["dropped"] == 3, "busy pool captures not dropped: %s" % snapshots.stats())
+        for slot in held:
+            snapshots.pool.release(slot)
+        check(run_batch(snapshots, frame, verdict, image) == [0, 1, 2], "dropped captures not due again")
+        wait_written(snapshots)
+        stats = snapshots.stats()
+        check(stats["written"] == stats["captured"] == 7 and not stats["failed"], "stats %s" % stats)
+    finally:
+        snapshots.close()
+
+    files = written(directory)
+    check(len(files) == 7, "%d files written" % len(files))
+    for name in files:
+        object_id = int(name.split("_")[2].split(".")[0])
+        left, top, width, height = PERSONS[object_id - 1][:4]
+        x1, y1, x2, y2 = crop_rect((left, top, width, height), snapshots.margin, WIDTH, HEIGHT)
+        pixels = np.load(os.path.join(directory, "stream0", name))
+        check(np.array_equal(pixels, image[y1:y2, x1:x2]), "%s does not hold the crop" % name)
+
+
+def check_large_crop(directory, image):
+    snapshots = SnapshotCapture(directory, max_crop=(64, 64), slots=1, processes=1, image_format="npy")
+    try:
+        frame, verdict = make_frame([(0, 0, 500, 700, 9, VERDICT_NO_HELMET)])
+        run_batch(snapshots, frame, verdict, image)
+        wait_written(snapshots)
+    finally:
+        snapshots.close()
+    x1, y1, x2, y2 = crop_rect((0, 0, 500, 700), snapshots.margin, WIDTH, HEIGHT)
+    pixels = np.load(os.path.join(directory, "stream0", written(directory)[0]))
+    step = -(-(y2 - y1) // 64)
+    check(np.array_equal(pixels, image[y1:y2:step, x1:x2:step]), "large crop not subsampled")
+
+
+def check_jpeg(directory, image):
+    try:
+        import cv2
+    except ImportError:
+        print("OpenCV not installed, JPEG encoding not checked")
+        return
+    snapshots = SnapshotCapture(directory, processes=1)
+    try:
+        frame, verdict = make_frame(PERSONS[:1])
+        run_batch(snapshots, frame, verdict, image)
+        wait_written(snapshots)
+    finally:
+        snapshots.close()
+    decoded = cv2.imread(os.path.join(directory, "stream0", written(directory)[0]))
+    x1, y1, x2, y2 = crop_rect(PERSONS[0][:4], snapshots.margin, WIDTH, HEIGHT)
+    check(decoded is not None and decoded.shape == (y2 - y1, x2 - x1, 3), "JPEG not decodable")
+    expected = image[y1:y2, x1:x2, 2::-1].astype(np.int16)
+    check(np.abs(decoded.astype(np.int16) - expected).mean() < 8, "JPEG pixels differ")
+
+
+def measure(directory, image):
+    clock = _Clock(0.0)
+    snapshots = SnapshotCapture(directory, cooldown=0, max_per_batch=4, slots=64, image_format="npy",
+                                clock=clock)
+    frame, verdict = make_frame(PERSONS[:3])
+    elapsed = 0.0
+    captures = 0
+    try:
+        for _ in range(50):
+            clock.now += 1
+            begin = time.perf_counter()
+            run_batch(snapshots, frame, verdict, image)
+            elapsed += time.perf_counter() - begin
+            captures += 3
+            wait_written(snapshots)
+    finally:
+        snapshots.close()
+    return 1e6 * elapsed / captures
+
+
+def main(args):
+    image = make_image()
+    try:
+        for step in (check_rate_limits, check_large_crop, check_jpeg):
+            with tempfile.TemporaryDirectory() as directory:
+                step(directory, image)
+        with tempfile.TemporaryDirectory() as directory:
+            print("capture %.1f us per violator on the streaming thread" % measure(directory, image))
+    except AssertionError as e:
+        sys.stderr.write("FAILED: %s\n" % e)
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
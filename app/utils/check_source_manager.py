@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+# Drives source_manager.SourceManager on a running stand-in pipeline:
+#   source bins ! funnel (standing in for nvstreammux) ! fakesink
+# with stand_in_source_bin() bins: a live videotestsrc, a short MJPEG/AVI
+# file written first and decoded in its bin, and an rtsp:// source whose bin
+# reads a missing file, so it errors out after every attach. The script adds
+# and removes sources while buffers flow and asserts that
+#   - every added source delivers buffers through its own muxer request pad
+#   - a removed source's request pad is released and its slot reused
+#   - a removed source keeps its PERF_DATA slot, so batches of it still
+#     queued downstream of the muxer can update its FPS, until the id is reused
+#   - the failing source is detached (pad released) after each error and
+#     re-attached after 1, 2, 4, 4 s (backoff doubling up to the maximum)
+#   - removing it cancels the pending reconnect
+#
+# usage: python3 check_source_manager.py
+
+import os
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(APP_DIR)
+# common/ of the DeepStream Python apps, as main.py finds it
+sys.path.append(os.path.join(APP_DIR, '..'))
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GLib, Gst
+
+from source_manager import SourceManager, stand_in_source_bin
+
+MAX_SOURCES = 4
+RECONNECT_MIN = 1
+RECONNECT_MAX = 4
+FAILING_URI = "rtsp://stand-in/camera"
+EXPECTED_BACKOFFS = [1, 2, 4, 4]
+# timeout_add_seconds() may fire up to a second late
+BACKOFF_SLACK = 1.2
+
+
+class _PerfData:
+    """The part of common.FPS.PERF_DATA the manager touches."""
+
+    def __init__(self):
+        self.all_stream_fps = {}
+
+    def update_fps(self, stream_index):
+        self.all_stream_fps[stream_index].update_fps()
+
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+def write_sample_video(path, frames=60):
+    pipeline = Gst.parse_launch(
+        "videotestsrc num-buffers=%d ! video/x-raw,width=320,height=240,framerate=30/1 ! jpegenc ! "
+        "avimux ! filesink location=%s" % (frames, path))
+    pipeline.set_state(Gst.State.PLAYING)
+    message = pipeline.get_bus().timed_pop_filtered(30 * Gst.SECOND, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    pipeline.set_state(Gst.State.NULL)
+    check(message is not None and message.type == Gst.MessageType.EOS, "unable to write %s" % path)
+
+
+class Harness:
+    """The stand-in pipeline, its manager and what the script observed."""
+
+    def __init__(self, directory):
+        self.missing = os.path.join(directory, "missing.avi")
+        self.pipeline = Gst.Pipeline()
+        self.mux = Gst.ElementFactory.make("funnel", "stand-in-mux")
+        sink = Gst.ElementFactory.make("fakesink", "sink")
+        sink.set_property("sync", False)
+        self.pipeline.add(self.mux)
+        self.pipeline.add(sink)
+        self.mux.link(sink)
+        self.perf_data = _PerfData()
+        self.manager = SourceManager(self.pipeline, self.mux, self.perf_data, MAX_SOURCES, self.make_source_bin,
+                                     RECONNECT_MIN, RECONNECT_MAX)
+        self.buffers = {}
+        self.failing_attaches = []
+        self.loop = GLib.MainLoop()
+        self.failure = None
+
+    def make_source_bin(self, index, uri):
+        if uri == FAILING_URI:
+            check(self.mux.get_static_pad("sink_%u" % index) is None,
+                  "pad of source %d not released before its re-attach" % index)
+            self.failing_attaches.append(time.monotonic())
+            uri = self.missing
+        source_bin = stand_in_source_bin(index, uri)
+        self.buffers[index] = 0
+        source_bin.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self.count_buffer, index)
+        return source_bin
+
+    def count_buffer(self, pad, info, index):
+        self.buffers[index] = self.buffers.get(index, 0) + 1
+        return Gst.PadProbeReturn.OK
+
+    def bus_call(self, bus, message, loop):
+        if message.type == Gst.MessageType.ERROR:
+            self.failure = "pipeline error: %s" % message.parse_error()[0].message
+            loop.quit()
+        return True
+
+    def step(self, fn):
+        """GLib callback running one scripted step; stops the loop on a failed check."""
+        def run():
+            try:
+                fn()
+            except AssertionError as e:
+                self.failure = str(e)
+                self.loop.quit()
+            return False
+        return run
+
+    def at(self, seconds, fn):
+        GLib.timeout_add(int(seconds * 1000), self.step(fn))
+
+
+def main(args):
+    Gst.init(None)
+    with tempfile.TemporaryDirectory() as directory:
+        sample = os.path.join(directory, "sample.avi")
+        try:
+            write_sample_video(sample)
+        except AssertionError as e:
+            sys.stderr.write("FAILED: %s\n" % e)
+            return 1
+        harness = Harness(directory)
+        manager = harness.manager
+        mux = harness.mux
+        ids = {}
+        removed_slots = {}
+
+        bus = harness.pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect("message", manager.bus_call, harness.loop, harness.bus_call)
+        ids["test"] = manager.add_source("test://0")
+
+        def add_more():
+            ids["file"] = manager.add_source("file://" + sample)
+            ids["failing"] = manager.add_source(FAILING_URI)
+            check(None not in ids.values(), "sources not added: %s" % ids)
+
+        def flowing():
+            for name in ("test", "file"):
+                check(harness.buffers.get(ids[name], 0) > 0, "no buffers from the %s source" % name)
+            check(len(manager.list_sources()) == 3, "sources %s" % manager.list_sources())
+
+        def remove_test():
+            pads = len(mux.sinkpads)
+            check(manager.remove_source(ids["test"]), "test source not removed")
+            check(mux.get_static_pad("sink_%u" % ids["test"]) is None, "test source pad not released")
+            check(len(mux.sinkpads) == pads - 1, "muxer has %d sink pads, expected %d" % (len(mux.sinkpads),
+                                                                                        pads - 1))
+            # A batch of the removed source drained from the queues after the muxer
+            stream_index = "stream%d" % ids["test"]
+            check(stream_index in harness.perf_data.all_stream_fps, "FPS slot dropped while batches may be queued")
+            try:
+                harness.perf_data.update_fps(stream_index)
+            except KeyError:
+                raise AssertionError("late batch of removed source %d fails the probe" % ids["test"])
+            removed_slots[stream_index] = harness.perf_data.all_stream_fps[stream_index]
+
+        def readd_test():
+            source_id = manager.add_source("test://again")
+            check(source_id == ids["test"], "freed slot %d not reused, got %s" % (ids["test"], source_id))
+            stream_index = "stream%d" % source_id
+            check(harness.perf_data.all_stream_fps[stream_index] is not removed_slots[stream_index],
+                  "FPS slot of the removed source not replaced on reuse")
+            harness.buffers[source_id] = 0
+
+        def readded_flowing():
+            check(harness.buffers[ids["test"]] > 0, "no buffers after re-adding to slot %d" % ids["test"])
+
+        def remove_failing():
+            entry = manager.sources[ids["failing"]]
+            check(entry.reconnect_id, "no reconnect pending for the failing source")
+            check(manager.remove_source(ids["failing"]), "failing source not removed")
+            harness.loop.quit()
+
+        harness.at(0.5, add_more)
+        harness.at(2.5, flowing)
+        harness.at(3.0, remove_test)
+        harness.at(3.5, readd_test)
+        harness.at(5.0, readded_flowing)
+        harness.at(sum(EXPECTED_BACKOFFS) + 0.5 + BACKOFF_SLACK * len(EXPECTED_BACKOFFS), remove_failing)
+        GLib.timeout_add_seconds(60, harness.loop.quit)
+
+        harness.pipeline.set_state(Gst.State.PLAYING)
+        harness.loop.run()
+        attaches = harness.failing_attaches
+        harness.pipeline.set_state(Gst.State.NULL)
+
+    try:
+        check(harness.failure is None, harness.failure)
+        intervals = [after - before for before, after in zip(attaches, attaches[1:])]
+        check(len(intervals) >= len(EXPECTED_BACKOFFS), "only %d re-attaches of the failing source"
+              % len(intervals))
+        for interval, backoff in zip(intervals, EXPECTED_BACKOFFS):
+            check(backoff - 0.1 <= interval <= backoff + BACKOFF_SLACK,
+                  "re-attach after %.2f s, expected %d s (intervals %s)"
+                  % (interval, backoff, ["%.2f" % value for value in intervals]))
+        check(manager.reconnects == len(intervals), "%d reconnects counted, %d seen" % (manager.reconnects,
+                                                                                      len(intervals)))
+    except AssertionError as e:
+        sys.stderr.write("FAILED: %s\n" % e)
+        return 1
+    print("re-attach intervals: %s s" % ", ".join("%.2f" % value for value in intervals))
+    print("OK")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,209 @@
+################################################################################
+# Pure Python stand-in for the parts of the pyds metadata API the probe uses.
+#
+# Lists are GList-like nodes with .data and .next (None at the end), casts
+# return their argument, user meta types are their names and strings are kept
+# as Python strings, so get_string() returns what was written. Display metas
+# come from a fixed pool per batch, as in DeepStream.
+#
+# install() registers the module as "pyds"; call it before importing any
+# module of the app. Attribute access here is a plain Python lookup instead of
+# a pybind crossing, so timings measured on it leave out that part of the cost
+# of the real bindings.
+################################################################################
+
+import sys
+
+MAX_ELEMENTS_IN_DISPLAY_META = 16
+DISPLAY_META_POOL_SIZE = 64
+
+
+class GList:
+    __slots__ = ("data", "next")
+
+    def __init__(self, data, next=None):
+        self.data = data
+        self.next = next
+
+
+def glist(items):
+    """Return the head node of a list holding items, or None if empty."""
+    head = None
+    for item in reversed(items):
+        head = GList(item, head)
+    return head
+
+
+class _Castable:
+    __slots__ = ()
+
+    @classmethod
+    def cast(cls, data):
+        if data is None:
+            raise StopIteration
+        return data
+
+
+class NvOSD_ColorParams:
+    __slots__ = ("red", "green", "blue", "alpha")
+
+    def __init__(self):
+        self.red = self.green = self.blue = self.alpha = 0.0
+
+    def set(self, red, green, blue, alpha):
+        self.red = red
+        self.green = green
+        self.blue = blue
+        self.alpha = alpha
+
+
+class NvOSD_FontParams:
+    __slots__ = ("font_name", "font_size", "font_color")
+
+    def __init__(self):
+        self.font_name = None
+        self.font_size = 0
+        self.font_color = NvOSD_ColorParams()
+
+
+class NvOSD_TextParams:
+    __slots__ = ("display_text", "x_offset", "y_offset", "font_params", "set_bg_clr", "text_bg_clr")
+
+    def __init__(self, display_text=None):
+        self.display_text = display_text
+        self.x_offset = 0
+        self.y_offset = 0
+        self.font_params = NvOSD_FontParams()
+        self.set_bg_clr = 0
+        self.text_bg_clr = NvOSD_ColorParams()
+
+
+class NvOSD_RectParams:
+    __slots__ = ("left", "top", "width", "height", "border_width", "border_color")
+
+    def __init__(self, left=0.0, top=0.0, width=0.0, height=0.0):
+        self.left = left
+        self.top = top
+        self.width = width
+        self.height = height
+        self.border_width = 3
+        self.border_color = NvOSD_ColorParams()
+
+
+class NvDsBaseMeta:
+    __slots__ = ("meta_type",)
+
+    def __init__(self, meta_type):
+        self.meta_type = meta_type
+
+
+class NvDsUserMeta(_Castable):
+    __slots__ = ("base_meta", "user_meta_data")
+
+    def __init__(self, meta_type, user_meta_data):
+        self.base_meta = NvDsBaseMeta(meta_type)
+        self.user_meta_data = user_meta_data
+
+
+class NvDsAnalyticsObjInfo(_Castable):
+    __slots__ = ("roiStatus", "lcStatus", "ocStatus", "dirStatus")
+
+    def __init__(self, roiStatus=(), lcStatus=(), ocStatus=(), dirStatus=""):
+        self.roiStatus = list(roiStatus)
+        self.lcStatus = list(lcStatus)
+        self.ocStatus = list(ocStatus)
+        self.dirStatus = dirStatus
+
+
+class NvDsAnalyticsFrameMeta(_Castable):
+    __slots__ = ("objInROIcnt", "objLCCumCnt", "objLCCurrCnt", "ocStatus", "objCnt")
+
+    def __init__(self, objInROIcnt=None, objLCCumCnt=None, objLCCurrCnt=None, ocStatus=None, objCnt=None):
+        self.objInROIcnt = dict(objInROIcnt or {})
+        self.objLCCumCnt = dict(objLCCumCnt or {})
+        self.objLCCurrCnt = dict(objLCCurrCnt or {})
+        self.ocStatus = dict(ocStatus or {})
+        self.objCnt = dict(objCnt or {})
+
+
+class NvDsObjectMeta(_Castable):
+    __slots__ = ("rect_params", "text_params", "obj_label", "class_id", "unique_component_id", "object_id",
+                 "confidence", "obj_user_meta_list")
+
+    def __init__(self, left, top, width, height, obj_label, class_id, unique_component_id, object_id,
+                 confidence, obj_user_meta_list=None):
+        self.rect_params = NvOSD_RectParams(left, top, width, height)
+        self.text_params = NvOSD_TextParams(obj_label)
+        self.obj_label = obj_label
+        self.class_id = class_id
+        self.unique_component_id = unique_component_id
+        self.object_id = object_id
+        self.confidence = confidence
+        self.obj_user_meta_list = obj_user_meta_list
+
+
+class NvDsFrameMeta(_Castable):
+    __slots__ = ("pad_index", "source_id", "frame_num", "obj_meta_list", "frame_user_meta_list",
+                 "display_meta_list", "num_obj_meta")
+
+    def __init__(self, pad_index, frame_num, obj_metas, frame_user_metas=()):
+        self.pad_index = pad_index
+        self.source_id = pad_index
+        self.frame_num = frame_num
+        self.obj_meta_list = glist(obj_metas)
+        self.frame_user_meta_list = glist(list(frame_user_metas))
+        self.display_meta_list = None
+        self.num_obj_meta = len(obj_metas)
+
+
+class NvDsDisplayMeta(_Castable):
+    __slots__ = ("num_labels", "num_rects", "num_lines", "text_params")
+
+    def __init__(self):
+        self.num_labels = 0
+        self.num_rects = 0
+        self.num_lines = 0
+        self.text_params = [NvOSD_TextParams() for _ in range(MAX_ELEMENTS_IN_DISPLAY_META)]
+
+
+class NvDsBatchMeta(_Castable):
+    __slots__ = ("frame_meta_list", "num_frames_in_batch", "display_meta_pool")
+
+    def __init__(self, frame_metas, pool_size=DISPLAY_META_POOL_SIZE):
+        self.frame_meta_list = glist(frame_metas)
+        self.num_frames_in_batch = len(frame_metas)
+        self.display_meta_pool = [NvDsDisplayMeta() for _ in range(max(pool_size, len(frame_metas)))]
+
+
+def nvds_get_user_meta_type(name):
+    return name
+
+
+def nvds_acquire_display_meta_from_pool(batch_meta):
+    return batch_meta.display_meta_pool.pop()
+
+
+def nvds_add_display_meta_to_frame(frame_meta, display_meta):
+    frame_meta.display_meta_list = GList(display_meta, frame_meta.display_meta_list)
+
+
+def get_string(value):
+    return value
+
+
+# Batch metas by buffer hash, for code that goes through gst_buffer_get_nvds_batch_meta()
+_batch_metas = {}
+
+
+def attach_batch_meta(gst_buffer, batch_meta):
+    _batch_metas[hash(gst_buffer)] = batch_meta
+
+
+def gst_buffer_get_nvds_batch_meta(address):
+    return _batch_metas.get(address)
+
+
+def install():
+    """Register this module as pyds."""
+    sys.modules["pyds"] = sys.modules[__name__]
+    return sys.modules[__name__]
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+
+# Reads the shared memory metrics ring main.py publishes with --metrics-shm
+# (see metrics_ring.py) and prints the newest snapshot: one line per active
+# stream, or JSON with --json. --watch repeats every SECONDS. --layout
+# prints the byte layout of the header, slot and record for readers in
+# other languages.
+#
+# --check runs a writer process publishing as fast as it can next to a
+# reader polling the ring in this process, and asserts that every snapshot
+# read is complete: all its fields come from one publish and the snapshot
+# numbers never go back. A slot left half written must be refused. It then
+# runs observe() on a streaming thread against publish() in a loop and
+# asserts that every latency sample lands in a published histogram and that
+# each stream's frames and alerts_total are copied from the same observe().
+#
+# usage: python3 read_metrics_ring.py NAME [--json] [--watch SECONDS]
+#        python3 read_metrics_ring.py --layout
+#        python3 read_metrics_ring.py --check [--seconds SECONDS]
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from compliance import RESTRICTED_AREA, evaluate_frame
+from frame_arrays import FrameObjects
+from metrics_ring import HEADER_DTYPE, RECORD_DTYPE, MetricsReader, MetricsRing, slot_dtype
+
+CHECK_STREAMS = 6
+CHECK_QUEUES = 3
+
+
+def snapshot_dict(reader, slot):
+    """Return a slot copied by MetricsReader.latest() as plain Python values."""
+    records = slot["records"][:int(slot["stream_count"])]
+    streams = {}
+    for record in records[records["active"] != 0]:
+        stream = {name: record[name].item() for name in RECORD_DTYPE.names if name not in ("stream_id", "active")}
+        streams["stream%d" % record["stream_id"]] = stream
+    queues = dict(zip(reader.queue_names, slot["queue_levels"][:int(slot["queue_count"])].tolist()))
+    return {"time": float(slot["time"]), "snapshot": int(slot["snapshot"]), "writer_pid": reader.writer_pid,
+            "streams": streams, "queues": queues}
+
+
+def print_snapshot(snapshot):
+    print("snapshot %d at %s, writer %d" % (snapshot["snapshot"], time.strftime(
+        "%H:%M:%S", time.localtime(snapshot["time"])), snapshot["writer_pid"]))
+    print("  %-9s %10s %6s %9s %9s %9s %7s %7s %6s %9s"
+          % ("stream", "frames", "fps", "p50 us", "p95 us", "p99 us", "persons", "helmets", "alerts", "total"))
+    for name, stream in snapshot["streams"].items():
+        print("  %-9s %10d %6.1f %9.1f %9.1f %9.1f %7d %7d %6d %9d"
+              % (name, stream["frames"], stream["fps"], stream["probe_p50_us"], stream["probe_p95_us"],
+                 stream["probe_p99_us"], stream["persons"], stream["helmets"], stream["alerts"],
+                 stream["alerts_total"]))
+    for name, level in snapshot["queues"].items():
+        print("  queue %-24s %5.1f%%" % (name, 100 * level))
+
+
+def print_layout():
+    for title, dtype in (("header", HEADER_DTYPE), ("slot (max_streams records)", slot_dtype(1)),
+                         ("record", RECORD_DTYPE)):
+        print("%s: %d bytes" % (title, dtype.itemsize))
+        for name in dtype.names:
+            field, offset = dtype.fields[name][:2]
+            print("  %-16s %5d  %s" % (name, offset, field.str if field.subdtype is None
+                                       else "%s x %s" % (field.subdtype[0].str, field.subdtype[1])))
+    print("slots start at the header size rounded up to 64 bytes; the newest is (published - 1) % slots")
+
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+def check_frames():
+    """One frame per stream; stream s has s restricted-zone persons without a helmet and one helmet."""
+    frames = []
+    for stream_id in range(CHECK_STREAMS):
+        boxes = [(100 * index, 300, 80, 240) for index in range(stream_id)] + [(900, 300, 40, 40)]
+        labels = ["person"] * stream_id + ["helmet"]
+        zones = [(RESTRICTED_AREA,)] * stream_id + [()]
+        frames.append(FrameObjects.synthetic(stream_id, 0, boxes, labels, range(1, stream_id + 2), zones))
+    return frames
+
+
+def run_writer(path, seconds, ready):
+    """Writer process of --check: publishes as fast as it can for seconds."""
+    frames = check_frames()
+    verdicts = [evaluate_frame(frame, set()) for frame in frames]
+    ring = None
+
+    # Every field of publish n is derived from n
+    def fps():
+        return {"stream%d" % stream_id: float(ring.published + 1) for stream_id in range(CHECK_STREAMS)}
+
+    def level(index):
+        return lambda: ((ring.published + 1 + index) % 100) / 100.0
+
+    ring = MetricsRing(path, slots=4, max_streams=16, fps_source=fps,
+                       queues=[("queue%d" % index, level(index)) for index in range(CHECK_QUEUES)])
+    ready.set()
+    end = time.time() + seconds
+    while time.time() < end:
+        for frame, verdict in zip(frames, verdicts):
+            ring.observe(frame, verdict, 1e-4)
+        ring.publish()
+    ring.close(unlink=False)
+
+
+def check_snapshot(slot, verdicts):
+    snapshot = int(slot["snapshot"])
+    check(int(slot["seq"]) % 2 == 0, "odd sequence number in snapshot %d" % snapshot)
+    check(int(slot["stream_count"]) == CHECK_STREAMS, "snapshot %d has %d streams"
+          % (snapshot, int(slot["stream_count"])))
+    records = slot["records"][:CHECK_STREAMS]
+    check((records["frames"] == snapshot).all(), "snapshot %d: frames %s" % (snapshot, records["frames"]))
+    check((records["fps"] == snapshot).all(), "snapshot %d: fps %s" % (snapshot, records["fps"]))
+    for stream_id, verdict in enumerate(verdicts):
+        record = records[stream_id]
+        check(record["persons"] == verdict.person_count and record["alerts"] == verdict.alert_count,
+              "snapshot %d: stream %d counts" % (snapshot, stream_id))
+        check(record["alerts_total"] == snapshot * verdict.alert_count,
+              "snapshot %d: stream %d alerts_total %d" % (snapshot, stream_id, record["alerts_total"]))
+    levels = slot["queue_levels"][:CHECK_QUEUES].tolist()
+    expected = [((snapshot + index) % 100) / 100.0 for index in range(CHECK_QUEUES)]
+    check(all(abs(a - b) < 1e-6 for a, b in zip(levels, expected)), "snapshot %d: queue levels %s"
+          % (snapshot, levels))
+
+
+def check_threads(path, seconds):
+    """observe() on a streaming thread while this thread publishes."""
+    frames = check_frames()
+    verdicts = [evaluate_frame(frame, set()) for frame in frames]
+    ring = MetricsRing(path, slots=4, max_streams=16)
+    reader = MetricsReader(path)
+    observed = [0]
+    stop = threading.Event()
+
+    def streaming():
+        while not stop.is_set():
+            for frame, verdict in zip(frames, verdicts):
+                ring.observe(frame, verdict, 1e-4)
+            observed[0] += len(frames)
+
+    thread = threading.Thread(target=streaming, name="streaming")
+    thread.start()
+    # Every histogram publish() takes over, plus the one still filling at the end
+    histograms = []
+    snapshots = 0
+    try:
+        end = time.time() + seconds
+        while time.time() < end:
+            histograms.append(ring._latency)
+            ring.publish()
+            slot = reader.latest()
+            if slot is None:
+                continue
+            records = slot["records"][:CHECK_STREAMS]
+            for stream_id, verdict in enumerate(verdicts):
+                record = records[stream_id]
+                check(record["alerts_total"] == record["frames"] * verdict.alert_count,
+                      "snapshot %d: stream %d has %d frames but alerts_total %d" % (
+                          int(slot["snapshot"]), stream_id, record["frames"], record["alerts_total"]))
+            snapshots += 1
+    finally:
+        stop.set()
+        thread.join()
+    histograms.append(ring._latency)
+    samples = sum(int(histogram.counts.sum()) for histogram in histograms)
+    reader.close()
+    ring.close()
+    print("%d frames observed next to %d publishes, %d latency samples published, %d snapshots checked"
+          % (observed[0], ring.published, samples, snapshots))
+    check(samples == observed[0], "%d of %d latency samples lost" % (observed[0] - samples, observed[0]))
+    check(snapshots > 100, "only %d snapshots checked" % snapshots)
+
+
+def run_check(seconds):
+    path = os.path.join("/dev/shm", "ppe_metrics_check.%d" % os.getpid())
+    verdicts = [evaluate_frame(frame, set()) for frame in check_frames()]
+    check(all(verdict.alert_count for verdict in verdicts[1:]), "check frames raise no alerts")
+
+    context = multiprocessing.get_context("spawn")
+    ready = context.Event()
+    writer = context.Process(target=run_writer, args=(path, seconds, ready))
+    writer.start()
+    try:
+        check(ready.wait(30), "writer did not start")
+        reader = MetricsReader(path)
+        reads = empty = 0
+        previous = 0
+        seen = set()
+        while writer.is_alive():
+            slot = reader.latest()
+            if slot is None:
+                empty += bool(int(reader.header["published"]))
+                continue
+            check_snapshot(slot, verdicts)
+            snapshot = int(slot["snapshot"])
+            check(snapshot >= previous, "snapshot %d after %d" % (snapshot, previous))
+            previous = snapshot
+            seen.add(snapshot)
+            reads += 1
+        writer.join()
+        check(writer.exitcode == 0, "writer exited with %s" % writer.exitcode)
+        published = int(reader.header["published"])
+        check(reads > 100 and len(seen) > 100, "only %d reads of %d snapshots" % (reads, len(seen)))
+
+        # A slot the writer is filling is refused
+        index = (published - 1) % reader.slots
+        with open(path, "r+b") as f:
+            f.seek(int(reader.header["header_size"]) + index * reader.slot_dtype.itemsize)
+            f.write((int(reader.ring[index]["seq"]) + 1).to_bytes(8, "little"))
+        check(reader.latest() is None, "half written slot accepted")
+        print("%d snapshots published, %d read (%d distinct), %d retries, %d reads gave up"
+              % (published, reads, len(seen), reader.retries, empty))
+        reader.close()
+    finally:
+        if writer.is_alive():
+            writer.terminate()
+        if os.path.exists(path):
+            os.remove(path)
+    check_threads(path, seconds)
+    print("OK")
+    return 0
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog=args[0])
+    parser.add_argument("name", nargs="?", help="ring name under /dev/shm, or its path")
+    parser.add_argument("--json", action="store_true", help="print the snapshot as JSON")
+    parser.add_argument("--watch", type=float, default=0, help="read again every SECONDS")
+    parser.add_argument("--layout", action="store_true", help="print the ring layout")
+    parser.add_argument("--check", action="store_true", help="run a writer and a reader process concurrently")
+    parser.add_argument("--seconds", type=float, default=3.0, help="length of --check (default %(default)s)")
+    options = parser.parse_args(args[1:])
+    if options.layout:
+        print_layout()
+        return 0
+    try:
+        if options.check:
+            return run_check(options.seconds)
+        if not options.name:
+            parser.error("a ring name is needed")
+        reader = MetricsReader(options.name)
+    except AssertionError as e:
+        sys.stderr.write("FAILED: %s\n" % e)
+        return 1
+    except (OSError, ValueError) as e:
+        sys.stderr.write(" %s \n" % e)
+        return 1
+    while True:
+        slot = reader.latest()
+        if slot is None:
+            print("nothing published yet" if not int(reader.header["published"]) else "no consistent snapshot")
+        elif options.json:
+            print(json.dumps(snapshot_dict(reader, slot)))
+        else:
+            print_snapshot(snapshot_dict(reader, slot))
+        if not options.watch:
+            return 0
+        try:
+            time.sleep(options.watch)
+        except KeyboardInterrupt:
+            return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+
+# Replays a main.py --record-file recording through the compliance logic on
+# the CPU and prints the replay counters and the speed against the recorded
+# time. The zones (--zone-geometry), PPE rules (--ppe-rules) and helmet check
+# settings (--compliance-config) can differ from those of the recorded run.
+# --verdicts-out saves the per-object verdicts; --compare loads the verdicts
+# of an earlier replay of the same recording and reports what changed, e.g.
+#   python3 replay_recording.py --verdicts-out before.npz site.rec
+#   python3 replay_recording.py --compliance-config tuned.txt --compare before.npz site.rec
+#
+# --check records synthetic batches, verifies that a replay returns the
+# recorded frames and the verdicts of the live evaluation, that zone masks
+# are mapped between processes, that a cut-off recording still reads up to
+# its last complete chunk and that a recorder appending to it after a restart
+# cuts the partial chunk off first; it reports the replay speed.
+#
+# usage: python3 replay_recording.py [options] recording
+#        python3 replay_recording.py --check
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+
+from compliance import RESTRICTED_AREA, ComplianceSettings, load_compliance_settings
+from frame_arrays import FrameObjects, zone_bit
+from inference_interval import pgie_settings
+from ppe_rules import RuleEngine, load_ppe_rules
+from recording import FILE_HEADER_SIZE, MAGIC, MetadataRecorder, Recording, chunk_columns, encode_chunk
+from replay import ReplayEngine, VerdictLog, compare_verdicts, load_verdicts
+from track_state import DEFAULT_SHADOW_TRACKING_AGE, UNTRACKED_OBJECT_ID, TrackStateStore
+from zones import ANCHOR_FOOT, ANCHORS, ZoneEngine, load_zone_geometry
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+ANALYTICS_CONFIG = os.path.join(APP_DIR, 'config_nvdsanalytics.txt')
+CHECK_STREAMS = 4
+CHECK_FPS = 30
+CHECK_BATCHES = 3000
+CHECK_CHUNK_FRAMES = 512
+
+
+class _Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+class _Scene:
+    """Persons walking through the restricted area of each stream, some with helmets."""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.next_id = 1
+        self.persons = {stream_id: [self._person() for _ in range(6)] for stream_id in range(CHECK_STREAMS)}
+        self.crossed = [0] * CHECK_STREAMS
+
+    def _person(self):
+        self.next_id += 1
+        # Whole pixels, as float32 rect_params would hold them
+        return [self.next_id, self.rng.randrange(1800), self.rng.randrange(100, 800), self.rng.random() < 0.6]
+
+    def frame(self, stream_id, frame_num):
+        rng = self.rng
+        boxes, labels, object_ids, roi_names = [], [], [], []
+        persons = self.persons[stream_id]
+        for index, person in enumerate(persons):
+            if rng.random() < 0.01:
+                persons[index] = person = self._person()
+            object_id, left, top, helmet = person
+            person[1] = min(max(left + rng.randrange(-4, 5), 0), 1800)
+            boxes.append((person[1], top, 80, 240))
+            labels.append("person")
+            object_ids.append(object_id)
+            roi_names.append((RESTRICTED_AREA,) if person[1] > 900 else ())
+            if helmet and rng.random() < 0.9:
+                boxes.append((person[1] + 28, top + 4, 24, 18))
+                labels.append("Helmet")
+                object_ids.append(UNTRACKED_OBJECT_ID)
+                roi_names.append(())
+        self.crossed[stream_id] += rng.random() < 0.05
+        zone_counts = line_counts = overcrowding = None
+        if stream_id % 2 == 0:
+            inside = sum(1 for names in roi_names if names)
+            zone_counts = {RESTRICTED_AREA: inside}
+            line_counts = {"Entry": self.crossed[stream_id], "Exit": self.crossed[stream_id] // 2}
+            overcrowding = {RESTRICTED_AREA: inside > 2}
+        return FrameObjects.synthetic(stream_id, frame_num, boxes, labels, object_ids, roi_names,
+                                      zone_counts, line_counts, overcrowding)
+
+
+def same_frame(a, b):
+    return (a.stream_id == b.stream_id and a.frame_num == b.frame_num and np.array_equal(a.boxes, b.boxes)
+            and all(np.array_equal(getattr(a, name), getattr(b, name))
+                    for name in ("labels", "class_ids", "component_ids", "object_ids", "confidences",
+                                 "roi_mask", "lc_mask"))
+            and (a.zone_counts, a.line_counts, a.overcrowding) == (b.zone_counts, b.line_counts, b.overcrowding))
+
+
+def record_scene(path):
+    """Record CHECK_BATCHES synthetic batches; return the frames and the live VerdictLog."""
+    scene = _Scene(random.Random(11))
+    clock = _Clock(1700000000.0)
+    recorder = MetadataRecorder(path, CHECK_CHUNK_FRAMES, clock=clock)
+    recorder.start()
+    live = ReplayEngine(TrackStateStore())
+    log = VerdictLog()
+    frames = []
+    for batch in range(CHECK_BATCHES):
+        clock.now += 1.0 / CHECK_FPS
+        recorder.begin_batch()
+        for stream_id in range(CHECK_STREAMS):
+            frame = scene.frame(stream_id, batch)
+            recorder.record(frame)
+            log.add(frame, live.evaluate(frame))
+            frames.append(frame)
+    recorder.stop()
+    stats = recorder.stats()
+    check(stats["frames"] == len(frames) and not stats["dropped_chunks"] and not stats["failed_chunks"],
+          "recorder stats %s" % stats)
+    return frames, log
+
+
+def check_replay(path, frames, live_log):
+    with Recording(path) as recording:
+        replayed = [frame for _, batch in recording.batches() for frame in batch]
+        check(len(replayed) == len(frames), "%d frames replayed, %d recorded" % (len(replayed), len(frames)))
+        check(all(same_frame(a, b) for a, b in zip(frames, replayed)), "replayed frames differ")
+        batch_sizes = {len(batch) for _, batch in recording.batches()}
+        check(batch_sizes == {CHECK_STREAMS}, "batches split: sizes %s" % batch_sizes)
+
+        log = VerdictLog()
+        stats = ReplayEngine(TrackStateStore()).run(recording, log)
+        check(not recording.truncated, "complete recording reported truncated")
+    difference = compare_verdicts(live_log.arrays(), log.arrays())
+    check(difference["changed_objects"] == 0 and difference["alerts_before"] > 0, "replay %s" % difference)
+
+    # Another restricted zone name: every alert goes away
+    with Recording(path) as recording:
+        other = VerdictLog()
+        ReplayEngine(TrackStateStore(), compliance=ComplianceSettings("Nowhere")).run(recording, other)
+    difference = compare_verdicts(log.arrays(), other.arrays())
+    check(difference["alerts_after"] == 0 and difference["changed_frames"] > 0, "zone change %s" % difference)
+    return stats
+
+
+def check_zone_remap(directory):
+    # Written by a process where "Gate B" was the first interned name
+    path = os.path.join(directory, "remap.rec")
+    frame = FrameObjects.synthetic(0, 0, [(0, 0, 10, 10)], ["person"], [5])
+    frame.roi_mask = np.array([1], dtype=np.uint64)
+    columns, names = chunk_columns([(0, 0, 0, 0.0, frame.boxes, frame.labels, frame.class_ids, frame.component_ids,
+                                     frame.object_ids, frame.confidences, frame.roi_mask, frame.lc_mask,
+                                     None, None, None)])
+    with open(path, "wb") as f:
+        f.write(MAGIC.ljust(FILE_HEADER_SIZE, b"\0"))
+        f.write(encode_chunk(columns, ["Gate B"], names))
+    with Recording(path) as recording:
+        (_, batch), = list(recording.batches())
+        mask = int(batch.frames[0].roi_mask[0])
+    check(zone_bit("Gate B") != 1 and mask == zone_bit("Gate B"), "zone mask not mapped: %d" % mask)
+
+
+def check_truncated(directory, path, frames):
+    cut = os.path.join(directory, "cut.rec")
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(cut, "wb") as f:
+        f.write(data[:-100])
+    with Recording(cut) as recording:
+        count = sum(len(batch) for _, batch in recording.batches())
+        check(recording.truncated, "cut recording not reported truncated")
+    check(0 < count < len(frames) and count % CHECK_CHUNK_FRAMES == 0, "%d frames read from a cut recording" % count)
+    return cut, count
+
+
+def check_append_after_crash(cut, complete_count):
+    """Restart recording on a file cut off mid chunk, as after a crash."""
+    scene = _Scene(random.Random(12))
+    clock = _Clock(1800000000.0)
+    recorder = MetadataRecorder(cut, CHECK_CHUNK_FRAMES, clock=clock)
+    recorder.start()
+    appended = []
+    for batch in range(CHECK_CHUNK_FRAMES // CHECK_STREAMS + 10):
+        clock.now += 1.0 / CHECK_FPS
+        recorder.begin_batch()
+        for stream_id in range(CHECK_STREAMS):
+            frame = scene.frame(stream_id, batch)
+            recorder.record(frame)
+            appended.append(frame)
+    recorder.stop()
+    with Recording(cut) as recording:
+        replayed = [frame for _, batch in recording.batches() for frame in batch]
+        check(not recording.truncated, "recording appended after a crash reported truncated")
+    check(len(replayed) == complete_count + len(appended),
+          "%d frames read after the restart, expected %d + %d" % (len(replayed), complete_count, len(appended)))
+    check(all(same_frame(a, b) for a, b in zip(appended, replayed[complete_count:])),
+          "frames recorded after the restart differ")
+
+
+def run_check():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "scene.rec")
+        frames, live_log = record_scene(path)
+        stats = check_replay(path, frames, live_log)
+        check_zone_remap(directory)
+        cut, complete_count = check_truncated(directory, path, frames)
+        check_append_after_crash(cut, complete_count)
+        size = os.path.getsize(path)
+    objects = sum(len(frame) for frame in frames)
+    print("%d frames, %d objects, %.1f bytes per object recorded" % (len(frames), objects, size / objects))
+    print("replayed %.0f frames/s, %.0fx realtime of %d streams at %d fps"
+          % (stats["frames"] / stats["seconds"], stats["speedup"], CHECK_STREAMS, CHECK_FPS))
+    print("OK")
+    return 0
+
+
+def build_engine(options):
+    settings = ComplianceSettings()
+    if options.compliance_config:
+        settings = load_compliance_settings(options.compliance_config)
+    size = (options.width, options.height)
+    engine = ReplayEngine(TrackStateStore(ttl_frames=options.track_ttl, reeval_interval=options.reeval_interval,
+                                          hysteresis=options.verdict_hysteresis),
+                          compliance=settings, interval_aware=options.pgie_config is not None)
+    if options.pgie_config:
+        engine.pgie_unique_id, _ = pgie_settings(options.pgie_config)
+    if options.zone_geometry:
+        engine.zone_engine = ZoneEngine(load_zone_geometry(options.zone_geometry, *size), options.zone_anchor)
+    if options.ppe_rules:
+        geometry = load_zone_geometry(options.zone_geometry or options.analytics_config, *size)
+        engine.ppe_engine = RuleEngine(load_ppe_rules(options.ppe_rules), geometry)
+    return engine
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog=args[0])
+    parser.add_argument("path", nargs="?", help="recording written by main.py --record-file")
+    parser.add_argument("--zone-geometry", help="recompute the ROI and line status from this nvdsanalytics config")
+    parser.add_argument("--zone-anchor", choices=ANCHORS, default=ANCHOR_FOOT,
+                        help="box point tested against the zones with --zone-geometry (default %(default)s)")
+    parser.add_argument("--analytics-config", default=ANALYTICS_CONFIG,
+                        help="nvdsanalytics config of the near-line rules without --zone-geometry")
+    parser.add_argument("--width", type=int, default=1920, help="streammux width of the recorded run")
+    parser.add_argument("--height", type=int, default=1080, help="streammux height of the recorded run")
+    parser.add_argument("--ppe-rules", help="evaluate these PPE rules instead of the built-in helmet check")
+    parser.add_argument("--compliance-config", help="restricted zone and head fraction of the helmet check")
+    parser.add_argument("--reeval-interval", type=int, default=5,
+                        help="frames between re-associations of a tracked person (default %(default)s)")
+    parser.add_argument("--verdict-hysteresis", type=int, default=3,
+                        help="consecutive opposite observations needed to flip a track's verdict")
+    parser.add_argument("--track-ttl", type=int, default=DEFAULT_SHADOW_TRACKING_AGE,
+                        help="frames a track verdict is kept unseen (default %(default)s)")
+    parser.add_argument("--pgie-config", help="replay interval aware, with the PGIE id of this nvinfer config")
+    parser.add_argument("--verdicts-out", help="save the per-object verdicts to this .npz")
+    parser.add_argument("--compare", help="report the changes against verdicts saved with --verdicts-out")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--check", action="store_true", help="run the self check on synthetic frames")
+    options = parser.parse_args(args[1:])
+    if options.check:
+        try:
+            return run_check()
+        except AssertionError as e:
+            sys.stderr.write("FAILED: %s\n" % e)
+            return 1
+    if not options.path:
+        parser.error("a recording path is required")
+    try:
+        engine = build_engine(options)
+        before = load_verdicts(options.compare) if options.compare else None
+        log = VerdictLog() if options.verdicts_out or before is not None else None
+        with Recording(options.path) as recording:
+            results = {"replay": engine.run(recording, log)}
+            if recording.truncated:
+                sys.stderr.write("%s ends in an incomplete chunk, replayed up to it\n" % options.path)
+        if options.verdicts_out:
+            log.save(options.verdicts_out)
+        if before is not None:
+            results["changes"] = compare_verdicts(before, log.arrays())
+    except (OSError, ValueError) as e:
+        sys.stderr.write(" %s \n" % e)
+        return 1
+    if options.json:
+        print(json.dumps(results, indent=1))
+    else:
+        for name, values in results.items():
+            print("%s: %s" % (name, values))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+# Drives interval_scheduler.IntervalScheduler with simulated load traces
+# instead of a pipeline. A trace is a list of segments, each holding a number
+# of seconds, the persons in the restricted zone and the GPU milliseconds per
+# batch of the PGIE, the SGIE and everything else. The simulated pipeline
+# runs one batch per source frame. The PGIE time is divided by interval + 1
+# and the SGIE time by its own interval + 1. When a batch takes longer than
+# a frame, the FPS drops and the queue in front of the PGIE fills. Each
+# period every stream passes the frames it ran at that FPS, with the zone's
+# persons, to the scheduler's observe(), which measures the FPS from them as
+# it does from the probe; the scheduler also sees the queue level.
+#
+# Built-in scenarios: night (empty zone), crowd (a crowd arrives on a GPU that
+# can run every frame), saturated (a crowd on a GPU that cannot) and flicker
+# (persons in and out of the zone every period). --check asserts the
+# expected behaviour of each; --trace runs a JSON file holding a list of
+# {"seconds", "zone_persons", "pgie_ms", "sgie_ms", "other_ms"} segments.
+#
+# usage: python3 simulate_interval_scheduler.py [--scenario NAME ...] [--config FILE] [--verbose]
+#        python3 simulate_interval_scheduler.py --trace trace.json [--config FILE]
+#        python3 simulate_interval_scheduler.py --check
+
+import argparse
+import json
+import os
+import random
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from frame_arrays import FrameObjects
+from interval_scheduler import IntervalScheduler, SchedulerSettings, load_scheduler_settings
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SCHEDULER_CONFIG = os.path.join(APP_DIR, 'config_interval_scheduler.txt')
+STREAMS = 4
+PGIE_INTERVAL = 5
+QUEUE_BUFFERS = 200
+FPS_NOISE = 0.01
+
+
+def segment(seconds, zone_persons, pgie_ms=20.0, sgie_ms=8.0, other_ms=4.0):
+    return {"seconds": seconds, "zone_persons": zone_persons, "pgie_ms": pgie_ms, "sgie_ms": sgie_ms,
+            "other_ms": other_ms}
+
+
+SCENARIOS = {
+    "night": [segment(900, 0)],
+    "crowd": [segment(120, 0), segment(120, 5), segment(300, 0)],
+    # Every frame through the PGIE takes 2.3 frame times; interval 2 keeps up
+    "saturated": [segment(60, 1, pgie_ms=60), segment(3600, 5, pgie_ms=60)],
+    "flicker": [segment(60, 1)] + [segment(2, persons) for persons in [0, 3] * 150],
+}
+
+
+class _Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class SimulatedPipeline:
+    """FPS and PGIE queue level of a pipeline at the scheduler's intervals."""
+
+    def __init__(self, target_fps, rng):
+        self.target_fps = target_fps
+        self.rng = rng
+        self.pgie_interval = PGIE_INTERVAL
+        self.sgie_interval = 0
+        self.queued = 0.0
+        # Fractions of a frame carried into the next period, per stream
+        self.carry = [0.0] * STREAMS
+
+    def apply(self, interval, sgie_interval):
+        self.pgie_interval = interval
+        self.sgie_interval = sgie_interval
+
+    def run(self, seconds, load):
+        batch_ms = (load["pgie_ms"] / (self.pgie_interval + 1) + load["sgie_ms"] / (self.sgie_interval + 1)
+                    + load["other_ms"])
+        capacity = 1000.0 / batch_ms
+        self.queued = min(max(self.queued + (self.target_fps - capacity) * seconds, 0.0), QUEUE_BUFFERS)
+        fps = min(self.target_fps, capacity)
+        return fps
+
+    def frames(self, seconds, fps):
+        """Return the frames each stream ran in seconds at about fps."""
+        counts = []
+        for stream in range(STREAMS):
+            self.carry[stream] += fps * (1 + self.rng.uniform(-FPS_NOISE, FPS_NOISE)) * seconds
+            count = int(self.carry[stream])
+            self.carry[stream] -= count
+            counts.append(count)
+        return counts
+
+    def backlog(self):
+        return self.queued / QUEUE_BUFFERS
+
+
+def zone_frame(stream_id, persons, zone_name):
+    boxes = [(100 * index, 300, 80, 240) for index in range(persons)]
+    return FrameObjects.synthetic(stream_id, 0, boxes, ["person"] * persons, range(1, persons + 1),
+                                  [(zone_name,)] * persons)
+
+
+def simulate(settings, trace, seed=5):
+    """Run a trace; return the per-period (time, interval, fps, backlog, zone persons) rows and the scheduler."""
+    rng = random.Random(seed)
+    clock = _Clock(0.0)
+    pipeline = SimulatedPipeline(settings.target_fps, rng)
+    scheduler = IntervalScheduler(settings, PGIE_INTERVAL, pipeline.apply, pipeline.backlog, clock=clock)
+    rows = []
+    period = settings.period
+    for load in trace:
+        for _ in range(max(1, int(round(load["seconds"] / period)))):
+            clock.now += period
+            fps = pipeline.run(period, load)
+            for stream_id, count in enumerate(pipeline.frames(period, fps)):
+                frame = zone_frame(stream_id, load["zone_persons"], settings.zone_name)
+                for _ in range(count):
+                    scheduler.observe(frame)
+            scheduler.step()
+            rows.append((clock.now, pipeline.pgie_interval, fps, pipeline.backlog(), load["zone_persons"]))
+    return rows, scheduler
+
+
+def changes(rows):
+    return sum(1 for before, after in zip(rows, rows[1:]) if before[1] != after[1])
+
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+def run_check(settings):
+    periods = {name: [] for name in SCENARIOS}
+    rows, _ = simulate(settings, SCENARIOS["night"])
+    check(rows[-1][1] == settings.max_interval, "night ends at interval %d" % rows[-1][1])
+    check(all(b[1] >= a[1] for a, b in zip(rows, rows[1:])), "night lowered the interval")
+    periods["night"] = rows
+
+    rows, _ = simulate(settings, SCENARIOS["crowd"])
+    quiet = int(120 / settings.period)
+    crowd = rows[quiet:quiet + int(120 / settings.period)]
+    check(rows[quiet - 1][1] > settings.min_interval, "quiet start not raised")
+    check(all(row[1] == settings.min_interval for row in crowd), "crowd not at min-interval from its first period")
+    check(rows[-1][1] == settings.max_interval, "not back at max-interval after the crowd")
+    periods["crowd"] = rows
+
+    rows, scheduler = simulate(settings, SCENARIOS["saturated"])
+    crowd = rows[int(60 / settings.period):]
+    overloaded = sum(1 for row in crowd if row[2] < settings.overload_fps_ratio * settings.target_fps)
+    check(overloaded <= 0.02 * len(crowd), "overloaded %d of %d periods" % (overloaded, len(crowd)))
+    # Once the floor hold has grown to max-floor-periods a probe (two changes)
+    # happens at most every max-floor-periods periods
+    steady = crowd[len(crowd) // 2:]
+    allowed = 2 * (len(steady) // max(settings.max_floor_periods, 1) + 1)
+    check(changes(steady) <= allowed, "%d changes in the last %d periods under saturation, at most %d allowed"
+          % (changes(steady), len(steady), allowed))
+    check(scheduler.stats()["overload"] > 0, "overload never acted on")
+    # The FPS the scheduler counted is that of the period it decided on
+    fps_at = {row[0]: row[2] for row in rows}
+    tolerance = 1.0 / settings.period + FPS_NOISE * settings.target_fps
+    for decision in scheduler.decisions:
+        if decision["min_fps"] is not None:
+            check(abs(decision["min_fps"] - fps_at[decision["time"]]) <= tolerance,
+                  "decision at %d s measured %.1f fps, ran at %.1f" % (decision["time"], decision["min_fps"],
+                                                                   fps_at[decision["time"]]))
+    check(scheduler.stats()["floor_hold"] > settings.floor_periods or not settings.floor_periods,
+          "floor hold never grew")
+    periods["saturated"] = rows
+
+    rows, _ = simulate(settings, SCENARIOS["flicker"])
+    flicker = rows[int(60 / settings.period):]
+    check(changes(flicker) <= 1, "interval changed %d times with persons flickering" % changes(flicker))
+    check(flicker[-1][1] == settings.min_interval, "flickering crowd not at min-interval")
+    periods["flicker"] = rows
+
+    for name, rows in periods.items():
+        print("%-10s %4d periods  %3d changes  final interval %2d  mean fps %5.1f"
+              % (name, len(rows), changes(rows), rows[-1][1], sum(row[2] for row in rows) / len(rows)))
+    print("OK")
+    return 0
+
+
+def print_run(name, rows, scheduler, verbose):
+    print("%s: %d periods, %d changes, mean fps %.1f, stats %s"
+          % (name, len(rows), changes(rows), sum(row[2] for row in rows) / len(rows), scheduler.stats()))
+    if verbose:
+        for decision in scheduler.decisions:
+            print("  %s" % json.dumps(decision))
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog=args[0])
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run, repeatable (default all)")
+    parser.add_argument("--trace", help="JSON file with the segments of a load trace")
+    parser.add_argument("--config", default=SCHEDULER_CONFIG,
+                        help="scheduler settings (default %(default)s)")
+    parser.add_argument("--verbose", action="store_true", help="print the last decisions of each run")
+    parser.add_argument("--check", action="store_true", help="assert the expected behaviour of every scenario")
+    options = parser.parse_args(args[1:])
+    try:
+        settings = load_scheduler_settings(options.config) if options.config else SchedulerSettings()
+        if options.check:
+            return run_check(settings)
+        if options.trace:
+            with open(options.trace) as f:
+                runs = [(options.trace, [segment(**load) for load in json.load(f)])]
+        else:
+            runs = [(name, SCENARIOS[name]) for name in options.scenario or sorted(SCENARIOS)]
+    except AssertionError as e:
+        sys.stderr.write("FAILED: %s\n" % e)
+        return 1
+    except (OSError, ValueError, TypeError) as e:
+        sys.stderr.write(" %s \n" % e)
+        return 1
+    for name, trace in runs:
+        rows, scheduler = simulate(settings, trace)
+        print_run(name, rows, scheduler, options.verbose)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+
+# Prints a report of a --timeseries-file dump: per stream, the mean and peak
+# occupancy of every ROI, the crossings of every line, the share of time each
+# ROI was overcrowded and the persons / violations seen, over the last
+# --hours (or the whole history) at --resolution seconds.
+#
+# --check feeds three simulated days of frames to a store on a fake clock and
+# verifies that its memory does not grow, that hour, minute and second totals
+# agree over the retained windows, that crossings are counted from the
+# cumulative line counts and that a dump loads back unchanged; it reports the
+# cost of observe() per frame. It then stalls the frames: the flush timer has
+# to close the last second on its own, and a dump taken right after a frame,
+# as main.py does at shutdown, has to hold that frame's second. Finally 64
+# streams on the shipped nvdsanalytics config must fit in a store sized by
+# channel_count(), and a smaller store must report its dropped samples.
+#
+# usage: python3 timeseries_report.py [--hours H] [--resolution S] [--json] timeseries.npz
+#        python3 timeseries_report.py --check
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+
+from compliance import FrameVerdict
+from timeseries import (MAX_CHANNELS, SERIES_CROSSINGS, SERIES_OCCUPANCY, SERIES_OVERCROWDED, SERIES_PERSONS,
+                        SERIES_VIOLATIONS, TimeSeriesStore, channel_count)
+from zones import load_zone_geometry
+
+CHECK_STREAMS = 3
+CHECK_FPS = 2
+CHECK_DAYS = 3
+CAPACITY_STREAMS = 64
+ANALYTICS_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config_nvdsanalytics.txt')
+
+
+class _Frame:
+    """The FrameObjects fields TimeSeriesStore reads."""
+
+    def __init__(self, stream_id, zone_counts, overcrowding, line_counts):
+        self.stream_id = stream_id
+        self.zone_counts = zone_counts
+        self.overcrowding = overcrowding
+        self.line_counts = line_counts
+
+
+class _Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def print_report(summary, hours):
+    print("Last %s h" % hours if hours else "Whole history")
+    for stream, series in sorted(summary.items()):
+        print(stream)
+        for name, values in sorted(series.get(SERIES_OCCUPANCY, {}).items()):
+            print("  ROI %-20s mean %6.2f  peak %4d" % (name, values["mean"], values["max"]))
+        for name, values in sorted(series.get(SERIES_OVERCROWDED, {}).items()):
+            print("  ROI %-20s overcrowded %5.1f%%" % (name, 100 * values["mean"]))
+        for name, values in sorted(series.get(SERIES_CROSSINGS, {}).items()):
+            print("  line %-19s crossings %d" % (name, values["sum"]))
+        for kind in (SERIES_PERSONS, SERIES_VIOLATIONS):
+            values = series.get(kind, {}).get("")
+            if values is not None:
+                print("  %-24s mean %6.2f  peak %4d" % (kind, values["mean"], values["max"]))
+
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+def simulate(store, clock, seconds, rng):
+    """Feed CHECK_FPS frames per stream per second; return the expected line and violation totals."""
+    lines = np.zeros(CHECK_STREAMS, dtype=np.int64)
+    crossings = {}
+    violations = 0
+    elapsed = 0.0
+    start = clock.now
+    for second in range(seconds):
+        for frame_index in range(CHECK_FPS):
+            clock.now = start + second + frame_index / CHECK_FPS
+            for stream_id in range(CHECK_STREAMS):
+                persons = rng.randrange(8)
+                alerts = rng.randrange(persons + 1)
+                step = rng.randrange(3)
+                lines[stream_id] += step
+                frame = _Frame(stream_id, {"RF": persons, "Gate": persons // 2}, {"RF": persons > 5},
+                               {"Entry": int(lines[stream_id]), "Exit": int(lines[stream_id]) // 2})
+                verdict = FrameVerdict(None, persons, 0, alerts)
+                begin = time.perf_counter()
+                store.observe(frame, verdict)
+                elapsed += time.perf_counter() - begin
+                violations += alerts
+    for stream_id in range(CHECK_STREAMS):
+        crossings[stream_id] = int(lines[stream_id])
+    return crossings, violations, elapsed
+
+
+def check_stall(clock):
+    """The last second reaches the rings through the timer and through dump(), without a later frame."""
+    store = TimeSeriesStore(clock=clock)
+    stalled = int(clock.now)
+    store.observe(_Frame(0, {"RF": 3}, None, None), FrameVerdict(None, 3, 0, 1))
+    store.flush_callback()
+    check(not store.query(0, SERIES_PERSONS, "", 1)["time"], "the timer flushed the second still running")
+    clock.now = stalled + 2
+    store.flush_callback()
+    flushed = store.query(0, SERIES_PERSONS, "", 1)
+    check(flushed["time"] == [stalled] and flushed["sum"] == [3], "stalled second not flushed: %s" % flushed)
+
+    # Frames after a flush of their own second add to the same bucket
+    clock.now = stalled + 3
+    store.observe(_Frame(0, {"RF": 2}, None, None), FrameVerdict(None, 2, 0, 0))
+    clock.now = stalled + 3.5
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "timeseries.npz")
+        store.dump(path)
+        store.observe(_Frame(0, {"RF": 4}, None, None), FrameVerdict(None, 4, 0, 0))
+        dumped = TimeSeriesStore.load(path, clock=clock).query(0, SERIES_PERSONS, "", 1)
+    check(dumped["time"] == [stalled, stalled + 3] and dumped["sum"] == [3, 2],
+          "dump lost the last second: %s" % dumped)
+    clock.now = stalled + 5
+    store.flush_callback()
+    last = store.query(0, SERIES_PERSONS, "", 1)
+    check(last["sum"][-1] == 6 and last["count"][-1] == 2, "second split by the dump: %s" % last)
+
+
+def check_capacity(clock):
+    """Every channel of CAPACITY_STREAMS streams fits a store sized by channel_count()."""
+    geometry = load_zone_geometry(ANALYTICS_CONFIG)
+    frames = []
+    for stream_id in range(CAPACITY_STREAMS):
+        stream = geometry.get(stream_id)
+        if stream is None:
+            frames.append(_Frame(stream_id, None, None, None))
+            continue
+        occupancy = stream.rois.names + stream.overcrowding.names
+        frames.append(_Frame(stream_id, {name: 1 for name in occupancy},
+                             {name: False for name in stream.overcrowding.names},
+                             {name: 0 for name in stream.lines.names}))
+    sized = TimeSeriesStore(max_channels=channel_count(CAPACITY_STREAMS, geometry), clock=clock)
+    fixed = TimeSeriesStore(clock=clock)
+    for store in (sized, fixed):
+        for frame in frames:
+            store.observe(frame, FrameVerdict(None, 1, 0, 0))
+    check(sized.dropped == 0, "%d samples dropped by a store of %d channels" % (sized.dropped, sized.max_channels))
+    stats = fixed.stats()
+    check(stats["channels"] == MAX_CHANNELS and stats["dropped"] == len(sized.keys) - MAX_CHANNELS,
+          "stats of a full store %s" % stats)
+
+
+def run_check():
+    rng = random.Random(7)
+    # Start at a day boundary so the hour ring lines up with the simulated days
+    clock = _Clock(1700006400.0)
+    store = TimeSeriesStore(clock=clock)
+    memory = store.memory_bytes()
+    start = clock.now
+    crossings, violations, elapsed = simulate(store, clock, CHECK_DAYS * 86400, rng)
+    store.flush()
+    frames = CHECK_DAYS * 86400 * CHECK_FPS * CHECK_STREAMS
+    check(store.memory_bytes() == memory, "memory grew from %d to %d bytes" % (memory, store.memory_bytes()))
+    check(store.dropped == 0, "%d samples dropped" % store.dropped)
+
+    # The hour ring holds everything; the first sample of each line only sets the baseline
+    totals = store.summary(start, None, 3600)
+    for stream_id, expected in crossings.items():
+        entry = totals["stream%d" % stream_id][SERIES_CROSSINGS]["Entry"]
+        first = store.query(stream_id, SERIES_CROSSINGS, "Entry", 3600)
+        check(entry["count"] == CHECK_DAYS * 86400 * CHECK_FPS, "stream %d has %d samples" % (stream_id, entry["count"]))
+        check(len(first["time"]) == CHECK_DAYS * 24, "stream %d has %d hours" % (stream_id, len(first["time"])))
+        # Entry grew by expected in total, minus the unseen step of the first frame
+        check(expected - 2 <= entry["sum"] <= expected, "stream %d crossings %d, expected %d"
+              % (stream_id, entry["sum"], expected))
+    counted = sum(totals["stream%d" % stream_id][SERIES_VIOLATIONS][""]["sum"] for stream_id in crossings)
+    check(counted == violations, "violations %d, expected %d" % (counted, violations))
+
+    # Coarser resolutions are exact sums of the finer ones over the windows both retain
+    end = (int(clock.now) + 1) // 3600 * 3600
+    for fine, coarse, span in ((1, 60, 600), (60, 3600, 3 * 3600)):
+        window = (end - span, end)
+        a = store.summary(*window, resolution=fine)
+        b = store.summary(*window, resolution=coarse)
+        check(a == b, "%d s and %d s totals differ over the last %d s" % (fine, coarse, span))
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "timeseries.npz")
+        store.dump(path)
+        size = os.path.getsize(path)
+        loaded = TimeSeriesStore.load(path, clock=clock)
+        check(loaded.keys == store.keys, "keys differ after load")
+        check(loaded.summary(start, None, 3600) == totals, "hour totals differ after load")
+        check(loaded.summary(end - 600, end, 1) == store.summary(end - 600, end, 1), "second totals differ after load")
+    check_stall(clock)
+    check_capacity(clock)
+
+    print("%d channels, %d KB of rings, %d KB dump, observe %.2f us/frame"
+          % (len(store.keys), memory // 1024, size // 1024, 1e6 * elapsed / frames))
+    print("OK")
+    return 0
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog=args[0])
+    parser.add_argument("path", nargs="?", help="dump written by main.py --timeseries-file")
+    parser.add_argument("--hours", type=float, default=0, help="report the last H hours, 0 for all (default)")
+    parser.add_argument("--resolution", type=int, default=60, help="bucket seconds to read (default %(default)s)")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    parser.add_argument("--check", action="store_true", help="run the self check on simulated frames")
+    options = parser.parse_args(args[1:])
+    if options.check:
+        try:
+            return run_check()
+        except AssertionError as e:
+            sys.stderr.write("FAILED: %s\n" % e)
+            return 1
+    if not options.path:
+        parser.error("a dump path is required")
+    try:
+        store = TimeSeriesStore.load(options.path)
+    except (OSError, ValueError, KeyError) as e:
+        sys.stderr.write(" %s \n" % e)
+        return 1
+    start = time.time() - options.hours * 3600 if options.hours else None
+    summary = store.summary(start, None, options.resolution)
+    if options.json:
+        print(json.dumps(summary, indent=1))
+    else:
+        print_report(summary, options.hours)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+# Runs tracing.PipelineTracer on a CPU-only pipeline:
+#   videotestsrc ! queue ! videoconvert ! queue ! identity (slow) ! queue ! fakesink
+# where the identity element sleeps per buffer, prints the JSON snapshot and
+# fails unless the slow stage is reported as the bottleneck and the queue in
+# front of it as the fullest one.
+#
+# usage: python3 trace_pipeline.py [buffers] [sleep us per buffer]
+
+import json
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GLib, Gst
+
+from tracing import PipelineTracer
+
+SLOW_STAGE = "slow-stage"
+
+
+def main(args):
+    buffers = int(args[1]) if len(args) > 1 else 300
+    sleep_us = int(args[2]) if len(args) > 2 else 20000
+    Gst.init(None)
+    pipeline = Gst.parse_launch(
+        "videotestsrc name=source num-buffers=%d ! video/x-raw,width=640,height=360,framerate=100/1 ! "
+        "queue name=queue1 ! videoconvert name=convert ! queue name=queue2 ! "
+        "identity name=%s sleep-time=%d ! queue name=queue3 ! fakesink name=sink sync=false"
+        % (buffers, SLOW_STAGE, sleep_us))
+    tracer = PipelineTracer(pipeline, pipeline.get_by_name("source"), window_seconds=60, sample_ms=20)
+    tracer.attach()
+
+    loop = GLib.MainLoop()
+    bus = pipeline.get_bus()
+    bus.add_signal_watch()
+    bus.connect("message::eos", lambda bus, message: loop.quit())
+    bus.connect("message::error", lambda bus, message: (print(message.parse_error()), loop.quit()))
+    pipeline.set_state(Gst.State.PLAYING)
+    loop.run()
+    snapshot = tracer.snapshot()
+    pipeline.set_state(Gst.State.NULL)
+
+    print(json.dumps(snapshot, indent=2))
+    fullest = max(snapshot["queues"].items(), key=lambda item: item[1]["mean_level_buffers"])[0]
+    bottleneck = tracer.bottleneck()
+    print("bottleneck: %s, fullest queue: %s" % (bottleneck, fullest))
+    if bottleneck not in (SLOW_STAGE, "queue2") or fullest != "queue2":
+        sys.stderr.write("Tracer did not point at the slow stage\n")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
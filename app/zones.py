@@ -0,0 +1,562 @@
+################################################################################
+# In-process zone geometry compiled from the nvdsanalytics configuration.
+#
+# load_zone_geometry() reads the roi-*, line-crossing-* and direction-*
+# entries of a config_nvdsanalytics*.txt per stream and compiles them into
+# padded NumPy edge tables with bounding boxes. Point-in-polygon and segment
+# crossing tests then run for all objects of a frame at once, so the probe can
+# compute ROI and line membership itself, from any anchor point of the boxes,
+# instead of walking every object's analytics user meta and searching its
+# roiStatus strings.
+#
+# ZoneEngine fills FrameObjects.roi_mask and lc_mask with the same zone_bit()
+# masks frame_meta.py derives from the plugin, so compliance.py works unchanged
+# on either source.
+#
+# It is opt-in (--zone-geometry) for its anchor choice, not for speed: the
+# probe spends more time in ZoneEngine.apply_batch() than in the meta walk it
+# skips, about 3x per frame on site-16 and 4x on crowd-64 of bench_probe.py.
+################################################################################
+
+import configparser
+
+import numpy as np
+
+from frame_arrays import check_zone_names, zone_bit
+from track_state import UNTRACKED_OBJECT_ID
+
+ANCHOR_FOOT = "foot"
+ANCHOR_HEAD = "head"
+ANCHOR_CENTER = "center"
+ANCHORS = (ANCHOR_FOOT, ANCHOR_HEAD, ANCHOR_CENTER)
+# Head anchor height as a fraction of the box, as in association.head_points()
+HEAD_FRACTION = 12
+
+ROI_SECTION = "roi-filtering-stream-"
+OVERCROWDING_SECTION = "overcrowding-stream-"
+LINE_SECTION = "line-crossing-stream-"
+DIRECTION_SECTION = "direction-detection-stream-"
+# class-id of a section that applies to every class
+ALL_CLASSES = -1
+# Least cosine between an object's move and a line's direction per
+# line-crossing mode: loose counts any move with a component along the
+# direction, balanced one within 60 degrees of it, strict within 30
+LINE_MODES = {"loose": 0.0, "balanced": 0.5, "strict": 0.866}
+DEFAULT_LINE_MODE = "balanced"
+# Objects ZoneEngine.apply_batch() tests per call; bigger batches are split
+# into runs of whole frames, which bounds the temporaries at crowd-64
+CHUNK_OBJECTS = 1024
+
+
+def _coordinates(value, count=None):
+    """Parse 'x1;y1;x2;y2;...' (trailing ';' allowed) into an (N, 2) array."""
+    values = [float(v) for v in value.split(";") if v.strip()]
+    if len(values) % 2 or (count is not None and len(values) != 2 * count):
+        raise ValueError("bad coordinate list %r" % value)
+    return np.array(values, dtype=np.float64).reshape(-1, 2)
+
+
+class PolygonTable:
+    """Named polygons as padded edge tables.
+
+    Edges are stored as (P, V) arrays of start and end points; polygons with
+    fewer than V vertices are padded with zero length edges, which never count
+    as a crossing.
+    """
+
+    def __init__(self, names, polygons):
+        self.names = list(names)
+        self.bits = np.array([zone_bit(name) for name in self.names], dtype=np.uint64)
+        count = len(polygons)
+        vertices = max((len(polygon) for polygon in polygons), default=0)
+        start = np.zeros((count, vertices, 2))
+        end = np.zeros((count, vertices, 2))
+        for index, polygon in enumerate(polygons):
+            start[index, :len(polygon)] = polygon
+            end[index, :len(polygon)] = np.roll(polygon, -1, axis=0)
+            start[index, len(polygon):] = end[index, len(polygon):] = polygon[0]
+        self.x1, self.y1 = start[..., 0], start[..., 1]
+        self.x2, self.y2 = end[..., 0], end[..., 1]
+        dy = self.y2 - self.y1
+        # Slope of x over y, 0 for horizontal edges which the parity test skips
+        self.inverse_slope = np.divide(self.x2 - self.x1, dy, out=np.zeros_like(dy), where=dy != 0)
+        self.bbox = np.array([[p[:, 0].min(), p[:, 1].min(), p[:, 0].max(), p[:, 1].max()]
+                              for p in polygons]).reshape(count, 4)
+
+    def __len__(self):
+        return len(self.names)
+
+    def contains(self, points):
+        """Return an (N, P) bool array: point n lies inside polygon p."""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if not len(points) or not len(self):
+            return np.zeros((len(points), len(self)), dtype=bool)
+        px = points[:, 0, None]
+        py = points[:, 1, None]
+        candidates = ((px >= self.bbox[:, 0]) & (px <= self.bbox[:, 2]) &
+                      (py >= self.bbox[:, 1]) & (py <= self.bbox[:, 3]))
+        if not candidates.any():
+            return candidates
+        px = px[..., None]
+        py = py[..., None]
+        # Even-odd rule over (N, P, V): count edges straddling the point's y to its right
+        straddles = (self.y1 > py) != (self.y2 > py)
+        x_cross = self.x1 + (py - self.y1) * self.inverse_slope
+        return (np.count_nonzero(straddles & (px < x_cross), axis=2) & 1).astype(bool) & candidates
+
+    def masks(self, points):
+        """Return the zone_bit() mask of the polygons containing each point."""
+        # Bits are distinct, so summing them is the same as or-ing them
+        return self.contains(points) @ self.bits
+
+
+def _cross(ax, ay, bx, by):
+    return ax * by - ay * bx
+
+
+class LineTable:
+    """Named counting lines with the direction an object must move to count.
+
+    Each nvdsanalytics line-crossing entry is 'dx1;dy1;dx2;dy2;x1;y1;x2;y2':
+    the direction vector followed by the line itself. extended lines count any
+    crossing of the infinite line through the two points; mode is one of
+    LINE_MODES.
+    """
+
+    def __init__(self, names, entries, extended=False, mode=DEFAULT_LINE_MODE):
+        self.names = list(names)
+        self.bits = np.array([zone_bit(name) for name in self.names], dtype=np.uint64)
+        entries = np.array(entries, dtype=np.float64).reshape(-1, 4, 2)
+        self.direction = entries[:, 1] - entries[:, 0]
+        self.start = entries[:, 2]
+        self.end = entries[:, 3]
+        self.extended = extended
+        if mode not in LINE_MODES:
+            raise ValueError("unknown line-crossing mode %r" % mode)
+        self.mode = mode
+        self.min_cosine = LINE_MODES[mode]
+
+    def __len__(self):
+        return len(self.names)
+
+    def crossings(self, previous, current):
+        """Return an (N, L) bool array: the move previous[n] -> current[n] crossed line l.
+
+        Only moves with a positive component along the line's direction, and at
+        most the angle of the line's mode away from it, count.
+        """
+        previous = np.asarray(previous, dtype=np.float64).reshape(-1, 2)
+        current = np.asarray(current, dtype=np.float64).reshape(-1, 2)
+        if not len(previous) or not len(self):
+            return np.zeros((len(previous), len(self)), dtype=bool)
+        ax, ay = previous[:, 0, None], previous[:, 1, None]
+        bx, by = current[:, 0, None], current[:, 1, None]
+        cx, cy = self.start[:, 0], self.start[:, 1]
+        ex, ey = self.end[:, 0] - cx, self.end[:, 1] - cy
+        # Side of the line before and after the move
+        side_a = _cross(ex, ey, ax - cx, ay - cy)
+        side_b = _cross(ex, ey, bx - cx, by - cy)
+        crossed = (side_a * side_b < 0)
+        if not self.extended:
+            # The line's end points must also lie on either side of the move
+            mx, my = bx - ax, by - ay
+            side_c = _cross(mx, my, cx - ax, cy - ay)
+            side_d = _cross(mx, my, cx + ex - ax, cy + ey - ay)
+            crossed &= side_c * side_d < 0
+        along = (bx - ax) * self.direction[:, 0] + (by - ay) * self.direction[:, 1]
+        crossed &= along > 0
+        if self.min_cosine > 0:
+            lengths = np.hypot(bx - ax, by - ay) * np.hypot(self.direction[:, 0], self.direction[:, 1])
+            crossed &= along >= self.min_cosine * lengths
+        return crossed
+
+    def masks(self, previous, current):
+        return self.crossings(previous, current) @ self.bits
+
+    def distances(self, points):
+        """Return an (N, L) array: distance of point n to the segment of line l."""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if not len(points) or not len(self):
+            return np.zeros((len(points), len(self)))
+        px, py = points[:, 0, None], points[:, 1, None]
+        cx, cy = self.start[:, 0], self.start[:, 1]
+        ex, ey = self.end[:, 0] - cx, self.end[:, 1] - cy
+        length = ex * ex + ey * ey
+        t = np.divide((px - cx) * ex + (py - cy) * ey, length, out=np.zeros((len(points), len(self))),
+                      where=length > 0)
+        if not self.extended:
+            t = np.clip(t, 0.0, 1.0)
+        return np.hypot(px - (cx + t * ex), py - (cy + t * ey))
+
+
+class DirectionTable:
+    """Named reference directions; classify() picks the closest one to a motion."""
+
+    def __init__(self, names, entries):
+        self.names = list(names)
+        entries = np.array(entries, dtype=np.float64).reshape(-1, 2, 2)
+        vectors = entries[:, 1] - entries[:, 0]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        self.unit = np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+    def __len__(self):
+        return len(self.names)
+
+    def classify(self, motions, min_cosine=0.5):
+        """Return the index of the best matching direction per motion, or -1."""
+        motions = np.asarray(motions, dtype=np.float64).reshape(-1, 2)
+        if not len(self):
+            return np.full(len(motions), -1, dtype=np.int64)
+        norms = np.linalg.norm(motions, axis=1, keepdims=True)
+        unit = np.divide(motions, norms, out=np.zeros_like(motions), where=norms > 0)
+        cosine = unit @ self.unit.T
+        best = cosine.argmax(axis=1)
+        return np.where(cosine[np.arange(len(motions)), best] >= min_cosine, best, -1)
+
+
+class StreamGeometry:
+    """The compiled ROIs, overcrowding ROIs, lines and directions of one stream.
+
+    inverse_roi streams report the ROIs an object is outside of; the class
+    ids limit ROI and line status to one class, ALL_CLASSES for any.
+    """
+
+    def __init__(self, rois, overcrowding, lines, directions, inverse_roi=False, roi_class_id=ALL_CLASSES,
+                 line_class_id=ALL_CLASSES):
+        self.rois = rois
+        self.overcrowding = overcrowding
+        self.lines = lines
+        self.directions = directions
+        self.inverse_roi = inverse_roi
+        self.roi_class_id = roi_class_id
+        self.line_class_id = line_class_id
+
+
+def _labelled(section, prefix, parse):
+    names = []
+    values = []
+    for key, value in section.items():
+        if key.startswith(prefix):
+            names.append(key[len(prefix):])
+            values.append(parse(value))
+    return names, values
+
+
+def _enabled(config, section_name):
+    return config.has_section(section_name) and config[section_name].getboolean("enable", True)
+
+
+def _zone_names(config):
+    """Return the ROI and line names of the enabled sections, which get zone_bit() masks."""
+    names = []
+    for stream_id in _stream_ids(config):
+        for section_name, prefix in ((ROI_SECTION, "roi-"), (OVERCROWDING_SECTION, "roi-"),
+                                     (LINE_SECTION, "line-crossing-")):
+            section_name += str(stream_id)
+            if _enabled(config, section_name):
+                names.extend(key[len(prefix):] for key in config[section_name] if key.startswith(prefix))
+    return names
+
+
+def _stream_ids(config):
+    ids = set()
+    for section_name in config.sections():
+        for prefix in (ROI_SECTION, OVERCROWDING_SECTION, LINE_SECTION, DIRECTION_SECTION):
+            if section_name.startswith(prefix) and section_name[len(prefix):].isdigit():
+                ids.add(int(section_name[len(prefix):]))
+    return sorted(ids)
+
+
+def parse_zone_geometry(config, frame_width=None, frame_height=None):
+    """Compile a parsed nvdsanalytics config into {stream id: StreamGeometry}.
+
+    Coordinates are given for config-width x config-height and are scaled to
+    frame_width x frame_height when those are set, as the plugin does.
+    """
+    properties = config["property"] if config.has_section("property") else {}
+    config_width = float(properties.get("config-width", frame_width or 1))
+    config_height = float(properties.get("config-height", frame_height or 1))
+    scale = np.array([(frame_width or config_width) / config_width,
+                      (frame_height or config_height) / config_height])
+
+    def polygon(value):
+        return _coordinates(value) * scale
+
+    def line(value):
+        return _coordinates(value, 4) * scale
+
+    def direction(value):
+        return _coordinates(value, 2) * scale
+
+    # Checked up front, so a config over the limit interns none of its names
+    check_zone_names(_zone_names(config))
+    geometry = {}
+    for stream_id in _stream_ids(config):
+        rois = PolygonTable([], [])
+        inverse_roi = False
+        roi_class_id = line_class_id = ALL_CLASSES
+        if _enabled(config, ROI_SECTION + str(stream_id)):
+            section = config[ROI_SECTION + str(stream_id)]
+            rois = PolygonTable(*_labelled(section, "roi-", polygon))
+            inverse_roi = section.getboolean("inverse-roi", False)
+            roi_class_id = section.getint("class-id", ALL_CLASSES)
+        overcrowding = PolygonTable([], [])
+        if _enabled(config, OVERCROWDING_SECTION + str(stream_id)):
+            overcrowding = PolygonTable(*_labelled(config[OVERCROWDING_SECTION + str(stream_id)], "roi-", polygon))
+        lines = LineTable([], [])
+        if _enabled(config, LINE_SECTION + str(stream_id)):
+            section = config[LINE_SECTION + str(stream_id)]
+            lines = LineTable(*_labelled(section, "line-crossing-", line), extended=section.getboolean("extended", False),
+                              mode=section.get("mode", DEFAULT_LINE_MODE).strip())
+            line_class_id = section.getint("class-id", ALL_CLASSES)
+        directions = DirectionTable([], [])
+        if _enabled(config, DIRECTION_SECTION + str(stream_id)):
+            directions = DirectionTable(*_labelled(config[DIRECTION_SECTION + str(stream_id)], "direction-", direction))
+        geometry[stream_id] = StreamGeometry(rois, overcrowding, lines, directions, inverse_roi, roi_class_id,
+                                             line_class_id)
+    return geometry
+
+
+def load_zone_geometry(path, frame_width=None, frame_height=None):
+    """Read and compile a config_nvdsanalytics*.txt file."""
+    # Later duplicate keys win, as in the plugin
+    config = configparser.ConfigParser(interpolation=None, strict=False)
+    config.optionxform = str
+    if not config.read(path):
+        raise ValueError("unable to read %s" % path)
+    return parse_zone_geometry(config, frame_width, frame_height)
+
+
+def config_size(path, default=(1920, 1080)):
+    """Return the (config-width, config-height) of a config_nvdsanalytics*.txt."""
+    config = configparser.ConfigParser(interpolation=None, strict=False)
+    config.optionxform = str
+    config.read(path)
+    if not config.has_section("property"):
+        return default
+    properties = config["property"]
+    return (properties.getint("config-width", default[0]), properties.getint("config-height", default[1]))
+
+
+def format_coordinates(points):
+    """Format points as the 'x1;y1;x2;y2;...' lists of the nvdsanalytics config."""
+    return ";".join("%d;%d" % (round(x), round(y)) for x, y in points)
+
+
+def set_config_entries(path, section, entries):
+    """Set key=value entries in a section of an nvdsanalytics config file.
+
+    The file is edited line by line so comments and layout survive; existing
+    keys are replaced in place, new ones are added at the end of the section
+    and a missing section is appended with enable=1.
+    """
+    with open(path) as f:
+        lines = f.read().splitlines()
+    header = "[%s]" % section
+    start = next((index for index, line in enumerate(lines) if line.strip() == header), None)
+    if start is None:
+        if lines and lines[-1].strip():
+            lines.append("")
+        lines.extend([header, "enable=1"])
+        start = len(lines) - 2
+    end = next((index for index in range(start + 1, len(lines)) if lines[index].lstrip().startswith("[")),
+               len(lines))
+    pending = dict(entries)
+    for index in range(start + 1, end):
+        key = lines[index].split("=", 1)[0].strip()
+        if "=" in lines[index] and not lines[index].lstrip().startswith("#") and key in pending:
+            lines[index] = "%s=%s" % (key, pending.pop(key))
+    # Append after the last non-blank line of the section
+    insert = end
+    while insert > start + 1 and not lines[insert - 1].strip():
+        insert -= 1
+    lines[insert:insert] = ["%s=%s" % item for item in pending.items()]
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def anchor_points(boxes, anchor=ANCHOR_FOOT):
+    """Return the (N, 2) anchor points of (left, top, width, height) boxes."""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    x = boxes[:, 0] + boxes[:, 2] / 2
+    if anchor == ANCHOR_FOOT:
+        y = boxes[:, 1] + boxes[:, 3]
+    elif anchor == ANCHOR_HEAD:
+        y = boxes[:, 1] + boxes[:, 3] / HEAD_FRACTION
+    elif anchor == ANCHOR_CENTER:
+        y = boxes[:, 1] + boxes[:, 3] / 2
+    else:
+        raise ValueError("unknown anchor %r" % anchor)
+    return np.column_stack((x, y))
+
+
+class _StackedTables:
+    """The ROI and line tables of every stream stacked along a leading stream axis.
+
+    Indexing them with the stream index of each object gives per-object tables,
+    so the objects of a whole batch are tested in one call whatever streams
+    they come from. Padding polygons have a NaN bounding box and padding
+    lines zero length, so neither ever matches, and their zone bits are 0.
+    """
+
+    def __init__(self, geometry):
+        self.index = {stream_id: index for index, stream_id in enumerate(sorted(geometry))}
+        streams = [geometry[stream_id] for stream_id in sorted(geometry)]
+        count = len(streams)
+        polygons = max((stream.rois.x1.shape[0] for stream in streams), default=0)
+        vertices = max((stream.rois.x1.shape[1] for stream in streams), default=0)
+        self.x1, self.y1, self.x2, self.y2, self.inverse_slope = (np.zeros((count, polygons, vertices))
+                                                                  for _ in range(5))
+        self.bbox = np.full((count, polygons, 4), np.nan)
+        self.roi_bits = np.zeros((count, polygons), dtype=np.uint64)
+        lines = max((len(stream.lines) for stream in streams), default=0)
+        self.line_start, self.line_end, self.line_direction = (np.zeros((count, lines, 2)) for _ in range(3))
+        self.line_bits = np.zeros((count, lines), dtype=np.uint64)
+        for index, stream in enumerate(streams):
+            rois = stream.rois
+            p, v = rois.x1.shape
+            for name in ("x1", "y1", "x2", "y2", "inverse_slope"):
+                getattr(self, name)[index, :p, :v] = getattr(rois, name)
+            self.bbox[index, :p] = rois.bbox
+            self.roi_bits[index, :p] = rois.bits
+            count_lines = len(stream.lines)
+            self.line_start[index, :count_lines] = stream.lines.start
+            self.line_end[index, :count_lines] = stream.lines.end
+            self.line_direction[index, :count_lines] = stream.lines.direction
+            self.line_bits[index, :count_lines] = stream.lines.bits
+        self.inverse_roi = np.array([stream.inverse_roi for stream in streams], dtype=bool)
+        self.roi_class_id = np.array([stream.roi_class_id for stream in streams], dtype=np.int64)
+        self.has_lines = [len(stream.lines) > 0 for stream in streams]
+        self.line_class_id = [stream.line_class_id for stream in streams]
+        self.extended = np.array([stream.lines.extended for stream in streams], dtype=bool)
+        self.min_cosine = np.array([stream.lines.min_cosine for stream in streams])
+
+    def roi_masks(self, streams, points, class_ids):
+        """PolygonTable.masks() of each point against the ROIs of its stream, with inverse-roi and class-id."""
+        px = points[:, 0, None]
+        py = points[:, 1, None]
+        bbox = self.bbox
+        inside = px >= bbox[streams, :, 0]
+        inside &= px <= bbox[streams, :, 2]
+        inside &= py >= bbox[streams, :, 1]
+        inside &= py <= bbox[streams, :, 3]
+        rows, polygons = np.nonzero(inside)
+        if len(rows):
+            # Even-odd rule, only for the point and polygon pairs whose bounding
+            # box matched; one edge column at a time keeps the temporaries (K,)
+            pair_streams = streams[rows]
+            px = px[rows, 0]
+            py = py[rows, 0]
+            odd = np.zeros(len(rows), dtype=bool)
+            for edge in range(self.x1.shape[2]):
+                y1 = self.y1[pair_streams, polygons, edge]
+                straddles = (y1 > py) != (self.y2[pair_streams, polygons, edge] > py)
+                x_cross = self.x1[pair_streams, polygons, edge] + \
+                    (py - y1) * self.inverse_slope[pair_streams, polygons, edge]
+                odd ^= straddles & (px < x_cross)
+            inside[rows, polygons] = odd
+        inside ^= self.inverse_roi[streams][:, None]
+        masks = np.bitwise_or.reduce(self.roi_bits[streams] * inside, axis=1)
+        class_id = self.roi_class_id[streams]
+        masks[(class_id != ALL_CLASSES) & (class_ids != class_id)] = 0
+        return masks
+
+    def line_masks(self, streams, previous, current):
+        """LineTable.masks() of each move against the lines of its stream, one line column at a time."""
+        ax, ay = previous[:, 0], previous[:, 1]
+        bx, by = current[:, 0], current[:, 1]
+        mx, my = bx - ax, by - ay
+        move_length = np.hypot(mx, my)
+        extended = self.extended[streams]
+        min_cosine = self.min_cosine[streams]
+        masks = np.zeros(len(streams), dtype=np.uint64)
+        for line in range(self.line_bits.shape[1]):
+            cx, cy = self.line_start[streams, line, 0], self.line_start[streams, line, 1]
+            ex, ey = self.line_end[streams, line, 0] - cx, self.line_end[streams, line, 1] - cy
+            crossed = _cross(ex, ey, ax - cx, ay - cy) * _cross(ex, ey, bx - cx, by - cy) < 0
+            side_c = _cross(mx, my, cx - ax, cy - ay)
+            side_d = _cross(mx, my, cx + ex - ax, cy + ey - ay)
+            crossed &= extended | (side_c * side_d < 0)
+            dx, dy = self.line_direction[streams, line, 0], self.line_direction[streams, line, 1]
+            along = mx * dx + my * dy
+            crossed &= along > 0
+            crossed &= (min_cosine <= 0) | (along >= min_cosine * move_length * np.hypot(dx, dy))
+            masks[crossed] |= self.line_bits[streams[crossed], line]
+        return masks
+
+
+class ZoneEngine:
+    """Fills the ROI and line masks of frames from compiled geometry.
+
+    apply_batch() tests the objects of the frames of a batch in one call per
+    table, up to CHUNK_OBJECTS at a time, rather than one call per frame.
+    Line crossings compare an object's anchor with where it was in the
+    previous frame of its stream, so only tracked objects seen in consecutive
+    frames can cross.
+    """
+
+    def __init__(self, geometry, anchor=ANCHOR_FOOT):
+        self.geometry = geometry
+        self.anchor = anchor
+        self._tables = _StackedTables(geometry)
+        self._previous = {}
+
+    def reconfigured(self, geometry):
+        """Return an engine for new geometry that keeps this one's last object positions."""
+        engine = ZoneEngine(geometry, self.anchor)
+        engine._previous = self._previous
+        return engine
+
+    def apply(self, frame):
+        self.apply_batch((frame,))
+
+    def apply_batch(self, frames):
+        tables = self._tables
+        chunk = []
+        objects = 0
+        for frame in frames:
+            if frame.stream_id not in tables.index or not len(frame):
+                continue
+            if chunk and objects + len(frame) > CHUNK_OBJECTS:
+                self._apply_chunk(chunk)
+                chunk = []
+                objects = 0
+            chunk.append(frame)
+            objects += len(frame)
+        if chunk:
+            self._apply_chunk(chunk)
+
+    def _apply_chunk(self, frames):
+        tables = self._tables
+        sizes = [len(frame) for frame in frames]
+        offsets = np.cumsum([0] + sizes).tolist()
+        streams = np.repeat([tables.index[frame.stream_id] for frame in frames], sizes)
+        points = anchor_points(np.concatenate([frame.boxes for frame in frames]), self.anchor)
+        class_ids = np.concatenate([frame.class_ids for frame in frames])
+        roi_masks = tables.roi_masks(streams, points, class_ids)
+
+        known = []
+        before = []
+        line_frames = []
+        for frame, begin, end in zip(frames, offsets, offsets[1:]):
+            frame.roi_mask = roi_masks[begin:end]
+            stream = tables.index[frame.stream_id]
+            if not tables.has_lines[stream]:
+                continue
+            line_frames.append((frame, begin, end))
+            previous = self._previous.get(frame.stream_id, {})
+            line_class_id = tables.line_class_id[stream]
+            counted = (frame.class_ids == line_class_id).tolist() if line_class_id != ALL_CLASSES \
+                else [True] * len(frame)
+            for index, object_id in enumerate(frame.object_ids.tolist()):
+                if counted[index] and object_id in previous and object_id != UNTRACKED_OBJECT_ID:
+                    known.append(begin + index)
+                    before.append(previous[object_id])
+        if not line_frames:
+            return
+        lc_masks = np.zeros(len(points), dtype=np.uint64)
+        if known:
+            lc_masks[known] = tables.line_masks(streams[known], np.array(before), points[known])
+        for frame, begin, end in line_frames:
+            frame.lc_mask = lc_masks[begin:end]
+            self._previous[frame.stream_id] = dict(zip(frame.object_ids.tolist(), points[begin:end].tolist()))